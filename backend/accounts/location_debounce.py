@@ -0,0 +1,226 @@
+"""
+Дебаунсинг рассылки позиций водителей на карту диспетчеризации
+
+Для каждого водителя хранится последняя разосланная позиция, время и оценка
+скорости. Новая позиция рассылается, если с прошлой рассылки прошло не меньше
+интервала и водитель сместился не меньше порога расстояния. Пороги адаптивные:
+- интервал MIN_INTERVAL_SECONDS, пока карту кто-то смотрит, и
+  UNWATCHED_INTERVAL_SECONDS, когда клиентов карты нет;
+- расстояние растет со скоростью (скорость * DISTANCE_PER_SPEED_SECONDS в
+  пределах MIN_DISTANCE_M..MAX_DISTANCE_M): стоящий водитель отсекается по
+  дрожанию GPS, быстрый рассылается примерно раз в DISTANCE_PER_SPEED_SECONDS.
+
+Хранилище подключаемое (BACKEND):
+- 'memory' - LRU в памяти процесса на MAX_ENTRIES водителей с TTL_SECONDS;
+- 'django' - общее для воркеров хранилище через Django cache API
+  (CACHES[DJANGO_CACHE_ALIAS]), записи живут TTL_SECONDS.
+
+Число подписчиков карты берется из счетчика клиентов DispatchMapConsumer
+(dispatch.map_state.map_subscribers) раз в SUBSCRIBERS_REFRESH_SECONDS. Пока
+счетчика нет (кэш процесса, consumer в другом процессе), карта считается
+просматриваемой.
+
+Счетчики рассылки (stats) - в памяти процесса: отдаются staff-эндпоинтом
+/api/dispatch/location-debounce-stats/ и пишутся в лог раз в STATS_LOG_INTERVAL_SECONDS.
+"""
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+from dispatch import map_state
+from geo.services import Geo
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LOCATION_DEBOUNCE_SETTINGS = {
+    'BACKEND': 'memory',  # memory | django
+    'DJANGO_CACHE_ALIAS': 'default',
+    'MAX_ENTRIES': 20000,
+    'TTL_SECONDS': 600,
+    'MIN_INTERVAL_SECONDS': 0.5,
+    'UNWATCHED_INTERVAL_SECONDS': 5.0,
+    'MIN_DISTANCE_M': 10.0,
+    'MAX_DISTANCE_M': 50.0,
+    'DISTANCE_PER_SPEED_SECONDS': 1.0,
+    'SUBSCRIBERS_REFRESH_SECONDS': 2.0,
+    'STATS_LOG_INTERVAL_SECONDS': 300,  # 0 - не писать
+}
+
+KEY_PREFIX = 'location_debounce:v1'
+
+
+def _debounce_settings() -> Dict:
+    options = dict(DEFAULT_LOCATION_DEBOUNCE_SETTINGS)
+    options.update(getattr(settings, 'LOCATION_DEBOUNCE', {}) or {})
+    return options
+
+
+class MemoryDebounceStore:
+    """Состояние водителей в LRU процесса с TTL"""
+
+    def __init__(self, max_entries: int = 20000, ttl_seconds: int = 600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: OrderedDict = OrderedDict()  # ключ -> (expires_at, значение)
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            if item[0] < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return item[1]
+
+    def set(self, key: str, value: Dict):
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+
+class DjangoCacheDebounceStore:
+    """Общее состояние через Django cache API (Redis, Memcached)"""
+
+    def __init__(self, alias: str = 'default', ttl_seconds: int = 600):
+        from django.core.cache import caches
+        self.cache = caches[alias]
+        self.ttl_seconds = ttl_seconds
+
+    def get(self, key: str) -> Optional[Dict]:
+        return self.cache.get(key)
+
+    def set(self, key: str, value: Dict):
+        self.cache.set(key, value, timeout=self.ttl_seconds)
+
+
+class LocationDebouncer:
+    """Решает, рассылать ли позицию водителя, и считает отсеянные обновления"""
+
+    def __init__(self, options: Optional[Dict] = None, store=None):
+        self.options = options or _debounce_settings()
+        self.store = store if store is not None else self._build_store()
+        self._lock = threading.Lock()
+        self._subscribers: Optional[Tuple[float, int]] = None  # (прочитано, значение)
+        self.reset_stats()
+
+    def _build_store(self):
+        options = self.options
+        if options['BACKEND'] == 'django':
+            try:
+                return DjangoCacheDebounceStore(options['DJANGO_CACHE_ALIAS'], options['TTL_SECONDS'])
+            except Exception as e:
+                logger.warning(f'Не удалось подключить общее хранилище дебаунсинга позиций: {e}')
+        return MemoryDebounceStore(options['MAX_ENTRIES'], options['TTL_SECONDS'])
+
+    def reset_stats(self):
+        with self._lock:
+            self._stats = {'forwarded': 0, 'suppressed_interval': 0, 'suppressed_distance': 0}
+            self._stats_logged_at = time.monotonic()
+
+    def stats(self) -> Dict:
+        """Счетчики разосланных и отсеянных обновлений"""
+        with self._lock:
+            stats = dict(self._stats)
+        suppressed = stats['suppressed_interval'] + stats['suppressed_distance']
+        total = suppressed + stats['forwarded']
+        stats['suppressed'] = suppressed
+        stats['suppression_rate'] = round(suppressed / total, 4) if total else 0.0
+        stats['map_subscribers'] = self.map_subscribers()
+        return stats
+
+    def _count(self, name: str):
+        interval = self.options['STATS_LOG_INTERVAL_SECONDS']
+        with self._lock:
+            self._stats[name] += 1
+            due = bool(interval) and time.monotonic() - self._stats_logged_at >= interval
+            if due:
+                self._stats_logged_at = time.monotonic()
+        if due:
+            logger.info(f'Дебаунсинг позиций: {self.stats()}')
+
+    def map_subscribers(self) -> Optional[int]:
+        """
+        Число подписчиков карты (перечитывается раз в SUBSCRIBERS_REFRESH_SECONDS);
+        None - счетчика клиентов карты нет (dispatch.map_state.map_subscribers)
+        """
+        now = time.monotonic()
+        cached = self._subscribers
+        if cached is not None and now - cached[0] < self.options['SUBSCRIBERS_REFRESH_SECONDS']:
+            return cached[1]
+        try:
+            value = map_state.map_subscribers()
+        except Exception as e:
+            logger.warning(f'Не удалось прочитать число подписчиков карты: {e}')
+            value = cached[1] if cached is not None else None
+        self._subscribers = (now, value)
+        return value
+
+    def thresholds(self, speed_mps: float, subscribers: Optional[int]) -> Tuple[float, float]:
+        """(минимальный интервал в секундах, минимальное смещение в метрах)"""
+        options = self.options
+        watched = subscribers is None or subscribers > 0
+        interval = options['MIN_INTERVAL_SECONDS'] if watched else options['UNWATCHED_INTERVAL_SECONDS']
+        distance = min(
+            max(speed_mps * options['DISTANCE_PER_SPEED_SECONDS'], options['MIN_DISTANCE_M']),
+            options['MAX_DISTANCE_M']
+        )
+        return interval, distance
+
+    def should_send(self, driver_id, lat: float, lon: float, now: Optional[float] = None) -> bool:
+        """True - позицию нужно разослать (состояние водителя при этом обновляется)"""
+        now = time.time() if now is None else now
+        key = f'{KEY_PREFIX}:driver:{driver_id}'
+        state = self.store.get(key)
+
+        speed = 0.0
+        if state is not None:
+            interval, min_distance = self.thresholds(state.get('speed', 0.0), self.map_subscribers())
+            elapsed = now - state['t']
+            if elapsed < interval:
+                self._count('suppressed_interval')
+                return False
+            distance = Geo.calculate_fast_distance(state['lat'], state['lon'], lat, lon)
+            if distance < min_distance:
+                self._count('suppressed_distance')
+                return False
+            if elapsed > 0:
+                # Сглаженная скорость между рассылками
+                speed = 0.5 * state.get('speed', 0.0) + 0.5 * distance / elapsed
+
+        self.store.set(key, {'t': now, 'lat': lat, 'lon': lon, 'speed': speed})
+        self._count('forwarded')
+        return True
+
+
+_debouncer: Optional[LocationDebouncer] = None
+_debouncer_lock = threading.Lock()
+
+
+def get_location_debouncer() -> LocationDebouncer:
+    """Дебаунсер процесса по настройке LOCATION_DEBOUNCE"""
+    global _debouncer
+    if _debouncer is None:
+        with _debouncer_lock:
+            if _debouncer is None:
+                _debouncer = LocationDebouncer()
+    return _debouncer
+
+
+def reset_location_debouncer():
+    """Сбрасывает дебаунсер (тесты, смена настроек)"""
+    global _debouncer
+    with _debouncer_lock:
+        _debouncer = None
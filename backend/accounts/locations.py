@@ -0,0 +1,394 @@
+"""
+Прием позиций водителей (GPS) с отложенной записью в БД
+
+Обработчик запроса только кладет позицию в память процесса (LocationPipeline.ingest):
+на водителя хранится одна последняя позиция, более старые и повторные точки
+отбрасываются. Фоновый поток раз в FLUSH_INTERVAL_SECONDS (или при накоплении
+MAX_PENDING водителей) пишет накопленное одним bulk_update - одна короткая
+транзакция вместо save() на каждую точку, поэтому SQLite не упирается в блокировку
+записи. post_save при этом не срабатывает: индекс водителей (dispatch.driver_index)
+обновляется сразу после записи, рассылка на карту (dispatch.map_state и
+driver_location_update) и обновление ETA выполняются в отдельном потоке,
+ETA - не чаще ETA_INTERVAL_SECONDS на водителя.
+
+Время устройства (recorded_at) используется только для порядка и отсева повторов;
+в last_location_update, индекс водителей и дельты карты пишется время приема
+сервером (received_at), поэтому отстающие часы телефона не делают водителя
+"устаревшим".
+
+Driver.current_lat/current_lon в БД отстают от последней точки не более чем на
+интервал записи; свежая позиция процесса - LocationPipeline.latest().
+Водитель должен отправлять точки в один процесс (WebSocket держит соединение),
+иначе более старая точка из другого процесса может быть записана позже новой.
+
+EAGER=True записывает и рассылает сразу в ingest (тесты, отладка).
+"""
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+import atexit
+import logging
+import threading
+import time
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Driver
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LOCATION_PIPELINE_SETTINGS = {
+    'FLUSH_INTERVAL_SECONDS': 1.0,
+    'MAX_PENDING': 2000,
+    'BATCH_SIZE': 500,
+    'ETA_INTERVAL_SECONDS': 5,
+    'EAGER': False,
+}
+
+LOCATION_FIELDS = ['current_lat', 'current_lon', 'last_location_update']
+
+# Статусы заказа, для которых водителю пересчитывается ETA
+ETA_ORDER_STATUSES = ('assigned', 'driver_en_route', 'arrived_waiting', 'ride_ongoing')
+
+
+def _pipeline_settings() -> Dict:
+    options = dict(DEFAULT_LOCATION_PIPELINE_SETTINGS)
+    options.update(getattr(settings, 'LOCATION_PIPELINE', {}) or {})
+    return options
+
+
+@dataclass(slots=True)
+class LocationFix:
+    """Точка GPS водителя"""
+    driver_id: int
+    lat: float
+    lon: float
+    recorded_at: datetime
+    accuracy: Optional[float] = None
+    received_at: Optional[datetime] = None  # Время приема сервером (ingest)
+
+
+def fix_from_payload(driver_id: int, payload: Dict) -> LocationFix:
+    """
+    Точка из тела запроса или сообщения WebSocket:
+    {"lat", "lon", "timestamp" (ISO, необязательно), "accuracy" (метры, необязательно)}
+
+    Raises:
+        ValueError: с текстом ошибки для клиента
+    """
+    lat = payload.get('lat')
+    lon = payload.get('lon')
+    if lat is None or lon is None:
+        raise ValueError('Требуются lat и lon')
+    try:
+        lat = float(lat)
+        lon = float(lon)
+    except (ValueError, TypeError):
+        raise ValueError('Неверный формат координат')
+    if not (-90 <= lat <= 90):
+        raise ValueError('Широта должна быть в диапазоне от -90 до 90')
+    if not (-180 <= lon <= 180):
+        raise ValueError('Долгота должна быть в диапазоне от -180 до 180')
+
+    recorded_at = None
+    timestamp = payload.get('timestamp')
+    if timestamp:
+        recorded_at = parse_datetime(str(timestamp))
+        if recorded_at is None:
+            raise ValueError('Неверный формат timestamp')
+        if timezone.is_naive(recorded_at):
+            recorded_at = timezone.make_aware(recorded_at)
+
+    accuracy = payload.get('accuracy')
+    if accuracy is not None:
+        try:
+            accuracy = float(accuracy)
+        except (ValueError, TypeError):
+            raise ValueError('Неверный формат accuracy')
+
+    return LocationFix(driver_id, lat, lon, recorded_at, accuracy)
+
+
+class LocationPipeline:
+    """Последние позиции водителей в памяти процесса и их пакетная запись"""
+
+    def __init__(self, options: Optional[Dict] = None):
+        self.options = options or _pipeline_settings()
+        self._lock = threading.Lock()
+        self._latest: Dict[int, LocationFix] = {}
+        self._pending: Dict[int, LocationFix] = {}
+        self._eta_refreshed: Dict[int, float] = {}
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._fanout: Optional[ThreadPoolExecutor] = None
+        self.stats = {'accepted': 0, 'dropped': 0, 'written': 0, 'flushes': 0}
+
+    def ingest(
+        self,
+        driver_id: int,
+        lat: float,
+        lon: float,
+        recorded_at: Optional[datetime] = None,
+        accuracy: Optional[float] = None
+    ) -> bool:
+        """
+        Принимает точку водителя.
+
+        Returns:
+            False, если точка не новее уже принятой (повтор или пришла не по порядку)
+        """
+        accepted = self._store(LocationFix(driver_id, lat, lon, recorded_at, accuracy))
+        if accepted:
+            self._after_ingest()
+        return accepted
+
+    def ingest_many(self, fixes: Iterable[LocationFix]) -> List[bool]:
+        """Принимает пачку точек (например, накопленных приложением без сети)"""
+        results = [self._store(fix) for fix in fixes]
+        if any(results):
+            self._after_ingest()
+        return results
+
+    def latest(self, driver_id: int) -> Optional[LocationFix]:
+        """Последняя принятая позиция водителя в этом процессе"""
+        with self._lock:
+            return self._latest.get(driver_id)
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    @staticmethod
+    def _clamp(recorded_at: Optional[datetime], now: datetime) -> datetime:
+        if recorded_at is None or recorded_at > now:
+            return now
+        return recorded_at
+
+    def _store(self, fix: LocationFix) -> bool:
+        fix.received_at = timezone.now()
+        fix.recorded_at = self._clamp(fix.recorded_at, fix.received_at)
+        with self._lock:
+            previous = self._latest.get(fix.driver_id)
+            if previous is not None and fix.recorded_at <= previous.recorded_at:
+                self.stats['dropped'] += 1
+                return False
+            self._latest[fix.driver_id] = fix
+            self._pending[fix.driver_id] = fix
+            self.stats['accepted'] += 1
+            return True
+
+    def _after_ingest(self):
+        if self.options['EAGER']:
+            self.flush()
+            return
+        self._ensure_thread()
+        if self.pending_count() >= self.options['MAX_PENDING']:
+            self._wakeup.set()
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name='location-flush', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        interval = self.options['FLUSH_INTERVAL_SECONDS']
+        while True:
+            self._wakeup.wait(interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f'Ошибка записи позиций водителей: {e}', exc_info=True)
+            finally:
+                close_old_connections()
+
+    def flush(self) -> int:
+        """
+        Записывает накопленные позиции одним bulk_update и запускает рассылку.
+
+        Returns:
+            Количество записанных водителей
+        """
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        if not batch:
+            return 0
+
+        fixes = list(batch.values())
+        drivers = [
+            Driver(id=fix.driver_id, current_lat=fix.lat, current_lon=fix.lon, last_location_update=fix.received_at)
+            for fix in fixes
+        ]
+        try:
+            with transaction.atomic():
+                Driver.objects.bulk_update(drivers, LOCATION_FIELDS, batch_size=self.options['BATCH_SIZE'])
+        except Exception:
+            # Вернуть в очередь то, что не перекрыто более новыми точками
+            with self._lock:
+                for fix in fixes:
+                    self._pending.setdefault(fix.driver_id, fix)
+            raise
+
+        with self._lock:
+            self.stats['written'] += len(fixes)
+            self.stats['flushes'] += 1
+
+        from dispatch.driver_index import update_driver_index
+        update_driver_index({
+            fix.driver_id: {'current_lat': fix.lat, 'current_lon': fix.lon, 'last_location_update': fix.received_at}
+            for fix in fixes
+        })
+
+        if self.options['EAGER']:
+            self._fan_out(fixes)
+        else:
+            if self._fanout is None:
+                self._fanout = ThreadPoolExecutor(max_workers=1, thread_name_prefix='location-fanout')
+            self._fanout.submit(self._fan_out_safe, fixes)
+        return len(fixes)
+
+    def _fan_out_safe(self, fixes: List[LocationFix]):
+        try:
+            self._fan_out(fixes)
+        except Exception as e:
+            logger.error(f'Ошибка рассылки позиций водителей: {e}', exc_info=True)
+        finally:
+            close_old_connections()
+
+    def _fan_out(self, fixes: List[LocationFix]):
+        """Дельты карты, driver_location_update и ETA после записи пачки"""
+        from dispatch import map_state
+
+        map_state.publish_many([
+            {
+                'kind': map_state.KIND_DRIVER,
+                'id': fix.driver_id,
+                'fields': {
+                    'lat': fix.lat,
+                    'lon': fix.lon,
+                    'last_location_update': fix.received_at.isoformat(),
+                },
+            }
+            for fix in fixes
+        ])
+        self._send_legacy_updates(fixes, self._refresh_eta(fixes))
+
+    def _refresh_eta(self, fixes: List[LocationFix]) -> Dict[int, Dict]:
+        """
+        ETA водителей с активным заказом (не чаще ETA_INTERVAL_SECONDS на водителя)
+        по маршруту заказа в dispatch.eta_tracker
+        """
+        now = time.monotonic()
+        interval = self.options['ETA_INTERVAL_SECONDS']
+        due = [
+            fix.driver_id for fix in fixes
+            if now - self._eta_refreshed.get(fix.driver_id, float('-inf')) >= interval
+        ]
+        if not due:
+            return {}
+
+        from dispatch.eta_tracker import get_eta_tracker
+        from orders.models import Order
+
+        positions = {fix.driver_id: fix for fix in fixes}
+        orders = Order.objects.filter(
+            driver_id__in=due, status__in=ETA_ORDER_STATUSES
+        ).only('id', 'driver_id', 'pickup_lat', 'pickup_lon').order_by('driver_id', 'assigned_at')
+        tracker = get_eta_tracker()
+        etas = {}
+        for order in orders:
+            if order.driver_id in etas:
+                continue
+            self._eta_refreshed[order.driver_id] = now
+            fix = positions[order.driver_id]
+            eta_data = tracker.eta_at(order.id, order.driver_id, fix.lat, fix.lon, (order.pickup_lat, order.pickup_lon))
+            if eta_data:
+                etas[order.driver_id] = {'order_id': str(order.id), **eta_data}
+        return etas
+
+    def _send_legacy_updates(self, fixes: List[LocationFix], etas: Dict[int, Dict]):
+        """
+        driver_location_update / driver_eta_update в dispatch_map (как сигнал driver_updated);
+        клиентам в режиме дельт - только driver_eta_update
+        """
+        from dispatch import map_state
+        from .signals import get_channel_layer_safe, should_send_location_update
+
+        channel_layer = get_channel_layer_safe()
+        if not channel_layer:
+            return
+        send = async_to_sync(channel_layer.group_send)
+        for driver_id, eta in etas.items():
+            send(map_state.DELTA_GROUP, {'type': 'driver_eta_update', 'data': {'driver_id': str(driver_id), **eta}})
+        if not map_state.has_legacy_subscribers():
+            return
+        due = [
+            fix for fix in fixes
+            if fix.driver_id in etas or should_send_location_update(fix.driver_id, fix.lat, fix.lon)
+        ]
+        if not due:
+            return
+
+        names = {
+            row['id']: row for row in
+            Driver.objects.filter(id__in=[fix.driver_id for fix in due]).values('id', 'name', 'car_model')
+        }
+        for fix in due:
+            info = names.get(fix.driver_id, {})
+            location_data = {
+                'driver_id': str(fix.driver_id),
+                'lat': fix.lat,
+                'lon': fix.lon,
+                'timestamp': fix.received_at.isoformat(),
+                'name': info.get('name'),
+                'car_model': info.get('car_model'),
+            }
+            eta = etas.get(fix.driver_id)
+            if eta:
+                location_data['eta'] = {key: value for key, value in eta.items() if key != 'order_id'}
+            send(map_state.LEGACY_GROUP, {'type': 'driver_location_update', 'data': location_data})
+            if eta:
+                send(map_state.LEGACY_GROUP, {
+                    'type': 'driver_eta_update',
+                    'data': {'driver_id': str(fix.driver_id), **eta},
+                })
+
+
+_pipeline: Optional[LocationPipeline] = None
+_pipeline_lock = threading.Lock()
+
+
+def get_location_pipeline() -> LocationPipeline:
+    """Конвейер позиций процесса"""
+    global _pipeline
+    if _pipeline is None:
+        with _pipeline_lock:
+            if _pipeline is None:
+                _pipeline = LocationPipeline()
+                atexit.register(_flush_at_exit)
+    return _pipeline
+
+
+def reset_location_pipeline():
+    """Сбрасывает конвейер (тесты, смена настроек)"""
+    global _pipeline
+    with _pipeline_lock:
+        _pipeline = None
+
+
+def _flush_at_exit():
+    if _pipeline is None:
+        return
+    try:
+        _pipeline.flush()
+    except Exception as e:
+        logger.error(f'Не удалось записать позиции при завершении: {e}')
@@ -1,24 +1,17 @@
-from django.db.models.signals import post_save, pre_save
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
 from django.utils import timezone
 from datetime import timedelta
+from .location_debounce import get_location_debouncer
 from .models import Driver
 import logging
 
 logger = logging.getLogger(__name__)
 
-# Кэш для дебаунсинга обновлений локаций
-# В production лучше использовать Redis
-_location_update_cache = {}
-_last_location_cache = {}
-
-# Минимальное расстояние изменения для отправки обновления (в метрах)
-MIN_DISTANCE_CHANGE_M = 10.0  # 10 метров
-
-# Минимальный интервал между обновлениями (в секундах)
-MIN_UPDATE_INTERVAL_SECONDS = 0.5  # 500ms
+# Поля, которые меняет обновление позиции
+LOCATION_FIELDS = frozenset({'current_lat', 'current_lon', 'last_location_update'})
 
 
 def get_channel_layer_safe():
@@ -32,43 +25,88 @@ def get_channel_layer_safe():
 def should_send_location_update(driver_id: str, new_lat: float, new_lon: float) -> bool:
     """
     Проверяет, нужно ли отправлять обновление локации
-    Возвращает True если:
-    1. Прошло достаточно времени с последнего обновления
-    2. Позиция изменилась значительно
+    (адаптивные пороги и хранилище - accounts.location_debounce)
+    """
+    try:
+        return get_location_debouncer().should_send(driver_id, new_lat, new_lon)
+    except Exception as e:
+        # Недоступное общее хранилище не должно останавливать рассылку
+        logger.warning(f"Location debounce failed: {e}")
+        return True
+
+
+def location_update_due(instance) -> bool:
+    """
+    Дебаунсинг позиции один раз на сохранение: результат нужен нескольким
+    обработчикам post_save, а should_send_location_update меняет кэш
     """
-    now = timezone.now()
-    driver_id_str = str(driver_id)
-    
-    # Проверяем время последнего обновления
-    last_update_time = _location_update_cache.get(driver_id_str)
-    if last_update_time:
-        time_diff = (now - last_update_time).total_seconds()
-        if time_diff < MIN_UPDATE_INTERVAL_SECONDS:
-            return False
-    
-    # Проверяем значимость изменения позиции
-    last_location = _last_location_cache.get(driver_id_str)
-    if last_location:
-        from geo.services import Geo
-        distance = Geo.calculate_distance(
-            last_location['lat'], last_location['lon'],
-            new_lat, new_lon
-        )
-        if distance < MIN_DISTANCE_CHANGE_M:
-            return False
-    
-    # Обновляем кэш
-    _location_update_cache[driver_id_str] = now
-    _last_location_cache[driver_id_str] = {'lat': new_lat, 'lon': new_lon}
-    
-    return True
+    key = (instance.current_lat, instance.current_lon, instance.last_location_update)
+    cached = getattr(instance, '_location_update_due', None)
+    if cached is None or cached[0] != key:
+        cached = (key, should_send_location_update(instance.id, instance.current_lat, instance.current_lon))
+        instance._location_update_due = cached
+    return cached[1]
+
+
+@receiver(post_save, sender=Driver)
+def driver_map_delta(sender, instance, update_fields=None, **kwargs):
+    """Дельта карты диспетчеризации: только измененные поля, после commit (dispatch.map_state)"""
+    from dispatch import map_state
+
+    try:
+        if (
+            update_fields and set(update_fields) <= LOCATION_FIELDS
+            and instance.current_lat is not None and instance.current_lon is not None
+            and not location_update_due(instance)
+        ):
+            return
+        map_state.publish_on_commit([map_state.driver_change(instance, update_fields)])
+    except Exception as e:
+        logger.error(f"Error publishing driver map delta: {e}")
+
+
+@receiver(post_delete, sender=Driver)
+def driver_deleted_map_delta(sender, instance, **kwargs):
+    """Удаленный водитель убирается с карты"""
+    from dispatch import map_state
+
+    try:
+        map_state.publish_on_commit([
+            {'kind': map_state.KIND_DRIVER, 'id': instance.id, 'op': map_state.OP_REMOVE}
+        ])
+    except Exception as e:
+        logger.error(f"Error publishing driver map delta: {e}")
+
+
+@receiver(post_save, sender=Driver)
+def driver_index_updated(sender, instance, update_fields=None, **kwargs):
+    """Обновляет водителя в индексе ближайших водителей (dispatch.driver_index)"""
+    from dispatch.driver_index import index_driver
+
+    try:
+        index_driver(instance, update_fields)
+    except Exception as e:
+        logger.error(f"Error updating driver index: {e}")
+
+
+@receiver(post_delete, sender=Driver)
+def driver_index_removed(sender, instance, **kwargs):
+    """Удаленный водитель убирается из индекса"""
+    from dispatch.driver_index import remove_from_driver_index
+
+    remove_from_driver_index(instance.id)
 
 
 @receiver(post_save, sender=Driver)
 def driver_updated(sender, instance, **kwargs):
-    """Отправляет обновления водителя через WebSocket в dispatch_map группу"""
+    """
+    Отправляет обновления водителя через WebSocket в dispatch_map группу
+    (клиенты в режиме дельт получают их из dispatch.map_state)
+    """
+    from dispatch import map_state
+
     channel_layer = get_channel_layer_safe()
-    if not channel_layer:
+    if not channel_layer or not map_state.has_legacy_subscribers():
         return
 
     try:
@@ -76,7 +114,7 @@ def driver_updated(sender, instance, **kwargs):
         if 'current_lat' in kwargs.get('update_fields', []) or 'current_lon' in kwargs.get('update_fields', []):
             if instance.current_lat is not None and instance.current_lon is not None:
                 # Проверяем, нужно ли отправлять обновление (дебаунсинг)
-                if not should_send_location_update(instance.id, instance.current_lat, instance.current_lon):
+                if not location_update_due(instance):
                     return
                 
                 # Получаем ETA для активного заказа, если есть
@@ -94,9 +132,8 @@ def driver_updated(sender, instance, **kwargs):
                 ).first()
                 
                 if active_order:
-                    from dispatch.services import DispatchEngine
-                    engine = DispatchEngine()
-                    eta_data = engine.calculate_eta(instance, active_order)
+                    from dispatch.eta_tracker import get_eta_tracker
+                    eta_data = get_eta_tracker().eta(instance, active_order)
                 
                 location_data = {
                     'driver_id': str(instance.id),
@@ -176,9 +213,8 @@ def driver_updated(sender, instance, **kwargs):
                 ).first()
                 
                 if active_order:
-                    from dispatch.services import DispatchEngine
-                    engine = DispatchEngine()
-                    eta_data = engine.calculate_eta(instance, active_order)
+                    from dispatch.eta_tracker import get_eta_tracker
+                    eta_data = get_eta_tracker().eta(instance, active_order)
                     if eta_data:
                         location_data['eta'] = eta_data
                 
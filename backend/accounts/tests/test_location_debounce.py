@@ -0,0 +1,126 @@
+"""
+Тесты для дебаунсинга рассылки позиций (accounts.location_debounce)
+"""
+import time
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from accounts.location_debounce import (
+    DEFAULT_LOCATION_DEBOUNCE_SETTINGS, LocationDebouncer, MemoryDebounceStore, reset_location_debouncer,
+    get_location_debouncer,
+)
+from accounts.models import User
+from dispatch import map_state
+
+# ~11 м и ~111 м по широте
+STEP_SMALL = 0.0001
+STEP_LARGE = 0.001
+
+
+class LocationDebouncerTestCase(TestCase):
+    """Тесты для LocationDebouncer и хранилищ"""
+
+    def setUp(self):
+        cache.clear()
+
+    def _debouncer(self, **options):
+        return LocationDebouncer({**DEFAULT_LOCATION_DEBOUNCE_SETTINGS, **options})
+
+    def test_interval_and_distance_thresholds(self):
+        """Частые и мелкие смещения отсеиваются, счетчики это отражают"""
+        debouncer = self._debouncer()
+        self.assertTrue(debouncer.should_send(1, 51.0, 71.0, now=100.0))
+        self.assertFalse(debouncer.should_send(1, 51.0 + STEP_LARGE, 71.0, now=100.2))
+        self.assertFalse(debouncer.should_send(1, 51.00005, 71.0, now=101.0))
+        self.assertTrue(debouncer.should_send(1, 51.0 + STEP_SMALL * 2, 71.0, now=102.0))
+
+        stats = debouncer.stats()
+        self.assertEqual(stats['forwarded'], 2)
+        self.assertEqual(stats['suppressed_interval'], 1)
+        self.assertEqual(stats['suppressed_distance'], 1)
+        self.assertEqual(stats['suppression_rate'], 0.5)
+
+    def test_thresholds_adapt_to_speed_and_subscribers(self):
+        """Быстрому водителю нужен больший сдвиг, без подписчиков карты - больший интервал"""
+        debouncer = self._debouncer(SUBSCRIBERS_REFRESH_SECONDS=0)
+        self.assertEqual(debouncer.thresholds(0.0, None), (0.5, 10.0))
+        self.assertEqual(debouncer.thresholds(30.0, None), (0.5, 30.0))
+        self.assertEqual(debouncer.thresholds(100.0, None), (0.5, 50.0))
+
+        map_state.subscriber_joined(delta_mode=True)
+        self.assertEqual(debouncer.thresholds(0.0, debouncer.map_subscribers())[0], 0.5)
+        map_state.subscriber_left(delta_mode=True)
+        map_state.subscriber_left(delta_mode=True)  # лишний disconnect не уводит счетчик ниже нуля
+        self.assertEqual(debouncer.map_subscribers(), 0)
+
+        self.assertTrue(debouncer.should_send(1, 51.0, 71.0, now=100.0))
+        self.assertFalse(debouncer.should_send(1, 51.0 + STEP_LARGE, 71.0, now=102.0))
+        self.assertTrue(debouncer.should_send(1, 51.0 + STEP_LARGE, 71.0, now=105.0))
+
+    def test_memory_store_is_bounded(self):
+        """LRU вытесняет давно не обновлявшихся водителей, устаревшие записи не читаются"""
+        store = MemoryDebounceStore(max_entries=2, ttl_seconds=600)
+        for driver_id in range(3):
+            store.set(f'driver:{driver_id}', {'t': 0})
+        self.assertEqual(len(store), 2)
+        self.assertIsNone(store.get('driver:0'))
+
+        expired = MemoryDebounceStore(max_entries=2, ttl_seconds=-1)
+        expired.set('driver:0', {'t': 0})
+        self.assertIsNone(expired.get('driver:0'))
+
+    def test_django_backend_is_shared_between_workers(self):
+        """С BACKEND='django' состояние водителей общее для процессов"""
+        first = self._debouncer(BACKEND='django')
+        second = self._debouncer(BACKEND='django')
+
+        self.assertTrue(first.should_send(1, 51.0, 71.0, now=100.0))
+        self.assertFalse(second.should_send(1, 51.0 + STEP_LARGE, 71.0, now=100.2))
+
+    def test_subscribers_come_from_map_counter(self):
+        """Подписчики - общий счетчик клиентов карты: он истекает без ping и восстанавливается ими"""
+        debouncer = self._debouncer(SUBSCRIBERS_REFRESH_SECONDS=0)
+        self.assertIsNone(debouncer.map_subscribers())
+        map_state.subscriber_joined()
+        map_state.subscriber_joined(delta_mode=True)
+        self.assertEqual(debouncer.map_subscribers(), 2)
+
+        now = time.time()
+        with mock.patch('time.time') as clock:
+            # ping продлевает счетчик
+            clock.return_value = now + 60
+            map_state.subscriber_alive()
+            clock.return_value = now + 120
+            self.assertEqual(debouncer.map_subscribers(), 1)
+
+            # Подписчики упавшего процесса не держат карту "просматриваемой" вечно
+            clock.return_value = now + 300
+            self.assertIsNone(debouncer.map_subscribers())
+            map_state.subscriber_alive(delta_mode=True)
+            self.assertEqual(debouncer.map_subscribers(), 1)
+
+    def test_stats_are_logged_and_exposed_to_staff(self):
+        """Счетчики пишутся в лог раз в STATS_LOG_INTERVAL_SECONDS и отдаются staff-эндпоинтом"""
+        debouncer = self._debouncer(STATS_LOG_INTERVAL_SECONDS=60)
+        with self.assertNoLogs('accounts.location_debounce', level='INFO'):
+            debouncer.should_send(1, 51.0, 71.0, now=100.0)
+        debouncer._stats_logged_at -= 60
+        with self.assertLogs('accounts.location_debounce', level='INFO') as logs:
+            debouncer.should_send(1, 51.0, 71.0, now=100.1)
+        self.assertIn("'suppressed_interval': 1", logs.output[0])
+
+        reset_location_debouncer()
+        self.addCleanup(reset_location_debouncer)
+        get_location_debouncer().should_send(1, 51.0, 71.0, now=100.0)
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user(username='driver', phone='+77000000002', password='pass'))
+        self.assertEqual(client.get('/api/dispatch/location-debounce-stats/').status_code, 403)
+        client.force_authenticate(
+            User.objects.create_user(username='admin', phone='+77000000999', password='pass', is_staff=True)
+        )
+        response = client.get('/api/dispatch/location-debounce-stats/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['forwarded'], 1)
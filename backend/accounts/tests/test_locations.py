@@ -0,0 +1,105 @@
+"""
+Тесты для приема позиций водителей (accounts.locations)
+"""
+from datetime import timedelta
+from unittest import mock
+
+from django.core.cache import cache
+from django.db.models.signals import post_save
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from accounts.locations import DEFAULT_LOCATION_PIPELINE_SETTINGS, LocationPipeline, reset_location_pipeline
+from accounts.models import Driver, DriverStatus
+from dispatch import map_state
+from utils.testing import create_city, create_driver, create_region
+
+
+class LocationPipelineTestCase(TestCase):
+    """Тесты для LocationPipeline и update_location"""
+
+    def setUp(self):
+        cache.clear()
+        reset_location_pipeline()
+        region = create_region(create_city())
+        self.drivers = [
+            create_driver(region, i, is_online=True, status=DriverStatus.ONLINE_IDLE) for i in range(3)
+        ]
+
+    def tearDown(self):
+        reset_location_pipeline()
+
+    def _pipeline(self):
+        pipeline = LocationPipeline(dict(DEFAULT_LOCATION_PIPELINE_SETTINGS))
+        pipeline._ensure_thread = mock.Mock()
+        return pipeline
+
+    def test_fixes_are_coalesced_per_driver(self):
+        """На водителя пишется одна последняя точка, старые и повторные отбрасываются"""
+        pipeline = self._pipeline()
+        # Часы устройства отстают на 10 минут: порядок по ним, время записи - серверное
+        start = timezone.now() - timedelta(minutes=10)
+        received_from = timezone.now()
+        for i in range(10):
+            for driver in self.drivers:
+                pipeline.ingest(driver.id, 51.1 + i * 0.001, 71.4, recorded_at=start + timedelta(seconds=i))
+        self.assertFalse(pipeline.ingest(self.drivers[0].id, 50.0, 70.0, recorded_at=start))
+        self.assertEqual(pipeline.pending_count(), 3)
+        self.assertEqual(pipeline.stats['dropped'], 1)
+
+        pipeline.options['EAGER'] = True  # рассылка в этом потоке
+        with mock.patch.object(pipeline, '_fan_out') as fan_out:
+            with self.assertNumQueries(3):  # savepoint, bulk_update, release
+                self.assertEqual(pipeline.flush(), 3)
+        self.assertEqual(len(fan_out.call_args.args[0]), 3)
+        self.assertEqual(pipeline.pending_count(), 0)
+
+        driver = Driver.objects.get(id=self.drivers[0].id)
+        self.assertAlmostEqual(driver.current_lat, 51.109)
+        self.assertGreaterEqual(driver.last_location_update, received_from)
+        self.assertEqual(driver.last_location_update, pipeline.latest(driver.id).received_at)
+        self.assertEqual(pipeline.latest(driver.id).recorded_at, start + timedelta(seconds=9))
+
+    def test_failed_flush_keeps_fixes(self):
+        """При ошибке записи точки возвращаются в очередь"""
+        pipeline = self._pipeline()
+        pipeline.ingest(self.drivers[0].id, 51.1, 71.4)
+        with mock.patch.object(Driver.objects, 'bulk_update', side_effect=RuntimeError('locked')):
+            with self.assertRaises(RuntimeError):
+                pipeline.flush()
+        self.assertEqual(pipeline.pending_count(), 1)
+
+    @override_settings(LOCATION_PIPELINE={'EAGER': True})
+    def test_update_location_endpoint(self):
+        """PATCH location не вызывает post_save и публикует дельту карты после записи"""
+        driver = self.drivers[1]
+        client = APIClient()
+        client.force_authenticate(driver.user)
+        seq = map_state.current_seq()
+
+        saves = []
+        post_save.connect(lambda **kwargs: saves.append(kwargs), sender=Driver, weak=False, dispatch_uid='test_saves')
+        try:
+            response = client.patch('/api/mobile/drivers/location/', {'lat': 51.2, 'lon': 71.5}, format='json')
+        finally:
+            post_save.disconnect(sender=Driver, dispatch_uid='test_saves')
+        self.assertEqual(response.status_code, 200)
+        # Прежний контракт приложения: профиль водителя с новой позицией
+        self.assertEqual(response.data['id'], driver.id)
+        self.assertEqual(response.data['current_position'], {'lat': 51.2, 'lon': 71.5})
+        self.assertEqual(saves, [])
+
+        driver.refresh_from_db()
+        self.assertEqual((driver.current_lat, driver.current_lon), (51.2, 71.5))
+        delta = map_state.deltas_since(seq)[0]
+        self.assertEqual(delta['id'], str(driver.id))
+        self.assertEqual((delta['fields']['lat'], delta['fields']['lon']), (51.2, 71.5))
+
+        response = client.patch('/api/mobile/drivers/location/?compact=1', {'lat': 51.3, 'lon': 71.5}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.data), {'driver_id', 'lat', 'lon', 'last_location_update', 'accepted'})
+        self.assertTrue(response.data['accepted'])
+
+        response = client.patch('/api/mobile/drivers/location/', {'lat': 95, 'lon': 71.5}, format='json')
+        self.assertEqual(response.status_code, 400)
@@ -21,6 +21,7 @@ from .serializers import (
 from django.contrib.auth import authenticate
 from .services import OTPService, UserService
 from .pagination import DriverPagination
+from .locations import fix_from_payload, get_location_pipeline
 
 User = get_user_model()
 
@@ -579,42 +580,19 @@ class DriverViewSet(viewsets.ModelViewSet):
                     status=status.HTTP_403_FORBIDDEN
                 )
 
-        lat = request.data.get('lat')
-        lon = request.data.get('lon')
-
-        if lat is None or lon is None:
-            return Response(
-                {'error': 'Требуются lat и lon'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-
-        # Валидация координат
         try:
-            lat = float(lat)
-            lon = float(lon)
-            
-            # Проверка диапазона координат (широта: -90 до 90, долгота: -180 до 180)
-            if not (-90 <= lat <= 90):
-                return Response(
-                    {'error': 'Широта должна быть в диапазоне от -90 до 90'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            if not (-180 <= lon <= 180):
-                return Response(
-                    {'error': 'Долгота должна быть в диапазоне от -180 до 180'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-        except (ValueError, TypeError):
+            fix = fix_from_payload(driver.id, request.data)
+        except ValueError as e:
             return Response(
-                {'error': 'Неверный формат координат. Требуются числа'},
+                {'error': str(e)},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        from django.utils import timezone
-        driver.current_lat = lat
-        driver.current_lon = lon
-        driver.last_location_update = timezone.now()
-        driver.save(update_fields=['current_lat', 'current_lon', 'last_location_update'])
+        # Запись в БД - пакетно (accounts.locations); в ответе уже новая позиция
+        get_location_pipeline().ingest_many([fix])
+        driver.current_lat = fix.lat
+        driver.current_lon = fix.lon
+        driver.last_location_update = fix.received_at
 
         return Response(DriverSerializer(driver).data)
 
@@ -9,8 +9,10 @@ from django.contrib.auth import get_user_model
 from .models import Passenger, Driver
 from .serializers import PassengerSerializer, DriverSerializer, PhoneLoginSerializer, VerifyOTPSerializer, UserSerializer
 from .services import OTPService, UserService
+from .locations import fix_from_payload, get_location_pipeline
 from orders.models import Order, OrderStatus, OrderOffer
 from orders.serializers import OrderSerializer
+from dispatch.eta_tracker import get_eta_tracker
 from dispatch.services import DispatchEngine
 from regions.models import Region
 
@@ -323,11 +325,10 @@ class MobilePassengerViewSet(viewsets.ViewSet):
                 # Рассчитываем ETA если водитель в пути
                 if order.status in [OrderStatus.DRIVER_EN_ROUTE, OrderStatus.ASSIGNED]:
                     try:
-                        engine = DispatchEngine()
-                        eta_data = engine.calculate_eta(order.driver, order)
+                        eta_data = get_eta_tracker().eta(order.driver, order)
                         if eta_data:
                             response_data['eta'] = {
-                                'seconds': eta_data.get('eta_seconds'),
+                                'seconds': eta_data.get('duration_seconds'),
                                 'distance_km': eta_data.get('distance_km'),
                                 'formatted': eta_data.get('eta_formatted')
                             }
@@ -404,47 +405,39 @@ class MobileDriverViewSet(viewsets.ViewSet):
 
     @action(detail=False, methods=['patch'], url_path='location')
     def update_location(self, request):
-        """Обновить позицию водителя"""
+        """
+        Обновить позицию водителя.
+        Позиция принимается в память и записывается пакетно (accounts.locations).
+        Ответ - профиль водителя с новой позицией; ?compact=1 - короткое
+        подтверждение без сериализации профиля (для новых версий приложения)
+        """
         try:
             driver = self.get_driver()
             
-            lat = request.data.get('lat')
-            lon = request.data.get('lon')
-            
-            if lat is None or lon is None:
-                return Response(
-                    {'error': 'Требуются lat и lon'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            
-            # Валидация координат
             try:
-                lat = float(lat)
-                lon = float(lon)
-                
-                if not (-90 <= lat <= 90):
-                    return Response(
-                        {'error': 'Широта должна быть в диапазоне от -90 до 90'},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-                if not (-180 <= lon <= 180):
-                    return Response(
-                        {'error': 'Долгота должна быть в диапазоне от -180 до 180'},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-            except (ValueError, TypeError):
+                fix = fix_from_payload(driver.id, request.data)
+            except ValueError as e:
                 return Response(
-                    {'error': 'Неверный формат координат'},
+                    {'error': str(e)},
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
-            driver.current_lat = lat
-            driver.current_lon = lon
-            driver.last_location_update = timezone.now()
-            driver.save(update_fields=['current_lat', 'current_lon', 'last_location_update'])
-            
-            serializer = DriverSerializer(driver)
-            return Response(serializer.data)
+            accepted = get_location_pipeline().ingest_many([fix])[0]
+            if request.query_params.get('compact') in ('1', 'true', 'True'):
+                return Response({
+                    'driver_id': driver.id,
+                    'lat': fix.lat,
+                    'lon': fix.lon,
+                    'last_location_update': fix.received_at.isoformat(),
+                    'accepted': accepted,
+                })
+
+            # Позиция еще может быть не записана в БД - профиль отдается с принятой
+            if accepted:
+                driver.current_lat = fix.lat
+                driver.current_lon = fix.lon
+                driver.last_location_update = fix.received_at
+            return Response(DriverSerializer(driver).data)
         except Exception as e:
             return Response(
                 {'error': str(e)},
@@ -672,13 +665,12 @@ class MobileDriverViewSet(viewsets.ViewSet):
             # Добавляем маршрут если нужно
             if order.status in [OrderStatus.DRIVER_EN_ROUTE, OrderStatus.ASSIGNED]:
                 try:
-                    engine = DispatchEngine()
-                    route_data = engine.calculate_driver_route(driver, order)
-                    if route_data:
+                    eta_data = get_eta_tracker().eta(driver, order)
+                    if eta_data:
                         response_data['route_to_pickup'] = {
-                            'distance_km': route_data.get('distance_km'),
-                            'duration_minutes': route_data.get('duration_minutes'),
-                            'eta': route_data.get('eta').isoformat() if route_data.get('eta') else None,
+                            'distance_km': eta_data['distance_km'],
+                            'duration_minutes': eta_data['duration_minutes'],
+                            'eta': eta_data['eta'],
                         }
                 except Exception:
                     pass
@@ -0,0 +1,234 @@
+"""
+Кэш ответов аналитики (AnalyticsViewSet)
+
+Ключ - эндпоинт, нормализованный диапазон дат (до минуты), регион и прочие
+параметры запроса, плюс поколения всех дней диапазона. Сохранение/удаление
+заказа меняет поколение дня его created_at (analytics.signals), поэтому
+ответы по затронутым дням перестают находиться без перебора ключей.
+
+Закрытые диапазоны (до начала сегодняшнего дня) живут HISTORICAL_TTL_SECONDS,
+диапазоны с сегодняшним днем и эндпоинты с текущим состоянием водителей
+(LIVE_ENDPOINTS) - короткий TTL. С кэшем в памяти процесса (LocMemCache, по
+умолчанию без CACHES) сброс поколений из других процессов не виден, поэтому
+там и закрытые диапазоны живут короткий TTL. Одинаковые одновременные запросы
+считаются один раз (single-flight: блокировка в процессе + cache.add между процессами).
+"""
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Dict, Iterable, List, Optional
+import hashlib
+import json
+import logging
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ANALYTICS_CACHE_SETTINGS = {
+    'ENABLED': True,
+    'ALIAS': 'default',
+    'HISTORICAL_TTL_SECONDS': 24 * 3600,
+    'LIVE_TTL_SECONDS': 60,
+    # Короткий TTL по эндпоинтам (для диапазонов с сегодняшним днем)
+    'ENDPOINT_TTL_SECONDS': {
+        'metrics': 30,
+        'drivers': 30,
+        'peak_hours': 300,
+        'driver_performance': 120,
+    },
+    'LOCK_TIMEOUT_SECONDS': 30,
+    'LOCK_POLL_SECONDS': 0.05,
+    'MAX_RANGE_DAYS': 400,
+}
+
+# Зависят от текущего состояния водителей (online_drivers) - всегда короткий TTL
+LIVE_ENDPOINTS = frozenset({'metrics', 'drivers'})
+
+KEY_PREFIX = 'analytics:v1'
+
+_MISSING = object()
+
+
+def _cache_settings() -> Dict:
+    options = dict(DEFAULT_ANALYTICS_CACHE_SETTINGS)
+    options.update(getattr(settings, 'ANALYTICS_CACHE', {}) or {})
+    return options
+
+
+def _backend():
+    return caches[_cache_settings()['ALIAS']]
+
+
+def _parse(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def normalize_range(date_from: Optional[str], date_to: Optional[str], now: Optional[datetime] = None):
+    """
+    Диапазон как в MetricsAggregator.get_date_range, округленный до минуты:
+    запросы с умолчаниями (последние 30 дней) в пределах минуты дают один ключ
+    """
+    now = now or timezone.now()
+    start = _parse(date_from) or now - timedelta(days=30)
+    end = _parse(date_to) or now
+    return start.replace(second=0, microsecond=0), end.replace(second=0, microsecond=0)
+
+
+def _days(start: datetime, end: datetime) -> List[date]:
+    first = timezone.localtime(start).date()
+    last = timezone.localtime(end).date()
+    return [first + timedelta(days=i) for i in range((last - first).days + 1)]
+
+
+def _generation_key(day: date) -> str:
+    return f'{KEY_PREFIX}:gen:{day.isoformat()}'
+
+
+def invalidate_days(days: Iterable[date]):
+    """Новое поколение для дней: закэшированные ответы по ним больше не находятся"""
+    options = _cache_settings()
+    if not options['ENABLED']:
+        return
+    token = uuid.uuid4().hex[:12]
+    # Поколение живет не меньше ответов, иначе после его вытеснения нашлись бы старые ответы
+    _backend().set_many(
+        {_generation_key(day): token for day in set(days)},
+        timeout=options['HISTORICAL_TTL_SECONDS']
+    )
+
+
+def invalidate_for(created_at: Iterable[Optional[datetime]]):
+    """Инвалидация по created_at измененных заказов"""
+    invalidate_days({timezone.localtime(value).date() for value in created_at if value})
+
+
+class _KeyedLocks:
+    """Блокировки по ключу внутри процесса (удаляются, когда никто не ждет)"""
+
+    def __init__(self):
+        self._mutex = threading.Lock()
+        self._locks: Dict[str, list] = {}
+
+    @contextmanager
+    def hold(self, key: str):
+        with self._mutex:
+            entry = self._locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._mutex:
+                entry[1] -= 1
+                if not entry[1]:
+                    self._locks.pop(key, None)
+
+
+_local_locks = _KeyedLocks()
+
+
+def cache_key(endpoint: str, start: datetime, end: datetime, params: Dict[str, Any], generations: List) -> str:
+    payload = json.dumps(
+        [endpoint, start.isoformat(), end.isoformat(), sorted(params.items()), generations],
+        default=str
+    )
+    return f'{KEY_PREFIX}:{endpoint}:{hashlib.sha1(payload.encode()).hexdigest()}'
+
+
+def is_process_local(backend) -> bool:
+    """Кэш в памяти процесса: инвалидация из других процессов до него не доходит"""
+    from django.core.cache.backends.locmem import LocMemCache
+    return isinstance(backend, LocMemCache)
+
+
+def _ttl(endpoint: str, end: datetime, now: datetime, options: Dict, shared: bool = True) -> int:
+    today_start = timezone.localtime(now).replace(hour=0, minute=0, second=0, microsecond=0)
+    if shared and endpoint not in LIVE_ENDPOINTS and end < today_start:
+        return options['HISTORICAL_TTL_SECONDS']
+    return options['ENDPOINT_TTL_SECONDS'].get(endpoint, options['LIVE_TTL_SECONDS'])
+
+
+def get_or_compute(
+    endpoint: str,
+    date_from: Optional[str],
+    date_to: Optional[str],
+    compute: Callable[[], Any],
+    extend_back: bool = False,
+    **params
+):
+    """
+    Ответ эндпоинта из кэша или compute() с сохранением.
+
+    Args:
+        endpoint: Имя эндпоинта
+        date_from, date_to: Диапазон из запроса (ISO, могут быть пустыми)
+        compute: Расчет ответа (исключения не кэшируются)
+        extend_back: Ответ зависит и от предыдущего такого же периода (comparison)
+        **params: Остальные параметры, влияющие на ответ (region_id, granularity, ...)
+
+    Returns:
+        (ответ, 'hit' | 'miss' | 'bypass')
+    """
+    options = _cache_settings()
+    if not options['ENABLED']:
+        return compute(), 'bypass'
+
+    now = timezone.now()
+    try:
+        start, end = normalize_range(date_from, date_to, now)
+    except ValueError:
+        # Некорректные даты - ошибку вернет сам расчет
+        return compute(), 'bypass'
+
+    span_start = start - (end - start) - timedelta(minutes=1) if extend_back else start
+    days = _days(span_start, end)
+    if len(days) > options['MAX_RANGE_DAYS']:
+        return compute(), 'bypass'
+
+    backend = _backend()
+    known = backend.get_many([_generation_key(day) for day in days])
+    generations = [known.get(_generation_key(day), '0') for day in days]
+    key = cache_key(endpoint, start, end, params, generations)
+
+    value = backend.get(key, _MISSING)
+    if value is not _MISSING:
+        return value, 'hit'
+
+    with _local_locks.hold(key):
+        value = backend.get(key, _MISSING)
+        if value is not _MISSING:
+            return value, 'hit'
+
+        lock_key = f'{key}:lock'
+        lock_timeout = options['LOCK_TIMEOUT_SECONDS']
+        owns_lock = backend.add(lock_key, 1, timeout=lock_timeout)
+        if not owns_lock:
+            # Считает другой процесс - ждем его результат
+            deadline = time.monotonic() + lock_timeout
+            while time.monotonic() < deadline:
+                time.sleep(options['LOCK_POLL_SECONDS'])
+                value = backend.get(key, _MISSING)
+                if value is not _MISSING:
+                    return value, 'hit'
+                if backend.get(lock_key) is None:
+                    break
+            logger.debug(f'Аналитика {endpoint}: не дождались расчета другого процесса')
+
+        try:
+            value = compute()
+            ttl = _ttl(endpoint, end, now, options, shared=not is_process_local(backend))
+            backend.set(key, value, timeout=ttl)
+        finally:
+            if owns_lock:
+                backend.delete(lock_key)
+    return value, 'miss'
@@ -0,0 +1,23 @@
+"""
+Команда для обновления срезов аналитики (запускать по расписанию, например раз в 5 минут)
+
+Использование:
+    python manage.py refresh_analytics_rollups
+    python manage.py refresh_analytics_rollups --full
+"""
+from django.core.management.base import BaseCommand
+
+from analytics.rollups import refresh_rollups
+
+
+class Command(BaseCommand):
+    help = 'Обновить почасовые и дневные срезы заказов для аналитики'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Перестроить срезы с нуля')
+
+    def handle(self, *args, **options):
+        result = refresh_rollups(full=options['full'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Пересчитано часов: {result["hours"]}. Водяной знак: {result["watermark"]}'
+        ))
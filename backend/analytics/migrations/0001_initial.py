@@ -0,0 +1,67 @@
+# Generated by Django 4.2.27 on 2026-10-17 04:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupDirtyHour',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.DateTimeField(unique=True, verbose_name='Начало часа')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RollupState',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False, verbose_name='Название')),
+                ('watermark', models.DateTimeField(blank=True, null=True, verbose_name='Максимальный обработанный updated_at')),
+                ('last_run_at', models.DateTimeField(blank=True, null=True, verbose_name='Последний запуск')),
+            ],
+            options={
+                'verbose_name': 'Состояние срезов',
+                'verbose_name_plural': 'Состояния срезов',
+            },
+        ),
+        migrations.CreateModel(
+            name='OrderHourlyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('region_id', models.CharField(blank=True, default='', max_length=50, verbose_name='Регион пассажира')),
+                ('status', models.CharField(max_length=50, verbose_name='Статус')),
+                ('driver_id', models.IntegerField(blank=True, null=True, verbose_name='Водитель')),
+                ('orders_count', models.PositiveIntegerField(default=0, verbose_name='Заказов')),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Сумма final_price')),
+                ('bucket', models.DateTimeField(verbose_name='Начало часа')),
+            ],
+            options={
+                'verbose_name': 'Почасовой срез заказов',
+                'verbose_name_plural': 'Почасовые срезы заказов',
+                'indexes': [models.Index(fields=['bucket', 'region_id'], name='analytics_o_bucket_5b08e5_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='OrderDailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('region_id', models.CharField(blank=True, default='', max_length=50, verbose_name='Регион пассажира')),
+                ('status', models.CharField(max_length=50, verbose_name='Статус')),
+                ('driver_id', models.IntegerField(blank=True, null=True, verbose_name='Водитель')),
+                ('orders_count', models.PositiveIntegerField(default=0, verbose_name='Заказов')),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Сумма final_price')),
+                ('day', models.DateField(verbose_name='Дата')),
+            ],
+            options={
+                'verbose_name': 'Дневной срез заказов',
+                'verbose_name_plural': 'Дневные срезы заказов',
+                'indexes': [models.Index(fields=['day', 'region_id'], name='analytics_o_day_b85974_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,61 @@
+from django.db import models
+
+
+class OrderRollupFields(models.Model):
+    """Общие поля срезов заказов (analytics.rollups)"""
+    region_id = models.CharField(max_length=50, blank=True, default='', verbose_name='Регион пассажира')
+    status = models.CharField(max_length=50, verbose_name='Статус')
+    driver_id = models.IntegerField(null=True, blank=True, verbose_name='Водитель')
+    orders_count = models.PositiveIntegerField(default=0, verbose_name='Заказов')
+    revenue = models.DecimalField(
+        max_digits=14,
+        decimal_places=2,
+        default=0,
+        verbose_name='Сумма final_price'
+    )
+
+    class Meta:
+        abstract = True
+
+
+class OrderHourlyRollup(OrderRollupFields):
+    """Почасовой срез заказов по created_at"""
+    bucket = models.DateTimeField(verbose_name='Начало часа')
+
+    class Meta:
+        verbose_name = 'Почасовой срез заказов'
+        verbose_name_plural = 'Почасовые срезы заказов'
+        indexes = [
+            models.Index(fields=['bucket', 'region_id']),
+        ]
+
+
+class OrderDailyRollup(OrderRollupFields):
+    """Дневной срез заказов по created_at (дата в TIME_ZONE)"""
+    day = models.DateField(verbose_name='Дата')
+
+    class Meta:
+        verbose_name = 'Дневной срез заказов'
+        verbose_name_plural = 'Дневные срезы заказов'
+        indexes = [
+            models.Index(fields=['day', 'region_id']),
+        ]
+
+
+class RollupDirtyHour(models.Model):
+    """Час, который нужно пересчитать (удаленные заказы не видны по updated_at)"""
+    bucket = models.DateTimeField(unique=True, verbose_name='Начало часа')
+
+
+class RollupState(models.Model):
+    """Состояние инкрементального обновления срезов"""
+    name = models.CharField(max_length=50, primary_key=True, verbose_name='Название')
+    watermark = models.DateTimeField(null=True, blank=True, verbose_name='Максимальный обработанный updated_at')
+    last_run_at = models.DateTimeField(null=True, blank=True, verbose_name='Последний запуск')
+
+    class Meta:
+        verbose_name = 'Состояние срезов'
+        verbose_name_plural = 'Состояния срезов'
+
+    def __str__(self):
+        return f'{self.name}: {self.watermark}'
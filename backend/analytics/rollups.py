@@ -0,0 +1,346 @@
+"""
+Почасовые и дневные срезы заказов для аналитики
+
+Срезы (OrderHourlyRollup, OrderDailyRollup) хранят количество заказов и
+сумму final_price по created_at в разрезе региона пассажира, статуса и
+водителя. refresh_rollups пересчитывает только часы, в которых есть
+заказы с updated_at больше водяного знака (RollupState), и часы удаленных
+заказов (RollupDirtyHour), затем соответствующие дни.
+
+order_cells собирает агрегаты за произвольный период: целые дни - из
+дневных срезов, целые часы - из почасовых, неполные часы на краях и всё
+после последнего запуска обновления - из таблицы заказов. Пока срезы ни
+разу не строились (или ANALYTICS_ROLLUPS['ENABLED'] = False), весь период
+считается по заказам.
+"""
+from collections import defaultdict
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Max, Q, Sum
+from django.db.models.functions import ExtractHour, TruncDate, TruncHour
+from django.utils import timezone
+
+from analytics.cache import invalidate_days
+from analytics.models import OrderDailyRollup, OrderHourlyRollup, RollupDirtyHour, RollupState
+from orders.models import Order
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_NAME = 'orders'
+HOUR = timedelta(hours=1)
+SPANS_PER_QUERY = 100
+
+DEFAULT_ANALYTICS_ROLLUPS_SETTINGS = {
+    'ENABLED': True,
+    'LAG_SECONDS': 300,  # Перекрытие водяного знака (транзакции, закоммиченные с опозданием)
+}
+
+
+def _rollup_settings() -> Dict:
+    options = dict(DEFAULT_ANALYTICS_ROLLUPS_SETTINGS)
+    options.update(getattr(settings, 'ANALYTICS_ROLLUPS', {}) or {})
+    return options
+
+
+def floor_hour(value: datetime) -> datetime:
+    return value.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+def ceil_hour(value: datetime) -> datetime:
+    start = floor_hour(value)
+    return start if start == value else start + HOUR
+
+
+def _local_midnight(day) -> datetime:
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def _spans(starts: Iterable, step: timedelta) -> List[Tuple]:
+    """Склеивает соседние интервалы [start, start + step) в непрерывные отрезки"""
+    spans = []
+    for start in sorted(starts):
+        if spans and spans[-1][1] == start:
+            spans[-1][1] = start + step
+        else:
+            spans.append([start, start + step])
+    return [tuple(span) for span in spans]
+
+
+def _spans_q(field: str, spans: Sequence[Tuple]) -> Q:
+    q = Q()
+    for start, end in spans:
+        q |= Q(**{f'{field}__gte': start, f'{field}__lt': end})
+    return q
+
+
+# ---------------------------------------------------------------------------
+# Обновление срезов
+# ---------------------------------------------------------------------------
+
+def _rebuild_hours(hours: Iterable[datetime]):
+    spans = _spans(hours, HOUR)
+    for i in range(0, len(spans), SPANS_PER_QUERY):
+        chunk = spans[i:i + SPANS_PER_QUERY]
+        OrderHourlyRollup.objects.filter(_spans_q('bucket', chunk)).delete()
+        rows = (
+            Order.objects.filter(_spans_q('created_at', chunk))
+            .annotate(k_bucket=TruncHour('created_at', tzinfo=dt_timezone.utc))
+            .values('k_bucket', 'passenger__region_id', 'status', 'driver_id')
+            .annotate(k_count=Count('id'), k_revenue=Sum('final_price'))
+            .order_by()
+        )
+        OrderHourlyRollup.objects.bulk_create([
+            OrderHourlyRollup(
+                bucket=row['k_bucket'],
+                region_id=row['passenger__region_id'] or '',
+                status=row['status'],
+                driver_id=row['driver_id'],
+                orders_count=row['k_count'],
+                revenue=row['k_revenue'] or Decimal('0'),
+            )
+            for row in rows
+        ], batch_size=1000)
+
+
+def _rebuild_days(days: Iterable):
+    days = sorted(set(days))
+    for i in range(0, len(days), SPANS_PER_QUERY):
+        chunk = days[i:i + SPANS_PER_QUERY]
+        OrderDailyRollup.objects.filter(day__in=chunk).delete()
+        spans = [(_local_midnight(day), _local_midnight(day + timedelta(days=1))) for day in chunk]
+        rows = (
+            OrderHourlyRollup.objects.filter(_spans_q('bucket', spans))
+            .annotate(k_day=TruncDate('bucket'))
+            .values('k_day', 'region_id', 'status', 'driver_id')
+            .annotate(k_count=Sum('orders_count'), k_revenue=Sum('revenue'))
+            .order_by()
+        )
+        OrderDailyRollup.objects.bulk_create([
+            OrderDailyRollup(
+                day=row['k_day'],
+                region_id=row['region_id'],
+                status=row['status'],
+                driver_id=row['driver_id'],
+                orders_count=row['k_count'],
+                revenue=row['k_revenue'] or Decimal('0'),
+            )
+            for row in rows
+        ], batch_size=1000)
+
+
+def refresh_rollups(full: bool = False) -> Dict:
+    """
+    Инкрементально обновляет срезы.
+
+    После commit сбрасывает кэш ответов аналитики за пересчитанные дни:
+    ответы, посчитанные по прежним срезам, иначе жили бы до HISTORICAL_TTL_SECONDS.
+
+    Args:
+        full: Перестроить все срезы с нуля
+
+    Returns:
+        Количество пересчитанных часов и дней
+    """
+    options = _rollup_settings()
+    started_at = timezone.now()
+
+    with transaction.atomic():
+        state, _ = RollupState.objects.select_for_update().get_or_create(name=ROLLUP_NAME)
+        full = full or state.watermark is None
+
+        rebuilt_days = set()
+        if full:
+            # Дни, срезы которых исчезнут вместе с удаленными заказами
+            rebuilt_days.update(OrderDailyRollup.objects.values_list('day', flat=True).distinct())
+            OrderHourlyRollup.objects.all().delete()
+            OrderDailyRollup.objects.all().delete()
+            changed = Order.objects.all()
+        else:
+            since = state.watermark - timedelta(seconds=options['LAG_SECONDS'])
+            changed = Order.objects.filter(updated_at__gt=since)
+
+        hours = set(
+            changed.annotate(k_bucket=TruncHour('created_at', tzinfo=dt_timezone.utc))
+            .values_list('k_bucket', flat=True)
+            .distinct()
+            .order_by()
+        )
+        watermark = changed.aggregate(value=Max('updated_at'))['value']
+
+        dirty = list(RollupDirtyHour.objects.values_list('id', 'bucket'))
+        hours.update(floor_hour(bucket) for _, bucket in dirty)
+
+        _rebuild_hours(hours)
+        days = {timezone.localtime(hour).date() for hour in hours}
+        _rebuild_days(days)
+        rebuilt_days.update(days)
+        RollupDirtyHour.objects.filter(id__in=[pk for pk, _ in dirty]).delete()
+
+        if watermark and (state.watermark is None or watermark > state.watermark):
+            state.watermark = watermark
+        state.watermark = state.watermark or started_at
+        state.last_run_at = started_at
+        state.save()
+
+        # Ответы аналитики, посчитанные по прежним срезам, больше не находятся
+        transaction.on_commit(lambda: invalidate_days(rebuilt_days))
+
+    logger.info(f'Срезы аналитики обновлены: часов {len(hours)}, полный пересчет: {full}')
+    return {'hours': len(hours), 'full': full, 'watermark': state.watermark}
+
+
+def mark_hour_dirty(created_at: Optional[datetime]):
+    """Помечает час заказа для пересчета (удаление заказа)"""
+    if created_at is None:
+        return
+    RollupDirtyHour.objects.bulk_create([RollupDirtyHour(bucket=floor_hour(created_at))], ignore_conflicts=True)
+
+
+# ---------------------------------------------------------------------------
+# Чтение
+# ---------------------------------------------------------------------------
+
+# Измерение -> (выражение для заказов, выражение для почасовых срезов)
+_DIMENSIONS = {
+    'bucket': (TruncHour('created_at', tzinfo=dt_timezone.utc), F('bucket')),
+    'hour_of_day': (ExtractHour('created_at'), ExtractHour('bucket')),
+    'region_id': (F('passenger__region_id'), F('region_id')),
+    'status': (F('status'), F('status')),
+    'driver_id': (F('driver_id'), F('driver_id')),
+}
+
+
+def _horizon() -> Optional[datetime]:
+    """Граница, до которой срезы актуальны (начало часа последнего запуска)"""
+    if not _rollup_settings()['ENABLED']:
+        return None
+    last_run_at = RollupState.objects.filter(name=ROLLUP_NAME).values_list('last_run_at', flat=True).first()
+    return floor_hour(last_run_at) if last_run_at else None
+
+
+def _plan(date_from: datetime, date_to: datetime, use_daily: bool) -> Dict[str, list]:
+    """
+    Разбивает [date_from, date_to] на отрезки:
+    raw - (start, end, end_inclusive) по таблице заказов,
+    hourly - [start, end) по почасовым срезам,
+    daily - [first_day, last_day) по дневным срезам
+    """
+    plan = {'raw': [], 'hourly': [], 'daily': []}
+    horizon = _horizon()
+    h0 = ceil_hour(date_from)
+    h1 = min(floor_hour(date_to), horizon) if horizon else h0
+    if h0 >= h1:
+        plan['raw'].append((date_from, date_to, True))
+        return plan
+
+    if date_from < h0:
+        plan['raw'].append((date_from, h0, False))
+    plan['raw'].append((h1, date_to, True))
+
+    if use_daily:
+        first_day = timezone.localtime(h0).date()
+        if _local_midnight(first_day) < h0:
+            first_day += timedelta(days=1)
+        last_day = timezone.localtime(h1).date()
+        d0, d1 = _local_midnight(first_day), _local_midnight(last_day)
+        # Дневные срезы совпадают с часовыми, только если полночь - граница часа в UTC
+        if d0 < d1 and floor_hour(d0) == d0:
+            plan['daily'].append((first_day, last_day))
+            plan['hourly'] += [(h0, d0), (d1, h1)]
+            return plan
+
+    plan['hourly'].append((h0, h1))
+    return plan
+
+
+def _aware(value: datetime) -> datetime:
+    return timezone.make_aware(value) if timezone.is_naive(value) else value
+
+
+def order_cells(
+    date_from: datetime,
+    date_to: datetime,
+    dims: Sequence[str],
+    region_id: Optional[str] = None,
+    statuses: Optional[Sequence[str]] = None,
+    hourly: bool = False
+) -> List[Dict]:
+    """
+    Агрегаты заказов (created_at в [date_from, date_to]) с группировкой по dims.
+
+    dims - из 'bucket', 'hour_of_day', 'region_id', 'status', 'driver_id'.
+    bucket - начало часа или (для дневных срезов) локальной полуночи.
+    hourly=True - не использовать дневные срезы (нужна точность до часа).
+
+    Returns:
+        Список словарей {dim: value, 'orders_count': int, 'revenue': Decimal};
+        одна и та же комбинация dims может встречаться несколько раз
+    """
+    date_from, date_to = _aware(date_from), _aware(date_to)
+    plan = _plan(date_from, date_to, use_daily=not hourly and 'hour_of_day' not in dims)
+    cells = []
+
+    def collect(queryset, source: int, count_expr, revenue_expr):
+        exprs = {f'k_{dim}': _DIMENSIONS[dim][source] for dim in dims}
+        rows = queryset.values(**exprs).annotate(k_count=count_expr, k_revenue=revenue_expr).order_by()
+        for row in rows:
+            cell = {dim: row[f'k_{dim}'] for dim in dims}
+            if 'region_id' in cell:
+                cell['region_id'] = cell['region_id'] or ''
+            cell['orders_count'] = row['k_count']
+            cell['revenue'] = row['k_revenue'] or Decimal('0')
+            cells.append(cell)
+
+    for start, end, inclusive in plan['raw']:
+        queryset = Order.objects.filter(created_at__gte=start)
+        queryset = queryset.filter(created_at__lte=end) if inclusive else queryset.filter(created_at__lt=end)
+        if region_id:
+            queryset = queryset.filter(passenger__region_id=region_id)
+        if statuses:
+            queryset = queryset.filter(status__in=statuses)
+        collect(queryset, 0, Count('id'), Sum('final_price'))
+
+    for start, end in plan['hourly']:
+        if start >= end:
+            continue
+        queryset = OrderHourlyRollup.objects.filter(bucket__gte=start, bucket__lt=end)
+        if region_id:
+            queryset = queryset.filter(region_id=region_id)
+        if statuses:
+            queryset = queryset.filter(status__in=statuses)
+        collect(queryset, 1, Sum('orders_count'), Sum('revenue'))
+
+    for first_day, last_day in plan['daily']:
+        queryset = OrderDailyRollup.objects.filter(day__gte=first_day, day__lt=last_day)
+        if region_id:
+            queryset = queryset.filter(region_id=region_id)
+        if statuses:
+            queryset = queryset.filter(status__in=statuses)
+        daily_dims = {f'k_{dim}': F('day' if dim == 'bucket' else dim) for dim in dims}
+        rows = queryset.values(**daily_dims).annotate(
+            k_count=Sum('orders_count'), k_revenue=Sum('revenue')
+        ).order_by()
+        for row in rows:
+            cell = {dim: row[f'k_{dim}'] for dim in dims}
+            if 'bucket' in cell:
+                cell['bucket'] = _local_midnight(cell['bucket'])
+            cell['orders_count'] = row['k_count']
+            cell['revenue'] = row['k_revenue'] or Decimal('0')
+            cells.append(cell)
+
+    return cells
+
+
+def sum_cells(cells: Iterable[Dict], key) -> Dict:
+    """Суммирует orders_count и revenue по ключу key(cell)"""
+    totals = defaultdict(lambda: {'orders_count': 0, 'revenue': Decimal('0')})
+    for cell in cells:
+        item = totals[key(cell)]
+        item['orders_count'] += cell['orders_count']
+        item['revenue'] += cell['revenue']
+    return totals
@@ -1,18 +1,59 @@
 from django.utils import timezone
 from django.db.models import (
-    Count, Sum, Avg, Q, F, DecimalField, IntegerField,
+    Count, Sum, Avg, Q, F, DecimalField, DurationField, IntegerField,
     Case, When, Value, CharField
 )
-from django.db.models.functions import TruncHour, TruncDay, TruncWeek, TruncMonth, ExtractHour
+from django.db.models.functions import TruncDay
 from decimal import Decimal
-from datetime import timedelta
+from datetime import datetime, time, timedelta
 import csv
 import logging
+import zlib
 from io import StringIO
-from typing import Optional, Dict, List, Any
+from typing import Optional, Dict, Iterable, Iterator, List, Any
 from orders.models import Order, OrderStatus
 from accounts.models import Driver, DriverStatistics, Passenger
 from regions.models import Region
+from dispatch.exports import csv_lines
+from .rollups import order_cells, sum_cells
+
+logger = logging.getLogger(__name__)
+
+
+def _duration_minutes(value) -> Optional[float]:
+    """Минуты из результата Avg по DurationField (timedelta или None)"""
+    if value is None:
+        return None
+    return value.total_seconds() / 60
+
+
+def _period_start(bucket: datetime, granularity: str) -> datetime:
+    """Начало периода (час/день/неделя/месяц) в текущем часовом поясе, как Trunc* в БД"""
+    local = timezone.localtime(bucket)
+    if granularity == 'hour':
+        return local.replace(minute=0, second=0, microsecond=0)
+    day = local.date()
+    if granularity == 'week':
+        day -= timedelta(days=day.weekday())
+    elif granularity == 'month':
+        day = day.replace(day=1)
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def _period_totals(date_from: datetime, date_to: datetime, region_id: Optional[str] = None):
+    """Заказы, выполненные и выручка за период (для сравнения периодов)"""
+    by_status = sum_cells(
+        order_cells(date_from, date_to, ['status'], region_id=region_id), key=lambda cell: cell['status']
+    )
+    total_orders = sum(item['orders_count'] for item in by_status.values())
+    completed = by_status.get(OrderStatus.COMPLETED, {'orders_count': 0, 'revenue': Decimal('0')})
+    completed_count = completed['orders_count']
+    total_revenue = completed['revenue']
+    avg_order_value = total_revenue / completed_count if completed_count > 0 else Decimal('0')
+    return (
+        {'total_orders': total_orders, 'completed_orders': completed_count},
+        {'total_revenue': float(total_revenue), 'avg_order_value': float(avg_order_value)},
+    )
 
 
 class MetricsAggregator:
@@ -47,55 +88,45 @@ class MetricsAggregator:
         if region_id:
             queryset = queryset.filter(passenger__region_id=region_id)
         
-        total_orders = queryset.count()
-        completed_orders = queryset.filter(status=OrderStatus.COMPLETED).count()
-        cancelled_orders = queryset.filter(status=OrderStatus.CANCELLED).count()
+        # Счетчики и средние - одним запросом (разница времени считается в БД)
+        totals = queryset.aggregate(
+            total_orders=Count('id'),
+            completed_orders=Count('id', filter=Q(status=OrderStatus.COMPLETED)),
+            cancelled_orders=Count('id', filter=Q(status=OrderStatus.CANCELLED)),
+            # Среднее время выполнения (от создания до завершения)
+            avg_duration=Avg(
+                F('completed_at') - F('created_at'),
+                filter=Q(status=OrderStatus.COMPLETED, completed_at__isnull=False),
+                output_field=DurationField()
+            ),
+            # Среднее время ожидания водителя (от создания до назначения)
+            avg_assignment_time=Avg(
+                F('assigned_at') - F('created_at'),
+                filter=Q(assigned_at__isnull=False),
+                output_field=DurationField()
+            ),
+            avg_distance=Avg('distance_km'),
+            # Метрики по surge pricing
+            orders_with_surge=Count('id', filter=Q(quote_surge_multiplier__gt=1.0)),
+            avg_surge_multiplier=Avg('quote_surge_multiplier'),
+        )
         
+        total_orders = totals['total_orders']
+        completed_orders = totals['completed_orders']
+        cancelled_orders = totals['cancelled_orders']
         success_rate = (completed_orders / total_orders * 100) if total_orders > 0 else 0
         
-        # Среднее время выполнения (от создания до завершения)
-        completed_with_times = queryset.filter(
-            status=OrderStatus.COMPLETED,
-            completed_at__isnull=False
-        )
-        
-        avg_duration_minutes = None
-        if completed_with_times.exists():
-            durations = []
-            for order in completed_with_times:
-                if order.completed_at and order.created_at:
-                    duration = (order.completed_at - order.created_at).total_seconds() / 60
-                    durations.append(duration)
-            if durations:
-                avg_duration_minutes = sum(durations) / len(durations)
+        avg_duration_minutes = _duration_minutes(totals['avg_duration'])
+        avg_assignment_time_minutes = _duration_minutes(totals['avg_assignment_time'])
+        avg_distance = totals['avg_distance'] or 0
+        orders_with_surge = totals['orders_with_surge']
+        avg_surge_multiplier = totals['avg_surge_multiplier'] or 1.0
         
         # Распределение по статусам
         status_distribution = queryset.values('status').annotate(
             count=Count('id')
         ).order_by('-count')
         
-        # Среднее расстояние
-        avg_distance = queryset.filter(
-            distance_km__isnull=False
-        ).aggregate(
-            avg=Avg('distance_km')
-        )['avg'] or 0
-        
-        # Среднее время ожидания водителя (от создания до назначения)
-        avg_assignment_time_minutes = None
-        assigned_orders = queryset.filter(
-            assigned_at__isnull=False,
-            created_at__isnull=False
-        )
-        if assigned_orders.exists():
-            assignment_times = []
-            for order in assigned_orders:
-                if order.assigned_at and order.created_at:
-                    time_diff = (order.assigned_at - order.created_at).total_seconds() / 60
-                    assignment_times.append(time_diff)
-            if assignment_times:
-                avg_assignment_time_minutes = sum(assignment_times) / len(assignment_times)
-        
         # Распределение по категориям инвалидности
         disability_distribution = queryset.values(
             'passenger__disability_category'
@@ -103,17 +134,6 @@ class MetricsAggregator:
             count=Count('id')
         ).order_by('-count')
         
-        # Метрики по surge pricing
-        orders_with_surge = queryset.filter(
-            quote_surge_multiplier__isnull=False,
-            quote_surge_multiplier__gt=1.0
-        ).count()
-        avg_surge_multiplier = queryset.filter(
-            quote_surge_multiplier__isnull=False
-        ).aggregate(
-            avg=Avg('quote_surge_multiplier')
-        )['avg'] or 1.0
-        
         return {
             'total_orders': total_orders,
             'completed_orders': completed_orders,
@@ -210,42 +230,31 @@ class MetricsAggregator:
         """Временные ряды данных"""
         date_from, date_to = MetricsAggregator.get_date_range(date_from, date_to)
         
-        queryset = Order.objects.filter(
-            created_at__gte=date_from,
-            created_at__lte=date_to
+        # Агрегаты по часам/дням из срезов (analytics.rollups)
+        cells = order_cells(
+            date_from, date_to, ['bucket', 'status'], region_id=region_id, hourly=granularity == 'hour'
         )
         
-        if region_id:
-            queryset = queryset.filter(passenger__region_id=region_id)
-        
-        # Выбор функции группировки по времени
-        if granularity == 'hour':
-            trunc_func = TruncHour('created_at')
-        elif granularity == 'week':
-            trunc_func = TruncWeek('created_at')
-        elif granularity == 'month':
-            trunc_func = TruncMonth('created_at')
-        else:  # day
-            trunc_func = TruncDay('created_at')
-        
-        # Агрегация по времени
-        time_series = queryset.annotate(
-            time_period=trunc_func
-        ).values('time_period').annotate(
-            total=Count('id'),
-            completed=Count('id', filter=Q(status=OrderStatus.COMPLETED)),
-            cancelled=Count('id', filter=Q(status=OrderStatus.CANCELLED)),
-            revenue=Sum('final_price', filter=Q(status=OrderStatus.COMPLETED), output_field=DecimalField())
-        ).order_by('time_period')
+        periods = {}
+        for cell in cells:
+            period = _period_start(cell['bucket'], granularity)
+            item = periods.setdefault(period, {'total': 0, 'completed': 0, 'cancelled': 0, 'revenue': Decimal('0')})
+            item['total'] += cell['orders_count']
+            if cell['status'] == OrderStatus.COMPLETED:
+                item['completed'] += cell['orders_count']
+                item['revenue'] += cell['revenue']
+            elif cell['status'] == OrderStatus.CANCELLED:
+                item['cancelled'] += cell['orders_count']
         
         result = []
-        for item in time_series:
+        for period in sorted(periods):
+            item = periods[period]
             result.append({
-                'period': item['time_period'].isoformat() if item['time_period'] else None,
+                'period': period.isoformat(),
                 'total': item['total'],
                 'completed': item['completed'],
                 'cancelled': item['cancelled'],
-                'revenue': float(item['revenue'] or 0),
+                'revenue': float(item['revenue']),
             })
         
         return result
@@ -256,31 +265,30 @@ class MetricsAggregator:
         try:
             date_from, date_to = MetricsAggregator.get_date_range(date_from, date_to)
             
-            queryset = Order.objects.filter(
-                created_at__gte=date_from,
-                created_at__lte=date_to
-            ).select_related('passenger', 'passenger__region')
+            cells = order_cells(date_from, date_to, ['region_id', 'status'])
+            
+            distribution = {}
+            for cell in cells:
+                item = distribution.setdefault(
+                    cell['region_id'], {'orders_count': 0, 'completed_count': 0, 'revenue': Decimal('0')}
+                )
+                item['orders_count'] += cell['orders_count']
+                if cell['status'] == OrderStatus.COMPLETED:
+                    item['completed_count'] += cell['orders_count']
+                    item['revenue'] += cell['revenue']
             
-            distribution = queryset.values(
-                'passenger__region__id',
-                'passenger__region__title'
-            ).annotate(
-                orders_count=Count('id'),
-                completed_count=Count('id', filter=Q(status=OrderStatus.COMPLETED)),
-                revenue=Sum('final_price', filter=Q(status=OrderStatus.COMPLETED), output_field=DecimalField())
-            ).order_by('-orders_count')
+            titles = dict(Region.objects.filter(id__in=[r for r in distribution if r]).values_list('id', 'title'))
             
             result = []
-            for item in distribution:
-                region_id = item.get('passenger__region__id')
-                region_title = item.get('passenger__region__title')
+            for region_id, item in sorted(distribution.items(), key=lambda kv: -kv[1]['orders_count']):
+                region_title = titles.get(region_id)
                 
                 result.append({
-                    'region_id': region_id if region_id is not None else '',
+                    'region_id': region_id,
                     'region_title': region_title if region_title else 'Не указан',
-                    'orders_count': item.get('orders_count', 0),
-                    'completed_count': item.get('completed_count', 0),
-                    'revenue': float(item.get('revenue') or 0),
+                    'orders_count': item['orders_count'],
+                    'completed_count': item['completed_count'],
+                    'revenue': float(item['revenue']),
                 })
             
             return result
@@ -294,27 +302,17 @@ class MetricsAggregator:
         """Пиковые часы загруженности"""
         date_from, date_to = MetricsAggregator.get_date_range(date_from, date_to)
         
-        queryset = Order.objects.filter(
-            created_at__gte=date_from,
-            created_at__lte=date_to
+        # Группировка по часам суток (почасовые срезы)
+        peak_hours = sum_cells(
+            order_cells(date_from, date_to, ['hour_of_day'], region_id=region_id),
+            key=lambda cell: int(cell['hour_of_day'])
         )
         
-        if region_id:
-            queryset = queryset.filter(passenger__region_id=region_id)
-        
-        # Группировка по часам
-        peak_hours = queryset.annotate(
-            hour=ExtractHour('created_at')
-        ).values('hour').annotate(
-            orders_count=Count('id')
-        ).order_by('hour')
-        
         result = []
-        for item in peak_hours:
-            hour = int(item['hour'])
+        for hour in sorted(peak_hours):
             result.append({
                 'hour': f"{hour:02d}:00",
-                'orders': item['orders_count'],
+                'orders': peak_hours[hour]['orders_count'],
             })
         
         return result
@@ -325,21 +323,26 @@ class MetricsAggregator:
         """Топ водители по производительности"""
         date_from, date_to = MetricsAggregator.get_date_range(date_from, date_to)
         
-        queryset = Order.objects.filter(
-            created_at__gte=date_from,
-            created_at__lte=date_to,
-            driver__isnull=False,
-            status=OrderStatus.COMPLETED
+        # Выполненные заказы по водителям (срезы)
+        by_driver = sum_cells(
+            order_cells(date_from, date_to, ['driver_id'], statuses=[OrderStatus.COMPLETED]),
+            key=lambda cell: cell['driver_id']
         )
-        
-        performance = queryset.values(
-            'driver__id',
-            'driver__name',
-            'driver__rating'
-        ).annotate(
-            orders_count=Count('id'),
-            total_revenue=Sum('final_price', output_field=DecimalField())
-        ).order_by('-orders_count')[:limit]
+        by_driver.pop(None, None)
+        top = sorted(by_driver.items(), key=lambda kv: (-kv[1]['orders_count'], kv[0]))[:limit]
+        drivers = {
+            d['id']: d for d in Driver.objects.filter(id__in=[driver_id for driver_id, _ in top]).values('id', 'name', 'rating')
+        }
+        performance = [
+            {
+                'driver__id': driver_id,
+                'driver__name': drivers.get(driver_id, {}).get('name'),
+                'driver__rating': drivers.get(driver_id, {}).get('rating'),
+                'orders_count': item['orders_count'],
+                'total_revenue': item['revenue'],
+            }
+            for driver_id, item in top
+        ]
         
         # Получаем метрики по офферам для каждого водителя
         from orders.models import OrderOffer
@@ -380,40 +383,15 @@ class MetricsAggregator:
         try:
             date_from_obj, date_to_obj = MetricsAggregator.get_date_range(date_from, date_to)
             
-            # Текущий период - передаем datetime объекты напрямую в методы
-            # Но методы ожидают строки, поэтому преобразуем обратно
-            date_from_str = date_from_obj.isoformat()
-            date_to_str = date_to_obj.isoformat()
-            
-            current_metrics = MetricsAggregator.get_order_metrics(
-                date_from_str,
-                date_to_str,
-                region_id
-            )
-            current_financial = MetricsAggregator.get_financial_metrics(
-                date_from_str,
-                date_to_str,
-                region_id
-            )
+            # Счетчики и выручка обоих периодов - из срезов
+            current_metrics, current_financial = _period_totals(date_from_obj, date_to_obj, region_id)
             
             # Предыдущий период (такой же по длительности)
             period_duration = date_to_obj - date_from_obj
             prev_date_to_obj = date_from_obj - timedelta(seconds=1)
             prev_date_from_obj = prev_date_to_obj - period_duration
             
-            prev_date_from_str = prev_date_from_obj.isoformat()
-            prev_date_to_str = prev_date_to_obj.isoformat()
-            
-            prev_metrics = MetricsAggregator.get_order_metrics(
-                prev_date_from_str,
-                prev_date_to_str,
-                region_id
-            )
-            prev_financial = MetricsAggregator.get_financial_metrics(
-                prev_date_from_str,
-                prev_date_to_str,
-                region_id
-            )
+            prev_metrics, prev_financial = _period_totals(prev_date_from_obj, prev_date_to_obj, region_id)
             
             # Расчет изменений в процентах
             def calc_change(current, previous):
@@ -469,94 +447,115 @@ class MetricsAggregator:
 
 
 class CSVExportService:
-    """Сервис для экспорта отчетов в CSV"""
-    
+    """
+    Сервис для экспорта отчетов в CSV.
+
+    Строки отчетов читаются через values_list/values и iterator() порциями
+    (EXPORT_CHUNK_SIZE), без создания моделей; stream_report отдает
+    закодированный CSV кусками для StreamingHttpResponse (опционально gzip).
+    Методы export_*_report собирают тот же CSV целиком в StringIO.
+    """
+
+    EXPORT_CHUNK_SIZE = 2000
+    STREAM_BUFFER_SIZE = 64 * 1024
+
+    ORDERS_REPORT_HEADER = [
+        'ID заказа',
+        'Дата создания',
+        'Пассажир',
+        'Водитель',
+        'Регион',
+        'Статус',
+        'Адрес отправления',
+        'Адрес назначения',
+        'Расстояние (км)',
+        'Предварительная цена',
+        'Финальная цена',
+        'Дата завершения'
+    ]
+
+    FINANCIAL_REPORT_HEADER = [
+        'Дата',
+        'Регион',
+        'Количество заказов',
+        'Общая выручка',
+        'Средний чек',
+        'Средняя предварительная цена',
+        'Средняя финальная цена'
+    ]
+
+    DRIVER_REPORT_HEADER = [
+        'Водитель',
+        'Регион',
+        'Телефон',
+        'Рейтинг',
+        'Всего заказов',
+        'Выполнено',
+        'Отменено',
+        'Общая выручка',
+        'Средний чек'
+    ]
+
+    # Тип отчета -> (метод строк, имя файла, учитывает region_id)
+    REPORTS = {
+        'orders': ('iter_orders_report_rows', 'orders_report.csv', True),
+        'financial': ('iter_financial_report_rows', 'financial_report.csv', True),
+        'drivers': ('iter_driver_report_rows', 'drivers_report.csv', False),
+    }
+
     @staticmethod
-    def export_orders_report(date_from: Optional[str] = None, date_to: Optional[str] = None,
-                           region_id: Optional[str] = None) -> StringIO:
-        """Экспорт отчета по заказам"""
+    def iter_orders_report_rows(date_from: Optional[str] = None, date_to: Optional[str] = None,
+                                region_id: Optional[str] = None) -> Iterator[List]:
+        """Строки отчета по заказам (с заголовком)"""
         date_from, date_to = MetricsAggregator.get_date_range(date_from, date_to)
         
         queryset = Order.objects.filter(
             created_at__gte=date_from,
             created_at__lte=date_to
-        ).select_related('passenger', 'driver', 'passenger__region')
+        )
         
         if region_id:
             queryset = queryset.filter(passenger__region_id=region_id)
         
-        output = StringIO()
-        # Добавляем BOM для правильного отображения кириллицы в Excel
-        output.write('\ufeff')
-        writer = csv.writer(output)
-        
-        # Заголовки
-        writer.writerow([
-            'ID заказа',
-            'Дата создания',
-            'Пассажир',
-            'Водитель',
-            'Регион',
-            'Статус',
-            'Адрес отправления',
-            'Адрес назначения',
-            'Расстояние (км)',
-            'Предварительная цена',
-            'Финальная цена',
-            'Дата завершения'
-        ])
-        
-        # Данные
-        for order in queryset:
-            writer.writerow([
-                order.id,
-                order.created_at.strftime('%Y-%m-%d %H:%M:%S') if order.created_at else '',
-                order.passenger.full_name if order.passenger else '',
-                order.driver.name if order.driver else 'Не назначен',
-                order.passenger.region.title if order.passenger and order.passenger.region else '',
-                order.get_status_display(),
-                order.pickup_title,
-                order.dropoff_title,
-                order.distance_km or '',
-                float(order.quote) if order.quote else '',
-                float(order.final_price) if order.final_price else '',
-                order.completed_at.strftime('%Y-%m-%d %H:%M:%S') if order.completed_at else '',
-            ])
-        
-        output.seek(0)
-        return output
-    
+        rows = queryset.values_list(
+            'id', 'created_at', 'passenger__full_name', 'driver__name', 'passenger__region__title',
+            'status', 'pickup_title', 'dropoff_title', 'distance_km', 'quote', 'final_price', 'completed_at'
+        ).iterator(chunk_size=CSVExportService.EXPORT_CHUNK_SIZE)
+        status_labels = dict(OrderStatus.choices)
+        
+        yield CSVExportService.ORDERS_REPORT_HEADER
+        for (order_id, created_at, passenger_name, driver_name, region_title, order_status,
+             pickup_title, dropoff_title, distance_km, quote, final_price, completed_at) in rows:
+            yield [
+                order_id,
+                created_at.strftime('%Y-%m-%d %H:%M:%S') if created_at else '',
+                passenger_name or '',
+                driver_name if driver_name is not None else 'Не назначен',
+                region_title or '',
+                status_labels.get(order_status, order_status),
+                pickup_title,
+                dropoff_title,
+                distance_km or '',
+                float(quote) if quote else '',
+                float(final_price) if final_price else '',
+                completed_at.strftime('%Y-%m-%d %H:%M:%S') if completed_at else '',
+            ]
+
     @staticmethod
-    def export_financial_report(date_from: Optional[str] = None, date_to: Optional[str] = None,
-                               region_id: Optional[str] = None) -> StringIO:
-        """Экспорт финансового отчета"""
+    def iter_financial_report_rows(date_from: Optional[str] = None, date_to: Optional[str] = None,
+                                   region_id: Optional[str] = None) -> Iterator[List]:
+        """Строки финансового отчета (с заголовком)"""
         date_from, date_to = MetricsAggregator.get_date_range(date_from, date_to)
         
         queryset = Order.objects.filter(
             created_at__gte=date_from,
             created_at__lte=date_to,
             status=OrderStatus.COMPLETED
-        ).select_related('passenger__region')
+        )
         
         if region_id:
             queryset = queryset.filter(passenger__region_id=region_id)
         
-        output = StringIO()
-        # Добавляем BOM для правильного отображения кириллицы в Excel
-        output.write('\ufeff')
-        writer = csv.writer(output)
-        
-        # Заголовки
-        writer.writerow([
-            'Дата',
-            'Регион',
-            'Количество заказов',
-            'Общая выручка',
-            'Средний чек',
-            'Средняя предварительная цена',
-            'Средняя финальная цена'
-        ])
-        
         # Группировка по дням и регионам
         daily_stats = queryset.annotate(
             date=TruncDay('created_at')
@@ -567,12 +566,13 @@ class CSVExportService:
             avg_final=Avg('final_price', output_field=DecimalField())
         ).order_by('date', 'passenger__region__title')
         
-        for stat in daily_stats:
+        yield CSVExportService.FINANCIAL_REPORT_HEADER
+        for stat in daily_stats.iterator(chunk_size=CSVExportService.EXPORT_CHUNK_SIZE):
             orders_count = stat['orders_count']
             total_revenue = float(stat['total_revenue'] or 0)
             avg_order_value = total_revenue / orders_count if orders_count > 0 else 0
             
-            writer.writerow([
+            yield [
                 stat['date'].strftime('%Y-%m-%d') if stat['date'] else '',
                 stat['passenger__region__title'] or 'Не указан',
                 orders_count,
@@ -580,39 +580,19 @@ class CSVExportService:
                 round(avg_order_value, 2),
                 float(stat['avg_quote'] or 0),
                 float(stat['avg_final'] or 0),
-            ])
-        
-        output.seek(0)
-        return output
-    
+            ]
+
     @staticmethod
-    def export_driver_report(date_from: Optional[str] = None, date_to: Optional[str] = None) -> StringIO:
-        """Экспорт отчета по водителям"""
+    def iter_driver_report_rows(date_from: Optional[str] = None, date_to: Optional[str] = None,
+                                region_id: Optional[str] = None) -> Iterator[List]:
+        """Строки отчета по водителям (с заголовком; region_id не используется)"""
         date_from, date_to = MetricsAggregator.get_date_range(date_from, date_to)
         
         queryset = Order.objects.filter(
             created_at__gte=date_from,
             created_at__lte=date_to,
             driver__isnull=False
-        ).select_related('driver', 'driver__region')
-        
-        output = StringIO()
-        # Добавляем BOM для правильного отображения кириллицы в Excel
-        output.write('\ufeff')
-        writer = csv.writer(output)
-        
-        # Заголовки
-        writer.writerow([
-            'Водитель',
-            'Регион',
-            'Телефон',
-            'Рейтинг',
-            'Всего заказов',
-            'Выполнено',
-            'Отменено',
-            'Общая выручка',
-            'Средний чек'
-        ])
+        )
         
         # Группировка по водителям
         driver_stats = queryset.values(
@@ -628,12 +608,13 @@ class CSVExportService:
             total_revenue=Sum('final_price', filter=Q(status=OrderStatus.COMPLETED), output_field=DecimalField())
         ).order_by('-total_orders')
         
-        for stat in driver_stats:
+        yield CSVExportService.DRIVER_REPORT_HEADER
+        for stat in driver_stats.iterator(chunk_size=CSVExportService.EXPORT_CHUNK_SIZE):
             completed = stat['completed_orders']
             revenue = float(stat['total_revenue'] or 0)
             avg_order_value = revenue / completed if completed > 0 else 0
             
-            writer.writerow([
+            yield [
                 stat['driver__name'],
                 stat['driver__region__title'] or 'Не указан',
                 stat['driver__user__phone'] or '',
@@ -643,7 +624,70 @@ class CSVExportService:
                 stat['cancelled_orders'],
                 revenue,
                 round(avg_order_value, 2),
-            ])
-        
+            ]
+
+    @staticmethod
+    def _to_stringio(rows: Iterable[List]) -> StringIO:
+        output = StringIO()
+        # Добавляем BOM для правильного отображения кириллицы в Excel
+        output.write('\ufeff')
+        writer = csv.writer(output)
+        writer.writerows(rows)
         output.seek(0)
         return output
+
+    @staticmethod
+    def stream_report(report_type: str, date_from: Optional[str] = None, date_to: Optional[str] = None,
+                      region_id: Optional[str] = None, gzip: bool = False) -> Iterator[bytes]:
+        """
+        CSV отчета кусками байт (UTF-8 с BOM), при gzip=True - сжатый поток gzip.
+        Неизвестный report_type - ValueError.
+        """
+        if report_type not in CSVExportService.REPORTS:
+            raise ValueError(f'Неизвестный тип отчета: {report_type}')
+        method_name, _, uses_region = CSVExportService.REPORTS[report_type]
+        rows = getattr(CSVExportService, method_name)(
+            date_from=date_from, date_to=date_to, region_id=region_id if uses_region else None
+        )
+        
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if gzip else None  # wbits=31 - формат gzip
+        buffer = []
+        size = 0
+        for line in csv_lines(rows, bom=True):
+            buffer.append(line)
+            size += len(line)
+            if size >= CSVExportService.STREAM_BUFFER_SIZE:
+                chunk = ''.join(buffer).encode('utf-8')
+                buffer, size = [], 0
+                chunk = compressor.compress(chunk) if compressor else chunk
+                if chunk:
+                    yield chunk
+        
+        chunk = ''.join(buffer).encode('utf-8')
+        if compressor:
+            chunk = compressor.compress(chunk) + compressor.flush()
+        if chunk:
+            yield chunk
+
+    @staticmethod
+    def export_orders_report(date_from: Optional[str] = None, date_to: Optional[str] = None,
+                           region_id: Optional[str] = None) -> StringIO:
+        """Экспорт отчета по заказам"""
+        return CSVExportService._to_stringio(
+            CSVExportService.iter_orders_report_rows(date_from, date_to, region_id)
+        )
+    
+    @staticmethod
+    def export_financial_report(date_from: Optional[str] = None, date_to: Optional[str] = None,
+                               region_id: Optional[str] = None) -> StringIO:
+        """Экспорт финансового отчета"""
+        return CSVExportService._to_stringio(
+            CSVExportService.iter_financial_report_rows(date_from, date_to, region_id)
+        )
+    
+    @staticmethod
+    def export_driver_report(date_from: Optional[str] = None, date_to: Optional[str] = None) -> StringIO:
+        """Экспорт отчета по водителям"""
+        return CSVExportService._to_stringio(
+            CSVExportService.iter_driver_report_rows(date_from, date_to)
+        )
@@ -0,0 +1,26 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from orders.models import Order
+from orders.signals import orders_bulk_updated
+from .cache import invalidate_for
+from .rollups import mark_hour_dirty
+
+
+@receiver(post_save, sender=Order)
+def order_saved(sender, instance, **kwargs):
+    """Сбрасывает кэш аналитики за день заказа"""
+    invalidate_for([instance.created_at])
+
+
+@receiver(post_delete, sender=Order)
+def order_deleted(sender, instance, **kwargs):
+    """Удаленный заказ не виден по updated_at - час пересчитывается при следующем обновлении срезов"""
+    mark_hour_dirty(instance.created_at)
+    invalidate_for([instance.created_at])
+
+
+@receiver(orders_bulk_updated)
+def orders_bulk_updated_handler(sender, order_ids, **kwargs):
+    """Пакетные назначения (dispatch.bulk_assign) - сбрасывает кэш за дни этих заказов"""
+    invalidate_for(Order.objects.filter(id__in=order_ids).values_list('created_at', flat=True).distinct())
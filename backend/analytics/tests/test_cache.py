@@ -0,0 +1,137 @@
+"""
+Тесты для кэша ответов аналитики (analytics.cache)
+"""
+from datetime import timedelta
+from unittest import mock
+import threading
+import time
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from analytics import cache as analytics_cache
+from analytics.rollups import refresh_rollups
+from analytics.services import MetricsAggregator
+from orders.models import Order, OrderStatus
+from utils.testing import create_city, create_order, create_passenger, create_region, staff_client
+
+
+class AnalyticsCacheTestCase(TestCase):
+    """Тесты для кэша AnalyticsViewSet"""
+
+    def setUp(self):
+        cache.clear()
+        self.passenger = create_passenger(create_region(create_city()))
+        self.client = staff_client()
+
+    def _create_order(self, order_id):
+        return create_order(order_id, self.passenger, status=OrderStatus.COMPLETED, desired_pickup_time=timezone.now())
+
+    def test_identical_requests_are_served_from_cache(self):
+        """Повторный запрос не пересчитывает метрики"""
+        self._create_order('o1')
+        with mock.patch.object(
+            MetricsAggregator, 'get_order_metrics', wraps=MetricsAggregator.get_order_metrics
+        ) as get_metrics:
+            first = self.client.get('/api/analytics/orders/', {'region_id': 'a'})
+            second = self.client.get('/api/analytics/orders/', {'region_id': 'a'})
+            other_region = self.client.get('/api/analytics/orders/', {'region_id': 'b'})
+
+        self.assertEqual(first['X-Analytics-Cache'], 'miss')
+        self.assertEqual(second['X-Analytics-Cache'], 'hit')
+        self.assertEqual(other_region['X-Analytics-Cache'], 'miss')
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(get_metrics.call_count, 2)
+
+    def test_order_save_invalidates_its_day(self):
+        """Новый заказ сбрасывает ответы по диапазонам с его днем"""
+        self._create_order('o1')
+        first = self.client.get('/api/analytics/orders/')
+        self.assertEqual(first.data['total_orders'], 1)
+
+        self._create_order('o2')
+        second = self.client.get('/api/analytics/orders/')
+        self.assertEqual(second['X-Analytics-Cache'], 'miss')
+        self.assertEqual(second.data['total_orders'], 2)
+
+    @override_settings(ANALYTICS_ROLLUPS={'ENABLED': True, 'LAG_SECONDS': 0})
+    def test_rollup_refresh_invalidates_rebuilt_days(self):
+        """Ответ, посчитанный по устаревшим срезам, не переживает их обновление"""
+        past = timezone.now() - timedelta(days=3)
+        self._create_order('o1')
+        Order.objects.filter(id='o1').update(created_at=past)
+        refresh_rollups()
+        params = {
+            'date_from': (past - timedelta(days=1)).isoformat(),
+            'date_to': (past + timedelta(days=1)).isoformat(),
+        }
+
+        order = Order.objects.get(id='o1')
+        order.status = OrderStatus.CANCELLED
+        order.save()
+        # До обновления срезов заказ еще считается завершенным
+        stale = self.client.get('/api/analytics/time-series/', params)
+        self.assertEqual(sum(p['completed'] for p in stale.data), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            refresh_rollups()
+        fresh = self.client.get('/api/analytics/time-series/', params)
+        self.assertEqual(fresh['X-Analytics-Cache'], 'miss')
+        self.assertEqual(sum(p['completed'] for p in fresh.data), 0)
+        self.assertEqual(sum(p['cancelled'] for p in fresh.data), 1)
+
+    def test_other_days_stay_cached(self):
+        """Изменение заказа за сегодня не сбрасывает закрытый диапазон"""
+        now = timezone.now()
+        params = {
+            'date_from': (now - timedelta(days=10)).isoformat(),
+            'date_to': (now - timedelta(days=5)).isoformat(),
+        }
+        self.client.get('/api/analytics/financial/', params)
+        self._create_order('o1')
+        response = self.client.get('/api/analytics/financial/', params)
+        self.assertEqual(response['X-Analytics-Cache'], 'hit')
+
+    def test_ttl_depends_on_range(self):
+        """Закрытый диапазон - длинный TTL, диапазон с сегодняшним днем и live-эндпоинты - короткий"""
+        now = timezone.now()
+        options = analytics_cache._cache_settings()
+        yesterday = now - timedelta(days=1, hours=1)
+        self.assertEqual(
+            analytics_cache._ttl('orders', yesterday, now, options), options['HISTORICAL_TTL_SECONDS']
+        )
+        self.assertEqual(analytics_cache._ttl('orders', now, now, options), options['LIVE_TTL_SECONDS'])
+        self.assertEqual(analytics_cache._ttl('metrics', yesterday, now, options), 30)
+        # Кэш процесса (LocMemCache) - закрытые диапазоны тоже с коротким TTL
+        self.assertTrue(analytics_cache.is_process_local(analytics_cache._backend()))
+        self.assertEqual(
+            analytics_cache._ttl('orders', yesterday, now, options, shared=False), options['LIVE_TTL_SECONDS']
+        )
+
+    def test_concurrent_requests_compute_once(self):
+        """Одинаковые одновременные запросы считаются один раз"""
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.1)
+            return {'value': 42}
+
+        results = []
+        date_from = (timezone.now() - timedelta(days=7)).isoformat()
+        date_to = (timezone.now() - timedelta(days=1)).isoformat()
+
+        def worker():
+            results.append(analytics_cache.get_or_compute('orders', date_from, date_to, compute, region_id='a'))
+
+        threads = [threading.Thread(target=worker) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([value for value, _ in results], [{'value': 42}] * 5)
+        self.assertEqual(sorted(status for _, status in results), ['hit'] * 4 + ['miss'])
+
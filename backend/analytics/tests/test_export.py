@@ -0,0 +1,57 @@
+"""
+Тесты для потокового экспорта отчетов аналитики
+"""
+import csv
+import gzip
+import io
+from decimal import Decimal
+
+from django.test import TestCase
+
+from analytics.services import CSVExportService
+from orders.models import OrderStatus
+from utils.testing import create_city, create_driver, create_order, create_passenger, create_region, staff_client
+
+
+class CSVExportStreamingTestCase(TestCase):
+    """Тесты для CSVExportService.stream_report и AnalyticsViewSet.export"""
+
+    def setUp(self):
+        region = create_region(create_city(), title='Регион A')
+        passenger = create_passenger(region)
+        driver = create_driver(region, name='Водитель', plate_number='A1')
+        for i in range(30):
+            create_order(
+                f'o{i}', passenger, driver=driver if i % 2 else None,
+                status=OrderStatus.COMPLETED if i % 2 else OrderStatus.CANCELLED,
+                final_price=Decimal('1000.00') if i % 2 else None,
+            )
+        self.client = staff_client()
+
+    def test_stream_matches_legacy_export(self):
+        """Потоковый CSV совпадает с выгрузкой в StringIO"""
+        for report_type, legacy in (
+            ('orders', CSVExportService.export_orders_report),
+            ('financial', CSVExportService.export_financial_report),
+            ('drivers', CSVExportService.export_driver_report),
+        ):
+            streamed = b''.join(CSVExportService.stream_report(report_type)).decode('utf-8')
+            self.assertEqual(streamed, legacy().getvalue())
+
+        rows = list(csv.reader(io.StringIO(b''.join(CSVExportService.stream_report('orders')).decode('utf-8-sig'))))
+        self.assertEqual(len(rows), 31)
+        self.assertIn('Не назначен', [row[3] for row in rows])
+
+    def test_export_endpoint_streams_plain_and_gzip(self):
+        """Эндпоинт отдает поток, gzip - по запросу клиента"""
+        response = self.client.get('/api/analytics/export/?type=drivers')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        plain = b''.join(response.streaming_content)
+        self.assertTrue(plain.startswith('\ufeffВодитель'.encode('utf-8')))
+
+        response = self.client.get('/api/analytics/export/?type=drivers&gzip=1', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), plain)
+
+        self.assertEqual(self.client.get('/api/analytics/export/?type=unknown').status_code, 400)
@@ -0,0 +1,61 @@
+"""
+Тесты для MetricsAggregator
+"""
+from datetime import timedelta
+from decimal import Decimal
+
+from django.test import TestCase
+from django.utils import timezone
+
+from analytics.services import MetricsAggregator
+from orders.models import Order, OrderStatus
+from utils.testing import create_city, create_order, create_passenger, create_region
+
+
+class OrderMetricsTestCase(TestCase):
+    """Тесты для get_order_metrics"""
+
+    def setUp(self):
+        self.passenger = create_passenger(create_region(create_city()))
+
+    def _create_orders(self, count):
+        for i in range(count):
+            order = create_order(
+                f'o{i}', self.passenger,
+                status=OrderStatus.COMPLETED if i % 3 else OrderStatus.CANCELLED,
+                desired_pickup_time=timezone.now(), distance_km=float(i),
+                quote_surge_multiplier=Decimal('1.5') if i % 2 else Decimal('1.0'),
+            )
+            # created_at задается auto_now_add, поэтому сдвигаем времена относительно него
+            Order.objects.filter(id=order.id).update(
+                assigned_at=order.created_at + timedelta(minutes=2 * (i % 3)),
+                completed_at=order.created_at + timedelta(minutes=30 + i) if i % 3 else None,
+            )
+
+    def test_metrics_use_constant_number_of_queries(self):
+        """Число запросов не зависит от количества заказов"""
+        self._create_orders(6)
+        with self.assertNumQueries(3):  # aggregate + распределение по статусам и категориям
+            MetricsAggregator.get_order_metrics()
+        Order.objects.all().delete()
+        self._create_orders(30)
+        with self.assertNumQueries(3):
+            metrics = MetricsAggregator.get_order_metrics()
+
+        self.assertEqual(metrics['total_orders'], 30)
+        self.assertEqual(metrics['completed_orders'], 20)
+        self.assertEqual(metrics['cancelled_orders'], 10)
+        self.assertEqual(metrics['orders_with_surge'], 15)
+        self.assertEqual(metrics['avg_surge_multiplier'], 1.25)
+        self.assertEqual(metrics['avg_distance_km'], 14.5)
+
+        completed = [i for i in range(30) if i % 3]
+        self.assertAlmostEqual(metrics['avg_duration_minutes'], sum(30 + i for i in completed) / len(completed), places=2)
+        self.assertAlmostEqual(metrics['avg_assignment_time_minutes'], sum(2 * (i % 3) for i in range(30)) / 30, places=2)
+
+    def test_metrics_without_orders(self):
+        """Пустой период"""
+        metrics = MetricsAggregator.get_order_metrics()
+        self.assertEqual(metrics['total_orders'], 0)
+        self.assertIsNone(metrics['avg_duration_minutes'])
+        self.assertIsNone(metrics['avg_assignment_time_minutes'])
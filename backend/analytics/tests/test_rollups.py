@@ -0,0 +1,106 @@
+"""
+Тесты для срезов аналитики
+"""
+import random
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db.models import Count
+from django.db.models.functions import TruncDay
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from analytics.models import OrderDailyRollup, OrderHourlyRollup
+from analytics.rollups import refresh_rollups
+from analytics.services import MetricsAggregator
+from orders.models import Order, OrderStatus
+from utils.testing import create_city, create_driver, create_order, create_passenger, create_region
+
+STATUSES = [OrderStatus.COMPLETED, OrderStatus.COMPLETED, OrderStatus.CANCELLED, OrderStatus.ASSIGNED]
+
+
+@override_settings(ANALYTICS_ROLLUPS={'ENABLED': True, 'LAG_SECONDS': 0})
+class AnalyticsRollupTestCase(TestCase):
+    """Результаты MetricsAggregator по срезам совпадают с расчетом по заказам"""
+
+    def setUp(self):
+        city = create_city()
+        regions = [create_region(city, r, title=f'Регион {r}') for r in ('a', 'b')]
+        self.passengers = [create_passenger(region, i) for i, region in enumerate(regions + regions[:1])]
+        self.drivers = [create_driver(regions[0], i, rating=4.0 + i * 0.3) for i in range(3)]
+        self.rng = random.Random(11)
+        self.now = timezone.now()
+        for i in range(80):
+            self._create_order(f'o{i}', self.now - timedelta(minutes=self.rng.randint(0, 6 * 24 * 60)))
+
+    def _create_order(self, order_id, created_at):
+        rng = self.rng
+        status = rng.choice(STATUSES)
+        order = create_order(
+            order_id, rng.choice(self.passengers), status=status,
+            driver=rng.choice(self.drivers + [None]) if status != OrderStatus.CANCELLED else None,
+            desired_pickup_time=created_at,
+            final_price=Decimal(rng.randint(500, 3000)) if status == OrderStatus.COMPLETED else None,
+        )
+        Order.objects.filter(id=order.id).update(created_at=created_at)
+        return order
+
+    def _metrics(self):
+        date_from = (self.now - timedelta(days=5, minutes=17)).isoformat()
+        date_to = self.now.isoformat()
+        return {
+            'series_hour': MetricsAggregator.get_time_series_data(date_from, date_to, 'hour'),
+            'series_day': MetricsAggregator.get_time_series_data(date_from, date_to, 'day'),
+            'series_week': MetricsAggregator.get_time_series_data(date_from, date_to, 'week', region_id='a'),
+            'regions': MetricsAggregator.get_region_distribution(date_from, date_to),
+            'peak_hours': MetricsAggregator.get_peak_hours(date_from, date_to),
+            'drivers': MetricsAggregator.get_driver_performance(date_from, date_to),
+            'comparison': MetricsAggregator.get_comparison_metrics(date_from, date_to, 'b'),
+        }
+
+    def _raw_metrics(self):
+        with override_settings(ANALYTICS_ROLLUPS={'ENABLED': False}):
+            return self._metrics()
+
+    def test_rollups_match_raw_orders(self):
+        """Срезы (дни + часы + края из заказов) дают тот же результат"""
+        raw = self._raw_metrics()
+        refresh_rollups()
+        self.assertTrue(OrderDailyRollup.objects.exists())
+        self.assertEqual(self._metrics(), raw)
+
+        # Дневной ряд совпадает с группировкой TruncDay в БД
+        date_from = self.now - timedelta(days=5, minutes=17)
+        expected = (
+            Order.objects.filter(created_at__gte=date_from, created_at__lte=self.now)
+            .annotate(day=TruncDay('created_at')).values('day').annotate(total=Count('id')).order_by('day')
+        )
+        self.assertEqual(
+            [(item['period'], item['total']) for item in raw['series_day']],
+            [(item['day'].isoformat(), item['total']) for item in expected],
+        )
+
+    def test_incremental_refresh_handles_updates_and_deletes(self):
+        """Обновление пересчитывает только затронутые часы"""
+        refresh_rollups()
+
+        order = Order.objects.exclude(status=OrderStatus.COMPLETED).first()
+        order.status = OrderStatus.COMPLETED
+        order.final_price = Decimal('1234.00')
+        order.save()
+        Order.objects.filter(id='o3').delete()
+        self._create_order('new', self.now - timedelta(days=2, minutes=5))
+
+        result = refresh_rollups()
+        self.assertFalse(result['full'])
+        self.assertLessEqual(result['hours'], 3)
+        self.assertEqual(self._metrics(), self._raw_metrics())
+        self.assertEqual(
+            sum(OrderHourlyRollup.objects.values_list('orders_count', flat=True)), Order.objects.count()
+        )
+
+    def test_orders_after_last_refresh_are_read_from_orders(self):
+        """Заказы после последнего обновления учитываются без пересчета срезов"""
+        refresh_rollups()
+        self._create_order('late', timezone.now())
+        self.assertEqual(self._metrics(), self._raw_metrics())
@@ -2,8 +2,9 @@ from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
-from django.http import HttpResponse
+from django.http import StreamingHttpResponse
 import logging
+from . import cache as analytics_cache
 from .services import MetricsAggregator, CSVExportService
 from .serializers import (
     MetricsSerializer, FinancialMetricsSerializer, DriverMetricsSerializer,
@@ -43,84 +44,114 @@ class AnalyticsViewSet(viewsets.ViewSet):
             'granularity': self.request.query_params.get('granularity', 'day'),
         }
     
+    def _cached_response(self, endpoint, params, compute, extend_back=False, **extra):
+        """Ответ из кэша аналитики (analytics.cache); extra - параметры, влияющие на ответ"""
+        data, cache_status = analytics_cache.get_or_compute(
+            endpoint, params['date_from'], params['date_to'], compute,
+            extend_back=extend_back, **extra
+        )
+        response = Response(data)
+        response['X-Analytics-Cache'] = cache_status
+        return response
+    
     @action(detail=False, methods=['get'])
     def metrics(self, request):
         """Основные метрики (KPI)"""
         params = self._get_query_params()
-        metrics = MetricsAggregator.get_order_metrics(
-            date_from=params['date_from'],
-            date_to=params['date_to'],
-            region_id=params['region_id']
-        )
         
-        # Добавляем метрики водителей
-        driver_metrics = MetricsAggregator.get_driver_metrics(
-            date_from=params['date_from'],
-            date_to=params['date_to'],
-            driver_id=params['driver_id']
-        )
-        metrics.update(driver_metrics)
+        def compute():
+            metrics = MetricsAggregator.get_order_metrics(
+                date_from=params['date_from'],
+                date_to=params['date_to'],
+                region_id=params['region_id']
+            )
+            
+            # Добавляем метрики водителей
+            driver_metrics = MetricsAggregator.get_driver_metrics(
+                date_from=params['date_from'],
+                date_to=params['date_to'],
+                driver_id=params['driver_id']
+            )
+            metrics.update(driver_metrics)
+            
+            # Добавляем финансовые метрики
+            financial_metrics = MetricsAggregator.get_financial_metrics(
+                date_from=params['date_from'],
+                date_to=params['date_to'],
+                region_id=params['region_id']
+            )
+            metrics.update(financial_metrics)
+            return MetricsSerializer(metrics).data
         
-        # Добавляем финансовые метрики
-        financial_metrics = MetricsAggregator.get_financial_metrics(
-            date_from=params['date_from'],
-            date_to=params['date_to'],
-            region_id=params['region_id']
+        return self._cached_response(
+            'metrics', params, compute,
+            region_id=params['region_id'], driver_id=params['driver_id']
         )
-        metrics.update(financial_metrics)
-        
-        serializer = MetricsSerializer(metrics)
-        return Response(serializer.data)
     
     @action(detail=False, methods=['get'])
     def orders(self, request):
         """Аналитика заказов"""
         params = self._get_query_params()
-        metrics = MetricsAggregator.get_order_metrics(
-            date_from=params['date_from'],
-            date_to=params['date_to'],
-            region_id=params['region_id']
-        )
-        serializer = MetricsSerializer(metrics)
-        return Response(serializer.data)
+        
+        def compute():
+            metrics = MetricsAggregator.get_order_metrics(
+                date_from=params['date_from'],
+                date_to=params['date_to'],
+                region_id=params['region_id']
+            )
+            return MetricsSerializer(metrics).data
+        
+        return self._cached_response('orders', params, compute, region_id=params['region_id'])
     
     @action(detail=False, methods=['get'])
     def financial(self, request):
         """Финансовая аналитика"""
         params = self._get_query_params()
-        metrics = MetricsAggregator.get_financial_metrics(
-            date_from=params['date_from'],
-            date_to=params['date_to'],
-            region_id=params['region_id']
-        )
-        serializer = FinancialMetricsSerializer(metrics)
-        return Response(serializer.data)
+        
+        def compute():
+            metrics = MetricsAggregator.get_financial_metrics(
+                date_from=params['date_from'],
+                date_to=params['date_to'],
+                region_id=params['region_id']
+            )
+            return FinancialMetricsSerializer(metrics).data
+        
+        return self._cached_response('financial', params, compute, region_id=params['region_id'])
     
     @action(detail=False, methods=['get'])
     def drivers(self, request):
         """Аналитика водителей"""
         params = self._get_query_params()
-        metrics = MetricsAggregator.get_driver_metrics(
-            date_from=params['date_from'],
-            date_to=params['date_to'],
-            driver_id=params['driver_id']
-        )
-        serializer = DriverMetricsSerializer(metrics)
-        return Response(serializer.data)
+        
+        def compute():
+            metrics = MetricsAggregator.get_driver_metrics(
+                date_from=params['date_from'],
+                date_to=params['date_to'],
+                driver_id=params['driver_id']
+            )
+            return DriverMetricsSerializer(metrics).data
+        
+        return self._cached_response('drivers', params, compute, driver_id=params['driver_id'])
     
     @action(detail=False, methods=['get'])
     def time_series(self, request):
         """Временные ряды"""
         try:
             params = self._get_query_params()
-            data = MetricsAggregator.get_time_series_data(
-                date_from=params['date_from'],
-                date_to=params['date_to'],
-                granularity=params['granularity'],
-                region_id=params['region_id']
+            
+            def compute():
+                data = MetricsAggregator.get_time_series_data(
+                    date_from=params['date_from'],
+                    date_to=params['date_to'],
+                    granularity=params['granularity'],
+                    region_id=params['region_id']
+                )
+                return TimeSeriesDataSerializer(data, many=True).data
+            
+            return self._cached_response(
+                'time_series', params, compute,
+                region_id=params['region_id'], granularity=params['granularity']
             )
-            serializer = TimeSeriesDataSerializer(data, many=True)
-            return Response(serializer.data)
         except Exception as e:
             logger.error(f"Error in time_series endpoint: {str(e)}", exc_info=True)
             return Response(
@@ -133,18 +164,19 @@ class AnalyticsViewSet(viewsets.ViewSet):
         """Распределение по регионам"""
         try:
             # Безопасно получаем параметры запроса
-            date_from = request.query_params.get('date_from')
-            date_to = request.query_params.get('date_to')
+            params = self._get_query_params()
             
             # Игнорируем region_id, если он передан (метод не использует фильтрацию по региону)
             # Это предотвращает ошибки, если фронтенд передает некорректный region_id
             
-            data = MetricsAggregator.get_region_distribution(
-                date_from=date_from,
-                date_to=date_to
-            )
-            serializer = RegionDistributionSerializer(data, many=True)
-            return Response(serializer.data)
+            def compute():
+                data = MetricsAggregator.get_region_distribution(
+                    date_from=params['date_from'],
+                    date_to=params['date_to']
+                )
+                return RegionDistributionSerializer(data, many=True).data
+            
+            return self._cached_response('regions', params, compute)
         except Exception as e:
             logger.error(f"Error in regions endpoint: {str(e)}", exc_info=True)
             import traceback
@@ -159,13 +191,16 @@ class AnalyticsViewSet(viewsets.ViewSet):
         """Пиковые часы"""
         try:
             params = self._get_query_params()
-            data = MetricsAggregator.get_peak_hours(
-                date_from=params['date_from'],
-                date_to=params['date_to'],
-                region_id=params['region_id']
-            )
-            serializer = PeakHoursSerializer(data, many=True)
-            return Response(serializer.data)
+            
+            def compute():
+                data = MetricsAggregator.get_peak_hours(
+                    date_from=params['date_from'],
+                    date_to=params['date_to'],
+                    region_id=params['region_id']
+                )
+                return PeakHoursSerializer(data, many=True).data
+            
+            return self._cached_response('peak_hours', params, compute, region_id=params['region_id'])
         except Exception as e:
             logger.error(f"Error in peak_hours endpoint: {str(e)}", exc_info=True)
             return Response(
@@ -179,13 +214,16 @@ class AnalyticsViewSet(viewsets.ViewSet):
         try:
             params = self._get_query_params()
             limit = int(request.query_params.get('limit', 10))
-            data = MetricsAggregator.get_driver_performance(
-                date_from=params['date_from'],
-                date_to=params['date_to'],
-                limit=limit
-            )
-            serializer = DriverPerformanceSerializer(data, many=True)
-            return Response(serializer.data)
+            
+            def compute():
+                data = MetricsAggregator.get_driver_performance(
+                    date_from=params['date_from'],
+                    date_to=params['date_to'],
+                    limit=limit
+                )
+                return DriverPerformanceSerializer(data, many=True).data
+            
+            return self._cached_response('driver_performance', params, compute, limit=limit)
         except Exception as e:
             logger.error(f"Error in driver_performance endpoint: {str(e)}", exc_info=True)
             return Response(
@@ -198,12 +236,18 @@ class AnalyticsViewSet(viewsets.ViewSet):
         """Сравнение метрик текущего периода с предыдущим"""
         try:
             params = self._get_query_params()
-            data = MetricsAggregator.get_comparison_metrics(
-                date_from=params['date_from'],
-                date_to=params['date_to'],
-                region_id=params['region_id']
+            
+            def compute():
+                return MetricsAggregator.get_comparison_metrics(
+                    date_from=params['date_from'],
+                    date_to=params['date_to'],
+                    region_id=params['region_id']
+                )
+            
+            # Сравнение читает и предыдущий период такой же длительности
+            return self._cached_response(
+                'comparison', params, compute, extend_back=True, region_id=params['region_id']
             )
-            return Response(data)
         except Exception as e:
             logger.error(f"Error in comparison endpoint: {str(e)}", exc_info=True)
             return Response(
@@ -213,38 +257,35 @@ class AnalyticsViewSet(viewsets.ViewSet):
     
     @action(detail=False, methods=['get'])
     def export(self, request):
-        """Экспорт отчетов в CSV"""
+        """
+        Экспорт отчетов в CSV (потоково).
+        Query param: gzip=1 — передать сжатым (Content-Encoding: gzip)
+        """
         report_type = request.query_params.get('type', 'orders')
         params = self._get_query_params()
         
-        region_id = params['region_id']
-        
-        if report_type == 'orders':
-            csv_data = CSVExportService.export_orders_report(
-                date_from=params['date_from'],
-                date_to=params['date_to'],
-                region_id=region_id
-            )
-            filename = 'orders_report.csv'
-        elif report_type == 'financial':
-            csv_data = CSVExportService.export_financial_report(
-                date_from=params['date_from'],
-                date_to=params['date_to'],
-                region_id=region_id
-            )
-            filename = 'financial_report.csv'
-        elif report_type == 'drivers':
-            csv_data = CSVExportService.export_driver_report(
-                date_from=params['date_from'],
-                date_to=params['date_to']
-            )
-            filename = 'drivers_report.csv'
-        else:
+        if report_type not in CSVExportService.REPORTS:
             return Response(
                 {'error': 'Неверный тип отчета. Доступны: orders, financial, drivers'},
                 status=status.HTTP_400_BAD_REQUEST
             )
+        filename = CSVExportService.REPORTS[report_type][1]
+        
+        use_gzip = (
+            request.query_params.get('gzip') in ('1', 'true', 'True')
+            and 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', '')
+        )
+        stream = CSVExportService.stream_report(
+            report_type,
+            date_from=params['date_from'],
+            date_to=params['date_to'],
+            region_id=params['region_id'],
+            gzip=use_gzip
+        )
         
-        response = HttpResponse(csv_data.getvalue(), content_type='text/csv; charset=utf-8-sig')
+        response = StreamingHttpResponse(stream, content_type='text/csv; charset=utf-8')
         response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        if use_gzip:
+            response['Content-Encoding'] = 'gzip'
+            response['Vary'] = 'Accept-Encoding'
         return response
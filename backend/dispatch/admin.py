@@ -0,0 +1,18 @@
+from django.contrib import admin
+from .models import PlanningJob
+
+
+@admin.register(PlanningJob)
+class PlanningJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'kind', 'status', 'progress', 'created_by', 'created_at', 'finished_at']
+    list_filter = ['kind', 'status', 'created_at']
+    readonly_fields = [
+        'id', 'kind', 'status', 'params', 'progress', 'message', 'result',
+        'result_filename', 'result_content_type', 'error', 'created_by',
+        'created_at', 'started_at', 'finished_at'
+    ]
+    exclude = ['result_file']
+    date_hierarchy = 'created_at'
+
+    def has_add_permission(self, request):
+        return False
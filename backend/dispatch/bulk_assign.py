@@ -0,0 +1,301 @@
+"""
+Пакетная запись назначений заказов
+
+Вместо order.save() / OrderService.update_status для каждого заказа все
+назначения записываются в одной транзакции: bulk_update заказов,
+bulk_create OrderEvent и одно обновление статуса водителей. План мог
+устареть, пока считался, поэтому заказы (и водители, если меняется их
+статус) сначала блокируются и перечитываются (select_for_update): заказ,
+статус которого уже не status_from, и занятый водитель отклоняются. Сигналы
+post_save при этом не срабатывают, поэтому после коммита отправляется
+одна пачка WebSocket-уведомлений (notify_assignments), дельты карты
+(dispatch.map_state), статусы водителей в индексе (dispatch.driver_index)
+и сигнал orders.signals.orders_bulk_updated.
+
+auto_assign_queue - массовое назначение очереди (DispatchViewSet.auto_assign_all
+и фоновая задача dispatch.jobs).
+"""
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, List, Optional
+import logging
+
+from asgiref.sync import async_to_sync
+from django.db import transaction
+from django.utils import timezone
+
+from accounts.models import Driver, DriverStatus
+from orders.models import Order, OrderEvent, OrderStatus
+
+logger = logging.getLogger(__name__)
+
+# updated_at явно: bulk_update не обновляет auto_now (по нему работают срезы аналитики)
+ORDER_FIELDS = ['driver', 'status', 'assigned_at', 'assignment_reason', 'updated_at']
+
+# Связи, которые читает OrderSerializer (чтобы сериализация пачки не делала запросов на заказ)
+SERIALIZER_RELATED = (
+    'passenger__user', 'passenger__region__city',
+    'driver__user__passenger', 'driver__region__city',
+)
+
+
+# Водитель с таким статусом не может получить заказ при немедленном назначении
+BUSY_DRIVER_STATUSES = (
+    DriverStatus.OFFERED, DriverStatus.ENROUTE_TO_PICKUP, DriverStatus.ON_TRIP, DriverStatus.PAUSED,
+)
+
+REJECT_ORDER_CHANGED = 'order_changed'
+REJECT_DRIVER_UNAVAILABLE = 'driver_unavailable'
+
+
+@dataclass(slots=True)
+class PendingAssignment:
+    """Назначение, ожидающее записи"""
+    order_id: str
+    driver_id: int
+    status_from: Optional[str]
+    reason: str = ''
+
+
+@dataclass(slots=True)
+class CommitResult:
+    """Результат commit_assignments"""
+    written: List[PendingAssignment] = field(default_factory=list)
+    # order_id -> REJECT_ORDER_CHANGED | REJECT_DRIVER_UNAVAILABLE
+    rejected: Dict[str, str] = field(default_factory=dict)
+
+
+def commit_assignments(
+    assignments: Iterable[PendingAssignment],
+    driver_status: Optional[str] = None,
+    notify: bool = True
+) -> CommitResult:
+    """
+    Записывает назначения одной транзакцией фиксированным числом запросов.
+
+    Заказ назначается, только если его статус в БД все еще status_from
+    (None - любой); при driver_status водитель должен быть онлайн и не
+    занят (BUSY_DRIVER_STATUSES). Остальные назначения отклоняются.
+
+    Args:
+        assignments: Назначения
+        driver_status: Новый статус назначенных водителей (None - не менять)
+        notify: Отправить WebSocket-уведомления после коммита
+
+    Returns:
+        CommitResult с записанными и отклоненными назначениями
+    """
+    assignments = list(assignments)
+    result = CommitResult()
+    if not assignments:
+        return result
+
+    now = timezone.now()
+    with transaction.atomic():
+        current = dict(
+            Order.objects.select_for_update()
+            .filter(id__in=[a.order_id for a in assignments])
+            .values_list('id', 'status')
+        )
+        available = None
+        if driver_status is not None:
+            available = set(
+                Driver.objects.select_for_update()
+                .filter(id__in={a.driver_id for a in assignments}, is_online=True)
+                .exclude(status__in=BUSY_DRIVER_STATUSES)
+                .values_list('id', flat=True)
+            )
+
+        for a in assignments:
+            status = current.get(a.order_id)
+            if status is None or (a.status_from is not None and status != a.status_from):
+                result.rejected[a.order_id] = REJECT_ORDER_CHANGED
+            elif available is not None and a.driver_id not in available:
+                result.rejected[a.order_id] = REJECT_DRIVER_UNAVAILABLE
+            else:
+                result.written.append(a)
+
+        written = result.written
+        driver_ids = sorted({a.driver_id for a in written})
+        if written:
+            Order.objects.bulk_update([
+                Order(
+                    id=a.order_id,
+                    driver_id=a.driver_id,
+                    status=OrderStatus.ASSIGNED,
+                    assigned_at=now,
+                    assignment_reason=a.reason,
+                    updated_at=now,
+                )
+                for a in written
+            ], ORDER_FIELDS, batch_size=500)
+            OrderEvent.objects.bulk_create([
+                OrderEvent(
+                    order_id=a.order_id,
+                    status_from=a.status_from,
+                    status_to=OrderStatus.ASSIGNED,
+                    description=a.reason,
+                )
+                for a in written
+            ], batch_size=500)
+            if driver_status is not None:
+                Driver.objects.filter(id__in=driver_ids).update(status=driver_status, idle_since=None)
+            transaction.on_commit(lambda: _after_commit(written, driver_status, notify))
+
+    if result.rejected:
+        logger.warning(f'Отклонено устаревших назначений: {len(result.rejected)} ({result.rejected})')
+    logger.info(f'Записано назначений: {len(written)}, водителей: {len(driver_ids)}')
+    return result
+
+
+def _after_commit(assignments: List[PendingAssignment], driver_status: Optional[str], notify: bool):
+    from orders.signals import orders_bulk_updated
+    from . import map_state
+    from .driver_index import update_driver_index
+
+    driver_ids = sorted({a.driver_id for a in assignments})
+    if driver_status is not None:
+        update_driver_index({driver_id: {'status': driver_status} for driver_id in driver_ids})
+
+    order_ids = [a.order_id for a in assignments]
+    orders_bulk_updated.send(sender=Order, order_ids=order_ids)
+
+    # Дельты карты: поля известны без чтения заказов
+    changes = [
+        {
+            'kind': map_state.KIND_ORDER,
+            'id': a.order_id,
+            'fields': {'status': OrderStatus.ASSIGNED, 'driver_id': str(a.driver_id)},
+        }
+        for a in assignments
+    ]
+    if driver_status is not None:
+        changes.extend(
+            {'kind': map_state.KIND_DRIVER, 'id': driver_id, 'fields': {'status': driver_status}}
+            for driver_id in driver_ids
+        )
+    try:
+        map_state.publish_many(changes)
+    except Exception as e:
+        logger.error(f'Не удалось опубликовать дельты карты: {e}')
+
+    if notify:
+        notify_assignments(order_ids)
+
+
+def notify_assignments(order_ids: List[str]):
+    """
+    Отправляет обновления назначенных заказов через WebSocket:
+    одна пачка orders_batch_update в dispatch_map (если там есть подписчики) и каждому водителю,
+    order_update в группы заказов и пассажиров (как сигнал order_updated)
+    """
+    from orders.serializers import OrderSerializer
+    from orders.signals import get_channel_layer_safe
+    from . import map_state
+
+    channel_layer = get_channel_layer_safe()
+    if not channel_layer or not order_ids:
+        return
+
+    try:
+        orders = list(Order.objects.filter(id__in=order_ids).select_related(*SERIALIZER_RELATED))
+        payloads = OrderSerializer(orders, many=True).data
+        send = async_to_sync(channel_layer.group_send)
+
+        if map_state.has_legacy_subscribers():
+            send(map_state.LEGACY_GROUP, {'type': 'orders_batch_update', 'data': {'orders': payloads}})
+
+        by_driver = defaultdict(list)
+        for order, data in zip(orders, payloads):
+            send(f'order_{order.id}', {'type': 'order_update', 'data': data})
+            send(f'passenger_{order.passenger_id}', {'type': 'order_update', 'data': data})
+            if order.driver_id:
+                by_driver[order.driver_id].append(data)
+
+        for driver_id, driver_orders in by_driver.items():
+            send(f'driver_{driver_id}', {'type': 'orders_batch_update', 'data': {'orders': driver_orders}})
+    except Exception as e:
+        logger.error(f'Ошибка отправки пачки назначений через WebSocket: {e}')
+
+
+def auto_assign_queue(progress_callback: Optional[Callable] = None) -> Dict:
+    """
+    Массовое назначение всех заказов в очереди (ACTIVE_QUEUE).
+
+    Водители подбираются без записи в БД: занятые в этой пачке водители
+    исключаются из кандидатов, назначения записываются одним пакетом.
+
+    Args:
+        progress_callback: callback(current, total, message), как в plan_routes_greedy
+    """
+    from dispatch.services import DispatchEngine
+
+    queue = list(
+        Order.objects.filter(status=OrderStatus.ACTIVE_QUEUE).select_related('passenger', 'pickup_region')
+    )
+    if not queue:
+        return {
+            'success': True,
+            'assigned': 0,
+            'failed': 0,
+            'message': 'Нет заказов в очереди'
+        }
+
+    engine = DispatchEngine()
+    assigned_count = 0
+    failed_count = 0
+    failed_orders = []
+
+    pending = []
+    busy_driver_ids = set()
+    for idx, order in enumerate(queue):
+        if progress_callback:
+            progress_callback(idx + 1, len(queue), f'Обработка заказа {order.id}')
+        try:
+            result = engine.assign_order(order, exclude_driver_ids=busy_driver_ids)
+            if result.driver_id:
+                driver_id = int(result.driver_id)
+                busy_driver_ids.add(driver_id)
+                pending.append(PendingAssignment(
+                    order_id=order.id,
+                    driver_id=driver_id,
+                    status_from=order.status,
+                    reason=result.reason,
+                ))
+            else:
+                failed_count += 1
+                failed_orders.append({
+                    'order_id': order.id,
+                    'reason': result.reason or 'Не удалось назначить водителя'
+                })
+        except Exception as e:
+            logger.exception(f'Ошибка при назначении заказа {order.id}: {str(e)}')
+            failed_count += 1
+            failed_orders.append({
+                'order_id': order.id,
+                'reason': f'Ошибка: {str(e)}'
+            })
+
+    try:
+        committed = commit_assignments(pending, driver_status=DriverStatus.ENROUTE_TO_PICKUP)
+        assigned_count = len(committed.written)
+        failed_count += len(committed.rejected)
+        failed_orders.extend(
+            {'order_id': order_id, 'reason': f'Назначение устарело: {reason}'}
+            for order_id, reason in committed.rejected.items()
+        )
+    except Exception as e:
+        logger.exception(f'Ошибка записи назначений: {str(e)}')
+        failed_count += len(pending)
+        failed_orders.extend(
+            {'order_id': a.order_id, 'reason': f'Ошибка: {str(e)}'} for a in pending
+        )
+
+    return {
+        'success': True,
+        'assigned': assigned_count,
+        'failed': failed_count,
+        'total': len(queue),
+        'failed_orders': failed_orders,
+        'message': f'Обработано заказов: {len(queue)}, назначено: {assigned_count}, ошибок: {failed_count}'
+    }
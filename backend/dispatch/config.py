@@ -49,6 +49,10 @@ class DispatchParams:
     fixed_buffer_min: float = 5.0  # Фиксированный буфер в минутах
     use_traffic_api: bool = False  # Использовать API пробок
     
+    # Параллельная оценка кандидатов (dispatch.parallel)
+    parallel_workers: int = 0  # Число процессов для оценки кандидатов (0/1 - последовательно)
+    parallel_min_candidates: int = 8  # Минимум кандидатов, при котором имеет смысл пул процессов
+    
     @classmethod
     def from_dict(cls, data: dict) -> 'DispatchParams':
         """Создать экземпляр из словаря"""
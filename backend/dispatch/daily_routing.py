@@ -17,16 +17,20 @@
 - fairness_norm → отклонение кол-ва заказов водителя от медианы
 - quality_norm → штраф за низкий рейтинг
 """
-from typing import List, Dict, Optional
+from typing import Callable, List, Dict, Optional, Tuple
 from datetime import datetime, date, timedelta
 from django.utils import timezone
 from django.db.models import Q
 from orders.models import Order, OrderStatus, DispatchConfig
 from accounts.models import Driver, DriverStatus, DriverStatistics
 from geo.services import Geo
+from dispatch.bulk_assign import PendingAssignment, commit_assignments
+from dispatch.plan_cache import CachedPlan, PlanFingerprint, get_daily_plan_cache
 import logging
 import math
 
+import numpy as np
+
 logger = logging.getLogger(__name__)
 
 DROPOFF_BUFFER_MINUTES = 7.0  # Время высадки пассажира 5-10 мин
@@ -140,10 +144,13 @@ def _compute_ml_score(
     order: Order,
     config: DispatchConfig,
     median_orders: float,
+    deadhead_km: Optional[float] = None,
 ) -> DriverScore:
     """
     Вычисляет ML cost-score для назначения order водителю route.driver.
     Чем МЕНЬШЕ cost, тем ЛУЧШЕ кандидат.
+    deadhead_km можно передать заранее рассчитанным (векторно для всех маршрутов
+    считает DailyScoringEngine.best_route).
     """
     driver = route.driver
     stats = route.stats
@@ -153,7 +160,8 @@ def _compute_ml_score(
     gap_norm = min(gap_min / MAX_GAP_MINUTES, 1.0)
 
     # ── 2. deadhead_norm ──────────────────────────────────────
-    deadhead_km = route.deadhead_km_to(order)
+    if deadhead_km is None:
+        deadhead_km = route.deadhead_km_to(order)
     deadhead_norm = min(deadhead_km / MAX_DEADHEAD_KM, 1.0)
 
     # ── 3. reject_norm ────────────────────────────────────────
@@ -221,17 +229,156 @@ def _compute_ml_score(
     return DriverScore(driver.id, cost, details)
 
 
-def _get_median(values: List[float]) -> float:
-    if not values:
-        return 0.0
-    s = sorted(values)
-    n = len(s)
-    if n % 2 == 0:
-        return (s[n // 2 - 1] + s[n // 2]) / 2.0
-    return s[n // 2]
+class LoadMedian:
+    """
+    Медиана числа заказов по маршрутам с инкрементальным обновлением.
 
+    Загрузки - небольшие целые числа и меняются только на +1, поэтому
+    хранится гистограмма загрузок и значения на позициях медианы
+    (вместе с количеством элементов меньше них); add() работает за O(1)
+    амортизированно вместо сортировки всех загрузок.
+    """
 
-def distribute_orders_for_day(target_date: date, auto_assign: bool = False, user=None) -> Dict:
+    def __init__(self, loads: List[int]):
+        self.size = len(loads)
+        self.counts = [0] * ((max(loads) if loads else 0) + 2)
+        for load in loads:
+            self.counts[load] += 1
+        # Позиции (по возрастанию) элементов, дающих медиану
+        ranks = [self.size // 2] if self.size % 2 else [self.size // 2 - 1, self.size // 2]
+        self._trackers = [[rank, 0, 0] for rank in ranks]  # [позиция, значение, элементов меньше значения]
+        for tracker in self._trackers:
+            self._settle(tracker)
+
+    def _settle(self, tracker: List[int]):
+        rank, value, below = tracker
+        while rank >= below + self.counts[value]:
+            below += self.counts[value]
+            value += 1
+        while rank < below:
+            value -= 1
+            below -= self.counts[value]
+        tracker[1], tracker[2] = value, below
+
+    def add(self, old_load: int):
+        """Один маршрут перешел с old_load на old_load + 1 заказов"""
+        if old_load + 2 >= len(self.counts):
+            self.counts.append(0)
+        self.counts[old_load] -= 1
+        self.counts[old_load + 1] += 1
+        for tracker in self._trackers:
+            if old_load + 1 == tracker[1]:
+                tracker[2] -= 1
+            self._settle(tracker)
+
+    @property
+    def median(self) -> float:
+        if not self.size:
+            return 0.0
+        return sum(tracker[1] for tracker in self._trackers) / len(self._trackers)
+
+
+class DailyScoringEngine:
+    """
+    Векторный расчет ML cost-score (_compute_ml_score) сразу для всех маршрутов.
+
+    Состояние водителей (последняя точка, время освобождения, загрузка,
+    acceptance/cancel rate, рейтинг) хранится в массивах NumPy; для заказа
+    за один проход считается вектор стоимости, а словарь деталей строится
+    только для победителя (через _compute_ml_score).
+    """
+
+    def __init__(self, routes: List[DailyRoute], config: DispatchConfig):
+        self.routes = routes
+        self.config = config
+        n = len(routes)
+
+        self.last_lat = np.full(n, np.nan)
+        self.last_lon = np.full(n, np.nan)
+        self.last_end = np.full(n, np.nan)  # Время освобождения, timestamp в секундах
+        for i, route in enumerate(routes):
+            coords = route.last_dropoff_coords()
+            if coords is not None:
+                self.last_lat[i], self.last_lon[i] = coords
+            end = route.last_end_time()
+            if end is not None:
+                self.last_end[i] = end.timestamp()
+
+        self.capacity = np.array([route.driver.capacity for route in routes], dtype=float)
+        self.load = np.array([route.total_orders for route in routes], dtype=float)
+        acceptance = np.array([route.stats.acceptance_rate if route.stats else 1.0 for route in routes], dtype=float)
+        cancel = np.array([route.stats.cancel_rate if route.stats else 0.0 for route in routes], dtype=float)
+        rating = np.array([route.driver.rating if route.driver.rating else 5.0 for route in routes], dtype=float)
+        quality = np.where(rating < 4.5, (4.5 - rating) / 1.5, 0.0)
+
+        # Слагаемые, не зависящие от заказа (zone_norm пока всегда 0)
+        self.static_cost = config.w_reject * (1.0 - acceptance) + config.w_cancel * cancel + \
+            config.w_quality * quality
+        self.fairness_scale = getattr(config, 'fairness_scale', 2.0) or 2.0
+        self.max_deadhead = getattr(config, 'max_deadhead_km', None) or MAX_DEADHEAD_KM
+        self.loads = LoadMedian([route.total_orders for route in routes])
+
+    @property
+    def median(self) -> float:
+        return self.loads.median
+
+    def best_route(self, order: Order) -> Tuple[Optional[int], float]:
+        """
+        Лучший маршрут для заказа
+
+        Returns:
+            (индекс маршрута или None, холостой пробег до заказа в км)
+        """
+        if not self.routes:
+            return None, 0.0
+
+        config = self.config
+        pickup_ts = order.desired_pickup_time.timestamp()
+
+        deadhead = Geo.calculate_distances(order.pickup_lat, order.pickup_lon, self.last_lat, self.last_lon) / 1000.0
+        deadhead = np.nan_to_num(deadhead, nan=0.0)
+
+        has_end = ~np.isnan(self.last_end)
+        eligible = self.capacity >= order.seats_needed
+        eligible &= ~has_end | (pickup_ts >= self.last_end)
+        if self.max_deadhead > 0:
+            eligible &= deadhead <= self.max_deadhead
+        if not eligible.any():
+            return None, 0.0
+
+        gap = np.where(has_end, np.maximum((pickup_ts - self.last_end) / 60.0, 0.0), 0.0)
+        gap_norm = np.minimum(gap / MAX_GAP_MINUTES, 1.0)
+        deadhead_norm = np.minimum(deadhead / MAX_DEADHEAD_KM, 1.0)
+
+        median = self.loads.median
+        if median >= 0 and self.fairness_scale > 0:
+            fairness_norm = np.minimum(np.maximum(0.0, self.load - median) / self.fairness_scale, 1.0)
+        else:
+            fairness_norm = np.zeros(len(self.routes))
+
+        cost = config.w_eta * gap_norm + config.w_deadhead * deadhead_norm + \
+            config.w_fairness * fairness_norm + self.static_cost
+        cost = np.where(eligible, cost, np.inf)
+
+        index = int(np.argmin(cost))
+        return index, float(deadhead[index])
+
+    def add_order(self, index: int, order: Order):
+        """Обновляет состояние маршрута index после назначения заказа"""
+        ride_min = (order.distance_km or 5) * MIN_PER_KM_RIDE
+        self.last_lat[index] = order.dropoff_lat
+        self.last_lon[index] = order.dropoff_lon
+        self.last_end[index] = order.desired_pickup_time.timestamp() + (ride_min + DROPOFF_BUFFER_MINUTES) * 60.0
+        self.loads.add(int(self.load[index]))
+        self.load[index] += 1
+
+
+def distribute_orders_for_day(
+    target_date: date,
+    auto_assign: bool = False,
+    user=None,
+    progress_callback: Optional[Callable] = None,
+) -> Dict:
     """
     Распределяет заказы на день используя ML-скоринг (многофакторная модель).
 
@@ -243,6 +390,13 @@ def distribute_orders_for_day(target_date: date, auto_assign: bool = False, user
                 + w_fairness·fairness + w_quality·quality
     4. Назначает заказ водителю с наименьшим cost.
     5. Возвращает маршруты с деталями скоринга.
+
+    progress_callback(current, total, message) вызывается для каждого заказа
+    (как в planner.plan_routes_greedy).
+
+    План кэшируется (dispatch.plan_cache): при неизменных данных просмотр и
+    экспорт возвращают сохраненный план, а применение и пересчет после
+    небольших изменений переоценивают только новые и измененные заказы.
     """
 
     config = DispatchConfig.get_active_config()
@@ -297,40 +451,53 @@ def distribute_orders_for_day(target_date: date, auto_assign: bool = False, user
     for drv in drivers:
         routes[drv.id] = DailyRoute(drv, stats_map.get(drv.id))
 
+    plan_cache = get_daily_plan_cache()
+    fingerprint = PlanFingerprint.build(
+        config, orders, already_assigned, drivers, stats_map, plan_cache.driver_coord_precision
+    )
+    cached = plan_cache.get(target_date)
+    if cached is not None and not auto_assign and cached.fingerprint_key == fingerprint.key:
+        plan_cache.record('hit')
+        return {**cached.result, "plan_cache": {"status": "hit", "reused": len(cached.assignments), "scored": 0}}
+    reusable = cached.reusable_assignments(fingerprint, plan_cache.delta_max_fraction) if cached else None
+
     for o in already_assigned:
         if o.driver_id in routes:
             routes[o.driver_id].add_order(o)
+    route_list = list(routes.values())
+    route_index = {route.driver.id: i for i, route in enumerate(route_list)}
+    engine = DailyScoringEngine(route_list, config)
 
     assigned_orders: List[Dict] = []
     unassigned_orders: List[Dict] = []
-
-    for order in orders:
-        eligible: List[DriverScore] = []
-        median_orders = _get_median([r.total_orders for r in routes.values()])
-
-        max_deadhead = getattr(config, 'max_deadhead_km', None) or MAX_DEADHEAD_KM
-        for drv_id, route in routes.items():
-            if not route.can_take_order(order):
-                continue
-            deadhead_km = route.deadhead_km_to(order)
-            if max_deadhead > 0 and deadhead_km > max_deadhead:
+    pending: List[PendingAssignment] = []
+    reused_count = 0
+
+    for idx, order in enumerate(orders):
+        if progress_callback:
+            progress_callback(idx + 1, len(orders), f"Обработка заказа {order.id}")
+        # Неизмененный заказ из сохраненного плана остается у прежнего водителя
+        previous = reusable.get(order.id) if reusable else None
+        index = route_index.get(previous["driver_id"]) if previous else None
+        if index is not None and route_list[index].can_take_order(order):
+            route = route_list[index]
+            deadhead = route.deadhead_km_to(order)
+            best = DriverScore(previous["driver_id"], previous["ml_cost"], previous["ml_details"])
+            reused_count += 1
+        else:
+            index, deadhead = engine.best_route(order)
+            if index is None:
+                unassigned_orders.append({
+                    "id": order.id,
+                    "reason": "Нет подходящего водителя (все заняты или не хватает вместимости)",
+                })
                 continue
-            score = _compute_ml_score(route, order, config, median_orders)
-            eligible.append(score)
-
-        if not eligible:
-            unassigned_orders.append({
-                "id": order.id,
-                "reason": "Нет подходящего водителя (все заняты или не хватает вместимости)",
-            })
-            continue
 
-        eligible.sort(key=lambda s: s.cost)
-        best = eligible[0]
-        route = routes[best.driver_id]
+            route = route_list[index]
+            best = _compute_ml_score(route, order, config, engine.median, deadhead)
 
-        deadhead = route.deadhead_km_to(order)
         route.add_order(order, best.details)
+        engine.add_order(index, order)
         route.total_distance_km += deadhead
         if order.distance_km:
             route.total_distance_km += order.distance_km
@@ -344,25 +511,36 @@ def distribute_orders_for_day(target_date: date, auto_assign: bool = False, user
         }
 
         if auto_assign:
-            try:
-                driver = route.driver
-                order.driver = driver
-                order.driver_id = driver.id
-                order.status = OrderStatus.ASSIGNED
-                order.assigned_at = timezone.now()
-                order.assignment_reason = (
-                    f"ML-распределение на {target_date.isoformat()}: "
-                    f"водитель {driver.name}, cost={best.cost:.4f}"
+            driver = route.driver
+            reason = (
+                f"ML-распределение на {target_date.isoformat()}: "
+                f"водитель {driver.name}, cost={best.cost:.4f}"
+            )
+            pending.append(PendingAssignment(
+                order_id=order.id, driver_id=driver.id, status_from=order.status, reason=reason,
+            ))
+            order.driver = driver
+            order.status = OrderStatus.ASSIGNED
+            order.assignment_reason = reason
+
+        assigned_orders.append(assignment_info)
+
+    # Назначения записываются одним пакетом после распределения всех заказов
+    if pending:
+        try:
+            committed = commit_assignments(pending)
+            if committed.rejected:
+                # Заказ изменился, пока считался план - назначение не записано
+                assigned_orders = [a for a in assigned_orders if a["order_id"] not in committed.rejected]
+                unassigned_orders.extend(
+                    {"id": order_id, "reason": f"Назначение устарело: {reason}"}
+                    for order_id, reason in committed.rejected.items()
                 )
-                order.save(update_fields=[
-                    "driver", "driver_id", "status", "assigned_at", "assignment_reason"
-                ])
-                assigned_orders.append(assignment_info)
-            except Exception as e:
-                logger.error(f"Ошибка назначения заказа {order.id}: {e}")
-                unassigned_orders.append({"id": order.id, "reason": str(e)})
-        else:
-            assigned_orders.append(assignment_info)
+        except Exception as e:
+            logger.error(f"Ошибка записи назначений на {target_date.isoformat()}: {e}")
+            failed_ids = {a.order_id for a in pending}
+            assigned_orders = [a for a in assigned_orders if a["order_id"] not in failed_ids]
+            unassigned_orders.extend({"id": order_id, "reason": str(e)} for order_id in failed_ids)
 
     routes_list = []
     for drv_id in sorted(routes.keys()):
@@ -370,7 +548,7 @@ def distribute_orders_for_day(target_date: date, auto_assign: bool = False, user
         if r.total_orders > 0:
             routes_list.append(r.to_dict())
 
-    return {
+    result = {
         "date": target_date.isoformat(),
         "algorithm": "ml_scoring",
         "config": {
@@ -394,3 +572,22 @@ def distribute_orders_for_day(target_date: date, auto_assign: bool = False, user
         "unassigned_orders": unassigned_orders,
         "auto_assigned": auto_assign,
     }
+
+    if auto_assign:
+        # Заказы сменили статус - сохраненный план больше не нужен
+        plan_cache.invalidate(target_date)
+    else:
+        plan_cache.set(target_date, CachedPlan(
+            fingerprint_key=fingerprint.key,
+            base=fingerprint.base,
+            orders=fingerprint.orders,
+            assignments={a["order_id"]: a for a in assigned_orders},
+            result=result,
+        ))
+
+    plan_status = "delta" if reusable is not None else "miss"
+    plan_cache.record(plan_status)
+    return {
+        **result,
+        "plan_cache": {"status": plan_status, "reused": reused_count, "scored": len(orders) - reused_count},
+    }
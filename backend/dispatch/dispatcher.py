@@ -9,6 +9,7 @@ import logging
 from accounts.models import Driver
 from orders.models import Order
 from dispatch.insertion import best_insertion
+from dispatch.parallel import submit_candidate_evaluations, use_parallel
 from dispatch.utils import (
     calculate_load_bonus,
     calculate_region_bonus,
@@ -45,7 +46,7 @@ def assign_order(
         Словарь с ключами:
         - chosen_driver_id: ID выбранного водителя (int или None)
         - insert_position: Позиция вставки в маршрут (int или None)
-        - schedule_df: Расписание маршрута (DataFrame или None)
+        - schedule: Расписание маршрута (RouteSchedule или None, DataFrame - schedule.to_dataframe())
         - debug_table: Таблица всех кандидатов с их стоимостями (DataFrame)
     """
     if params is None:
@@ -54,7 +55,7 @@ def assign_order(
     debug_rows = []
     best_driver_id = None
     best_position = None
-    best_schedule_df = None
+    best_schedule = None
     best_cost = float('inf')
     
     # Фильтрация кандидатов
@@ -65,27 +66,36 @@ def assign_order(
         return {
             'chosen_driver_id': None,
             'insert_position': None,
-            'schedule_df': None,
+            'schedule': None,
             'debug_table': pd.DataFrame(debug_rows)
         }
     
     logger.info(f'Найдено {len(candidates)} кандидатов для заказа {new_order.id}')
     
+    # Параллельная оценка кандидатов (если включена): результаты собираются
+    # в том же порядке, что и в последовательном режиме
+    evaluations = None
+    if use_parallel(params, len(candidates)):
+        evaluations = submit_candidate_evaluations(candidates, routes_dict, new_order, start_time, params)
+    
     # Поиск лучшей позиции вставки для каждого кандидата
-    for driver in candidates:
+    for index, driver in enumerate(candidates):
         driver_id = driver.id
         current_route = get_driver_current_orders(driver_id, routes_dict)
         
         try:
             # Поиск лучшей позиции вставки
-            position, schedule_df, cost, debug_info = best_insertion(
-                driver=driver,
-                current_route=current_route,
-                new_order=new_order,
-                start_time=start_time,
-                params=params,
-                regions_df=regions_df
-            )
+            if evaluations is not None:
+                position, schedule, cost, debug_info = evaluations[index].result()
+            else:
+                position, schedule, cost, debug_info = best_insertion(
+                    driver=driver,
+                    current_route=current_route,
+                    new_order=new_order,
+                    start_time=start_time,
+                    params=params,
+                    regions_df=regions_df
+                )
             
             if position is None:
                 debug_rows.append({
@@ -134,7 +144,7 @@ def assign_order(
             if final_cost < best_cost:
                 best_driver_id = driver_id
                 best_position = position
-                best_schedule_df = schedule_df
+                best_schedule = schedule
                 best_cost = final_cost
                 
                 logger.debug(
@@ -165,7 +175,7 @@ def assign_order(
     result = {
         'chosen_driver_id': best_driver_id,
         'insert_position': best_position,
-        'schedule_df': best_schedule_df,
+        'schedule': best_schedule,
         'debug_table': debug_table
     }
     
@@ -210,7 +220,7 @@ def _filter_candidates(
             continue
         
         # c) Локация
-        if driver.current_lat is None or driver.current_lng is None:
+        if driver.current_lat is None or driver.current_lon is None:
             continue
         
         # d) Лимит заказов
@@ -241,9 +251,9 @@ def _check_regional_constraints_for_filtering(
         True если водитель может взять заказ, False иначе
     """
     driver_region = driver.region
-    order_region = order.pickup_region
+    order_region_id = order.pickup_region_id
     
-    if not driver_region or not order_region:
+    if not driver_region or not order_region_id:
         return True  # Если нет информации о регионе, разрешаем
     
     from dispatch.utils import is_city_driver, is_remote_driver, is_order_in_remote_region
@@ -258,7 +268,7 @@ def _check_regional_constraints_for_filtering(
     
     # Отдаленные водители: первый заказ должен быть из их региона
     if is_remote and len(current_route) == 0:
-        if driver_region.id != order_region.id:
+        if driver_region.id != order_region_id:
             if not params.allow_remote_driver_first_order_outside_region:
                 return False
     
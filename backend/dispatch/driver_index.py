@@ -0,0 +1,452 @@
+"""
+Индекс водителей в памяти процесса для поиска ближайших свободных водителей
+
+Водители раскладываются по корзинам (район, статус), внутри корзины - по
+равномерной сетке CELL_SIZE_DEG градусов. Запрос "k ближайших водителей со
+статусом из statuses, вместимостью от s, в радиусе r, в районе X"
+(DriverIndex.nearest) обходит кольца ячеек вокруг точки и останавливается,
+когда следующее кольцо заведомо дальше k-го найденного водителя или радиуса,
+поэтому не зависит от общего числа водителей.
+
+Индекс обновляется в своем процессе: сигналы сохранения/удаления Driver
+(accounts.signals), запись позиций (accounts.locations) и пакетные назначения
+(dispatch.bulk_assign). Изменения доступности водителя (AVAILABILITY_FIELDS)
+после фиксации транзакции увеличивают общую версию в Django cache
+(CACHES[CACHE_ALIAS]); каждый запрос к индексу сверяет ее со своей и при
+расхождении перестраивает индекс, поэтому водитель, освободившийся в другом
+процессе, виден сразу. Общей версия бывает только при общем кэше (Redis и т.п.);
+позиции из других процессов и изменения в обход сигналов (QuerySet.update)
+подхватываются перестроением раз в MAX_AGE_SECONDS.
+
+Индекс - только первый этап отбора: MatchingService и DispatchEngine проверяют
+найденных водителей запросом к БД.
+"""
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+import logging
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils import timezone
+
+from geo.services import Geo
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DRIVER_INDEX_SETTINGS = {
+    'MAX_AGE_SECONDS': 60,
+    'CACHE_ALIAS': 'default',
+    'CELL_SIZE_DEG': 0.01,  # ~1 км
+    'MATCHING_CANDIDATES': 100,
+}
+
+# Поля водителя в индексе (колонки values())
+INDEX_FIELDS = (
+    'region_id', 'status', 'is_online', 'capacity',
+    'current_lat', 'current_lon', 'last_location_update',
+)
+
+# Поля save(update_fields=...), после изменения которых другие процессы перестраивают индекс
+AVAILABILITY_FIELDS = frozenset({'region', 'region_id', 'status', 'is_online', 'capacity'})
+
+VERSION_KEY = 'driver_index:v1:version'
+
+# Метров в градусе широты
+METERS_PER_DEG = math.radians(1) * Geo.EARTH_RADIUS_M
+
+
+def driver_index_settings() -> Dict:
+    options = dict(DEFAULT_DRIVER_INDEX_SETTINGS)
+    options.update(getattr(settings, 'DRIVER_INDEX', {}) or {})
+    return options
+
+
+@dataclass(slots=True)
+class IndexedDriver:
+    """Водитель в индексе"""
+    id: int
+    region_id: Optional[str]
+    status: str
+    is_online: bool
+    capacity: int
+    current_lat: Optional[float] = None
+    current_lon: Optional[float] = None
+    last_location_update: Optional[datetime] = None
+
+    @property
+    def located(self) -> bool:
+        return self.current_lat is not None and self.current_lon is not None
+
+
+@dataclass(slots=True)
+class _Bucket:
+    """Онлайн-водители одного района в одном статусе"""
+    cells: Dict[Tuple[int, int], Set[int]] = field(default_factory=dict)
+    unlocated: Set[int] = field(default_factory=set)
+    # Границы занятых ячеек (только расширяются, сбрасываются перестроением)
+    bounds: Optional[List[int]] = None
+    size: int = 0
+
+
+class DriverIndex:
+    """Онлайн-водители по районам и статусам на равномерной сетке"""
+
+    def __init__(self, drivers: Iterable[IndexedDriver], cell_deg: float = 0.01):
+        self.cell_deg = cell_deg
+        self.built_at = time.time()
+        # Общая версия, которой соответствует индекс (None - неизвестна)
+        self.version: Optional[int] = None
+        self._lock = threading.RLock()
+        self._drivers: Dict[int, IndexedDriver] = {}
+        self._buckets: Dict[Tuple[Optional[str], str], _Bucket] = {}
+        for driver in drivers:
+            self._drivers[driver.id] = driver
+            self._add(driver)
+
+    def __len__(self) -> int:
+        return len(self._drivers)
+
+    def get(self, driver_id: int) -> Optional[IndexedDriver]:
+        with self._lock:
+            return self._drivers.get(driver_id)
+
+    def _cell(self, lat: float, lon: float) -> Tuple[int, int]:
+        return (math.floor(lat / self.cell_deg), math.floor(lon / self.cell_deg))
+
+    def _add(self, driver: IndexedDriver):
+        if not driver.is_online:
+            return
+        bucket = self._buckets.get((driver.region_id, driver.status))
+        if bucket is None:
+            bucket = self._buckets[(driver.region_id, driver.status)] = _Bucket()
+        bucket.size += 1
+        if not driver.located:
+            bucket.unlocated.add(driver.id)
+            return
+        x, y = self._cell(driver.current_lat, driver.current_lon)
+        bucket.cells.setdefault((x, y), set()).add(driver.id)
+        if bucket.bounds is None:
+            bucket.bounds = [x, y, x, y]
+        else:
+            bounds = bucket.bounds
+            bounds[0], bounds[1] = min(bounds[0], x), min(bounds[1], y)
+            bounds[2], bounds[3] = max(bounds[2], x), max(bounds[3], y)
+
+    def _discard(self, driver: IndexedDriver):
+        if not driver.is_online:
+            return
+        bucket = self._buckets.get((driver.region_id, driver.status))
+        if bucket is None:
+            return
+        if driver.located:
+            cell = self._cell(driver.current_lat, driver.current_lon)
+            members = bucket.cells.get(cell)
+            if members is None or driver.id not in members:
+                return
+            members.discard(driver.id)
+            if not members:
+                del bucket.cells[cell]
+        elif driver.id in bucket.unlocated:
+            bucket.unlocated.discard(driver.id)
+        else:
+            return
+        bucket.size -= 1
+
+    def upsert(self, driver: IndexedDriver):
+        """Добавляет водителя или заменяет все его поля"""
+        with self._lock:
+            previous = self._drivers.get(driver.id)
+            if previous is not None:
+                self._discard(previous)
+            self._drivers[driver.id] = driver
+            self._add(driver)
+
+    def update(self, driver_id: int, **fields) -> bool:
+        """
+        Меняет часть полей водителя (имена из INDEX_FIELDS).
+
+        Returns:
+            False, если водителя нет в индексе (он появится при перестроении)
+        """
+        with self._lock:
+            driver = self._drivers.get(driver_id)
+            if driver is None:
+                return False
+            self._discard(driver)
+            for name, value in fields.items():
+                setattr(driver, name, value)
+            self._add(driver)
+            return True
+
+    def update_many(self, changes: Dict[int, Dict]):
+        """update для пачки водителей под одной блокировкой"""
+        with self._lock:
+            for driver_id, fields in changes.items():
+                self.update(driver_id, **fields)
+
+    def remove(self, driver_id: int):
+        with self._lock:
+            driver = self._drivers.pop(driver_id, None)
+            if driver is not None:
+                self._discard(driver)
+
+    def _matches(
+        self,
+        driver: IndexedDriver,
+        min_capacity: int,
+        exclude: Set[int],
+        fresh_after: Optional[datetime]
+    ) -> bool:
+        if driver.capacity < min_capacity or driver.id in exclude:
+            return False
+        if fresh_after is not None and driver.last_location_update is not None:
+            return driver.last_location_update >= fresh_after
+        return True
+
+    def nearest(
+        self,
+        lat: float,
+        lon: float,
+        region_id: Optional[str] = None,
+        statuses: Optional[Iterable[str]] = None,
+        min_capacity: int = 0,
+        k: Optional[int] = None,
+        radius_m: Optional[float] = None,
+        exclude: Optional[Iterable[int]] = None,
+        max_location_age: Optional[timedelta] = None,
+        include_unlocated: bool = False
+    ) -> List[Tuple[int, Optional[float]]]:
+        """
+        Ближайшие онлайн-водители к точке.
+
+        Args:
+            region_id: Район (None - все районы)
+            statuses: Допустимые статусы (None - все)
+            min_capacity: Минимальная вместимость
+            k: Сколько водителей вернуть (None - всех подходящих)
+            radius_m: Максимальное расстояние по прямой
+            exclude: Идентификаторы исключаемых водителей
+            max_location_age: Водители с более старой позицией пропускаются
+                (водители без времени позиции не отсекаются)
+            include_unlocated: Добавить в конец водителей без позиции (не входят в k)
+
+        Returns:
+            [(driver_id, расстояние в метрах или None)] по возрастанию расстояния
+        """
+        exclude = {int(driver_id) for driver_id in exclude or ()}
+        fresh_after = timezone.now() - max_location_age if max_location_age is not None else None
+        statuses = set(statuses) if statuses is not None else None
+
+        with self._lock:
+            buckets = [
+                bucket for (bucket_region, status), bucket in self._buckets.items()
+                if (region_id is None or bucket_region == region_id)
+                and (statuses is None or status in statuses)
+                and bucket.size
+            ]
+            if k is not None and k <= 0:
+                found = []
+            else:
+                found = self._nearest_located(lat, lon, buckets, min_capacity, k, radius_m, exclude, fresh_after)
+
+            if include_unlocated:
+                unlocated = sorted(
+                    driver_id for bucket in buckets for driver_id in bucket.unlocated
+                    if self._matches(self._drivers[driver_id], min_capacity, exclude, None)
+                )
+                found.extend((driver_id, None) for driver_id in unlocated)
+        return found
+
+    def _nearest_located(self, lat, lon, buckets, min_capacity, k, radius_m, exclude, fresh_after):
+        buckets = [bucket for bucket in buckets if bucket.bounds is not None]
+        if not buckets:
+            return []
+
+        cx, cy = self._cell(lat, lon)
+        max_ring = max(
+            max(cx - bucket.bounds[0], bucket.bounds[2] - cx, cy - bucket.bounds[1], bucket.bounds[3] - cy)
+            for bucket in buckets
+        )
+        if radius_m is not None:
+            # Ячейка по долготе короче, чем по широте - кольца считаются по ней
+            cos_lat = max(math.cos(math.radians(min(abs(lat) + radius_m / METERS_PER_DEG, 89.9))), 1e-6)
+            max_ring = min(max_ring, math.ceil(radius_m / (self.cell_deg * METERS_PER_DEG * cos_lat)) + 1)
+
+        # Редкая сетка: проще проверить всех водителей корзин
+        total = sum(len(members) for bucket in buckets for members in bucket.cells.values())
+        if k is None or (2 * max_ring + 1) ** 2 > 4 * total:
+            found = [
+                (driver_id, distance)
+                for bucket in buckets
+                for members in bucket.cells.values()
+                for driver_id, distance in self._check(lat, lon, members, min_capacity, exclude, fresh_after, radius_m)
+            ]
+            found.sort(key=lambda item: (item[1], item[0]))
+            return found if k is None else found[:k]
+
+        found = []
+        for ring in range(max_ring + 1):
+            for cell in self._ring_cells(cx, cy, ring):
+                for bucket in buckets:
+                    members = bucket.cells.get(cell)
+                    if members:
+                        found.extend(self._check(lat, lon, members, min_capacity, exclude, fresh_after, radius_m))
+            if len(found) >= k:
+                found.sort(key=lambda item: (item[1], item[0]))
+                del found[k:]
+                if found[-1][1] <= self._ring_lower_bound(lat, ring):
+                    break
+        found.sort(key=lambda item: (item[1], item[0]))
+        return found[:k]
+
+    def _check(self, lat, lon, members, min_capacity, exclude, fresh_after, radius_m):
+        for driver_id in members:
+            driver = self._drivers[driver_id]
+            if not self._matches(driver, min_capacity, exclude, fresh_after):
+                continue
+            distance = Geo.calculate_fast_distance(lat, lon, driver.current_lat, driver.current_lon)
+            if radius_m is None or distance <= radius_m:
+                yield driver_id, distance
+
+    def _ring_lower_bound(self, lat: float, ring: int) -> float:
+        """
+        Нижняя граница расстояния до водителей за пределами колец 0..ring:
+        точка лежит в центральной ячейке, до края просмотренного квадрата
+        не меньше ring ячеек по каждой оси
+        """
+        cos_lat = max(math.cos(math.radians(min(abs(lat) + (ring + 1) * self.cell_deg, 89.9))), 1e-6)
+        # Запас на погрешность calculate_fast_distance
+        return ring * self.cell_deg * METERS_PER_DEG * cos_lat * 0.999
+
+    @staticmethod
+    def _ring_cells(cx: int, cy: int, ring: int):
+        if ring == 0:
+            yield (cx, cy)
+            return
+        for x in range(cx - ring, cx + ring + 1):
+            yield (x, cy - ring)
+            yield (x, cy + ring)
+        for y in range(cy - ring + 1, cy + ring):
+            yield (cx - ring, y)
+            yield (cx + ring, y)
+
+
+_driver_index: Optional[DriverIndex] = None
+_driver_index_lock = threading.Lock()
+
+
+def _version_cache():
+    return caches[driver_index_settings()['CACHE_ALIAS']]
+
+
+def shared_version() -> Optional[int]:
+    """Общая версия доступности водителей (None - кэш недоступен)"""
+    try:
+        return int(_version_cache().get(VERSION_KEY) or 0)
+    except Exception as e:
+        logger.warning(f'Не удалось прочитать версию индекса водителей: {e}')
+        return None
+
+
+def get_driver_index() -> DriverIndex:
+    """
+    Индекс водителей (строится одним запросом при первом обращении).
+    Перестраивается, если другой процесс изменил доступность водителей
+    (общая версия) или индекс старше MAX_AGE_SECONDS.
+    """
+    global _driver_index
+    index = _driver_index
+    options = driver_index_settings()
+    max_age = options['MAX_AGE_SECONDS']
+    # Версия читается до запроса водителей: изменения во время построения дадут еще одно перестроение
+    version = shared_version()
+    if (
+        index is not None and index.version == version
+        and (not max_age or time.time() - index.built_at < max_age)
+    ):
+        return index
+
+    with _driver_index_lock:
+        if _driver_index is None or _driver_index is index:
+            from accounts.models import Driver
+
+            drivers = [
+                IndexedDriver(id=row.pop('id'), **row)
+                for row in Driver.objects.values('id', *INDEX_FIELDS)
+            ]
+            _driver_index = DriverIndex(drivers, cell_deg=options['CELL_SIZE_DEG'])
+            _driver_index.version = version
+            logger.debug(f'Индекс водителей построен: {len(drivers)} водителей, версия {version}')
+        return _driver_index
+
+
+def _bump_version():
+    try:
+        cache = _version_cache()
+        cache.add(VERSION_KEY, 0, timeout=None)
+        version = cache.incr(VERSION_KEY)
+    except Exception as e:
+        logger.warning(f'Не удалось обновить версию индекса водителей: {e}')
+        return
+    index = _driver_index
+    if index is not None and index.version is not None and version == index.version + 1:
+        # Других изменений не было - свое изменение уже в индексе процесса
+        index.version = version
+
+
+def driver_availability_changed():
+    """Доступность водителей изменилась: после commit другие процессы перестроят индекс"""
+    transaction.on_commit(_bump_version)
+
+
+def sort_by_distance(drivers: Iterable, lat: float, lon: float) -> List:
+    """Водители из запроса к БД в порядке индекса: по расстоянию до точки, без позиции - в конце"""
+    def key(driver):
+        if driver.current_lat is None or driver.current_lon is None:
+            return (1, 0.0, driver.id)
+        return (0, Geo.calculate_fast_distance(lat, lon, driver.current_lat, driver.current_lon), driver.id)
+
+    return sorted(drivers, key=key)
+
+
+def invalidate_driver_index():
+    """Сбрасывает индекс водителей"""
+    global _driver_index
+    with _driver_index_lock:
+        _driver_index = None
+
+
+def index_driver(driver, update_fields: Optional[Iterable[str]] = None):
+    """Обновляет водителя после сохранения (если индекс уже построен)"""
+    if update_fields is None or AVAILABILITY_FIELDS.intersection(update_fields):
+        driver_availability_changed()
+    index = _driver_index
+    if index is None:
+        return
+    deferred = driver.get_deferred_fields()
+    fields = {name: getattr(driver, name) for name in INDEX_FIELDS if name not in deferred}
+    if len(fields) == len(INDEX_FIELDS):
+        index.upsert(IndexedDriver(id=driver.id, **fields))
+    else:
+        index.update(driver.id, **fields)
+
+
+def update_driver_index(changes: Dict[int, Dict]):
+    """Меняет поля водителей {driver_id: {поле: значение}} (если индекс уже построен)"""
+    if any(AVAILABILITY_FIELDS.intersection(fields) for fields in changes.values()):
+        driver_availability_changed()
+    index = _driver_index
+    if index is not None and changes:
+        index.update_many(changes)
+
+
+def remove_from_driver_index(driver_id: int):
+    driver_availability_changed()
+    index = _driver_index
+    if index is not None:
+        index.remove(driver_id)
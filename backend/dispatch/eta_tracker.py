@@ -0,0 +1,271 @@
+"""
+ETA водителя по ходу движения по уже построенному маршруту
+
+Вместо запроса маршрута от текущей позиции на каждую точку GPS трекер хранит
+маршрут (полилинию) для каждого активного заказа и проецирует на него новую
+позицию: оставшиеся расстояние и время считаются по накопленным длинам и
+длительностям отрезков. Длительности отрезков берутся из ответа бэкенда
+маршрутизации ('segment_durations', OSRM annotations), без них время
+распределяется пропорционально длине.
+
+Маршрут запрашивается заново (DispatchEngine.calculate_route), только если
+водитель отклонился от него дальше DEVIATION_METERS, прошло
+REROUTE_INTERVAL_SECONDS или сменилась точка назначения. Маршруты хранятся
+в памяти процесса (LRU на MAX_ENTRIES, TTL_SECONDS) и освобождаются, когда
+заказ уходит из активных статусов (orders.signals).
+"""
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Dict, Optional, Tuple
+import logging
+import math
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+from geo.services import Geo
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ETA_TRACKER_SETTINGS = {
+    'ENABLED': True,
+    'DEVIATION_METERS': 150,
+    'REROUTE_INTERVAL_SECONDS': 300,
+    'MAX_ENTRIES': 10000,
+    'TTL_SECONDS': 3 * 3600,
+}
+
+TARGET_PICKUP = 'pickup'
+TARGET_DROPOFF = 'dropoff'
+
+
+def _tracker_settings() -> Dict:
+    options = dict(DEFAULT_ETA_TRACKER_SETTINGS)
+    options.update(getattr(settings, 'ETA_TRACKER', {}) or {})
+    return options
+
+
+@dataclass(slots=True)
+class TrackedRoute:
+    """Маршрут до точки назначения с накопленными длинами и длительностями"""
+    target: Tuple[float, float]
+    lats: np.ndarray
+    lons: np.ndarray
+    cum_distance: np.ndarray  # метры от начала маршрута до каждой точки
+    cum_duration: np.ndarray  # секунды от начала маршрута до каждой точки
+    routed_at: float
+    progress: int = 0  # Отрезок последней проекции (движение только вперед)
+
+    @classmethod
+    def from_route(cls, route: Dict, target: Tuple[float, float]) -> Optional['TrackedRoute']:
+        points = route.get('route') or []
+        if len(points) < 2:
+            return None
+        coords = np.asarray(points, dtype=float)
+        lats, lons = coords[:, 0], coords[:, 1]
+        lengths = Geo.calculate_path_distances(lats, lons)
+        total_distance = float(lengths.sum())
+        reported = float(route.get('distance_m') or 0)
+        if reported > 0 and total_distance > 0:
+            # Остаток согласован с расстоянием, которое вернул бэкенд
+            lengths = lengths * (reported / total_distance)
+
+        durations = route.get('segment_durations')
+        if durations is not None and len(durations) == len(lengths):
+            durations = np.asarray(durations, dtype=float)
+        elif total_distance > 0:
+            durations = lengths / float(lengths.sum()) * float(route.get('duration_seconds') or 0)
+        else:
+            durations = np.zeros(len(lengths))
+
+        return cls(
+            target=target,
+            lats=lats,
+            lons=lons,
+            cum_distance=np.concatenate(([0.0], np.cumsum(lengths))),
+            cum_duration=np.concatenate(([0.0], np.cumsum(durations))),
+            routed_at=time.monotonic(),
+        )
+
+    def project(self, lat: float, lon: float) -> Tuple[float, float, float]:
+        """
+        Проекция точки на маршрут (с отрезка progress и дальше).
+
+        Returns:
+            (расстояние от точки до маршрута в метрах, пройдено метров, пройдено секунд)
+        """
+        start = self.progress
+        # Локальная равнопромежуточная проекция в метрах относительно точки
+        scale = math.radians(1) * Geo.EARTH_RADIUS_M
+        cos_lat = math.cos(math.radians(lat))
+        xs = (self.lons[start:] - lon) * scale * cos_lat
+        ys = (self.lats[start:] - lat) * scale
+        ax, ay, bx, by = xs[:-1], ys[:-1], xs[1:], ys[1:]
+        dx, dy = bx - ax, by - ay
+        length_sq = dx * dx + dy * dy
+        with np.errstate(invalid='ignore', divide='ignore'):
+            t = np.where(length_sq > 0, -(ax * dx + ay * dy) / length_sq, 0.0)
+        t = np.clip(t, 0.0, 1.0)
+        px, py = ax + t * dx, ay + t * dy
+        offsets = np.hypot(px, py)
+
+        best = int(np.argmin(offsets))
+        segment = start + best
+        fraction = float(t[best])
+        travelled = self.cum_distance[segment] + fraction * (self.cum_distance[segment + 1] - self.cum_distance[segment])
+        elapsed = self.cum_duration[segment] + fraction * (self.cum_duration[segment + 1] - self.cum_duration[segment])
+        self.progress = segment
+        return float(offsets[best]), float(travelled), float(elapsed)
+
+    def remaining(self, lat: float, lon: float) -> Tuple[float, float, float]:
+        """(отклонение от маршрута, оставшиеся метры, оставшиеся секунды)"""
+        offset, travelled, elapsed = self.project(lat, lon)
+        return (
+            offset,
+            max(float(self.cum_distance[-1]) - travelled, 0.0),
+            max(float(self.cum_duration[-1]) - elapsed, 0.0),
+        )
+
+
+class EtaTracker:
+    """Маршруты активных заказов в памяти процесса"""
+
+    def __init__(self, options: Optional[Dict] = None):
+        self.options = options or _tracker_settings()
+        self._routes: OrderedDict = OrderedDict()  # (order_id, driver_id, target) -> TrackedRoute
+        self._lock = threading.Lock()
+        self.stats = {'tracked': 0, 'routed': 0, 'deviations': 0, 'expired': 0}
+
+    def eta(self, driver, order, target: str = TARGET_PICKUP, engine=None) -> Optional[Dict]:
+        """
+        ETA водителя до точки подачи (или высадки) заказа в формате
+        DispatchEngine.calculate_eta; None - нет координат водителя или точки
+        """
+        if not driver.current_lat or not driver.current_lon:
+            return None
+        if target == TARGET_DROPOFF:
+            destination = (order.dropoff_lat, order.dropoff_lon)
+        else:
+            destination = (order.pickup_lat, order.pickup_lon)
+        if not destination[0] or not destination[1]:
+            return None
+        return self.eta_at(order.id, driver.id, driver.current_lat, driver.current_lon, destination, target, engine)
+
+    def eta_at(
+        self,
+        order_id,
+        driver_id,
+        lat: float,
+        lon: float,
+        destination: Tuple[float, float],
+        target: str = TARGET_PICKUP,
+        engine=None
+    ) -> Optional[Dict]:
+        """ETA из точки (lat, lon) до destination по маршруту заказа"""
+        if not self.options['ENABLED']:
+            return self._route_eta(lat, lon, destination, engine)
+
+        key = (str(order_id), driver_id, target)
+        now = time.monotonic()
+        with self._lock:
+            tracked = self._routes.get(key)
+            if tracked is not None:
+                self._routes.move_to_end(key)
+                if tracked.target != destination or now - tracked.routed_at >= self.options['REROUTE_INTERVAL_SECONDS']:
+                    self.stats['expired'] += 1
+                    tracked = None
+                else:
+                    offset, distance_m, duration_s = tracked.remaining(lat, lon)
+                    if offset <= self.options['DEVIATION_METERS']:
+                        self.stats['tracked'] += 1
+                        return self._format(distance_m, duration_s)
+                    self.stats['deviations'] += 1
+                    tracked = None
+
+        route = self._route(lat, lon, destination, engine)
+        if route is None:
+            return None
+        tracked = TrackedRoute.from_route(route, destination)
+        if tracked is not None:
+            with self._lock:
+                self.stats['routed'] += 1
+                self._routes[key] = tracked
+                self._routes.move_to_end(key)
+                self._evict(now)
+        return self._format(route['distance_m'], route['duration_seconds'])
+
+    def _evict(self, now: float):
+        ttl = self.options['TTL_SECONDS']
+        while self._routes:
+            key, tracked = next(iter(self._routes.items()))
+            if len(self._routes) <= self.options['MAX_ENTRIES'] and now - tracked.routed_at < ttl:
+                break
+            del self._routes[key]
+
+    def forget(self, order_id):
+        """Освобождает маршруты заказа (заказ завершен или отменен)"""
+        order_id = str(order_id)
+        with self._lock:
+            for key in [key for key in self._routes if key[0] == order_id]:
+                del self._routes[key]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._routes)
+
+    @staticmethod
+    def _route(lat: float, lon: float, destination: Tuple[float, float], engine=None) -> Optional[Dict]:
+        if engine is None:
+            from .services import DispatchEngine
+            engine = DispatchEngine()
+        return engine.calculate_route(lat, lon, destination[0], destination[1])
+
+    def _route_eta(self, lat, lon, destination, engine=None) -> Optional[Dict]:
+        route = self._route(lat, lon, destination, engine)
+        if route is None:
+            return None
+        return self._format(route['distance_m'], route['duration_seconds'])
+
+    @staticmethod
+    def _format(distance_m: float, duration_seconds: float) -> Dict:
+        eta = timezone.now() + timedelta(seconds=int(duration_seconds))
+        return {
+            'eta': eta.isoformat(),
+            'eta_timestamp': eta.timestamp(),
+            'distance_m': int(distance_m),
+            'distance_km': round(distance_m / 1000.0, 2),
+            'duration_minutes': int(duration_seconds / 60),
+            'duration_seconds': int(duration_seconds),
+        }
+
+
+_eta_tracker: Optional[EtaTracker] = None
+_eta_tracker_lock = threading.Lock()
+
+
+def get_eta_tracker() -> EtaTracker:
+    """Трекер ETA процесса"""
+    global _eta_tracker
+    if _eta_tracker is None:
+        with _eta_tracker_lock:
+            if _eta_tracker is None:
+                _eta_tracker = EtaTracker()
+    return _eta_tracker
+
+
+def reset_eta_tracker():
+    """Сбрасывает трекер (тесты, смена настроек)"""
+    global _eta_tracker
+    with _eta_tracker_lock:
+        _eta_tracker = None
+
+
+def release_order(order_id):
+    """Освобождает маршруты заказа, если трекер создан"""
+    tracker = _eta_tracker
+    if tracker is not None:
+        tracker.forget(order_id)
@@ -0,0 +1,154 @@
+"""
+Экспорт маршрутов дня (маршрутные листы водителей)
+
+ZIP-архивы собираются потоково (stream_zip): CSV пишется построчно прямо
+в запись архива, готовые сжатые куски отдаются StreamingHttpResponse.
+Память не зависит от числа водителей и строк.
+"""
+from datetime import date
+from typing import Dict, Iterable, Iterator, List, Tuple
+import csv
+import io
+import zipfile
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+class _Echo:
+    """Псевдо-файл для csv.writer: writerow возвращает готовую строку"""
+
+    def write(self, value):
+        return value
+
+
+class _ChunkBuffer(io.RawIOBase):
+    """Несжимаемый выходной поток для ZipFile: копит байты до drain()"""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self.size = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        self.size = 0
+        return data
+
+
+def csv_lines(rows: Iterable[Iterable], bom: bool = False, **fmtparams) -> Iterator[str]:
+    """Строки CSV по одной (BOM в начале - для Excel)"""
+    writer = csv.writer(_Echo(), **fmtparams)
+    if bom:
+        yield '\ufeff'
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def stream_zip(
+    entries: Iterable[Tuple[str, Iterable[str]]],
+    encoding: str = 'utf-8',
+    chunk_size: int = STREAM_CHUNK_SIZE
+) -> Iterator[bytes]:
+    """
+    Потоковый ZIP: entries - пары (имя файла, итератор строк).
+    Отдает сжатые куски по мере заполнения буфера.
+    """
+    buffer = _ChunkBuffer()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        for filename, lines in entries:
+            with zip_file.open(filename, 'w') as dest:
+                for line in lines:
+                    dest.write(line.encode(encoding))
+                    if buffer.size >= chunk_size:
+                        yield buffer.drain()
+            if buffer.size >= chunk_size:
+                yield buffer.drain()
+    tail = buffer.drain()
+    if tail:
+        yield tail
+
+
+def _format_time(iso_str):
+    """ЧЧ:ММ из ISO-строки времени"""
+    if not iso_str:
+        return ''
+    s = str(iso_str)
+    if 'T' in s:
+        part = s.split('T')[1][:5]
+        return part if len(part) == 5 else s
+    if len(s) >= 5 and ':' in s:
+        return s[:5]
+    return s
+
+
+def _route_rows(route: Dict, target_date: date) -> Iterator[List]:
+    """Строки маршрутного листа одного водителя"""
+    driver_info = route.get('driver', {})
+    orders = route.get('orders', [])
+
+    yield [f'Маршрутный лист на {target_date.strftime("%d.%m.%Y")}']
+    yield []
+    yield ['Водитель:', driver_info.get('name', '')]
+    yield ['Телефон:', driver_info.get('phone', '')]
+    yield ['Авто:', driver_info.get('car_model', '') or '', 'Гос. номер:', driver_info.get('plate_number', '') or '']
+    yield ['Регион:', driver_info.get('region', '')]
+    yield []
+    yield [
+        '№', 'ID', 'Пассажир', 'Откуда', 'Куда', 'Время',
+        'Сопр.', 'Мест', 'Км', 'Цена', 'Примечание'
+    ]
+
+    for idx, o in enumerate(orders, 1):
+        price = o.get('estimated_price', '')
+        if price:
+            try:
+                price = f'{float(price):.0f}'
+            except (ValueError, TypeError):
+                pass
+        yield [
+            idx,
+            o.get('id', ''),
+            o.get('passenger_name', ''),
+            (o.get('pickup_title', '') or '')[:80],
+            (o.get('dropoff_title', '') or '')[:80],
+            _format_time(o.get('desired_pickup_time')),
+            'Да' if o.get('has_companion') else 'Нет',
+            o.get('seats_needed', ''),
+            o.get('distance_km', '') if o.get('distance_km') is not None else '',
+            price,
+            (o.get('note') or '').replace('\n', ' ').strip()[:200],
+        ]
+
+    yield []
+    yield ['Итого заказов:', route.get('total_orders', 0)]
+    yield ['Общее расстояние, км:', route.get('total_distance_km', 0)]
+
+
+def iter_daily_routes_zip(routes: List[Dict], target_date: date) -> Iterator[bytes]:
+    """
+    Потоковый ZIP с отдельным CSV файлом для каждого водителя
+    (routes - маршруты из distribute_orders_for_day)
+    """
+    def entries():
+        for route in routes:
+            driver_info = route.get('driver', {})
+            driver_id = driver_info.get('id', 0)
+            driver_name = (driver_info.get('name', 'driver') or 'driver').replace(' ', '_').replace('/', '_')
+            filename = f'marshrut_{target_date}_{driver_id}_{driver_name}.csv'
+            lines = csv_lines(_route_rows(route, target_date), bom=True, delimiter=';', lineterminator='\r\n')
+            yield filename, lines
+
+    return stream_zip(entries())
+
+
+def build_daily_routes_zip(routes: List[Dict], target_date: date) -> bytes:
+    """ZIP маршрутных листов целиком (для сохранения результата фоновой задачи)"""
+    return b''.join(iter_daily_routes_zip(routes, target_date))
@@ -1,14 +1,21 @@
 """
 Модуль Best Insertion - поиск оптимальной позиции вставки заказа в маршрут
+
+Позиции оцениваются инкрементально по временной шкале текущего маршрута
+(RouteTimeline): прямые массивы прибытия/окончания и обратный массив
+"самого позднего допустимого прибытия". Для каждой позиции нужно три
+запроса времени в пути; полная симуляция выполняется только для выбранной.
 """
-from typing import List, Optional, Dict, Tuple
-from datetime import datetime
+from typing import Callable, List, Optional, Dict, Tuple
+from collections import OrderedDict
+from datetime import datetime, timedelta
 import pandas as pd
 import logging
+import threading
 
 from accounts.models import Driver
 from orders.models import Order
-from dispatch.simulator import simulate_route, create_travel_minutes_function
+from dispatch.simulator import RouteSchedule, simulate_schedule, create_travel_minutes_function
 from dispatch.utils import (
     is_city_driver,
     is_remote_driver,
@@ -19,6 +26,204 @@ from dispatch.config import DispatchParams
 
 logger = logging.getLogger(__name__)
 
+# Допуск сравнения времени (минуты) при проверке дедлайнов
+TIME_EPS_MIN = 1e-6
+
+
+class RouteTimeline:
+    """
+    Временная шкала маршрута водителя для инкрементальной оценки вставки.
+
+    Время хранится в минутах от start_time. Для заказа i:
+    arrive/start/end - прибытие к pickup, начало поездки, завершение;
+    latest[i] - самое позднее прибытие к pickup i, при котором заказ i
+    и все следующие укладываются в дедлайны (при неизменных временах в пути);
+    wait_suffix[i] - суммарное ожидание заказов i..n-1, которое поглощает
+    задержку при вставке перед i.
+    """
+    __slots__ = (
+        'orders', 'start_time', 'start_lat', 'start_lon', 'buffer_min',
+        'arrive', 'start', 'end', 'latest', 'wait_suffix',
+        'first_violation', 'total_time_min',
+    )
+
+    def __init__(
+        self,
+        orders: List[Order],
+        start_time: datetime,
+        start_lat: float,
+        start_lon: float,
+        travel_minutes_fn,
+        params: DispatchParams
+    ):
+        self.orders = list(orders)
+        self.start_time = start_time
+        self.start_lat = start_lat
+        self.start_lon = start_lon
+        self.buffer_min = params.dropoff_buffer_min
+        n = len(self.orders)
+
+        # Прямой проход - обычная симуляция текущего маршрута
+        schedule, _, _, _ = simulate_schedule(
+            start_lat, start_lon, start_time, self.orders,
+            travel_minutes_fn=travel_minutes_fn,
+            wait_limit_min=params.wait_limit_min,
+            wait_period_min=params.wait_period_min,
+            params=params
+        )
+        self.arrive = schedule.arrive_min
+        self.start = schedule.start_min
+        self.end = schedule.end_min
+        drive = schedule.t_drive_to_pickup_min
+        trip = schedule.t_trip_min
+        deadline = schedule.deadline_min
+        scheduled = [d - params.wait_limit_min for d in deadline]
+        self.first_violation = schedule.is_late.index(True) if any(schedule.is_late) else None
+
+        # Обратный проход: самое позднее допустимое прибытие и суммы ожиданий
+        self.latest = [0.0] * n
+        self.wait_suffix = [0.0] * (n + 1)
+        for i in range(n - 1, -1, -1):
+            # Самое позднее начало заказа i, при котором успеваем к следующему
+            if i == n - 1:
+                bound = float('inf')
+            else:
+                bound = self.latest[i + 1] - drive[i + 1] - trip[i] - self.buffer_min
+            self.latest[i] = min(deadline[i], bound) if scheduled[i] <= bound else float('-inf')
+            self.wait_suffix[i] = self.wait_suffix[i + 1] + (self.start[i] - self.arrive[i])
+
+        self.total_time_min = schedule.total_time_min
+
+    def _minutes(self, moment: datetime) -> float:
+        return (moment - self.start_time).total_seconds() / 60.0
+
+    def _at(self, minutes: float) -> datetime:
+        return self.start_time + timedelta(minutes=minutes)
+
+    def evaluate(self, position: int, new_order: Order, travel_minutes_fn, params: DispatchParams) -> Dict:
+        """
+        Оценивает вставку new_order на позицию position за O(1)
+        (три запроса времени в пути: подъезд, поездка, переезд к следующему заказу)
+
+        Returns:
+            Словарь: valid, reason, delta_total_time_min, slack_min, exact
+            (exact=False - оценка неточна, нужна полная симуляция)
+        """
+        n = len(self.orders)
+        if self.first_violation is not None and position > self.first_violation:
+            return {'valid': False, 'reason': 'existing_route_violation'}
+
+        if position == 0:
+            lat, lon, t = self.start_lat, self.start_lon, 0.0
+        else:
+            prev = self.orders[position - 1]
+            lat, lon, t = prev.dropoff_lat, prev.dropoff_lon, self.end[position - 1]
+
+        scheduled = self._minutes(new_order.desired_pickup_time)
+        deadline = scheduled + params.wait_limit_min
+
+        arrive = t + travel_minutes_fn(
+            lat, lon, new_order.pickup_lat, new_order.pickup_lon,
+            order_for_ml=new_order, current_time=self._at(t)
+        )
+        start = max(arrive, scheduled)
+        if start > deadline + TIME_EPS_MIN:
+            return {'valid': False, 'reason': 'new_order_late'}
+
+        end = start + travel_minutes_fn(
+            new_order.pickup_lat, new_order.pickup_lon, new_order.dropoff_lat, new_order.dropoff_lon,
+            order_for_ml=new_order, current_time=self._at(start)
+        ) + self.buffer_min
+
+        exact = True
+        if position < n:
+            following = self.orders[position]
+            arrive_next = end + travel_minutes_fn(
+                new_order.dropoff_lat, new_order.dropoff_lon, following.pickup_lat, following.pickup_lon,
+                order_for_ml=following, current_time=self._at(end)
+            )
+            if arrive_next > self.latest[position] + TIME_EPS_MIN:
+                return {'valid': False, 'reason': 'downstream_deadline'}
+            delay = arrive_next - self.arrive[position]
+            if delay < 0:
+                # Прибытие раньше прежнего (неметрические времена в пути):
+                # сдвиг ожиданий не линеен, оценка только приблизительная
+                exact = False
+            last_end = self.end[-1] + max(0.0, delay - self.wait_suffix[position])
+        else:
+            last_end = end
+
+        first_arrive = arrive if position == 0 else self.arrive[0]
+        return {
+            'valid': True,
+            'reason': 'ok',
+            'delta_total_time_min': (last_end - first_arrive) - self.total_time_min,
+            'slack_min': deadline - start,
+            'exact': exact,
+        }
+
+
+# LRU-кэш временных шкал: маршрут водителя меняется только при вставке,
+# поэтому при переборе заказов шкала переиспользуется
+TIMELINE_CACHE_MAX_ENTRIES = 2048
+_timeline_cache: OrderedDict = OrderedDict()
+_timeline_cache_lock = threading.Lock()
+
+
+def _travel_identity(travel_minutes_fn):
+    """
+    Идентичность функции времени в пути для ключа кэша: timeline_identity
+    (create_travel_minutes_function) или сама функция. Ссылка на функцию
+    в ключе не дает повторно использовать id() после сборки мусора.
+    """
+    return getattr(travel_minutes_fn, 'timeline_identity', travel_minutes_fn)
+
+
+def _timeline_key(
+    driver: Driver,
+    current_route: List[Order],
+    start_time: datetime,
+    travel_minutes_fn,
+    params: DispatchParams
+):
+    return (
+        driver.id, driver.current_lat, driver.current_lon, start_time,
+        tuple((o.id, o.desired_pickup_time, o.pickup_lat, o.pickup_lon, o.dropoff_lat, o.dropoff_lon)
+              for o in current_route),
+        _travel_identity(travel_minutes_fn),
+        tuple(sorted(params.to_dict().items())),
+    )
+
+
+def get_route_timeline(
+    driver: Driver,
+    current_route: List[Order],
+    start_time: datetime,
+    travel_minutes_fn,
+    params: DispatchParams
+) -> RouteTimeline:
+    """Временная шкала маршрута водителя (из кэша или построенная заново)"""
+    key = _timeline_key(driver, current_route, start_time, travel_minutes_fn, params)
+    with _timeline_cache_lock:
+        timeline = _timeline_cache.get(key)
+        if timeline is not None:
+            _timeline_cache.move_to_end(key)
+            return timeline
+
+    timeline = RouteTimeline(
+        current_route, start_time, driver.current_lat, driver.current_lon, travel_minutes_fn, params
+    )
+    with _timeline_cache_lock:
+        _timeline_cache[key] = timeline
+        while len(_timeline_cache) > TIMELINE_CACHE_MAX_ENTRIES:
+            _timeline_cache.popitem(last=False)
+    return timeline
+
+
+def clear_timeline_cache():
+    with _timeline_cache_lock:
+        _timeline_cache.clear()
+
 
 def best_insertion(
     driver: Driver,
@@ -26,11 +231,16 @@ def best_insertion(
     new_order: Order,
     start_time: datetime,
     params: Optional[DispatchParams] = None,
-    regions_df: Optional[pd.DataFrame] = None
-) -> Tuple[Optional[int], Optional[pd.DataFrame], float, Dict]:
+    regions_df: Optional[pd.DataFrame] = None,
+    travel_minutes_fn: Optional[Callable] = None
+) -> Tuple[Optional[int], Optional[RouteSchedule], float, Dict]:
     """
     Находит лучшую позицию для вставки нового заказа в существующий маршрут водителя.
     
+    Позиции оцениваются инкрементально (RouteTimeline), затем кандидаты
+    проверяются полной симуляцией в порядке возрастания оценки стоимости,
+    пока не найдется валидный. Стоимость возвращается по полной симуляции.
+    
     Args:
         driver: Объект Driver
         current_route: Текущий маршрут водителя (список Order объектов)
@@ -38,10 +248,12 @@ def best_insertion(
         start_time: Время начала работы водителя
         params: Параметры алгоритма
         regions_df: DataFrame с регионами (опционально)
+        travel_minutes_fn: Функция времени переезда (по умолчанию - через DispatchEngine)
     
     Returns:
         best_position: Лучшая позиция вставки (int или None)
-        best_schedule_df: Расписание для лучшей вставки (DataFrame или None)
+        best_schedule: Расписание для лучшей вставки (RouteSchedule или None,
+            DataFrame - через best_schedule.to_dataframe())
         best_cost: Стоимость лучшей вставки (float или float('inf'))
         debug_info: Информация для отладки (словарь)
     """
@@ -58,37 +270,49 @@ def best_insertion(
         logger.debug(f'Водитель {driver.id} не подходит: достигнут лимит заказов')
         return None, None, float('inf'), {'reason': 'max_orders_reached'}
     
-    if driver.current_lat is None or driver.current_lng is None:
+    if driver.current_lat is None or driver.current_lon is None:
         logger.debug(f'Водитель {driver.id} не подходит: нет координат')
         return None, None, float('inf'), {'reason': 'no_coordinates'}
     
     # Создаем функцию расчета времени переезда
-    travel_minutes_fn = create_travel_minutes_function(params=params)
-    
-    # Определяем начальные координаты водителя
-    driver_start_lat = driver.current_lat
-    driver_start_lng = driver.current_lng
+    if travel_minutes_fn is None:
+        travel_minutes_fn = create_travel_minutes_function(params=params)
     
     # Инициализация
-    best_position = None
-    best_schedule_df = None
-    best_cost = float('inf')
     debug_info = {
         'positions_tried': 0,
         'valid_positions': 0,
         'invalid_positions': 0,
+        'full_simulations': 0,
         'reasons': []
     }
     
-    # Перебор позиций вставки
-    num_positions = len(current_route) + 1
+    timeline = get_route_timeline(driver, current_route, start_time, travel_minutes_fn, params)
+    imbalance_penalty = params.imbalance_weight * len(current_route)
+    simulations = {}  # позиция -> результат simulate_schedule
+    
+    def simulate(pos: int):
+        if pos not in simulations:
+            debug_info['full_simulations'] += 1
+            simulations[pos] = simulate_schedule(
+                driver_start_lat=driver.current_lat,
+                driver_start_lng=driver.current_lon,
+                driver_start_time=start_time,
+                orders_sequence=current_route[:pos] + [new_order] + current_route[pos:],
+                travel_minutes_fn=travel_minutes_fn,
+                wait_limit_min=params.wait_limit_min,
+                wait_period_min=params.wait_period_min,
+                use_ml=params.use_ml_eta,
+                ml_predictor=None,  # TODO: добавить ML предсказатель
+                params=params
+            )
+        return simulations[pos]
     
-    for pos in range(num_positions):
+    # 1. Инкрементальная оценка всех позиций
+    estimates = []  # (оценка стоимости, позиция, штрафы без учета времени)
+    for pos in range(len(current_route) + 1):
         debug_info['positions_tried'] += 1
         
-        # Создание новой последовательности
-        new_sequence = current_route[:pos] + [new_order] + current_route[pos:]
-        
         # Проверка региональных ограничений
         regional_check_result = _check_regional_constraints(
             driver, new_order, current_route, pos, params
@@ -103,26 +327,52 @@ def best_insertion(
             logger.debug(f'Позиция {pos} не подходит: {regional_check_result["reason"]}')
             continue
         
-        # Симуляция маршрута
+        estimate = timeline.evaluate(pos, new_order, travel_minutes_fn, params)
+        if not estimate['valid']:
+            debug_info['invalid_positions'] += 1
+            debug_info['reasons'].append({
+                'position': pos,
+                'reason': f'invalid_route_violations: {estimate["reason"]}'
+            })
+            logger.debug(f'Позиция {pos} не валидна: {estimate["reason"]}')
+            continue
+        
+        # Штрафы, не зависящие от расписания
+        static_penalty = (
+            _calculate_region_penalty(driver, new_order, current_route, pos, params) +
+            imbalance_penalty +
+            _calculate_first_last_penalty(driver, new_order, current_route, pos, params)
+        )
+        delta_total_time_min = estimate['delta_total_time_min']
+        if not estimate['exact']:
+            # Редкий случай: уточняем оценку полной симуляцией
+            try:
+                _, _, _, total_time_min = simulate(pos)
+                delta_total_time_min = total_time_min - timeline.total_time_min
+            except Exception as e:
+                logger.error(f'Ошибка симуляции маршрута для позиции {pos}: {e}')
+        estimated_cost = (
+            delta_total_time_min +
+            _risk_penalty_for_slack(estimate['slack_min'], params) +
+            static_penalty
+        )
+        estimates.append((estimated_cost, pos, static_penalty))
+        debug_info['valid_positions'] += 1
+    
+    # 2. Полная симуляция для лучших позиций (обычно только для одной)
+    estimates.sort(key=lambda item: (item[0], item[1]))
+    for estimated_cost, pos, static_penalty in estimates:
         try:
-            schedule_df, is_valid, violations, total_time_min = simulate_route(
-                driver_start_lat=driver_start_lat,
-                driver_start_lng=driver_start_lng,
-                driver_start_time=start_time,
-                orders_sequence=new_sequence,
-                travel_minutes_fn=travel_minutes_fn,
-                wait_limit_min=params.wait_limit_min,
-                wait_period_min=params.wait_period_min,
-                use_ml=params.use_ml_eta,
-                ml_predictor=None,  # TODO: добавить ML предсказатель
-                params=params
-            )
+            schedule, is_valid, violations, total_time_min = simulate(pos)
         except Exception as e:
             logger.error(f'Ошибка симуляции маршрута для позиции {pos}: {e}')
+            debug_info['valid_positions'] -= 1
             debug_info['invalid_positions'] += 1
             continue
         
         if not is_valid:
+            # Оценка разошлась с симуляцией (время в пути зависит от времени суток)
+            debug_info['valid_positions'] -= 1
             debug_info['invalid_positions'] += 1
             debug_info['reasons'].append({
                 'position': pos,
@@ -131,64 +381,16 @@ def best_insertion(
             logger.debug(f'Позиция {pos} не валидна: нарушения дедлайнов')
             continue
         
-        # Расчет стоимости вставки
-        # 1. Увеличение времени маршрута
-        original_total_time_min = 0.0
-        if len(current_route) > 0:
-            _, _, _, original_total_time_min = simulate_route(
-                driver_start_lat=driver_start_lat,
-                driver_start_lng=driver_start_lng,
-                driver_start_time=start_time,
-                orders_sequence=current_route,
-                travel_minutes_fn=travel_minutes_fn,
-                wait_limit_min=params.wait_limit_min,
-                wait_period_min=params.wait_period_min,
-                params=params
-            )
-        
-        delta_total_time_min = total_time_min - original_total_time_min
-        
-        # 2. Штраф за регион
-        region_penalty = _calculate_region_penalty(
-            driver, new_order, current_route, pos, params
-        )
-        
-        # 3. Штраф за риск опоздания
-        risk_penalty = _calculate_risk_penalty(
-            schedule_df, new_order, params
-        )
-        
-        # 4. Штраф за перегруз
-        imbalance_penalty = params.imbalance_weight * len(current_route)
-        
-        # 5. Штраф за первый/последний заказ вне региона
-        first_last_penalty = _calculate_first_last_penalty(
-            driver, new_order, current_route, pos, params
-        )
-        
-        # Общая стоимость
         cost = (
-            delta_total_time_min +
-            region_penalty +
-            risk_penalty +
-            imbalance_penalty +
-            first_last_penalty
+            total_time_min - timeline.total_time_min +
+            _calculate_risk_penalty(schedule, new_order, params) +
+            static_penalty
         )
-        
-        debug_info['valid_positions'] += 1
-        
-        # Обновление лучшей позиции
-        if cost < best_cost:
-            best_position = pos
-            best_schedule_df = schedule_df
-            best_cost = cost
-            logger.debug(f'Найдена лучшая позиция {pos} со стоимостью {cost:.2f}')
-    
-    if best_position is None:
-        logger.debug(f'Не найдено валидных позиций для водителя {driver.id}')
-        return None, None, float('inf'), debug_info
+        logger.debug(f'Найдена лучшая позиция {pos} со стоимостью {cost:.2f} (оценка {estimated_cost:.2f})')
+        return pos, schedule, cost, debug_info
     
-    return best_position, best_schedule_df, best_cost, debug_info
+    logger.debug(f'Не найдено валидных позиций для водителя {driver.id}')
+    return None, None, float('inf'), debug_info
 
 
 def _check_regional_constraints(
@@ -205,9 +407,9 @@ def _check_regional_constraints(
         Словарь с ключами 'allowed' (bool) и 'reason' (str)
     """
     driver_region = driver.region
-    order_region = new_order.pickup_region
+    order_region_id = new_order.pickup_region_id
     
-    if not driver_region or not order_region:
+    if not driver_region or not order_region_id:
         return {'allowed': True, 'reason': 'no_region_info'}
     
     is_city = is_city_driver(driver)
@@ -223,7 +425,7 @@ def _check_regional_constraints(
     
     # Отдаленные водители: первый заказ должен быть из их региона
     if is_remote and len(current_route) == 0 and position == 0:
-        if driver_region.id != order_region.id:
+        if driver_region.id != order_region_id:
             if not params.allow_remote_driver_first_order_outside_region:
                 return {
                     'allowed': False,
@@ -233,18 +435,9 @@ def _check_regional_constraints(
     # Отдаленные водители: последний заказ должен возвращать в регион
     if is_remote and len(current_route) > 0 and position == len(current_route):
         # Проверяем, что drop точка нового заказа в регионе водителя
-        drop_region = None
-        if hasattr(new_order, 'dropoff_region'):
-            drop_region = new_order.dropoff_region
-        else:
-            # Используем регион по координатам dropoff
-            from regions.services import get_region_by_coordinates
-            if new_order.dropoff_lat and new_order.dropoff_lon:
-                drop_region = get_region_by_coordinates(
-                    new_order.dropoff_lat, new_order.dropoff_lon
-                )
+        drop_region_id = new_order.dropoff_region_id
         
-        if drop_region and drop_region.id != driver_region.id:
+        if drop_region_id and drop_region_id != driver_region.id:
             # Проверяем, есть ли еще заказы после этого
             # Если это последний заказ, то drop должен быть в регионе водителя
             return {
@@ -264,12 +457,12 @@ def _calculate_region_penalty(
 ) -> float:
     """Рассчитывает штраф за несовпадение региона"""
     driver_region = driver.region
-    order_region = new_order.pickup_region
+    order_region_id = new_order.pickup_region_id
     
-    if not driver_region or not order_region:
+    if not driver_region or not order_region_id:
         return 0.0
     
-    if driver_region.id == order_region.id:
+    if driver_region.id == order_region_id:
         return 0.0
     
     # Базовый штраф
@@ -283,7 +476,7 @@ def _calculate_region_penalty(
         # Если водитель работает в своем регионе
         driver_orders_in_region = sum(
             1 for order in current_route
-            if order.pickup_region and order.pickup_region.id == driver_region.id
+            if order.pickup_region_id == driver_region.id
         )
         if driver_orders_in_region > 0:
             penalty += params.region_penalty * 1.5
@@ -296,26 +489,21 @@ def _calculate_region_penalty(
 
 
 def _calculate_risk_penalty(
-    schedule_df: pd.DataFrame,
+    schedule: RouteSchedule,
     new_order: Order,
     params: DispatchParams
 ) -> float:
     """Рассчитывает штраф за риск опоздания"""
-    if schedule_df.empty:
-        return 0.0
-    
     # Находим строку для нового заказа
-    order_rows = schedule_df[schedule_df['order_id'] == str(new_order.id)]
-    if order_rows.empty:
+    index = schedule.index_of(new_order.id)
+    if index is None:
         return 0.0
     
-    order_row = order_rows.iloc[0]
-    start_time = order_row['start_time']
-    deadline_time = order_row['deadline_time']
-    
-    # Расчет slack
-    slack_min = (deadline_time - start_time).total_seconds() / 60.0
-    
+    return _risk_penalty_for_slack(schedule.slack_min(index), params)
+
+
+def _risk_penalty_for_slack(slack_min: float, params: DispatchParams) -> float:
+    """Штраф за риск опоздания по запасу времени до дедлайна"""
     if slack_min < params.risk_slack_min:
         return params.risk_penalty
     
@@ -334,9 +522,9 @@ def _calculate_first_last_penalty(
     Для всех водителей: первый заказ желательно из региона, последний — возврат в регион.
     """
     driver_region = driver.region
-    order_region = new_order.pickup_region
+    order_region_id = new_order.pickup_region_id
     
-    if not driver_region or not order_region:
+    if not driver_region or not order_region_id:
         return 0.0
     
     penalty = 0.0
@@ -348,26 +536,18 @@ def _calculate_first_last_penalty(
     
     # Первый заказ: штраф вне региона, бонус в регионе
     if position == 0 and len(current_route) == 0:
-        if driver_region.id != order_region.id:
+        if driver_region.id != order_region_id:
             penalty += remote_first if is_remote else fl_penalty
         elif fl_bonus < 0:
             penalty += fl_bonus  # бонус для первого заказа в регионе
     
     # Последний заказ: штраф если drop вне региона, бонус если в регионе
     if position == len(current_route) and len(current_route) > 0:
-        drop_region = None
-        if hasattr(new_order, 'dropoff_region'):
-            drop_region = new_order.dropoff_region
-        else:
-            from regions.services import get_region_by_coordinates
-            if new_order.dropoff_lat and new_order.dropoff_lon:
-                drop_region = get_region_by_coordinates(
-                    new_order.dropoff_lat, new_order.dropoff_lon
-                )
+        drop_region_id = new_order.dropoff_region_id
         
-        if drop_region and drop_region.id != driver_region.id:
+        if drop_region_id and drop_region_id != driver_region.id:
             penalty += remote_last if is_remote else fl_penalty
-        elif drop_region and drop_region.id == driver_region.id and fl_bonus < 0:
+        elif drop_region_id and drop_region_id == driver_region.id and fl_bonus < 0:
             penalty += fl_bonus  # бонус за последний заказ с возвратом в регион
     
     return penalty
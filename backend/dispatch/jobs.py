@@ -0,0 +1,307 @@
+"""
+Фоновые задачи планирования
+
+Долгие операции (распределение на день, экспорт маршрутов, массовое
+назначение очереди) выполняются в пуле потоков внутри процесса, а не в
+HTTP-запросе. Статус, прогресс и результат хранятся в PlanningJob;
+прогресс отправляется в группу dispatch_map (DispatchMapConsumer,
+сообщение planning_job_progress).
+
+Настройки - settings.PLANNING_JOBS:
+    WORKERS - размер пула потоков,
+    EAGER - выполнять задачу сразу в вызывающем потоке (тесты, отладка),
+    PROGRESS_INTERVAL_SECONDS - минимальный интервал между обновлениями прогресса,
+    STALE_AFTER_SECONDS - через сколько секунд задача в QUEUED/RUNNING считается
+        потерянной.
+
+Задачи не переживают перезапуск процесса: очередь пула живет в памяти, и
+после деплоя или падения задача навсегда осталась бы в QUEUED/RUNNING.
+fail_stale_jobs() переводит такие задачи в FAILED; она вызывается при
+постановке новой задачи и при чтении статуса через API. Упавшую так задачу
+нужно поставить заново.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, Optional
+import atexit
+import logging
+import threading
+import time
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from dispatch.models import PlanningJob, PlanningJobKind, PlanningJobStatus
+
+logger = logging.getLogger(__name__)
+
+
+class JobError(Exception):
+    """Ожидаемая ошибка задачи (сообщение показывается пользователю)"""
+
+
+@dataclass(slots=True)
+class JobResult:
+    """Результат обработчика задачи"""
+    data: Optional[dict] = None
+    file: Optional[bytes] = None
+    filename: str = ''
+    content_type: str = ''
+
+
+def _job_settings() -> Dict:
+    config = getattr(settings, 'PLANNING_JOBS', {})
+    return {
+        'WORKERS': config.get('WORKERS', 2),
+        'EAGER': config.get('EAGER', False),
+        'PROGRESS_INTERVAL_SECONDS': config.get('PROGRESS_INTERVAL_SECONDS', 0.5),
+        'STALE_AFTER_SECONDS': config.get('STALE_AFTER_SECONDS', 3600),
+    }
+
+
+# Обработчики задач по типу: handler(params, progress_callback) -> JobResult
+HANDLERS: Dict[str, Callable] = {}
+
+
+def register(kind: str):
+    def decorator(func):
+        HANDLERS[kind] = func
+        return func
+    return decorator
+
+
+def _target_date(params: Dict) -> date:
+    value = params.get('date')
+    return datetime.strptime(value, '%Y-%m-%d').date() if value else date.today()
+
+
+@register(PlanningJobKind.DAILY_ROUTES)
+def _daily_routes(params: Dict, progress: Callable) -> JobResult:
+    from dispatch.daily_routing import distribute_orders_for_day
+
+    return JobResult(data=distribute_orders_for_day(_target_date(params), progress_callback=progress))
+
+
+@register(PlanningJobKind.DAILY_ROUTES_APPLY)
+def _daily_routes_apply(params: Dict, progress: Callable) -> JobResult:
+    from dispatch.daily_routing import distribute_orders_for_day
+
+    return JobResult(data=distribute_orders_for_day(
+        _target_date(params), auto_assign=True, progress_callback=progress
+    ))
+
+
+@register(PlanningJobKind.DAILY_ROUTES_EXPORT)
+def _daily_routes_export(params: Dict, progress: Callable) -> JobResult:
+    from dispatch.daily_routing import distribute_orders_for_day
+    from dispatch.exports import build_daily_routes_zip
+
+    target_date = _target_date(params)
+    routes = distribute_orders_for_day(target_date, progress_callback=progress).get('routes', [])
+    if not routes:
+        raise JobError('Нет маршрутов для экспорта на указанную дату')
+    return JobResult(
+        data={'date': target_date.isoformat(), 'routes_count': len(routes)},
+        file=build_daily_routes_zip(routes, target_date),
+        filename=f'daily_routes_{target_date}.zip',
+        content_type='application/zip',
+    )
+
+
+@register(PlanningJobKind.AUTO_ASSIGN_ALL)
+def _auto_assign_all(params: Dict, progress: Callable) -> JobResult:
+    from dispatch.bulk_assign import auto_assign_queue
+
+    return JobResult(data=auto_assign_queue(progress_callback=progress))
+
+
+@register(PlanningJobKind.WINDOW_ROUTES)
+def _window_routes(params: Dict, progress: Callable) -> JobResult:
+    from dispatch.planner import plan_routes_for_day
+
+    return JobResult(data=plan_routes_for_day(_target_date(params), progress_callback=progress))
+
+
+@register(PlanningJobKind.WINDOW_ROUTES_APPLY)
+def _window_routes_apply(params: Dict, progress: Callable) -> JobResult:
+    from dispatch.planner import plan_routes_for_day
+
+    return JobResult(data=plan_routes_for_day(_target_date(params), auto_assign=True, progress_callback=progress))
+
+
+def job_to_dict(job: PlanningJob, include_result: bool = False) -> Dict:
+    """Представление задачи для API и WebSocket"""
+    data = {
+        'id': str(job.id),
+        'kind': job.kind,
+        'status': job.status,
+        'progress': round(job.progress, 4),
+        'message': job.message,
+        'error': job.error,
+        'params': job.params,
+        'has_file': bool(job.result_filename),
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    }
+    if include_result:
+        data['result'] = job.result
+    return data
+
+
+def _notify(job: PlanningJob):
+    """Отправляет состояние задачи клиентам карты (dispatch_map и группа дельт)"""
+    from dispatch import map_state
+    from orders.signals import get_channel_layer_safe
+
+    channel_layer = get_channel_layer_safe()
+    if not channel_layer:
+        return
+    try:
+        message = {'type': 'planning_job_progress', 'data': job_to_dict(job)}
+        for group in (map_state.LEGACY_GROUP, map_state.DELTA_GROUP):
+            async_to_sync(channel_layer.group_send)(group, message)
+    except Exception as e:
+        logger.debug(f'Не удалось отправить прогресс задачи {job.id}: {e}')
+
+
+class ProgressReporter:
+    """
+    progress_callback для обработчиков: сохраняет прогресс задачи и
+    отправляет его в WebSocket не чаще PROGRESS_INTERVAL_SECONDS
+    """
+
+    def __init__(self, job: PlanningJob, interval: float):
+        self.job = job
+        self.interval = interval
+        self._last_sent = 0.0
+
+    def __call__(self, current: int, total: int, message: str = ''):
+        now = time.monotonic()
+        if current < total and now - self._last_sent < self.interval:
+            return
+        self._last_sent = now
+        self.job.progress = current / total if total else 1.0
+        self.job.message = message[:255]
+        PlanningJob.objects.filter(id=self.job.id).update(progress=self.job.progress, message=self.job.message)
+        _notify(self.job)
+
+
+def _save(job: PlanningJob, **fields):
+    for name, value in fields.items():
+        setattr(job, name, value)
+    job.save(update_fields=list(fields))
+    _notify(job)
+
+
+def run_job(job_id) -> Optional[PlanningJob]:
+    """Выполняет задачу (в потоке пула или сразу при EAGER)"""
+    try:
+        job = PlanningJob.objects.get(id=job_id)
+    except PlanningJob.DoesNotExist:
+        logger.error(f'Задача планирования {job_id} не найдена')
+        return None
+
+    handler = HANDLERS.get(job.kind)
+    _save(job, status=PlanningJobStatus.RUNNING, started_at=timezone.now())
+    try:
+        if handler is None:
+            raise JobError(f'Неизвестный тип задачи: {job.kind}')
+        result = handler(job.params, ProgressReporter(job, _job_settings()['PROGRESS_INTERVAL_SECONDS']))
+    except Exception as e:
+        if not isinstance(e, JobError):
+            logger.exception(f'Ошибка задачи планирования {job.id}')
+        _save(job, status=PlanningJobStatus.FAILED, error=str(e), finished_at=timezone.now())
+        return job
+
+    _save(
+        job,
+        status=PlanningJobStatus.DONE,
+        progress=1.0,
+        result=result.data,
+        result_file=result.file,
+        result_filename=result.filename,
+        result_content_type=result.content_type,
+        finished_at=timezone.now(),
+    )
+    return job
+
+
+def _run_in_worker(job_id):
+    """Обертка для потока пула: свои соединения с БД"""
+    close_old_connections()
+    try:
+        run_job(job_id)
+    finally:
+        close_old_connections()
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=_job_settings()['WORKERS'], thread_name_prefix='planning-job'
+            )
+        return _executor
+
+
+def shutdown_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+            _executor = None
+
+
+atexit.register(shutdown_executor)
+
+
+STALE_JOB_ERROR = 'Задача прервана: сервер был перезапущен или задача превысила лимит времени'
+
+
+def fail_stale_jobs() -> int:
+    """
+    Переводит в FAILED задачи, потерянные при перезапуске процесса:
+    QUEUED дольше STALE_AFTER_SECONDS с создания и RUNNING дольше
+    STALE_AFTER_SECONDS с начала. Возвращает число таких задач.
+    """
+    now = timezone.now()
+    deadline = now - timedelta(seconds=_job_settings()['STALE_AFTER_SECONDS'])
+    stale = PlanningJob.objects.filter(
+        Q(status=PlanningJobStatus.QUEUED, created_at__lt=deadline)
+        | Q(status=PlanningJobStatus.RUNNING, started_at__lt=deadline)
+        | Q(status=PlanningJobStatus.RUNNING, started_at__isnull=True, created_at__lt=deadline)
+    )
+    count = stale.update(status=PlanningJobStatus.FAILED, error=STALE_JOB_ERROR, finished_at=now)
+    if count:
+        logger.warning(f'Помечено как FAILED потерянных задач планирования: {count}')
+    return count
+
+
+def submit_job(kind: str, params: Optional[Dict] = None, user=None) -> PlanningJob:
+    """
+    Создает задачу и ставит ее в очередь
+    (после коммита транзакции, чтобы поток пула видел запись)
+    """
+    fail_stale_jobs()
+    job = PlanningJob.objects.create(
+        kind=kind,
+        params=params or {},
+        created_by=user if user is not None and user.is_authenticated else None,
+    )
+    _notify(job)
+
+    if _job_settings()['EAGER']:
+        return run_job(job.id)
+
+    transaction.on_commit(lambda: get_executor().submit(_run_in_worker, job.id))
+    return job
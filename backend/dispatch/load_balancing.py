@@ -551,7 +551,7 @@ def _find_best_driver_for_order(
         if driver.capacity < order.seats_needed:
             continue
         
-        if driver.current_lat is None or driver.current_lng is None:
+        if driver.current_lat is None or driver.current_lon is None:
             continue
         
         current_route = get_driver_current_orders(driver.id, routes_dict)
@@ -0,0 +1,778 @@
+"""
+Локальный маршрутизатор по дорожному графу (замена OSRM для офлайн-развертываний)
+
+Граф хранится в компактном CSR-виде (массивы NumPy) и загружается либо из
+OSM XML выгрузки (.osm), либо из предобработанного файла (.npz), который
+строит команда `python manage.py build_road_graph`.
+
+Поиск:
+- с иерархией сжатия (ContractionHierarchy, строится build_road_graph и
+  хранится в том же .npz): точка-точка - двунаправленный поиск вверх по
+  рангу узлов, многие-ко-многим - корзины (bucket) обратных поисков до
+  назначений и прямой поиск от каждого источника;
+- без иерархии (граф из .osm): точка-точка - A* с эвристикой
+  "расстояние / максимальная скорость графа", многие-ко-многим - Dijkstra
+  от каждого источника с остановкой, когда все назначения достигнуты.
+
+Замеры задержки обоих режимов - в ROUTING.md.
+"""
+from typing import List, Optional, Dict, Tuple, Iterable
+import heapq
+import logging
+import math
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+from geo.services import Geo
+
+logger = logging.getLogger(__name__)
+
+
+# Скорости по типу дороги OSM (км/ч), если не указан maxspeed
+ROAD_SPEEDS_KMH = {
+    'motorway': 90.0,
+    'motorway_link': 60.0,
+    'trunk': 80.0,
+    'trunk_link': 50.0,
+    'primary': 60.0,
+    'primary_link': 45.0,
+    'secondary': 50.0,
+    'secondary_link': 40.0,
+    'tertiary': 40.0,
+    'tertiary_link': 35.0,
+    'unclassified': 30.0,
+    'residential': 25.0,
+    'living_street': 10.0,
+    'service': 15.0,
+}
+
+# Скорость на участке от точки до ближайшего узла графа (км/ч)
+ACCESS_SPEED_KMH = 20.0
+
+# Размер ячейки сетки для поиска ближайшего узла (градусы, ~500 м)
+SNAP_CELL_DEG = 0.005
+# Сколько колец ячеек просматривать при поиске ближайшего узла
+SNAP_MAX_RINGS = 4
+
+# Лимит узлов поиска свидетеля при сжатии: больше - меньше шорткатов, дольше сборка
+CH_WITNESS_SETTLE_LIMIT = 100
+
+
+def _parse_maxspeed(value: Optional[str]) -> Optional[float]:
+    """Парсит тег maxspeed OSM ('60', '60 km/h', '30 mph')"""
+    if not value:
+        return None
+    try:
+        parts = value.strip().split()
+        speed = float(parts[0])
+        if len(parts) > 1 and parts[1] == 'mph':
+            speed *= 1.609
+        return speed if speed > 0 else None
+    except (ValueError, IndexError):
+        return None
+
+
+class RoadGraph:
+    """
+    Ориентированный дорожный граф в CSR-представлении.
+
+    lats, lons: координаты узлов
+    indptr, targets: рёбра узла i - targets[indptr[i]:indptr[i + 1]]
+    durations: время проезда ребра (секунды)
+    lengths: длина ребра (метры)
+    ch: иерархия сжатия для быстрого поиска (None - A*/Dijkstra)
+    """
+
+    def __init__(
+        self,
+        lats: np.ndarray,
+        lons: np.ndarray,
+        indptr: np.ndarray,
+        targets: np.ndarray,
+        durations: np.ndarray,
+        lengths: np.ndarray,
+        ch: Optional['ContractionHierarchy'] = None
+    ):
+        self.lats = np.asarray(lats, dtype=np.float64)
+        self.lons = np.asarray(lons, dtype=np.float64)
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.targets = np.asarray(targets, dtype=np.int32)
+        self.durations = np.asarray(durations, dtype=np.float64)
+        self.lengths = np.asarray(lengths, dtype=np.float64)
+        self.ch = ch
+
+        # Максимальная скорость (м/с) - допустимая эвристика для A*
+        if len(self.durations):
+            speeds = self.lengths / np.maximum(self.durations, 1e-6)
+            self.max_speed_ms = float(speeds.max()) or 1.0
+        else:
+            self.max_speed_ms = 1.0
+
+        # Списки Python для горячего цикла поиска (быстрее индексации NumPy)
+        self._indptr = self.indptr.tolist()
+        self._targets = self.targets.tolist()
+        self._durations = self.durations.tolist()
+        self._lengths = self.lengths.tolist()
+        self._lats_rad = np.radians(self.lats).tolist()
+        self._lons_rad = np.radians(self.lons).tolist()
+
+        self._build_snap_index()
+
+    @property
+    def node_count(self) -> int:
+        return len(self.lats)
+
+    @property
+    def edge_count(self) -> int:
+        return len(self.targets)
+
+    # ── Построение ───────────────────────────────────────────
+
+    @classmethod
+    def from_edges(
+        cls,
+        lats: Iterable[float],
+        lons: Iterable[float],
+        edges: Iterable[Tuple[int, int, float]]
+    ) -> 'RoadGraph':
+        """
+        Строит граф из списка рёбер (source, target, speed_kmh).
+        Длина ребра считается по Haversine.
+        """
+        lats = np.asarray(list(lats), dtype=np.float64)
+        lons = np.asarray(list(lons), dtype=np.float64)
+        edges = list(edges)
+        n = len(lats)
+
+        if edges:
+            sources = np.array([e[0] for e in edges], dtype=np.int64)
+            targets = np.array([e[1] for e in edges], dtype=np.int64)
+            speeds = np.array([e[2] for e in edges], dtype=np.float64)
+        else:
+            sources = np.zeros(0, dtype=np.int64)
+            targets = np.zeros(0, dtype=np.int64)
+            speeds = np.zeros(0, dtype=np.float64)
+
+        lat1, lon1 = np.radians(lats[sources]), np.radians(lons[sources])
+        lat2, lon2 = np.radians(lats[targets]), np.radians(lons[targets])
+        a = (np.sin((lat2 - lat1) / 2) ** 2 +
+             np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2)
+        lengths = 2 * Geo.EARTH_RADIUS_M * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+        durations = lengths / (speeds / 3.6)
+
+        order = np.argsort(sources, kind='stable')
+        counts = np.bincount(sources, minlength=n)
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(counts, out=indptr[1:])
+
+        return cls(lats, lons, indptr, targets[order], durations[order], lengths[order])
+
+    @classmethod
+    def from_osm_xml(cls, path: str) -> 'RoadGraph':
+        """
+        Загружает граф из OSM XML выгрузки (.osm).
+        Учитываются только дороги для автомобилей (ROAD_SPEEDS_KMH) и oneway.
+        """
+        node_coords: Dict[int, Tuple[float, float]] = {}
+        ways: List[Tuple[List[int], float, int]] = []  # (узлы, скорость, направление)
+
+        for _, elem in ET.iterparse(path, events=('end',)):
+            if elem.tag == 'node':
+                node_coords[int(elem.get('id'))] = (float(elem.get('lat')), float(elem.get('lon')))
+                elem.clear()
+            elif elem.tag == 'way':
+                tags = {t.get('k'): t.get('v') for t in elem.findall('tag')}
+                highway = tags.get('highway')
+                if highway in ROAD_SPEEDS_KMH:
+                    refs = [int(nd.get('ref')) for nd in elem.findall('nd')]
+                    speed = _parse_maxspeed(tags.get('maxspeed')) or ROAD_SPEEDS_KMH[highway]
+                    oneway = tags.get('oneway')
+                    if oneway in ('yes', 'true', '1') or tags.get('junction') == 'roundabout' \
+                            or highway in ('motorway', 'motorway_link'):
+                        direction = 1
+                    elif oneway == '-1':
+                        direction = -1
+                    else:
+                        direction = 0
+                    if len(refs) >= 2:
+                        ways.append((refs, speed, direction))
+                elem.clear()
+
+        # Оставляем только узлы, входящие в дороги
+        index: Dict[int, int] = {}
+        lats: List[float] = []
+        lons: List[float] = []
+        edges: List[Tuple[int, int, float]] = []
+        for refs, speed, direction in ways:
+            ids = []
+            for ref in refs:
+                if ref not in node_coords:
+                    continue
+                if ref not in index:
+                    index[ref] = len(lats)
+                    lat, lon = node_coords[ref]
+                    lats.append(lat)
+                    lons.append(lon)
+                ids.append(index[ref])
+            for u, v in zip(ids, ids[1:]):
+                if direction >= 0:
+                    edges.append((u, v, speed))
+                if direction <= 0:
+                    edges.append((v, u, speed))
+
+        graph = cls.from_edges(lats, lons, edges)
+        logger.info(f'Дорожный граф загружен из {path}: {graph.node_count} узлов, {graph.edge_count} рёбер')
+        return graph
+
+    @classmethod
+    def load(cls, path: str) -> 'RoadGraph':
+        """Загружает граф из файла: .npz (предобработанный) или .osm (XML)"""
+        if str(path).endswith('.npz'):
+            data = np.load(path)
+            ch = None
+            if 'ch_rank' in data:
+                ch = ContractionHierarchy(**{name: data[f'ch_{name}'] for name in ContractionHierarchy.ARRAYS})
+            graph = cls(
+                data['lats'], data['lons'], data['indptr'],
+                data['targets'], data['durations'], data['lengths'], ch=ch
+            )
+            logger.info(
+                f'Дорожный граф загружен из {path}: {graph.node_count} узлов, {graph.edge_count} рёбер'
+                f'{", с иерархией сжатия" if ch is not None else ""}'
+            )
+            return graph
+        return cls.from_osm_xml(path)
+
+    def save(self, path: str):
+        """Сохраняет граф (и иерархию сжатия, если построена) в компактный .npz файл"""
+        arrays = {}
+        if self.ch is not None:
+            arrays = {f'ch_{name}': getattr(self.ch, name) for name in ContractionHierarchy.ARRAYS}
+        np.savez_compressed(
+            path,
+            lats=self.lats, lons=self.lons, indptr=self.indptr,
+            targets=self.targets,
+            durations=self.durations.astype(np.float32),
+            lengths=self.lengths.astype(np.float32),
+            **arrays
+        )
+
+    def contract(self) -> 'ContractionHierarchy':
+        """Строит иерархию сжатия; дальнейшие запросы идут через нее"""
+        self.ch = ContractionHierarchy.build(self)
+        return self.ch
+
+    # ── Привязка точек к графу ──────────────────────────────
+
+    def _build_snap_index(self):
+        """Равномерная сетка узлов для поиска ближайшего узла"""
+        self._snap_cells: Dict[Tuple[int, int], List[int]] = {}
+        cell_x = np.floor(self.lats / SNAP_CELL_DEG).astype(np.int64)
+        cell_y = np.floor(self.lons / SNAP_CELL_DEG).astype(np.int64)
+        for node, key in enumerate(zip(cell_x.tolist(), cell_y.tolist())):
+            self._snap_cells.setdefault(key, []).append(node)
+
+    def _ring_nodes(self, cx: int, cy: int, ring: int) -> List[int]:
+        """Узлы в ячейках на расстоянии ring (по Чебышёву) от ячейки (cx, cy)"""
+        nodes: List[int] = []
+        for dx in range(-ring, ring + 1):
+            for dy in range(-ring, ring + 1):
+                if max(abs(dx), abs(dy)) == ring:
+                    nodes.extend(self._snap_cells.get((cx + dx, cy + dy), ()))
+        return nodes
+
+    def nearest_node(self, lat: float, lon: float) -> Optional[Tuple[int, float]]:
+        """Ближайший узел графа и расстояние до него (метры)"""
+        cx = math.floor(lat / SNAP_CELL_DEG)
+        cy = math.floor(lon / SNAP_CELL_DEG)
+        candidates: List[int] = []
+        for ring in range(SNAP_MAX_RINGS + 1):
+            candidates.extend(self._ring_nodes(cx, cy, ring))
+            if candidates:
+                # Следующее кольцо может содержать более близкий узел
+                candidates.extend(self._ring_nodes(cx, cy, ring + 1))
+                break
+        if not candidates:
+            return None
+
+        idx = np.asarray(candidates)
+        dist = Geo.calculate_distance_matrix([lat], [lon], self.lats[idx], self.lons[idx])[0]
+        best = int(np.argmin(dist))
+        return int(idx[best]), float(dist[best])
+
+    # ── Поиск ────────────────────────────────────────────────
+
+    def _heuristic(self, node: int, target_lat: float, target_lon: float, cos_lat: float) -> float:
+        """Нижняя оценка времени до цели (равнопромежуточная проекция)"""
+        dx = (self._lons_rad[node] - target_lon) * cos_lat
+        dy = self._lats_rad[node] - target_lat
+        return Geo.EARTH_RADIUS_M * math.sqrt(dx * dx + dy * dy) / self.max_speed_ms * 0.99
+
+    def shortest_path(self, source: int, target: int) -> Optional[Tuple[List[int], float, float]]:
+        """
+        Кратчайший по времени путь: через иерархию сжатия, если она есть, иначе A*.
+        Возвращает (узлы пути, длительность с, длина м) или None.
+        """
+        if self.ch is not None:
+            return self.ch.shortest_path(source, target)
+        if source == target:
+            return [source], 0.0, 0.0
+
+        indptr, targets = self._indptr, self._targets
+        durations, lengths = self._durations, self._lengths
+        target_lat = self._lats_rad[target]
+        target_lon = self._lons_rad[target]
+        cos_lat = math.cos(target_lat)
+
+        best = {source: 0.0}
+        dist = {source: 0.0}
+        parent = {source: -1}
+        closed = set()
+        heap = [(self._heuristic(source, target_lat, target_lon, cos_lat), 0.0, source)]
+
+        while heap:
+            _, g, node = heapq.heappop(heap)
+            if node in closed:
+                continue
+            if node == target:
+                path = []
+                while node != -1:
+                    path.append(node)
+                    node = parent[node]
+                path.reverse()
+                return path, g, dist[target]
+            closed.add(node)
+            for e in range(indptr[node], indptr[node + 1]):
+                nxt = targets[e]
+                ng = g + durations[e]
+                if ng < best.get(nxt, math.inf):
+                    best[nxt] = ng
+                    dist[nxt] = dist[node] + lengths[e]
+                    parent[nxt] = node
+                    heapq.heappush(heap, (ng + self._heuristic(nxt, target_lat, target_lon, cos_lat), ng, nxt))
+        return None
+
+    def one_to_many(self, source: int, targets_set: Iterable[int]) -> Dict[int, Tuple[float, float]]:
+        """
+        Dijkstra от источника до набора узлов.
+        Возвращает {узел: (длительность с, длина м)} для достижимых узлов.
+        """
+        remaining = set(targets_set)
+        result: Dict[int, Tuple[float, float]] = {}
+        indptr, targets = self._indptr, self._targets
+        durations, lengths = self._durations, self._lengths
+
+        best = {source: 0.0}
+        dist = {source: 0.0}
+        closed = set()
+        heap = [(0.0, source)]
+
+        while heap and remaining:
+            g, node = heapq.heappop(heap)
+            if node in closed:
+                continue
+            closed.add(node)
+            if node in remaining:
+                result[node] = (g, dist[node])
+                remaining.discard(node)
+            for e in range(indptr[node], indptr[node + 1]):
+                nxt = targets[e]
+                ng = g + durations[e]
+                if ng < best.get(nxt, math.inf):
+                    best[nxt] = ng
+                    dist[nxt] = dist[node] + lengths[e]
+                    heapq.heappush(heap, (ng, nxt))
+        return result
+
+    def many_to_many(self, sources: List[int], targets_set: Iterable[int]) -> List[Dict[int, Tuple[float, float]]]:
+        """Для каждого источника {узел: (длительность с, длина м)} достижимых узлов из targets_set"""
+        if self.ch is not None:
+            return self.ch.many_to_many(sources, targets_set)
+        targets_set = set(targets_set)
+        return [self.one_to_many(source, targets_set) for source in sources]
+
+
+class _UpwardSearch:
+    """
+    Пошаговый Dijkstra вверх по рангу иерархии со stall-on-demand:
+    узел не раскрывается, если до него есть более короткий путь через
+    соседа выше по рангу (ребро из stall_edges) - такой узел не лежит
+    на кратчайшем пути.
+
+    settled: окончательные времена раскрытых (не остановленных) узлов
+    best, dist, parent: время, длина и (узел, ребро) родителя для достигнутых узлов
+    """
+
+    __slots__ = ('edges', 'stall_edges', 'best', 'dist', 'parent', 'settled', 'done', 'heap')
+
+    def __init__(self, source: int, edges: Tuple[List, ...], stall_edges: Tuple[List, ...]):
+        self.edges = edges
+        self.stall_edges = stall_edges
+        self.best = {source: 0.0}
+        self.dist = {source: 0.0}
+        self.parent = {source: (-1, -1)}
+        self.settled: Dict[int, float] = {}
+        self.done = set()
+        self.heap = [(0.0, source)]
+
+    def top(self) -> float:
+        return self.heap[0][0] if self.heap else math.inf
+
+    def step(self) -> Optional[int]:
+        """Извлекает узел из кучи; возвращает его, если он раскрыт (не устаревший и не остановлен)"""
+        g, node = heapq.heappop(self.heap)
+        if node in self.done:
+            return None
+        self.done.add(node)
+
+        best = self.best
+        indptr, heads, durations, _ = self.stall_edges
+        for e in range(indptr[node], indptr[node + 1]):
+            if best.get(heads[e], math.inf) + durations[e] < g:
+                return None
+        self.settled[node] = g
+
+        dist, parent = self.dist, self.parent
+        indptr, heads, durations, lengths = self.edges
+        for e in range(indptr[node], indptr[node + 1]):
+            nxt = heads[e]
+            ng = g + durations[e]
+            if ng < best.get(nxt, math.inf):
+                best[nxt] = ng
+                dist[nxt] = dist[node] + lengths[e]
+                parent[nxt] = (node, e)
+                heapq.heappush(self.heap, (ng, nxt))
+        return node
+
+    def run(self):
+        while self.heap:
+            self.step()
+
+
+class ContractionHierarchy:
+    """
+    Иерархия сжатия (Contraction Hierarchies) поверх RoadGraph.
+
+    Узлы сжимаются по возрастанию важности (rank). При сжатии узла v путь
+    u -> v -> w заменяется шорткатом u -> w, если в оставшемся графе нет
+    пути-свидетеля не длиннее. Запросы идут только вверх по рангу, поэтому
+    просматривают сотни узлов вместо всего графа.
+
+    up_*: рёбра v -> w с rank[w] > rank[v] в CSR по v (прямой поиск)
+    down_*: рёбра u -> v с rank[u] > rank[v] в CSR по v (обратный поиск)
+    *_mids: промежуточный узел шортката (-1 - ребро исходного графа)
+    """
+
+    ARRAYS = (
+        'rank',
+        'up_indptr', 'up_targets', 'up_durations', 'up_lengths', 'up_mids',
+        'down_indptr', 'down_sources', 'down_durations', 'down_lengths', 'down_mids',
+    )
+
+    def __init__(self, **arrays: np.ndarray):
+        for name in self.ARRAYS:
+            setattr(self, name, np.asarray(arrays[name]))
+
+        # Списки Python для горячего цикла поиска
+        self._up = (
+            self.up_indptr.tolist(), self.up_targets.tolist(),
+            self.up_durations.tolist(), self.up_lengths.tolist(),
+        )
+        self._down = (
+            self.down_indptr.tolist(), self.down_sources.tolist(),
+            self.down_durations.tolist(), self.down_lengths.tolist(),
+        )
+        self._up_mids = self.up_mids.tolist()
+        self._down_mids = self.down_mids.tolist()
+
+    @property
+    def shortcut_count(self) -> int:
+        return int((self.up_mids >= 0).sum() + (self.down_mids >= 0).sum())
+
+    # ── Построение ───────────────────────────────────────────
+
+    @classmethod
+    def build(cls, graph: 'RoadGraph', witness_limit: int = CH_WITNESS_SETTLE_LIMIT) -> 'ContractionHierarchy':
+        """
+        Сжимает граф. Порядок узлов - по разности рёбер (удвоенное число
+        шорткатов минус удаляемые рёбра) плюс число уже сжатых соседей,
+        с ленивым пересчетом приоритета при извлечении из кучи.
+        """
+        n = graph.node_count
+        # Текущий (еще не сжатый) граф: узел -> {сосед: (время, длина, mid)}
+        out_edges: List[Dict[int, Tuple[float, float, int]]] = [{} for _ in range(n)]
+        in_edges: List[Dict[int, Tuple[float, float, int]]] = [{} for _ in range(n)]
+        indptr, targets = graph._indptr, graph._targets
+        durations, lengths = graph._durations, graph._lengths
+        for u in range(n):
+            for e in range(indptr[u], indptr[u + 1]):
+                v = targets[e]
+                current = out_edges[u].get(v)
+                if v != u and (current is None or durations[e] < current[0]):
+                    out_edges[u][v] = in_edges[v][u] = (durations[e], lengths[e], -1)
+
+        def witness_distances(source: int, skip: int, limit: float, wanted: Iterable[int]) -> Dict[int, float]:
+            """Ограниченный Dijkstra от source в обход skip"""
+            best = {source: 0.0}
+            remaining = set(wanted)
+            heap = [(0.0, source)]
+            settled = 0
+            while heap and remaining and settled < witness_limit:
+                d, x = heapq.heappop(heap)
+                if d > best[x]:
+                    continue
+                if d > limit:
+                    break
+                remaining.discard(x)
+                settled += 1
+                for y, edge in out_edges[x].items():
+                    nd = d + edge[0]
+                    if y != skip and nd < best.get(y, math.inf):
+                        best[y] = nd
+                        heapq.heappush(heap, (nd, y))
+            return best
+
+        def shortcuts(v: int) -> List[Tuple[int, int, float, float]]:
+            """Шорткаты (u, w, время, длина), нужные при сжатии v"""
+            outs = out_edges[v]
+            if not outs:
+                return []
+            max_out = max(edge[0] for edge in outs.values())
+            result = []
+            for u, (du, lu, _) in in_edges[v].items():
+                best = witness_distances(u, v, du + max_out, outs.keys())
+                for w, (dw, lw, _) in outs.items():
+                    if w != u and best.get(w, math.inf) > du + dw:
+                        result.append((u, w, du + dw, lu + lw))
+            return result
+
+        deleted = [0] * n
+
+        def priority(v: int, found: List) -> int:
+            return 2 * len(found) - len(in_edges[v]) - len(out_edges[v]) + deleted[v]
+
+        queue = [(priority(v, shortcuts(v)), v) for v in range(n)]
+        heapq.heapify(queue)
+
+        rank = np.zeros(n, dtype=np.int32)
+        up: List[List] = [[] for _ in range(n)]
+        down: List[List] = [[] for _ in range(n)]
+        level = 0
+        while queue:
+            _, v = heapq.heappop(queue)
+            found = shortcuts(v)
+            current = priority(v, found)
+            if queue and current > queue[0][0]:
+                heapq.heappush(queue, (current, v))
+                continue
+
+            rank[v] = level
+            level += 1
+            up[v] = list(out_edges[v].items())
+            down[v] = list(in_edges[v].items())
+            for u in in_edges[v]:
+                del out_edges[u][v]
+                deleted[u] += 1
+            for w in out_edges[v]:
+                del in_edges[w][v]
+                deleted[w] += 1
+            out_edges[v] = {}
+            in_edges[v] = {}
+            for u, w, d, length in found:
+                existing = out_edges[u].get(w)
+                if existing is None or d < existing[0]:
+                    out_edges[u][w] = in_edges[w][u] = (d, length, v)
+
+        def to_csr(adjacency: List[List]) -> Tuple[np.ndarray, ...]:
+            counts = np.array([len(items) for items in adjacency], dtype=np.int64)
+            indptr = np.zeros(n + 1, dtype=np.int64)
+            np.cumsum(counts, out=indptr[1:])
+            flat = [item for items in adjacency for item in items]
+            return (
+                indptr,
+                np.array([node for node, _ in flat], dtype=np.int32),
+                np.array([edge[0] for _, edge in flat], dtype=np.float64),
+                np.array([edge[1] for _, edge in flat], dtype=np.float64),
+                np.array([edge[2] for _, edge in flat], dtype=np.int32),
+            )
+
+        up_arrays = to_csr(up)
+        down_arrays = to_csr(down)
+        hierarchy = cls(
+            rank=rank,
+            **dict(zip(('up_indptr', 'up_targets', 'up_durations', 'up_lengths', 'up_mids'), up_arrays)),
+            **dict(zip(('down_indptr', 'down_sources', 'down_durations', 'down_lengths', 'down_mids'), down_arrays)),
+        )
+        logger.info(f'Иерархия сжатия построена: {n} узлов, {hierarchy.shortcut_count} шорткатов')
+        return hierarchy
+
+    # ── Поиск ────────────────────────────────────────────────
+
+    def _search(self, source: int, backward: bool) -> '_UpwardSearch':
+        """Поиск вверх по up-рёбрам (прямой) или по down-рёбрам в обратную сторону"""
+        if backward:
+            return _UpwardSearch(source, self._down, self._up)
+        return _UpwardSearch(source, self._up, self._down)
+
+    def _find_mid(self, node: int, other: int, backward: bool) -> int:
+        """mid ребра node -> other (up) или other -> node (down), хранящегося у node"""
+        indptr, heads, _, _ = self._down if backward else self._up
+        mids = self._down_mids if backward else self._up_mids
+        for e in range(indptr[node], indptr[node + 1]):
+            if heads[e] == other:
+                return mids[e]
+        raise KeyError(f'Ребро иерархии {node} - {other} не найдено')
+
+    def _unpack(self, edges: List[Tuple[int, int, int]], path: List[int]):
+        """Раскрывает рёбра (из, в, mid) в узлы исходного графа, дописывая их в path"""
+        stack = list(reversed(edges))
+        while stack:
+            u, w, mid = stack.pop()
+            if mid < 0:
+                path.append(w)
+                continue
+            # rank[mid] ниже обоих концов: u -> mid хранится в down[mid], mid -> w - в up[mid]
+            stack.append((mid, w, self._find_mid(mid, w, backward=False)))
+            stack.append((u, mid, self._find_mid(mid, u, backward=True)))
+
+    def shortest_path(self, source: int, target: int) -> Optional[Tuple[List[int], float, float]]:
+        """
+        Двунаправленный поиск вверх: направления чередуются по меньшему ключу
+        и останавливаются, когда ключ не меньше найденного пути.
+        Возвращает (узлы пути, длительность с, длина м) или None.
+        """
+        if source == target:
+            return [source], 0.0, 0.0
+
+        forward = self._search(source, backward=False)
+        backward = self._search(target, backward=True)
+        meet, total = -1, math.inf
+        while True:
+            forward_top, backward_top = forward.top(), backward.top()
+            if min(forward_top, backward_top) >= total:
+                break
+            search, other = (forward, backward) if forward_top <= backward_top else (backward, forward)
+            node = search.step()
+            if node is not None and node in other.best:
+                candidate = search.best[node] + other.best[node]
+                if candidate < total:
+                    meet, total = node, candidate
+        if meet < 0:
+            return None
+
+        forward_parent, backward_parent = forward.parent, backward.parent
+        edges = []
+        node = meet
+        while node != source:
+            prev, e = forward_parent[node]
+            edges.append((prev, node, self._up_mids[e]))
+            node = prev
+        edges.reverse()
+        node = meet
+        while node != target:
+            nxt, e = backward_parent[node]
+            edges.append((node, nxt, self._down_mids[e]))
+            node = nxt
+
+        path = [source]
+        self._unpack(edges, path)
+        return path, forward.best[meet] + backward.best[meet], forward.dist[meet] + backward.dist[meet]
+
+    def many_to_many(self, sources: List[int], targets_set: Iterable[int]) -> List[Dict[int, Tuple[float, float]]]:
+        """
+        Матрица корзинами: обратный поиск от каждого назначения раскладывает
+        (назначение, время, длина) по узлам, прямой поиск от источника
+        собирает их. Возвращает для каждого источника {узел: (время с, длина м)}.
+        """
+        buckets: Dict[int, List[Tuple[int, float, float]]] = {}
+        for target in set(targets_set):
+            search = self._search(target, backward=True)
+            search.run()
+            for node, g in search.settled.items():
+                buckets.setdefault(node, []).append((target, g, search.dist[node]))
+
+        results = []
+        for source in sources:
+            search = self._search(source, backward=False)
+            search.run()
+            reached: Dict[int, Tuple[float, float]] = {}
+            for node, g in search.settled.items():
+                for target, tail, tail_length in buckets.get(node, ()):
+                    current = reached.get(target)
+                    if current is None or g + tail < current[0]:
+                        reached[target] = (g + tail, search.dist[node] + tail_length)
+            results.append(reached)
+        return results
+
+
+class LocalRouter:
+    """
+    Маршрутизатор по локальному графу с ответами в формате OSRM-бэкенда:
+    route() -> {'route', 'distance_m', 'distance_km', 'duration_seconds', 'duration_minutes'}
+    table() -> (durations, distances)
+    """
+
+    def __init__(self, graph: RoadGraph):
+        self.graph = graph
+        self.access_speed_ms = ACCESS_SPEED_KMH / 3.6
+
+    def route(self, lat1: float, lon1: float, lat2: float, lon2: float, geometry: bool = True) -> Optional[Dict]:
+        start = self.graph.nearest_node(lat1, lon1)
+        end = self.graph.nearest_node(lat2, lon2)
+        if start is None or end is None:
+            return None
+
+        found = self.graph.shortest_path(start[0], end[0])
+        if found is None:
+            logger.warning(f'Локальный граф не нашел маршрут между точками {lat1},{lon1} -> {lat2},{lon2}')
+            return None
+        path, duration, distance = found
+
+        access_m = start[1] + end[1]
+        distance_m = int(distance + access_m)
+        duration_seconds = int(duration + access_m / self.access_speed_ms)
+
+        route_points = []
+        if geometry:
+            route_points = [[lat1, lon1]]
+            route_points.extend([float(self.graph.lats[n]), float(self.graph.lons[n])] for n in path)
+            route_points.append([lat2, lon2])
+
+        return {
+            'route': route_points,
+            'distance_m': distance_m,
+            'distance_km': round(distance_m / 1000.0, 2),
+            'duration_seconds': duration_seconds,
+            'duration_minutes': int(duration_seconds / 60),
+        }
+
+    def table(
+        self,
+        sources: List[Tuple[float, float]],
+        destinations: List[Tuple[float, float]]
+    ) -> Optional[Tuple[List, List]]:
+        dest_nodes = [self.graph.nearest_node(lat, lon) for lat, lon in destinations]
+        target_set = {d[0] for d in dest_nodes if d is not None}
+
+        source_nodes = [self.graph.nearest_node(lat, lon) for lat, lon in sources]
+        reached_rows = iter(self.graph.many_to_many([s[0] for s in source_nodes if s is not None], target_set))
+
+        durations = []
+        distances = []
+        for src in source_nodes:
+            reached = next(reached_rows) if src is not None else {}
+            row_durations = []
+            row_distances = []
+            for dest in dest_nodes:
+                if src is None or dest is None or dest[0] not in reached:
+                    row_durations.append(None)
+                    row_distances.append(None)
+                    continue
+                duration, distance = reached[dest[0]]
+                access_m = src[1] + dest[1]
+                row_durations.append(duration + access_m / self.access_speed_ms)
+                row_distances.append(distance + access_m)
+            durations.append(row_durations)
+            distances.append(row_distances)
+        return durations, distances
@@ -0,0 +1,47 @@
+"""
+Команда для подготовки локального дорожного графа из OSM выгрузки
+"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from dispatch.local_router import RoadGraph
+
+
+class Command(BaseCommand):
+    help = 'Преобразует OSM XML выгрузку (.osm) в компактный граф (.npz) для локальной маршрутизации'
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', type=str, help='Путь к OSM XML файлу (.osm)')
+        parser.add_argument('output', type=str, help='Путь к выходному файлу (.npz)')
+        parser.add_argument(
+            '--no-ch', action='store_true',
+            help='Не строить иерархию сжатия (быстрая сборка, медленные запросы A*/Dijkstra)'
+        )
+
+    def handle(self, *args, **options):
+        source = options['source']
+        output = options['output']
+
+        if not output.endswith('.npz'):
+            raise CommandError('Выходной файл должен иметь расширение .npz')
+
+        self.stdout.write(f'Загрузка дорожного графа из {source}...')
+        try:
+            graph = RoadGraph.from_osm_xml(source)
+        except (OSError, SyntaxError) as e:
+            raise CommandError(f'Не удалось прочитать {source}: {e}')
+
+        if graph.edge_count == 0:
+            raise CommandError('В выгрузке не найдено автомобильных дорог')
+
+        if not options['no_ch']:
+            self.stdout.write(f'Построение иерархии сжатия ({graph.node_count} узлов)...')
+            started = time.monotonic()
+            ch = graph.contract()
+            self.stdout.write(f'Иерархия построена за {time.monotonic() - started:.0f} с: {ch.shortcut_count} шорткатов')
+
+        graph.save(output)
+        self.stdout.write(self.style.SUCCESS(
+            f'Граф сохранен в {output}: {graph.node_count} узлов, {graph.edge_count} рёбер. '
+            f'Укажите ROUTING_BACKEND=local и ROUTING_GRAPH_PATH={output}'
+        ))
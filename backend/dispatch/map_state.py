@@ -0,0 +1,398 @@
+"""
+Состояние карты диспетчеризации: снимок + дельты с номерами последовательности
+
+Снимок (build_snapshot, DispatchViewSet.map_data) содержит только поля карты
+и читается через values() без сериализаторов. Каждое изменение водителя или
+заказа публикуется дельтой (publish) в группу dispatch_map_delta после
+фиксации транзакции (publish_on_commit): только
+измененные поля и номер seq из общего счетчика (Django cache). Дельты хранятся
+в журнале LOG_TTL_SECONDS, поэтому клиент после переподключения дочитывает
+пропущенное (deltas_since) и берет новый снимок только при разрыве журнала.
+
+Счетчик и журнал общие для процессов только при общем кэше (Redis и т.п.).
+В том же кэше DispatchMapConsumer считает клиентов карты по протоколам
+(subscriber_joined/left). Клиенты в режиме дельт не входят в группу
+dispatch_map (LEGACY_GROUP), и без ее подписчиков полные сообщения прежнего
+протокола не собираются (has_legacy_subscribers); общее число клиентов
+(map_subscribers) читает дебаунсинг позиций (accounts.location_debounce).
+Счетчики живут SUBSCRIBERS_TTL_SECONDS и продлеваются ping клиентов
+(subscriber_alive), поэтому клиенты процесса, упавшего без disconnect,
+учитываются не дольше, чем остаются подключенными остальные клиенты.
+
+Клиент применяет дельты с seq больше уже примененного; upsert объекта,
+которого нет на карте, может содержать не все поля - недостающие берутся
+из следующего снимка.
+
+Формат дельты:
+    {'seq': 42, 'kind': 'driver' | 'order', 'id': '17', 'op': 'upsert' | 'remove',
+     'fields': {'lat': 51.1, 'lon': 71.4}}
+"""
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+import logging
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAP_STATE_SETTINGS = {
+    'CACHE_ALIAS': 'default',
+    'LOG_TTL_SECONDS': 600,
+    'MAX_RESYNC_DELTAS': 2000,
+    # Счетчики клиентов карты продлеваются их ping (раз в 30 с)
+    'SUBSCRIBERS_TTL_SECONDS': 90,
+}
+
+DELTA_GROUP = 'dispatch_map_delta'
+# Группа клиентов прежнего протокола (полные сериализованные объекты)
+LEGACY_GROUP = 'dispatch_map'
+KEY_PREFIX = 'dispatch_map:v1'
+SEQ_KEY = f'{KEY_PREFIX}:seq'
+# Счетчики клиентов карты (DispatchMapConsumer) по протоколам
+LEGACY_SUBSCRIBERS_KEY = f'{KEY_PREFIX}:legacy_subscribers'
+DELTA_SUBSCRIBERS_KEY = f'{KEY_PREFIX}:delta_subscribers'
+
+KIND_DRIVER = 'driver'
+KIND_ORDER = 'order'
+OP_UPSERT = 'upsert'
+OP_REMOVE = 'remove'
+
+# Заказы на карте (не завершенные и не отмененные)
+MAP_ORDER_STATUSES = (
+    'submitted', 'awaiting_dispatcher_decision', 'active_queue',
+    'assigned', 'driver_en_route', 'arrived_waiting', 'ride_ongoing',
+)
+
+# Поле на карте -> (колонка values() или {вложенный ключ: колонка}, поле модели в update_fields)
+DRIVER_COLUMNS = {
+    'name': ('name', 'name'),
+    'lat': ('current_lat', 'current_lat'),
+    'lon': ('current_lon', 'current_lon'),
+    'is_online': ('is_online', 'is_online'),
+    'status': ('status', 'status'),
+    'car_model': ('car_model', 'car_model'),
+    'plate_number': ('plate_number', 'plate_number'),
+    'region': ('region__title', 'region'),
+    'last_location_update': ('last_location_update', 'last_location_update'),
+}
+
+ORDER_COLUMNS = {
+    'pickup_lat': ('pickup_lat', 'pickup_lat'),
+    'pickup_lon': ('pickup_lon', 'pickup_lon'),
+    'dropoff_lat': ('dropoff_lat', 'dropoff_lat'),
+    'dropoff_lon': ('dropoff_lon', 'dropoff_lon'),
+    'pickup_title': ('pickup_title', 'pickup_title'),
+    'dropoff_title': ('dropoff_title', 'dropoff_title'),
+    'status': ('status', 'status'),
+    'driver_id': ('driver_id', 'driver'),
+    'passenger': ({'id': 'passenger_id', 'full_name': 'passenger__full_name'}, 'passenger'),
+    'created_at': ('created_at', 'created_at'),
+}
+
+# Идентификаторы отдаются строками (как в прежнем map-data)
+STR_COLUMNS = frozenset({'driver_id', 'passenger_id'})
+
+
+def _map_settings() -> Dict:
+    options = dict(DEFAULT_MAP_STATE_SETTINGS)
+    options.update(getattr(settings, 'DISPATCH_MAP_STATE', {}) or {})
+    return options
+
+
+def _cache():
+    return caches[_map_settings()['CACHE_ALIAS']]
+
+
+def _delta_key(seq: int) -> str:
+    return f'{KEY_PREFIX}:delta:{seq}'
+
+
+def current_seq() -> int:
+    """Номер последней опубликованной дельты"""
+    return int(_cache().get(SEQ_KEY) or 0)
+
+
+def _incr(key: str, delta: int, timeout: Optional[int] = None) -> int:
+    cache = _cache()
+    cache.add(key, 0, timeout=timeout)
+    try:
+        value = cache.incr(key, delta)
+    except ValueError:
+        # Ключ вытеснен между add и incr
+        cache.add(key, 0, timeout=timeout)
+        value = cache.incr(key, delta)
+    if timeout is not None:
+        cache.touch(key, timeout=timeout)
+    return value
+
+
+def _reserve(count: int) -> int:
+    """Резервирует count номеров, возвращает последний"""
+    return _incr(SEQ_KEY, count)
+
+
+def _subscribers_key(delta_mode: bool) -> str:
+    return DELTA_SUBSCRIBERS_KEY if delta_mode else LEGACY_SUBSCRIBERS_KEY
+
+
+def subscriber_joined(delta_mode: bool = False):
+    """Клиент карты подключился (DispatchMapConsumer); delta_mode - протокол дельт, иначе LEGACY_GROUP"""
+    _incr(_subscribers_key(delta_mode), 1, _map_settings()['SUBSCRIBERS_TTL_SECONDS'])
+
+
+def subscriber_left(delta_mode: bool = False):
+    key = _subscribers_key(delta_mode)
+    timeout = _map_settings()['SUBSCRIBERS_TTL_SECONDS']
+    if _incr(key, -1, timeout) < 0:
+        _cache().set(key, 0, timeout=timeout)
+
+
+def subscriber_alive(delta_mode: bool = False):
+    """
+    Клиент карты на связи (ping): продлевает счетчик, чтобы клиенты процесса,
+    упавшего без disconnect, не учитывались вечно.
+    Истекший счетчик живые клиенты восстанавливают заново
+    """
+    if not _cache().touch(_subscribers_key(delta_mode), timeout=_map_settings()['SUBSCRIBERS_TTL_SECONDS']):
+        subscriber_joined(delta_mode)
+
+
+def map_subscribers() -> Optional[int]:
+    """
+    Число клиентов карты обоих протоколов (accounts.location_debounce).
+    None - счетчиков нет (кэш процесса, consumer в другом процессе)
+    """
+    values = _cache().get_many([LEGACY_SUBSCRIBERS_KEY, DELTA_SUBSCRIBERS_KEY])
+    if not values:
+        return None
+    return sum(max(int(value), 0) for value in values.values())
+
+
+def has_legacy_subscribers() -> bool:
+    """
+    Есть ли клиенты прежнего протокола (полные driver_/order_ сообщения в LEGACY_GROUP).
+    Без счетчика (кэш процесса, consumer в другом процессе) - считаем, что есть.
+    """
+    try:
+        value = _cache().get(LEGACY_SUBSCRIBERS_KEY)
+    except Exception as e:
+        logger.debug(f'Не удалось прочитать число подписчиков dispatch_map: {e}')
+        return True
+    return value is None or int(value) > 0
+
+
+def _column_names(spec) -> List[str]:
+    return list(spec.values()) if isinstance(spec, dict) else [spec]
+
+
+def _all_columns(columns: Dict) -> List[str]:
+    return [name for spec, _ in columns.values() for name in _column_names(spec)]
+
+
+def _format(column: str, value):
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if column in STR_COLUMNS:
+        return str(value)
+    return value
+
+
+def _row(columns: Dict, values: Dict, keys: Optional[Iterable[str]] = None) -> Dict:
+    keys = columns.keys() if keys is None else keys
+    row = {}
+    for key in keys:
+        spec = columns[key][0]
+        if isinstance(spec, dict):
+            nested = {sub: _format(column, values.get(column)) for sub, column in spec.items()}
+            row[key] = nested if any(value is not None for value in nested.values()) else None
+        else:
+            row[key] = _format(spec, values.get(spec))
+    return row
+
+
+def _instance_values(instance, columns: Dict, keys: Iterable[str]) -> Dict:
+    """Значения колонок values() из экземпляра модели (region__title -> instance.region.title)"""
+    values = {}
+    for key in keys:
+        for column in _column_names(columns[key][0]):
+            value = instance
+            for part in column.split('__'):
+                value = getattr(value, part, None)
+                if value is None:
+                    break
+            values[column] = value
+    return values
+
+
+def _changed_keys(columns: Dict, update_fields: Optional[Iterable[str]]) -> List[str]:
+    if not update_fields:
+        return list(columns)
+    update_fields = {field[:-3] if field.endswith('_id') else field for field in update_fields}
+    return [key for key, (_, field) in columns.items() if field in update_fields]
+
+
+def driver_fields(driver, update_fields: Optional[Iterable[str]] = None) -> Dict:
+    """Поля карты водителя; при update_fields - только затронутые"""
+    keys = _changed_keys(DRIVER_COLUMNS, update_fields)
+    return _row(DRIVER_COLUMNS, _instance_values(driver, DRIVER_COLUMNS, keys), keys)
+
+
+def order_fields(order, update_fields: Optional[Iterable[str]] = None) -> Dict:
+    """Поля карты заказа; при update_fields - только затронутые"""
+    keys = _changed_keys(ORDER_COLUMNS, update_fields)
+    return _row(ORDER_COLUMNS, _instance_values(order, ORDER_COLUMNS, keys), keys)
+
+
+def _send(message: Dict):
+    from orders.signals import get_channel_layer_safe
+
+    channel_layer = get_channel_layer_safe()
+    if not channel_layer:
+        return
+    try:
+        async_to_sync(channel_layer.group_send)(DELTA_GROUP, {'type': 'map_delta', 'data': message})
+    except Exception as e:
+        logger.debug(f'Не удалось отправить дельты карты: {e}')
+
+
+def publish_many(changes: List[Dict]) -> List[Dict]:
+    """
+    Публикует пачку изменений одним сообщением.
+
+    Args:
+        changes: [{'kind', 'id', 'op', 'fields'}]
+
+    Returns:
+        Дельты с присвоенными seq
+    """
+    changes = [change for change in changes if change.get('op') == OP_REMOVE or change.get('fields')]
+    if not changes:
+        return []
+
+    last = _reserve(len(changes))
+    first = last - len(changes) + 1
+    deltas = [
+        {
+            'seq': first + i,
+            'kind': change['kind'],
+            'id': str(change['id']),
+            'op': change.get('op', OP_UPSERT),
+            'fields': change.get('fields') or {},
+        }
+        for i, change in enumerate(changes)
+    ]
+    _cache().set_many(
+        {_delta_key(delta['seq']): delta for delta in deltas},
+        timeout=_map_settings()['LOG_TTL_SECONDS']
+    )
+    _send({'seq': last, 'deltas': deltas})
+    return deltas
+
+
+def publish(kind: str, obj_id, fields: Optional[Dict] = None, op: str = OP_UPSERT) -> Optional[Dict]:
+    """Публикует одно изменение"""
+    deltas = publish_many([{'kind': kind, 'id': obj_id, 'op': op, 'fields': fields}])
+    return deltas[0] if deltas else None
+
+
+def driver_change(driver, update_fields: Optional[Iterable[str]] = None) -> Optional[Dict]:
+    """
+    Изменение водителя для publish_many (без позиции водитель убирается с карты);
+    None - публиковать нечего
+    """
+    if driver.current_lat is None or driver.current_lon is None:
+        if update_fields and not {'current_lat', 'current_lon'} & set(update_fields):
+            return None
+        return {'kind': KIND_DRIVER, 'id': driver.id, 'op': OP_REMOVE}
+    fields = driver_fields(driver, update_fields)
+    if update_fields and {'current_lat', 'current_lon'} & set(update_fields):
+        # Водитель мог только что появиться на карте - нужны обе координаты
+        fields.update(lat=driver.current_lat, lon=driver.current_lon)
+    return {'kind': KIND_DRIVER, 'id': driver.id, 'op': OP_UPSERT, 'fields': fields}
+
+
+def order_change(order, update_fields: Optional[Iterable[str]] = None) -> Dict:
+    """Изменение заказа для publish_many (неактивный заказ убирается с карты)"""
+    if order.status not in MAP_ORDER_STATUSES:
+        return {'kind': KIND_ORDER, 'id': order.id, 'op': OP_REMOVE}
+    return {'kind': KIND_ORDER, 'id': order.id, 'op': OP_UPSERT, 'fields': order_fields(order, update_fields)}
+
+
+def publish_on_commit(changes: List[Optional[Dict]]):
+    """
+    Публикует изменения после фиксации текущей транзакции (вне транзакции - сразу).
+
+    Поля берутся в момент вызова, поэтому последующие изменения экземпляра
+    в дельту не попадут; при откате транзакции дельта не публикуется.
+    """
+    changes = [change for change in changes if change]
+    if not changes:
+        return
+
+    def _publish():
+        try:
+            publish_many(changes)
+        except Exception as e:
+            logger.error(f'Не удалось опубликовать дельты карты: {e}')
+
+    transaction.on_commit(_publish)
+
+
+def deltas_since(seq: int) -> Optional[List[Dict]]:
+    """
+    Дельты после seq по журналу.
+
+    Returns:
+        Список дельт или None, если журнал неполон (нужен снимок)
+    """
+    last = current_seq()
+    if seq == last:
+        return []
+    # seq больше текущего - счетчик сброшен (перезапуск кэша)
+    if seq < 0 or seq > last or last - seq > _map_settings()['MAX_RESYNC_DELTAS']:
+        return None
+    keys = [_delta_key(n) for n in range(seq + 1, last + 1)]
+    found = _cache().get_many(keys)
+    if len(found) != len(keys):
+        return None
+    return [found[key] for key in keys]
+
+
+def build_snapshot() -> Dict:
+    """
+    Снимок карты: водители с позицией и активные заказы.
+
+    seq читается до запросов: дельты с большим seq применяются поверх снимка
+    (повторное применение безопасно - дельта содержит значения, а не приращения)
+    """
+    from accounts.models import Driver
+    from orders.models import Order
+
+    seq = current_seq()
+
+    drivers = []
+    for values in Driver.objects.filter(
+        current_lat__isnull=False, current_lon__isnull=False
+    ).values('id', *_all_columns(DRIVER_COLUMNS)):
+        row = _row(DRIVER_COLUMNS, values)
+        row['id'] = str(values['id'])
+        drivers.append(row)
+
+    orders = []
+    for values in Order.objects.filter(status__in=MAP_ORDER_STATUSES).values('id', *_all_columns(ORDER_COLUMNS)):
+        row = _row(ORDER_COLUMNS, values)
+        row['id'] = values['id']
+        orders.append(row)
+
+    return {
+        'seq': seq,
+        'drivers': drivers,
+        'orders': orders,
+        'drivers_count': len(drivers),
+        'orders_count': len(orders),
+    }
@@ -12,6 +12,7 @@ import math
 
 from orders.models import Order, OrderStatus, OrderOffer, DispatchConfig
 from accounts.models import Driver, DriverStatus, DriverStatistics
+from dispatch.driver_index import driver_index_settings, get_driver_index, sort_by_distance
 from dispatch.services import DispatchEngine
 from geo.services import Geo
 
@@ -69,8 +70,8 @@ class MatchingService:
         
         # Шаг D: Скоринг
         scored_candidates = []
-        for driver in top_candidates:
-            score = self._score_candidate(order, driver)
+        for driver, eta_data in top_candidates:
+            score = self._score_candidate(order, driver, eta_data)
             if score:
                 scored_candidates.append(score)
         
@@ -109,26 +110,50 @@ class MatchingService:
         
         logger.debug(f'Фильтрация кандидатов для заказа {order.id}, район: {pickup_region.title}')
         
+        # Первый этап: ближайшие свободные водители района из индекса в памяти
+        # (без запросов к БД), затем проверка найденных запросом
+        statuses = [DriverStatus.ONLINE_IDLE, DriverStatus.PAUSED]  # PAUSED можно включить опционально
+        max_deadhead_km = getattr(self.config, 'max_deadhead_km', None)
+        k = max(self.config.k_candidates, driver_index_settings()['MATCHING_CANDIDATES'])
+        nearest = get_driver_index().nearest(
+            order.pickup_lat, order.pickup_lon,
+            region_id=pickup_region.id,
+            statuses=statuses,
+            min_capacity=seats_needed,
+            k=k,
+            radius_m=max_deadhead_km * 1000 if max_deadhead_km and max_deadhead_km > 0 else None,
+            max_location_age=timedelta(minutes=5),
+        )
+        nearest_ids = [driver_id for driver_id, _ in nearest]
+
         # Базовый фильтр: онлайн и свободен
         query = Q(
             is_online=True,
-            status__in=[DriverStatus.ONLINE_IDLE, DriverStatus.PAUSED],  # PAUSED можно включить опционально
+            status__in=statuses,
             capacity__gte=seats_needed
         )
         
         # ЖЕСТКИЙ ФИЛЬТР: район должен совпадать
         query &= Q(region=pickup_region)
         
-        candidates_before_region = Driver.objects.filter(
-            is_online=True,
-            status__in=[DriverStatus.ONLINE_IDLE, DriverStatus.PAUSED],
-            capacity__gte=seats_needed
-        ).count()
-        
-        candidates = Driver.objects.filter(query).select_related('statistics', 'region')
+        by_id = {
+            driver.id: driver
+            for driver in Driver.objects.filter(query, id__in=nearest_ids).select_related('statistics', 'region')
+        }
+        # Порядок индекса - по расстоянию до подачи
+        candidates = [by_id[driver_id] for driver_id in nearest_ids if driver_id in by_id]
+        logger.debug(f'Кандидаты из индекса: {len(nearest_ids)}, после проверки в БД: {len(candidates)}')
+
+        if len(nearest_ids) == k and len(candidates) < self.config.k_candidates:
+            # Индекс уперся в k, а проверка в БД отсеяла часть водителей (позиция или
+            # статус изменились в обход индекса): за пределами k могут быть еще подходящие
+            candidates = sort_by_distance(
+                Driver.objects.filter(query).select_related('statistics', 'region'),
+                order.pickup_lat, order.pickup_lon,
+            )
+            logger.debug(f'Кандидатов после проверки меньше {self.config.k_candidates}, отбор запросом к БД: {len(candidates)}')
         
-        candidates_after_region = candidates.count()
-        logger.debug(f'Кандидаты до фильтрации по району: {candidates_before_region}, после: {candidates_after_region}')
+        candidates_after_region = len(candidates)
         
         # Дополнительные проверки
         filtered = []
@@ -163,15 +188,18 @@ class MatchingService:
         
         return filtered
     
-    def _get_top_k_by_eta(self, candidates: List[Driver], order: Order, k: int) -> List[Driver]:
+    def _get_top_k_by_eta(self, candidates: List[Driver], order: Order, k: int) -> List[Tuple[Driver, Dict]]:
         """
         Шаг C: Выбор Top-K кандидатов по ETA до подачи
+        ETA всех кандидатов считается одним пакетным запросом (OSRM /table).
+        Возвращает список (driver, eta_data) для повторного использования в скоринге
         """
         candidates_with_eta = []
+        eta_matrix = self.dispatch_engine.calculate_eta_matrix(candidates, [order])
         
         for driver in candidates:
             try:
-                eta_data = self.dispatch_engine.calculate_eta(driver, order)
+                eta_data = eta_matrix.get((driver.id, order.id))
                 if not eta_data:
                     continue
                 
@@ -187,28 +215,29 @@ class MatchingService:
                 if max_dh and max_dh > 0 and distance_km > max_dh:
                     continue
                 
-                candidates_with_eta.append((driver, eta_seconds))
+                candidates_with_eta.append((driver, eta_data))
             except Exception as e:
                 logger.warning(f"Ошибка расчета ETA для водителя {driver.id}: {e}")
                 continue
         
         # Сортируем по ETA и берем Top-K
-        candidates_with_eta.sort(key=lambda x: x[1])
-        top_k = [driver for driver, _ in candidates_with_eta[:k]]
+        candidates_with_eta.sort(key=lambda x: x[1]['duration_seconds'])
         
-        return top_k
+        return candidates_with_eta[:k]
     
-    def _score_candidate(self, order: Order, driver: Driver) -> Optional[CandidateScore]:
+    def _score_candidate(self, order: Order, driver: Driver, eta_data: Optional[Dict] = None) -> Optional[CandidateScore]:
         """
         Шаг D: Скоринг кандидата
+        eta_data: ETA, уже рассчитанный на шаге Top-K (иначе считается заново)
         Возвращает cost (меньше = лучше)
         """
         try:
             # Получаем статистику водителя
             stats, _ = DriverStatistics.objects.get_or_create(driver=driver)
             
-            # Рассчитываем ETA
-            eta_data = self.dispatch_engine.calculate_eta(driver, order)
+            # Рассчитываем ETA, если он не был передан
+            if eta_data is None:
+                eta_data = self.dispatch_engine.calculate_eta(driver, order)
             if not eta_data:
                 return None
             
@@ -429,8 +458,8 @@ class MatchingService:
             }
         
         scored_candidates = []
-        for driver in top_candidates:
-            score = self._score_candidate(order, driver)
+        for driver, eta_data in top_candidates:
+            score = self._score_candidate(order, driver, eta_data)
             if score:
                 scored_candidates.append(score)
         
@@ -621,8 +650,8 @@ class MatchingService:
         top_candidates = self._get_top_k_by_eta(candidates, order, self.config.k_candidates)
         
         scored = []
-        for driver in top_candidates:
-            score = self._score_candidate(order, driver)
+        for driver, eta_data in top_candidates:
+            score = self._score_candidate(order, driver, eta_data)
             if score:
                 scored.append({
                     'driver_id': driver.id,
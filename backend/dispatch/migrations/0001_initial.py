@@ -0,0 +1,44 @@
+# Generated by Django 4.2.27 on 2026-10-17 04:15
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlanningJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('kind', models.CharField(choices=[('daily_routes', 'Распределение на день (просмотр)'), ('daily_routes_apply', 'Распределение на день (назначение)'), ('daily_routes_export', 'Экспорт маршрутов дня'), ('auto_assign_all', 'Массовое назначение очереди')], max_length=30, verbose_name='Тип')),
+                ('status', models.CharField(choices=[('queued', 'В очереди'), ('running', 'Выполняется'), ('done', 'Завершена'), ('failed', 'Ошибка')], default='queued', max_length=20, verbose_name='Статус')),
+                ('params', models.JSONField(blank=True, default=dict, verbose_name='Параметры')),
+                ('progress', models.FloatField(default=0.0, verbose_name='Прогресс (0-1)')),
+                ('message', models.CharField(blank=True, default='', max_length=255, verbose_name='Сообщение')),
+                ('result', models.JSONField(blank=True, null=True, verbose_name='Результат')),
+                ('result_file', models.BinaryField(blank=True, null=True, verbose_name='Файл результата')),
+                ('result_filename', models.CharField(blank=True, default='', max_length=255, verbose_name='Имя файла')),
+                ('result_content_type', models.CharField(blank=True, default='', max_length=100, verbose_name='Тип файла')),
+                ('error', models.TextField(blank=True, default='', verbose_name='Ошибка')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Создана')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='Начата')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Завершена')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='planning_jobs', to=settings.AUTH_USER_MODEL, verbose_name='Создал')),
+            ],
+            options={
+                'verbose_name': 'Задача планирования',
+                'verbose_name_plural': 'Задачи планирования',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['status', 'created_at'], name='dispatch_pl_status_2409d0_idx')],
+            },
+        ),
+    ]
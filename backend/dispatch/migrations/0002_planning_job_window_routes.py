@@ -0,0 +1,18 @@
+# Generated by Django 4.2.27 on 2026-10-17 05:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dispatch', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='planningjob',
+            name='kind',
+            field=models.CharField(choices=[('daily_routes', 'Распределение на день (просмотр)'), ('daily_routes_apply', 'Распределение на день (назначение)'), ('daily_routes_export', 'Экспорт маршрутов дня'), ('auto_assign_all', 'Массовое назначение очереди'), ('window_routes', 'Планирование дня best insertion (просмотр)'), ('window_routes_apply', 'Планирование дня best insertion (назначение)')], max_length=30, verbose_name='Тип'),
+        ),
+    ]
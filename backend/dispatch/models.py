@@ -0,0 +1,68 @@
+import uuid
+
+from django.db import models
+from accounts.models import User
+
+
+class PlanningJobKind(models.TextChoices):
+    """Типы фоновых задач планирования"""
+    DAILY_ROUTES = 'daily_routes', 'Распределение на день (просмотр)'
+    DAILY_ROUTES_APPLY = 'daily_routes_apply', 'Распределение на день (назначение)'
+    DAILY_ROUTES_EXPORT = 'daily_routes_export', 'Экспорт маршрутов дня'
+    AUTO_ASSIGN_ALL = 'auto_assign_all', 'Массовое назначение очереди'
+    WINDOW_ROUTES = 'window_routes', 'Планирование дня best insertion (просмотр)'
+    WINDOW_ROUTES_APPLY = 'window_routes_apply', 'Планирование дня best insertion (назначение)'
+
+
+class PlanningJobStatus(models.TextChoices):
+    """Статусы фоновой задачи"""
+    QUEUED = 'queued', 'В очереди'
+    RUNNING = 'running', 'Выполняется'
+    DONE = 'done', 'Завершена'
+    FAILED = 'failed', 'Ошибка'
+
+
+class PlanningJob(models.Model):
+    """Фоновая задача планирования (dispatch.jobs)"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    kind = models.CharField(max_length=30, choices=PlanningJobKind.choices, verbose_name='Тип')
+    status = models.CharField(
+        max_length=20,
+        choices=PlanningJobStatus.choices,
+        default=PlanningJobStatus.QUEUED,
+        verbose_name='Статус'
+    )
+    params = models.JSONField(default=dict, blank=True, verbose_name='Параметры')
+    progress = models.FloatField(default=0.0, verbose_name='Прогресс (0-1)')
+    message = models.CharField(max_length=255, blank=True, default='', verbose_name='Сообщение')
+    result = models.JSONField(null=True, blank=True, verbose_name='Результат')
+    result_file = models.BinaryField(null=True, blank=True, verbose_name='Файл результата')
+    result_filename = models.CharField(max_length=255, blank=True, default='', verbose_name='Имя файла')
+    result_content_type = models.CharField(max_length=100, blank=True, default='', verbose_name='Тип файла')
+    error = models.TextField(blank=True, default='', verbose_name='Ошибка')
+    created_by = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='planning_jobs',
+        verbose_name='Создал'
+    )
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Создана')
+    started_at = models.DateTimeField(null=True, blank=True, verbose_name='Начата')
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name='Завершена')
+
+    class Meta:
+        verbose_name = 'Задача планирования'
+        verbose_name_plural = 'Задачи планирования'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+        ]
+
+    def __str__(self):
+        return f'{self.get_kind_display()} ({self.get_status_display()})'
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in (PlanningJobStatus.DONE, PlanningJobStatus.FAILED)
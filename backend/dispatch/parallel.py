@@ -0,0 +1,208 @@
+"""
+Параллельная оценка кандидатов для dispatcher.assign_order
+
+Оценки best_insertion для разных водителей независимы, поэтому их можно
+выполнять в пуле процессов. В процессы передаются только простые данные:
+снимки водителей/заказов (dispatch.snapshot) и матрица времени в пути,
+заранее рассчитанная в основном процессе (маршрутизатор и кэш маршрутов
+в воркерах не используются). Результаты возвращаются в порядке кандидатов,
+поэтому выбор лучшего водителя совпадает с последовательным режимом.
+
+Матрицы строятся из кэша маршрутов: недостающие пары всех кандидатов
+рассчитываются заранее пакетными table-запросами (DispatchEngine.prefetch_routes),
+а не route на каждую пару в основном процессе - иначе именно этот
+последовательный этап занимает почти все время (см. BEST_INSERTION.md).
+
+Включается параметром DispatchParams.parallel_workers.
+"""
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from concurrent.futures import Future, ProcessPoolExecutor
+from datetime import datetime
+import atexit
+import logging
+import threading
+
+from dispatch.config import DispatchParams
+from dispatch.insertion import best_insertion
+from dispatch.simulator import create_travel_minutes_function, straight_line_minutes
+from dispatch.snapshot import DriverSnapshot, OrderSnapshot, RegionSnapshot
+from dispatch.utils import get_driver_current_orders
+
+logger = logging.getLogger(__name__)
+
+Pair = Tuple[float, float, float, float]
+
+
+class TravelTimeMatrix:
+    """
+    Время в пути (минуты) для набора пар точек.
+    Вызывается так же, как функция из create_travel_minutes_function.
+    """
+    __slots__ = ('times', 'params')
+
+    def __init__(self, times: Dict[Pair, float], params: Optional[DispatchParams] = None):
+        self.times = times
+        self.params = params
+
+    def __call__(self, lat1, lon1, lat2, lon2, order_for_ml=None, current_time=None) -> float:
+        minutes = self.times.get((lat1, lon1, lat2, lon2))
+        if minutes is None:
+            # Пара не была рассчитана заранее - оценка по прямой
+            return straight_line_minutes(lat1, lon1, lat2, lon2, self.params)
+        return minutes
+
+
+def insertion_pairs(driver, route: List, new_order) -> Set[Pair]:
+    """
+    Пары точек, которые нужны best_insertion для маршрута водителя:
+    переезды текущего маршрута и переезды для каждой позиции вставки
+    """
+    pairs = set()
+    previous = (driver.current_lat, driver.current_lon)
+    new_pickup = (new_order.pickup_lat, new_order.pickup_lon)
+    new_dropoff = (new_order.dropoff_lat, new_order.dropoff_lon)
+    pairs.add(new_pickup + new_dropoff)
+
+    for order in route:
+        pickup = (order.pickup_lat, order.pickup_lon)
+        dropoff = (order.dropoff_lat, order.dropoff_lon)
+        pairs.add(previous + pickup)
+        pairs.add(pickup + dropoff)
+        pairs.add(previous + new_pickup)
+        pairs.add(new_dropoff + pickup)
+        previous = dropoff
+
+    pairs.add(previous + new_pickup)
+    return pairs
+
+
+def build_travel_matrix(pairs: Set[Pair], travel_minutes_fn: Callable, params: DispatchParams) -> TravelTimeMatrix:
+    """Рассчитывает матрицу в основном процессе (через кэш маршрутов)"""
+    times = {pair: travel_minutes_fn(*pair) for pair in pairs}
+    return TravelTimeMatrix(times, params)
+
+
+def prefetch_travel_times(pairs: Set[Pair], travel_minutes_fn: Callable):
+    """
+    Заполняет кэш маршрутов для всех пар одним пакетом (если функция времени
+    в пути это умеет - см. create_travel_minutes_function), чтобы build_travel_matrix
+    не запрашивал маршрут на каждую пару
+    """
+    prefetch = getattr(travel_minutes_fn, 'prefetch', None)
+    if prefetch is None or not pairs:
+        return
+    try:
+        prefetch(pairs)
+    except Exception as e:
+        logger.warning(f'Не удалось пакетно рассчитать время в пути, пары считаются по одной: {e}')
+
+
+def _init_worker():
+    """Инициализация процесса-воркера (Django нужен для импорта модулей dispatch)"""
+    import django
+    django.setup()
+
+
+def _evaluate_candidate(
+    driver: DriverSnapshot,
+    route: List[OrderSnapshot],
+    new_order: OrderSnapshot,
+    start_time: datetime,
+    params: DispatchParams,
+    travel_matrix: TravelTimeMatrix
+):
+    """Оценка одного кандидата в процессе-воркере"""
+    return best_insertion(
+        driver=driver,
+        current_route=route,
+        new_order=new_order,
+        start_time=start_time,
+        params=params,
+        travel_minutes_fn=travel_matrix
+    )
+
+
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_workers = 0
+_executor_lock = threading.Lock()
+
+
+def get_executor(workers: int) -> ProcessPoolExecutor:
+    """Общий пул процессов (пересоздается при изменении числа воркеров)"""
+    global _executor, _executor_workers
+    with _executor_lock:
+        if _executor is None or _executor_workers != workers:
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+            _executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker)
+            _executor_workers = workers
+        return _executor
+
+
+def shutdown_executor():
+    global _executor, _executor_workers
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True)
+            _executor = None
+            _executor_workers = 0
+
+
+atexit.register(shutdown_executor)
+
+
+def use_parallel(params: DispatchParams, candidates_count: int) -> bool:
+    """Включен ли параллельный режим для данного числа кандидатов"""
+    return params.parallel_workers > 1 and candidates_count >= params.parallel_min_candidates
+
+
+def submit_candidate_evaluations(
+    candidates: List,
+    routes_dict: Dict,
+    new_order,
+    start_time: datetime,
+    params: DispatchParams
+) -> Optional[List[Future]]:
+    """
+    Отправляет оценки best_insertion для всех кандидатов в пул процессов.
+
+    Returns:
+        Список Future в порядке кандидатов (result() - как у best_insertion)
+        или None, если пул недоступен (тогда используется последовательный режим)
+    """
+    from regions.services import get_region_index
+
+    region_snapshots: Dict[str, RegionSnapshot] = {
+        region.id: RegionSnapshot.from_model(region) for region in get_region_index().regions
+    }
+    order_snapshots: Dict[str, OrderSnapshot] = {}
+
+    def snapshot_order(order) -> OrderSnapshot:
+        snapshot = order_snapshots.get(order.id)
+        if snapshot is None:
+            snapshot = OrderSnapshot.from_model(order, region_snapshots.get(order.pickup_region_id))
+            order_snapshots[order.id] = snapshot
+        return snapshot
+
+    travel_minutes_fn = create_travel_minutes_function(params=params)
+    new_order_snapshot = snapshot_order(new_order)
+    prepared = []
+    for driver in candidates:
+        driver_snapshot = DriverSnapshot.from_model(driver, region_snapshots.get(driver.region_id))
+        route = [snapshot_order(order) for order in get_driver_current_orders(driver.id, routes_dict)]
+        prepared.append((driver_snapshot, route, insertion_pairs(driver_snapshot, route, new_order_snapshot)))
+
+    # Все пары всех кандидатов - одним пакетом, дальше матрицы собираются из кэша
+    prefetch_travel_times(set().union(*(pairs for _, _, pairs in prepared)), travel_minutes_fn)
+    tasks = [
+        (driver_snapshot, route, new_order_snapshot, start_time, params,
+         build_travel_matrix(pairs, travel_minutes_fn, params))
+        for driver_snapshot, route, pairs in prepared
+    ]
+
+    try:
+        executor = get_executor(params.parallel_workers)
+        return [executor.submit(_evaluate_candidate, *task) for task in tasks]
+    except Exception as e:
+        logger.warning(f'Пул процессов недоступен, используется последовательная оценка: {e}')
+        return None
@@ -0,0 +1,271 @@
+"""
+Кэш дневного плана (distribute_orders_for_day)
+
+Просмотр, экспорт и применение плана на день обычно идут подряд, а
+данные между ними почти не меняются. План сохраняется по дате вместе с
+отпечатком входных данных:
+- версия активной DispatchConfig (id + updated_at),
+- водители и их статистика (координаты квантуются, см. DRIVER_COORD_PRECISION),
+- уже назначенные заказы дня,
+- отпечаток каждого нераспределенного заказа.
+
+Полное совпадение - план возвращается без пересчета. Если совпадает все,
+кроме небольшой части заказов (DELTA_MAX_FRACTION), неизмененные заказы
+остаются у прежних водителей, а скоринг выполняется только для новых и
+измененных.
+"""
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import date
+from typing import Dict, Iterable, Optional
+import hashlib
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_DAILY_PLAN_CACHE_SETTINGS = {
+    'ENABLED': True,
+    'BACKEND': 'memory',  # memory | django
+    'MAX_ENTRIES': 32,  # Дат в памяти процесса
+    'TTL_SECONDS': 1800,
+    'DELTA_MAX_FRACTION': 0.25,  # Доля измененных заказов, при которой еще пересчитывается только дельта
+    'DRIVER_COORD_PRECISION': 3,  # ~110 м: дрожание GPS не сбрасывает план, смещение на квартал - сбрасывает
+    'DJANGO_CACHE_ALIAS': 'default',
+}
+
+
+def _digest(parts: Iterable) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        h.update(repr(part).encode())
+        h.update(b'\x00')
+    return h.hexdigest()
+
+
+def _ts(value) -> Optional[str]:
+    return value.isoformat() if value else None
+
+
+def order_fingerprint(order) -> str:
+    """Отпечаток заказа: поля, влияющие на скоринг и на содержимое плана"""
+    return _digest((
+        order.status, order.driver_id, _ts(order.desired_pickup_time),
+        order.pickup_lat, order.pickup_lon, order.dropoff_lat, order.dropoff_lon,
+        order.has_companion, order.distance_km, _ts(getattr(order, 'updated_at', None)),
+    ))
+
+
+@dataclass(slots=True)
+class PlanFingerprint:
+    """
+    Отпечаток входных данных плана.
+
+    base - все, кроме нераспределенных заказов (при его изменении дельта невозможна),
+    orders - отпечатки нераспределенных заказов по id.
+    """
+    base: str
+    orders: Dict[str, str] = field(default_factory=dict)
+
+    @property
+    def key(self) -> str:
+        return _digest((self.base, sorted(self.orders.items())))
+
+    @classmethod
+    def build(cls, config, orders, already_assigned, drivers, stats_map, coord_precision: int = 3):
+        p = coord_precision
+        driver_parts = []
+        for d in drivers:
+            stats = stats_map.get(d.id)
+            driver_parts.append((
+                d.id, d.capacity, d.rating, d.region_id, d.name, d.car_model, d.plate_number,
+                round(d.current_lat, p) if d.current_lat else None,
+                round(d.current_lon, p) if d.current_lon else None,
+                (stats.acceptance_rate, stats.cancel_rate) if stats else None,
+            ))
+        base = _digest((
+            config.id, _ts(config.updated_at),
+            _digest(driver_parts),
+            _digest((o.id, o.driver_id, order_fingerprint(o)) for o in already_assigned),
+        ))
+        return cls(base=base, orders={o.id: order_fingerprint(o) for o in orders})
+
+
+@dataclass(slots=True)
+class CachedPlan:
+    """Сохраненный план на дату"""
+    fingerprint_key: str
+    base: str
+    orders: Dict[str, str]
+    assignments: Dict[str, Dict]  # order_id -> assignment_info из результата
+    result: Dict
+    stored_at: float = 0.0
+
+    def reusable_assignments(self, fingerprint: PlanFingerprint, max_fraction: float) -> Optional[Dict[str, Dict]]:
+        """
+        Назначения, которые можно оставить без пересчета, или None,
+        если план устарел целиком
+        """
+        if fingerprint.base != self.base:
+            return None
+        reusable = {
+            order_id: self.assignments[order_id]
+            for order_id, fp in fingerprint.orders.items()
+            if self.orders.get(order_id) == fp and order_id in self.assignments
+        }
+        unchanged = sum(1 for order_id, fp in fingerprint.orders.items() if self.orders.get(order_id) == fp)
+        removed = sum(1 for order_id in self.orders if order_id not in fingerprint.orders)
+        changed = len(fingerprint.orders) - unchanged + removed
+        if changed > max(1, int(len(fingerprint.orders) * max_fraction)):
+            return None
+        return reusable
+
+
+class DailyPlanCache:
+    """LRU планов по датам (в памяти процесса) + опциональное общее хранилище"""
+
+    def __init__(
+        self,
+        max_entries: int = DEFAULT_DAILY_PLAN_CACHE_SETTINGS['MAX_ENTRIES'],
+        ttl_seconds: int = DEFAULT_DAILY_PLAN_CACHE_SETTINGS['TTL_SECONDS'],
+        delta_max_fraction: float = DEFAULT_DAILY_PLAN_CACHE_SETTINGS['DELTA_MAX_FRACTION'],
+        driver_coord_precision: int = DEFAULT_DAILY_PLAN_CACHE_SETTINGS['DRIVER_COORD_PRECISION'],
+        backend: Optional[object] = None,
+        enabled: bool = True
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.delta_max_fraction = delta_max_fraction
+        self.driver_coord_precision = driver_coord_precision
+        self.backend = backend
+        self.enabled = enabled
+        self._entries: OrderedDict = OrderedDict()  # date -> CachedPlan
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.hits = 0
+        self.delta_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(target_date: date) -> str:
+        return f'daily_plan:{target_date.isoformat()}'
+
+    def get(self, target_date: date) -> Optional[CachedPlan]:
+        if not self.enabled:
+            return None
+        key = self._key(target_date)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry.stored_at + self.ttl_seconds < now:
+                    del self._entries[key]
+                else:
+                    self._entries.move_to_end(key)
+                    return entry
+
+        if self.backend is not None:
+            try:
+                entry = self.backend.get(key)
+            except Exception as e:
+                logger.warning(f'Ошибка чтения общего кэша планов: {e}')
+                entry = None
+            if entry is not None:
+                self._store_local(key, entry)
+                return entry
+        return None
+
+    def set(self, target_date: date, entry: CachedPlan):
+        if not self.enabled:
+            return
+        entry.stored_at = time.time()
+        key = self._key(target_date)
+        self._store_local(key, entry)
+        if self.backend is not None:
+            try:
+                self.backend.set(key, entry, self.ttl_seconds)
+            except Exception as e:
+                logger.warning(f'Ошибка записи в общий кэш планов: {e}')
+
+    def _store_local(self, key: str, entry: CachedPlan):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, target_date: date):
+        key = self._key(target_date)
+        with self._lock:
+            self._entries.pop(key, None)
+        if self.backend is not None:
+            try:
+                self.backend.set(key, None, 1)
+            except Exception as e:
+                logger.warning(f'Ошибка сброса общего кэша планов: {e}')
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        if self.backend is not None:
+            self.backend.clear()
+
+    def record(self, status: str):
+        with self._lock:
+            if status == 'hit':
+                self.hits += 1
+            elif status == 'delta':
+                self.delta_hits += 1
+            else:
+                self.misses += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'size': len(self._entries),
+                'hits': self.hits,
+                'delta_hits': self.delta_hits,
+                'misses': self.misses,
+            }
+
+
+def _build_daily_plan_cache() -> DailyPlanCache:
+    """Создает кэш по настройке DAILY_PLAN_CACHE из settings.py"""
+    from dispatch.route_cache import DjangoCacheBackend
+
+    options = dict(DEFAULT_DAILY_PLAN_CACHE_SETTINGS)
+    options.update(getattr(settings, 'DAILY_PLAN_CACHE', {}) or {})
+
+    backend = None
+    if options['BACKEND'] == 'django':
+        try:
+            backend = DjangoCacheBackend(options['DJANGO_CACHE_ALIAS'])
+        except Exception as e:
+            logger.warning(f'Не удалось инициализировать общий кэш планов: {e}')
+
+    return DailyPlanCache(
+        max_entries=options['MAX_ENTRIES'],
+        ttl_seconds=options['TTL_SECONDS'],
+        delta_max_fraction=options['DELTA_MAX_FRACTION'],
+        driver_coord_precision=options['DRIVER_COORD_PRECISION'],
+        backend=backend,
+        enabled=options['ENABLED']
+    )
+
+
+_daily_plan_cache: Optional[DailyPlanCache] = None
+
+
+def get_daily_plan_cache() -> DailyPlanCache:
+    """Глобальный экземпляр кэша планов (ленивая инициализация)"""
+    global _daily_plan_cache
+    if _daily_plan_cache is None:
+        _daily_plan_cache = _build_daily_plan_cache()
+    return _daily_plan_cache
@@ -2,10 +2,12 @@
 Модуль планирования маршрутов на день
 """
 from typing import List, Optional, Dict, Callable
-from datetime import datetime
+from datetime import date, datetime, timedelta
 import pandas as pd
 import logging
 
+from django.utils import timezone
+
 from accounts.models import Driver
 from orders.models import Order, OrderStatus
 from dispatch.dispatcher import assign_order
@@ -51,7 +53,7 @@ def plan_routes_greedy(
     Returns:
         Словарь с ключами:
         - routes: Словарь маршрутов {driver_id: [order_series, ...]}
-        - schedules: Словарь расписаний {driver_id: schedule_df}
+        - schedules: Словарь расписаний {driver_id: RouteSchedule} (DataFrame - .to_dataframe())
         - unassigned_orders: Список неназначенных заказов
     """
     if params is None:
@@ -85,7 +87,7 @@ def plan_routes_greedy(
     
     # 5. Основной цикл назначения
     routes = {}  # {driver_id: [order, ...]}
-    schedules = {}  # {driver_id: schedule_df}
+    schedules = {}  # {driver_id: RouteSchedule}
     unassigned_orders = []
     
     total_orders = len(orders_in_window)
@@ -107,7 +109,7 @@ def plan_routes_greedy(
         if result['chosen_driver_id'] is not None:
             driver_id = result['chosen_driver_id']
             insert_pos = result['insert_position']
-            schedule_df = result['schedule_df']
+            schedule = result['schedule']
             
             # Добавляем заказ в маршрут водителя
             if driver_id not in routes:
@@ -116,8 +118,8 @@ def plan_routes_greedy(
             routes[driver_id].insert(insert_pos, order)
             
             # Сохраняем расписание
-            if schedule_df is not None:
-                schedules[driver_id] = schedule_df
+            if schedule is not None:
+                schedules[driver_id] = schedule
             
             logger.debug(f'Заказ {order.id} назначен водителю {driver_id} на позицию {insert_pos}')
         else:
@@ -192,3 +194,76 @@ def plan_routes_greedy(
             'avg_orders_per_driver': total_assigned / len(routes) if routes else 0
         }
     }
+
+
+def plan_routes_for_window(
+    day_start: Optional[datetime],
+    day_end: Optional[datetime],
+    params: Optional[DispatchParams] = None,
+    statuses: Optional[List[str]] = None,
+    auto_assign: bool = False,
+    progress_callback: Optional[Callable] = None
+) -> Dict:
+    """
+    Планирование окна на снимке данных (dispatch.snapshot.PlanningSnapshot).
+    
+    Заказы, водители и регионы загружаются фиксированным числом запросов,
+    plan_routes_greedy работает только в памяти, а при auto_assign
+    назначения записываются одним пакетом.
+    
+    Returns:
+        Результат plan_routes_greedy (заказы и водители - снимки) и
+        written - количество записанных назначений
+    """
+    from dispatch.snapshot import PlanningSnapshot
+    
+    snapshot = PlanningSnapshot.load(day_start, day_end, statuses=statuses)
+    result = plan_routes_greedy(
+        orders=snapshot.orders,
+        drivers=snapshot.drivers,
+        regions=list(snapshot.regions.values()),
+        day_start=day_start,
+        day_end=day_end,
+        params=params,
+        progress_callback=progress_callback
+    )
+    
+    result['written'] = snapshot.write_back(result['routes']) if auto_assign else 0
+    return result
+
+
+def plan_to_dict(result: Dict) -> Dict:
+    """Результат plan_routes_for_window для API и фоновых задач (идентификаторы вместо снимков)"""
+    return {
+        'routes': [
+            {'driver_id': driver_id, 'order_ids': [order.id for order in route]}
+            for driver_id, route in result['routes'].items()
+        ],
+        'unassigned_order_ids': [order.id for order in result['unassigned_orders']],
+        'statistics': result['statistics'],
+        'written': result.get('written', 0),
+    }
+
+
+def plan_routes_for_day(
+    target_date: date,
+    auto_assign: bool = False,
+    params: Optional[DispatchParams] = None,
+    progress_callback: Optional[Callable] = None
+) -> Dict:
+    """
+    Планирование дня best insertion на снимке данных
+    (DispatchViewSet.window_routes, задачи window_routes/window_routes_apply).
+
+    Returns:
+        plan_to_dict с датой; при auto_assign назначения записаны пакетно
+    """
+    day_start = timezone.make_aware(datetime.combine(target_date, datetime.min.time()))
+    result = plan_routes_for_window(
+        day_start,
+        day_start + timedelta(days=1),
+        params=params,
+        auto_assign=auto_assign,
+        progress_callback=progress_callback
+    )
+    return {'date': target_date.isoformat(), **plan_to_dict(result)}
@@ -0,0 +1,306 @@
+"""
+Кэш маршрутов и времени в пути перед DispatchEngine.calculate_route
+
+Двухуровневая схема:
+- L1: LRU-кэш в памяти процесса (OrderedDict) с TTL и ограничением по размеру
+- L2: подключаемое общее хранилище (Django cache API или sqlite-файл),
+  разделяемое между воркерами
+
+Ключ строится по квантованным координатам (lat, lon) обеих точек и
+корзине времени суток. Для планирования хранятся только расстояние и
+длительность, для карты - полная геометрия маршрута.
+"""
+from typing import Optional, Dict
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_ROUTE_CACHE_SETTINGS = {
+    'ENABLED': True,
+    'BACKEND': 'memory',  # memory | django | sqlite
+    'MAX_ENTRIES': 50000,  # Размер LRU в памяти процесса
+    'TTL_SECONDS': 6 * 3600,  # Время жизни записи
+    'COORD_PRECISION': 4,  # Знаков после запятой (~11 м)
+    'TIME_BUCKET_MINUTES': 60,  # Размер корзины времени суток (0 = без учета времени)
+    'DJANGO_CACHE_ALIAS': 'default',
+    'SQLITE_PATH': None,  # По умолчанию BASE_DIR / 'route_cache.sqlite3'
+    'SQLITE_MAX_ROWS': 200000,  # Сверх лимита удаляются записи, истекающие раньше всех
+    'SQLITE_PURGE_EVERY': 1000,  # Очистка истекших записей раз в N записей
+}
+
+
+class DjangoCacheBackend:
+    """Общее хранилище поверх Django cache API (Redis, Memcached, БД)"""
+
+    def __init__(self, alias: str = 'default'):
+        from django.core.cache import caches
+        self.cache = caches[alias]
+
+    def get(self, key: str) -> Optional[Dict]:
+        return self.cache.get(key)
+
+    def set(self, key: str, value: Dict, ttl: int):
+        self.cache.set(key, value, timeout=ttl)
+
+    def clear(self):
+        self.cache.clear()
+
+
+class SqliteBackend:
+    """
+    Общее хранилище в отдельном sqlite-файле (для одного сервера без Redis).
+    Раз в purge_every записей удаляются истекшие строки и строки сверх max_rows
+    (истекающие раньше всех), поэтому файл не растет без ограничений.
+    """
+
+    def __init__(self, path, max_rows: int = 200000, purge_every: int = 1000):
+        self.path = str(path)
+        self.max_rows = max_rows
+        self.purge_every = purge_every
+        self._writes = 0
+        self._writes_lock = threading.Lock()
+        self._local = threading.local()
+        conn = self._connection()
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS route_cache ('
+            'key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS route_cache_expires_at ON route_cache (expires_at)')
+        conn.commit()
+        self.purge()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=1.0, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[Dict]:
+        row = self._connection().execute(
+            'SELECT value, expires_at FROM route_cache WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None or row[1] < time.time():
+            return None
+        return json.loads(row[0])
+
+    def set(self, key: str, value: Dict, ttl: int):
+        conn = self._connection()
+        conn.execute(
+            'INSERT OR REPLACE INTO route_cache (key, value, expires_at) VALUES (?, ?, ?)',
+            (key, json.dumps(value), time.time() + ttl)
+        )
+        conn.commit()
+
+        with self._writes_lock:
+            self._writes += 1
+            due = self._writes >= self.purge_every
+            if due:
+                self._writes = 0
+        if due:
+            self.purge()
+
+    def purge(self) -> int:
+        """Удаляет истекшие записи и записи сверх max_rows; возвращает число удаленных"""
+        conn = self._connection()
+        try:
+            deleted = conn.execute('DELETE FROM route_cache WHERE expires_at < ?', (time.time(),)).rowcount
+            excess = conn.execute('SELECT COUNT(*) FROM route_cache').fetchone()[0] - self.max_rows
+            if excess > 0:
+                deleted += conn.execute(
+                    'DELETE FROM route_cache WHERE key IN '
+                    '(SELECT key FROM route_cache ORDER BY expires_at LIMIT ?)', (excess,)
+                ).rowcount
+            conn.commit()
+        except sqlite3.Error as e:
+            logger.warning(f'Ошибка очистки sqlite-кэша маршрутов: {e}')
+            return 0
+        if deleted:
+            logger.debug(f'Из sqlite-кэша маршрутов удалено записей: {deleted}')
+        return deleted
+
+    def clear(self):
+        conn = self._connection()
+        conn.execute('DELETE FROM route_cache')
+        conn.commit()
+
+
+class RouteCache:
+    """
+    Кэш маршрутов: LRU в памяти + опциональное общее хранилище.
+
+    Запись - словарь с ключами distance_m, distance_km, duration_seconds,
+    duration_minutes и (для полных записей) route. Поле eta не кэшируется,
+    оно вычисляется при чтении.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 50000,
+        ttl_seconds: int = 6 * 3600,
+        coord_precision: int = 4,
+        time_bucket_minutes: int = 60,
+        backend: Optional[object] = None,
+        enabled: bool = True
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.coord_precision = coord_precision
+        self.time_bucket_minutes = time_bucket_minutes
+        self.backend = backend
+        self.enabled = enabled
+        self._entries: OrderedDict = OrderedDict()  # key -> (expires_at, entry)
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    def make_key(
+        self,
+        lat1: float, lon1: float, lat2: float, lon2: float,
+        departure_time: Optional[datetime] = None
+    ) -> str:
+        """Ключ по квантованным координатам и корзине времени суток"""
+        p = self.coord_precision
+        bucket = 0
+        if self.time_bucket_minutes and departure_time is not None:
+            minute_of_day = departure_time.hour * 60 + departure_time.minute
+            bucket = minute_of_day // self.time_bucket_minutes
+        return (
+            f'route:{round(lat1, p)},{round(lon1, p)};'
+            f'{round(lat2, p)},{round(lon2, p)}:{bucket}'
+        )
+
+    def get(self, key: str, geometry: bool = True) -> Optional[Dict]:
+        """
+        Возвращает запись из кэша или None.
+        Для geometry=True подходят только записи с полной геометрией.
+        """
+        if not self.enabled:
+            return None
+
+        now = time.time()
+        with self._lock:
+            item = self._entries.get(key)
+            if item is not None:
+                expires_at, entry = item
+                if expires_at < now:
+                    del self._entries[key]
+                elif not geometry or entry.get('route'):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry
+
+        if self.backend is not None:
+            try:
+                entry = self.backend.get(key)
+            except Exception as e:
+                logger.warning(f'Ошибка чтения общего кэша маршрутов: {e}')
+                entry = None
+            if entry is not None and (not geometry or entry.get('route')):
+                self._store_local(key, entry, now)
+                with self._lock:
+                    self.shared_hits += 1
+                return entry
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key: str, entry: Dict):
+        """Сохраняет запись в LRU и в общее хранилище"""
+        if not self.enabled:
+            return
+
+        self._store_local(key, entry, time.time())
+        with self._lock:
+            self.stores += 1
+
+        if self.backend is not None:
+            try:
+                self.backend.set(key, entry, self.ttl_seconds)
+            except Exception as e:
+                logger.warning(f'Ошибка записи в общий кэш маршрутов: {e}')
+
+    def _store_local(self, key: str, entry: Dict, now: float):
+        with self._lock:
+            self._entries[key] = (now + self.ttl_seconds, entry)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        if self.backend is not None:
+            self.backend.clear()
+
+    def stats(self) -> Dict:
+        """Счетчики попаданий/промахов"""
+        with self._lock:
+            lookups = self.hits + self.shared_hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+                'stores': self.stores,
+                'evictions': self.evictions,
+                'hit_rate': round((self.hits + self.shared_hits) / lookups, 4) if lookups else 0.0,
+            }
+
+
+def _build_route_cache() -> RouteCache:
+    """Создает кэш по настройке ROUTE_CACHE из settings.py"""
+    options = dict(DEFAULT_ROUTE_CACHE_SETTINGS)
+    options.update(getattr(settings, 'ROUTE_CACHE', {}) or {})
+
+    backend = None
+    backend_name = options['BACKEND']
+    try:
+        if backend_name == 'django':
+            backend = DjangoCacheBackend(options['DJANGO_CACHE_ALIAS'])
+        elif backend_name == 'sqlite':
+            path = options['SQLITE_PATH'] or Path(settings.BASE_DIR) / 'route_cache.sqlite3'
+            backend = SqliteBackend(path, options['SQLITE_MAX_ROWS'], options['SQLITE_PURGE_EVERY'])
+    except Exception as e:
+        logger.warning(f'Не удалось инициализировать общий кэш маршрутов ({backend_name}): {e}')
+
+    return RouteCache(
+        max_entries=options['MAX_ENTRIES'],
+        ttl_seconds=options['TTL_SECONDS'],
+        coord_precision=options['COORD_PRECISION'],
+        time_bucket_minutes=options['TIME_BUCKET_MINUTES'],
+        backend=backend,
+        enabled=options['ENABLED']
+    )
+
+
+_route_cache: Optional[RouteCache] = None
+
+
+def get_route_cache() -> RouteCache:
+    """Глобальный экземпляр кэша маршрутов (ленивая инициализация)"""
+    global _route_cache
+    if _route_cache is None:
+        _route_cache = _build_route_cache()
+    return _route_cache
@@ -1,12 +1,15 @@
-from typing import List, Optional, Tuple, Dict
+from typing import List, Optional, Tuple, Dict, Iterable
 from django.utils import timezone
-from datetime import date, timedelta
+from datetime import date, datetime, timedelta
 from orders.models import Order, OrderStatus
 from accounts.models import Driver
 from geo.services import Geo
+from dispatch.route_cache import get_route_cache
 import logging
+import time
 import requests
 import json
+import numpy as np
 
 logger = logging.getLogger(__name__)
 
@@ -26,6 +29,12 @@ class DispatchEngine:
     _driver_order_counts = {}
     _last_reset_date = date.today()
 
+    # Приблизительная скорость движения в городе для расчета по прямой (км/ч)
+    STRAIGHT_LINE_SPEED_KMH = 40.0
+
+    def __init__(self, routing_backend: Optional['RoutingBackend'] = None):
+        self.routing_backend = routing_backend or get_routing_backend()
+
     def _reset_daily_counts_if_needed(self):
         """Сбрасывает счетчики, если наступил новый день"""
         today = date.today()
@@ -33,9 +42,11 @@ class DispatchEngine:
             self._driver_order_counts.clear()
             self._last_reset_date = today
 
-    def assign_order(self, order: Order) -> AssignmentResult:
+    def assign_order(self, order: Order, exclude_driver_ids: Optional[Iterable] = None) -> AssignmentResult:
         """
         Назначает заказ водителю
+        exclude_driver_ids: водители, уже занятые в текущей пачке назначений
+        (их статус еще не записан в БД)
         """
         if order.status != OrderStatus.ACTIVE_QUEUE:
             return AssignmentResult(
@@ -45,7 +56,7 @@ class DispatchEngine:
 
         self._reset_daily_counts_if_needed()
 
-        candidates = self._find_candidates(order)
+        candidates = self._find_candidates(order, exclude_driver_ids)
 
         if not candidates:
             # Получаем статистику для более информативного сообщения
@@ -90,7 +101,8 @@ class DispatchEngine:
             )
 
         # Сортируем по приоритету
-        candidates.sort(key=lambda d: self._calculate_priority(d, order, passenger))
+        priorities = self._calculate_priorities(candidates, order)
+        candidates = [driver for _, driver in sorted(zip(priorities, candidates), key=lambda item: item[0])]
 
         selected_driver = candidates[0]
 
@@ -103,7 +115,7 @@ class DispatchEngine:
             reason=f'Назначен водитель {selected_driver.name} из региона {selected_driver.region.title}'
         )
 
-    def _find_candidates(self, order: Order) -> List[Driver]:
+    def _find_candidates(self, order: Order, exclude_driver_ids: Optional[Iterable] = None) -> List[Driver]:
         """
         Находит кандидатов для заказа
         Район - это жесткое условие (hard constraint), не фактор приоритета
@@ -121,47 +133,39 @@ class DispatchEngine:
                 logger.error(f'Не удалось определить район для заказа {order.id}: нет pickup_region и нет passenger.region')
                 return []
 
-        # Получаем всех онлайн водителей с правильным статусом
         from accounts.models import DriverStatus
-        
-        # Фильтруем водителей: онлайн и доступные (не в поездке, не едут к подаче, не получили оффер)
-        online_drivers = Driver.objects.filter(is_online=True)
-        
-        # Логируем общее количество онлайн водителей
-        total_online = online_drivers.count()
-        logger.debug(f'Найдено онлайн водителей: {total_online} для заказа {order.id}, требуется мест: {seats_needed}, район: {pickup_region.title}')
-        
-        # Исключаем занятых водителей
+        from .driver_index import get_driver_index
+
+        # Исключаем занятых водителей (не в поездке, не едут к подаче, не получили оффер)
         excluded_statuses = [DriverStatus.ON_TRIP, DriverStatus.ENROUTE_TO_PICKUP, DriverStatus.OFFERED]
-        # Используем exclude только если поле status существует
-        try:
-            online_drivers = online_drivers.exclude(status__in=excluded_statuses)
-            available_count = online_drivers.count()
-            logger.debug(f'После исключения занятых водителей: {available_count}')
-        except Exception as e:
-            # Если поле status не существует (старая схема БД), просто используем is_online
-            logger.warning(f'Не удалось исключить водителей по статусу: {e}')
-            pass
+        available_statuses = [status for status in DriverStatus.values if status not in excluded_statuses]
 
+        # Первый этап: свободные онлайн-водители района из индекса в памяти
+        # (по расстоянию до подачи, водители без позиции - в конце)
+        nearest = get_driver_index().nearest(
+            order.pickup_lat, order.pickup_lon,
+            region_id=pickup_region.id,
+            statuses=available_statuses,
+            exclude=exclude_driver_ids,
+            include_unlocated=True,
+        )
+        nearest_ids = [driver_id for driver_id, _ in nearest]
+        logger.debug(f'Найдено в индексе свободных водителей района: {len(nearest_ids)} для заказа {order.id}, требуется мест: {seats_needed}, район: {pickup_region.title}')
+
+        # Проверка найденных в БД (изменения в обход сигналов индекс видит только после перестроения)
+        by_id = {
+            driver.id: driver
+            for driver in Driver.objects.filter(
+                id__in=nearest_ids, is_online=True, region_id=pickup_region.id
+            ).exclude(status__in=excluded_statuses).select_related('region')
+        }
+        region_drivers = [by_id[driver_id] for driver_id in nearest_ids if driver_id in by_id]
+        
         candidates = []
         capacity_filtered = 0
         status_filtered = 0
-        region_filtered = 0
-        no_region_filtered = 0
         
-        for driver in online_drivers:
-            # Проверка: водитель должен иметь заполненный region
-            if not driver.region:
-                no_region_filtered += 1
-                logger.warning(f'Водитель {driver.id} ({driver.name}) пропущен: не заполнен region (is_online=True, но нет района)')
-                continue
-            
-            # ЖЕСТКИЙ ФИЛЬТР: район должен совпадать
-            if driver.region.id != pickup_region.id:
-                region_filtered += 1
-                logger.debug(f'Водитель {driver.id} ({driver.name}) пропущен: район не совпадает ({driver.region.title} != {pickup_region.title})')
-                continue
-            
+        for driver in region_drivers:
             # Проверяем вместимость
             if driver.capacity < seats_needed:
                 capacity_filtered += 1
@@ -187,35 +191,40 @@ class DispatchEngine:
             candidates.append(driver)
             logger.debug(f'Водитель {driver.id} ({driver.name}) добавлен в кандидаты. Вместимость: {driver.capacity}, статус: {getattr(driver, "status", "N/A")}, район: {driver.region.title}')
 
-        logger.info(f'Для заказа {order.id} найдено кандидатов: {len(candidates)} из {total_online} онлайн водителей. '
+        logger.info(f'Для заказа {order.id} найдено кандидатов: {len(candidates)} из {len(region_drivers)} свободных водителей района. '
                    f'Район заказа: {pickup_region.title}. '
-                   f'Отфильтровано: по району - {region_filtered}, без района - {no_region_filtered}, по вместимости - {capacity_filtered}, по статусу - {status_filtered}')
+                   f'Отфильтровано: по вместимости - {capacity_filtered}, по статусу - {status_filtered}')
 
         return candidates
 
-    def _calculate_priority(self, driver: Driver, order: Order, passenger) -> tuple:
+    def _calculate_priorities(self, drivers: List[Driver], order: Order) -> List[tuple]:
         """
-        Вычисляет приоритет водителя для заказа
-        Возвращает кортеж для сортировки (меньше = выше приоритет)
+        Вычисляет приоритеты водителей для заказа
+        Возвращает кортежи для сортировки (меньше = выше приоритет)
         
         Район уже отфильтрован в _find_candidates как жесткое условие,
-        поэтому здесь учитываем только fairness и расстояние
+        поэтому здесь учитываем только fairness и расстояние.
+        Расстояния до точки забора считаются одним векторным вызовом.
         """
-        # 1. Fairness penalty (кто меньше заказов взял сегодня)
-        driver_id_str = str(driver.id)
-        order_count = self._driver_order_counts.get(driver_id_str, 0)
-
-        # 2. Расстояние до точки забора
-        if driver.current_lat is not None and driver.current_lon is not None:
-            distance = Geo.calculate_distance(
-                driver.current_lat, driver.current_lon,
-                order.pickup_lat, order.pickup_lon
+        distances = [float('inf')] * len(drivers)
+        located = [
+            i for i, driver in enumerate(drivers)
+            if driver.current_lat is not None and driver.current_lon is not None
+        ]
+        if located:
+            located_distances = Geo.calculate_distances(
+                order.pickup_lat, order.pickup_lon,
+                [drivers[i].current_lat for i in located],
+                [drivers[i].current_lon for i in located]
             )
-        else:
-            distance = float('inf')
+            for i, distance in zip(located, located_distances.tolist()):
+                distances[i] = distance
 
-        # Возвращаем кортеж для сортировки (без region_match - район уже отфильтрован)
-        return (order_count, distance)
+        # Fairness penalty (кто меньше заказов взял сегодня), затем расстояние
+        return [
+            (self._driver_order_counts.get(str(driver.id), 0), distance)
+            for driver, distance in zip(drivers, distances)
+        ]
 
     def get_candidates(self, order: Order, include_offline: bool = True) -> List[dict]:
         """
@@ -223,17 +232,25 @@ class DispatchEngine:
         include_offline: если True, включает офлайн водителей для ручного назначения
         """
         seats_needed = order.seats_needed
-        passenger = order.passenger
 
         # Получаем водителей (онлайн и офлайн, если разрешено)
         if include_offline:
             drivers = Driver.objects.filter(capacity__gte=seats_needed)
         else:
-            drivers = Driver.objects.filter(is_online=True, capacity__gte=seats_needed)
+            from .driver_index import get_driver_index
+
+            nearest = get_driver_index().nearest(
+                order.pickup_lat, order.pickup_lon, min_capacity=seats_needed, include_unlocated=True
+            )
+            drivers = Driver.objects.filter(
+                id__in=[driver_id for driver_id, _ in nearest], is_online=True, capacity__gte=seats_needed
+            )
+
+        drivers = list(drivers.select_related('region'))
+        priorities = self._calculate_priorities(drivers, order)
 
         result = []
-        for driver in drivers:
-            priority = self._calculate_priority(driver, order, passenger)
+        for driver, priority in zip(drivers, priorities):
             result.append({
                 'driver_id': str(driver.id),
                 'name': driver.name,
@@ -262,85 +279,49 @@ class DispatchEngine:
         self._driver_order_counts.clear()
         self._last_reset_date = date.today()
 
-    def calculate_route(self, lat1: float, lon1: float, lat2: float, lon2: float) -> Dict:
+    def calculate_route(
+        self,
+        lat1: float,
+        lon1: float,
+        lat2: float,
+        lon2: float,
+        geometry: bool = True,
+        departure_time: Optional[datetime] = None
+    ) -> Dict:
         """
-        Вычисляет маршрут между двумя точками по дорогам используя OSRM API
+        Вычисляет маршрут между двумя точками по дорогам через бэкенд маршрутизации
+        (OSRM API или локальный дорожный граф, см. настройку ROUTING)
         Возвращает словарь с координатами маршрута, расстоянием и временем в пути
+
+        geometry: False - нужны только расстояние и время (планирование),
+                  маршрут не запрашивается и не хранится в кэше
+        departure_time: время выезда (для корзины времени суток в ключе кэша)
         """
-        # Список OSRM серверов для попытки подключения
-        osrm_servers = [
-            "http://router.project-osrm.org",  # Публичный OSRM сервер
-            "https://router.project-osrm.org",  # HTTPS версия
-        ]
-        
-        for server_url in osrm_servers:
-            try:
-                # Формат: lon,lat (OSRM использует обратный порядок координат)
-                url = f"{server_url}/route/v1/driving/{lon1},{lat1};{lon2},{lat2}"
-                params = {
-                    'overview': 'full',  # Полный обзор маршрута со всеми точками
-                    'geometries': 'geojson',  # Формат GeoJSON для координат
-                    'steps': 'false'  # Не нужны пошаговые инструкции
-                }
-                
-                response = requests.get(url, params=params, timeout=5)
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    
-                    if data.get('code') == 'Ok' and len(data.get('routes', [])) > 0:
-                        route = data['routes'][0]
-                        geometry = route.get('geometry', {})
-                        coordinates = geometry.get('coordinates', [])
-                        
-                        if not coordinates or len(coordinates) == 0:
-                            continue  # Пробуем следующий сервер
-                        
-                        # Преобразуем координаты из [lon, lat] в [lat, lon]
-                        route_points = [[coord[1], coord[0]] for coord in coordinates]
-                        
-                        # Расстояние в метрах
-                        distance_m = int(route.get('distance', 0))
-                        # Время в секундах
-                        duration_seconds = int(route.get('duration', 0))
-                        
-                        logger.info(f"Маршрут успешно рассчитан через OSRM: {distance_m}м, {duration_seconds}с")
-                        
-                        return {
-                            'route': route_points,
-                            'distance_m': distance_m,
-                            'distance_km': round(distance_m / 1000.0, 2),
-                            'duration_seconds': duration_seconds,
-                            'duration_minutes': int(duration_seconds / 60),
-                            'eta': timezone.now() + timedelta(seconds=duration_seconds)
-                        }
-                    elif data.get('code') == 'NoRoute':
-                        logger.warning(f"OSRM не нашел маршрут между точками {lat1},{lon1} -> {lat2},{lon2}")
-                        break  # Не пробуем другие серверы, если маршрут не найден
-                        
-            except requests.exceptions.Timeout:
-                logger.warning(f"Таймаут при подключении к OSRM серверу {server_url}")
-                continue  # Пробуем следующий сервер
-            except requests.exceptions.RequestException as e:
-                logger.warning(f"Ошибка подключения к OSRM серверу {server_url}: {e}")
-                continue  # Пробуем следующий сервер
-            except Exception as e:
-                logger.error(f"Неожиданная ошибка при расчете маршрута через OSRM ({server_url}): {e}")
-                continue  # Пробуем следующий сервер
-        
-        # Если все серверы недоступны, используем fallback на прямую линию
-        logger.warning(f"Все OSRM серверы недоступны, используем прямую линию для маршрута {lat1},{lon1} -> {lat2},{lon2}")
-        return self._calculate_straight_line_route(lat1, lon1, lat2, lon2)
-    
+        route_cache = get_route_cache()
+        cache_key = route_cache.make_key(lat1, lon1, lat2, lon2, departure_time)
+
+        entry = route_cache.get(cache_key, geometry=geometry)
+        if entry is None:
+            entry = self.routing_backend.route(lat1, lon1, lat2, lon2, geometry)
+            if entry is not None:
+                route_cache.set(cache_key, entry)
+
+        if entry is None:
+            # Если бэкенд не вернул маршрут, используем fallback на прямую линию
+            logger.warning(f"Бэкенд маршрутизации ({self.routing_backend.name}) не вернул маршрут, используем прямую линию для маршрута {lat1},{lon1} -> {lat2},{lon2}")
+            return self._calculate_straight_line_route(lat1, lon1, lat2, lon2)
+
+        result = dict(entry)
+        result['eta'] = timezone.now() + timedelta(seconds=result['duration_seconds'])
+        return result
+
     def _calculate_straight_line_route(self, lat1: float, lon1: float, lat2: float, lon2: float) -> Dict:
         """
         Вычисляет прямую линию между двумя точками (fallback метод)
         """
         distance_m = Geo.calculate_distance(lat1, lon1, lat2, lon2)
         
-        # Приблизительная скорость движения в городе (км/ч)
-        AVERAGE_SPEED_KMH = 40.0
-        AVERAGE_SPEED_MS = AVERAGE_SPEED_KMH / 3.6  # м/с
+        AVERAGE_SPEED_MS = self.STRAIGHT_LINE_SPEED_KMH / 3.6  # м/с
         
         # Время в пути в секундах
         duration_seconds = distance_m / AVERAGE_SPEED_MS if AVERAGE_SPEED_MS > 0 else 0
@@ -410,3 +391,419 @@ class DispatchEngine:
             'duration_minutes': route['duration_minutes'],
             'duration_seconds': route['duration_seconds']
         }
+
+    # Ограничение публичного OSRM на размер /table запроса (координат в одном запросе)
+    OSRM_TABLE_MAX_COORDINATES = 100
+    # Максимум точек назначения в одном /table запросе (остальное - источники)
+    OSRM_TABLE_MAX_DESTINATIONS = 25
+
+    def calculate_eta_matrix(
+        self,
+        drivers: List[Driver],
+        orders: List[Order]
+    ) -> Dict[Tuple, Dict]:
+        """
+        Вычисляет ETA всех водителей до точек забора всех заказов пакетно.
+
+        Вместо N отдельных /route запросов выполняется один /table запрос
+        к бэкенду маршрутизации на пачку (с разбиением по лимиту координат OSRM).
+        Если бэкенд недоступен,
+        для оставшихся пар используется векторизованный Haversine.
+
+        Возвращает словарь {(driver_id, order_id): eta_data} в формате calculate_eta.
+        Водители и заказы без координат пропускаются.
+        """
+        drivers = [d for d in drivers if d.current_lat and d.current_lon]
+        orders = [o for o in orders if o.pickup_lat and o.pickup_lon]
+        if not drivers or not orders:
+            return {}
+
+        # durations/distances: матрицы (водители x заказы), NaN = не рассчитано
+        durations = np.full((len(drivers), len(orders)), np.nan)
+        distances = np.full((len(drivers), len(orders)), np.nan)
+
+        route_cache = get_route_cache()
+        keys = [
+            [
+                route_cache.make_key(d.current_lat, d.current_lon, o.pickup_lat, o.pickup_lon)
+                for o in orders
+            ]
+            for d in drivers
+        ]
+        for i in range(len(drivers)):
+            for j in range(len(orders)):
+                entry = route_cache.get(keys[i][j], geometry=False)
+                if entry is not None:
+                    durations[i, j] = entry['duration_seconds']
+                    distances[i, j] = entry['distance_m']
+
+        dest_chunk = self.OSRM_TABLE_MAX_DESTINATIONS
+        for j0 in range(0, len(orders), dest_chunk):
+            j1 = min(j0 + dest_chunk, len(orders))
+            # Запрашиваем только водителей, у которых есть непосчитанные пары
+            pending = [i for i in range(len(drivers)) if np.isnan(durations[i, j0:j1]).any()]
+            src_chunk = self.OSRM_TABLE_MAX_COORDINATES - (j1 - j0)
+            for k in range(0, len(pending), src_chunk):
+                rows = pending[k:k + src_chunk]
+                table = self.routing_backend.table(
+                    [(drivers[i].current_lat, drivers[i].current_lon) for i in rows],
+                    [(o.pickup_lat, o.pickup_lon) for o in orders[j0:j1]]
+                )
+                if table is None:
+                    continue
+                table_durations, table_distances = table
+                for r, i in enumerate(rows):
+                    for c, j in enumerate(range(j0, j1)):
+                        duration = table_durations[r][c]
+                        if duration is None:
+                            continue
+                        distance = table_distances[r][c] if table_distances else None
+                        durations[i, j] = duration
+                        distances[i, j] = distance if distance is not None else np.nan
+                        if distance is not None:
+                            route_cache.set(keys[i][j], self._table_entry(duration, distance))
+
+        # Fallback: векторизованная прямая линия отдельно для каждого поля,
+        # время из OSRM сохраняется, даже если расстояние не пришло
+        missing_durations = np.isnan(durations)
+        missing_distances = np.isnan(distances)
+        if missing_durations.any() or missing_distances.any():
+            logger.warning(
+                f'Матрица маршрутов неполна: нет времени для {int(missing_durations.sum())} пар, '
+                f'расстояния для {int(missing_distances.sum())} пар, используем прямую линию'
+            )
+            straight_m = Geo.calculate_distance_matrix(
+                [d.current_lat for d in drivers], [d.current_lon for d in drivers],
+                [o.pickup_lat for o in orders], [o.pickup_lon for o in orders]
+            )
+            speed_ms = self.STRAIGHT_LINE_SPEED_KMH / 3.6
+            distances = np.where(missing_distances, straight_m, distances)
+            durations = np.where(missing_durations, straight_m / speed_ms, durations)
+
+        now = timezone.now()
+        result = {}
+        for i, driver in enumerate(drivers):
+            for j, order in enumerate(orders):
+                duration_seconds = int(durations[i, j])
+                distance_m = int(distances[i, j])
+                eta = now + timedelta(seconds=duration_seconds)
+                result[(driver.id, order.id)] = {
+                    'eta': eta.isoformat(),
+                    'eta_timestamp': eta.timestamp(),
+                    'distance_m': distance_m,
+                    'distance_km': round(distance_m / 1000.0, 2),
+                    'duration_minutes': int(duration_seconds / 60),
+                    'duration_seconds': duration_seconds
+                }
+        return result
+
+    @staticmethod
+    def _table_entry(duration: float, distance: float) -> Dict:
+        """Запись кэша маршрутов (без геометрии) из ячейки table"""
+        return {
+            'route': [],
+            'distance_m': int(distance),
+            'distance_km': round(distance / 1000.0, 2),
+            'duration_seconds': int(duration),
+            'duration_minutes': int(duration / 60),
+        }
+
+    def prefetch_routes(
+        self,
+        pairs: Iterable[Tuple[float, float, float, float]],
+        departure_time: Optional[datetime] = None
+    ) -> int:
+        """
+        Заполняет кэш маршрутов (без геометрии) для пар (lat1, lon1, lat2, lon2)
+        пакетными table-запросами вместо route на каждую пару.
+        Запрашиваются только пары, которых нет в кэше; пары, для которых бэкенд
+        не вернул время, позже считаются calculate_route как обычно.
+
+        Возвращает число пар, рассчитанных бэкендом
+        """
+        route_cache = get_route_cache()
+        missing = {}
+        for pair in pairs:
+            key = route_cache.make_key(*pair, departure_time)
+            if key not in missing and route_cache.get(key, geometry=False) is None:
+                missing[key] = pair
+        if not missing:
+            return 0
+
+        fetched = 0
+        destinations = sorted({pair[2:] for pair in missing.values()})
+        dest_chunk = self.OSRM_TABLE_MAX_DESTINATIONS
+        for j0 in range(0, len(destinations), dest_chunk):
+            targets = destinations[j0:j0 + dest_chunk]
+            target_set = set(targets)
+            wanted = {(pair[:2], pair[2:]): key for key, pair in missing.items() if pair[2:] in target_set}
+            sources = sorted({origin for origin, _ in wanted})
+            src_chunk = self.OSRM_TABLE_MAX_COORDINATES - len(targets)
+            for i0 in range(0, len(sources), src_chunk):
+                rows = sources[i0:i0 + src_chunk]
+                table = self.routing_backend.table(rows, targets)
+                if table is None:
+                    continue
+                table_durations, table_distances = table
+                for r, origin in enumerate(rows):
+                    for c, target in enumerate(targets):
+                        key = wanted.get((origin, target))
+                        if key is None:
+                            continue
+                        duration = table_durations[r][c]
+                        distance = table_distances[r][c] if table_distances else None
+                        if duration is None or distance is None:
+                            continue
+                        route_cache.set(key, self._table_entry(duration, distance))
+                        fetched += 1
+
+        logger.debug(f'Кэш маршрутов заполнен пакетно: {fetched} из {len(missing)} пар')
+        return fetched
+
+
+class RoutingBackend:
+    """
+    Интерфейс бэкенда маршрутизации для DispatchEngine.
+
+    route() возвращает словарь {'route', 'distance_m', 'distance_km',
+    'duration_seconds', 'duration_minutes'} или None, если маршрут не найден.
+    Необязательное 'segment_durations' - время по отрезкам route (секунды).
+    table() возвращает матрицы (durations, distances) размером
+    len(sources) x len(destinations) (None в ячейке - нет маршрута) или None.
+    """
+    name = 'base'
+
+    def route(
+        self,
+        lat1: float,
+        lon1: float,
+        lat2: float,
+        lon2: float,
+        geometry: bool = True
+    ) -> Optional[Dict]:
+        raise NotImplementedError
+
+    def table(
+        self,
+        sources: List[Tuple[float, float]],
+        destinations: List[Tuple[float, float]]
+    ) -> Optional[Tuple[List, List]]:
+        raise NotImplementedError
+
+
+class OsrmBackend(RoutingBackend):
+    """Маршрутизация через HTTP API OSRM"""
+    name = 'osrm'
+
+    DEFAULT_SERVERS = [
+        "http://router.project-osrm.org",  # Публичный OSRM сервер
+        "https://router.project-osrm.org",  # HTTPS версия
+    ]
+
+    def __init__(self, servers: Optional[List[str]] = None):
+        self.servers = [url.rstrip('/') for url in (servers or self.DEFAULT_SERVERS)]
+
+    def route(
+        self,
+        lat1: float,
+        lon1: float,
+        lat2: float,
+        lon2: float,
+        geometry: bool = True
+    ) -> Optional[Dict]:
+        """
+        Запрашивает маршрут у OSRM серверов (перебирает по очереди).
+        Возвращает запись для кэша (без eta) или None, если маршрут не получен
+        """
+        for server_url in self.servers:
+            try:
+                # Формат: lon,lat (OSRM использует обратный порядок координат)
+                url = f"{server_url}/route/v1/driving/{lon1},{lat1};{lon2},{lat2}"
+                params = {
+                    'overview': 'full' if geometry else 'false',  # Полный обзор маршрута со всеми точками
+                    'geometries': 'geojson',  # Формат GeoJSON для координат
+                    'steps': 'false'  # Не нужны пошаговые инструкции
+                }
+                if geometry:
+                    # Время по отрезкам маршрута (для dispatch.eta_tracker)
+                    params['annotations'] = 'duration'
+                
+                response = requests.get(url, params=params, timeout=5)
+                
+                if response.status_code == 200:
+                    data = response.json()
+                    
+                    if data.get('code') == 'Ok' and len(data.get('routes', [])) > 0:
+                        route = data['routes'][0]
+                        
+                        route_points = []
+                        if geometry:
+                            geometry_data = route.get('geometry', {})
+                            coordinates = geometry_data.get('coordinates', [])
+                            
+                            if not coordinates or len(coordinates) == 0:
+                                continue  # Пробуем следующий сервер
+                            
+                            # Преобразуем координаты из [lon, lat] в [lat, lon]
+                            route_points = [[coord[1], coord[0]] for coord in coordinates]
+                        
+                        # Расстояние в метрах
+                        distance_m = int(route.get('distance', 0))
+                        # Время в секундах
+                        duration_seconds = int(route.get('duration', 0))
+                        
+                        logger.info(f"Маршрут успешно рассчитан через OSRM: {distance_m}м, {duration_seconds}с")
+                        
+                        result = {
+                            'route': route_points,
+                            'distance_m': distance_m,
+                            'distance_km': round(distance_m / 1000.0, 2),
+                            'duration_seconds': duration_seconds,
+                            'duration_minutes': int(duration_seconds / 60),
+                        }
+                        legs = route.get('legs') or []
+                        if geometry and len(legs) == 1:
+                            segment_durations = (legs[0].get('annotation') or {}).get('duration')
+                            if segment_durations and len(segment_durations) == len(route_points) - 1:
+                                result['segment_durations'] = [round(value, 1) for value in segment_durations]
+                        return result
+                    elif data.get('code') == 'NoRoute':
+                        logger.warning(f"OSRM не нашел маршрут между точками {lat1},{lon1} -> {lat2},{lon2}")
+                        break  # Не пробуем другие серверы, если маршрут не найден
+                        
+            except requests.exceptions.Timeout:
+                logger.warning(f"Таймаут при подключении к OSRM серверу {server_url}")
+                continue  # Пробуем следующий сервер
+            except requests.exceptions.RequestException as e:
+                logger.warning(f"Ошибка подключения к OSRM серверу {server_url}: {e}")
+                continue  # Пробуем следующий сервер
+            except Exception as e:
+                logger.error(f"Неожиданная ошибка при расчете маршрута через OSRM ({server_url}): {e}")
+                continue  # Пробуем следующий сервер
+        
+        return None
+
+    def table(
+        self,
+        sources: List[Tuple[float, float]],
+        destinations: List[Tuple[float, float]]
+    ) -> Optional[Tuple[List, List]]:
+        """
+        Один OSRM /table запрос: матрицы длительностей (с) и расстояний (м)
+        размером len(sources) x len(destinations), либо None при ошибке
+        """
+        points = list(sources) + list(destinations)
+        coords = ';'.join(f'{lon},{lat}' for lat, lon in points)
+        params = {
+            'sources': ';'.join(str(i) for i in range(len(sources))),
+            'destinations': ';'.join(str(i) for i in range(len(sources), len(points))),
+            'annotations': 'duration,distance',
+        }
+
+        for server_url in self.servers:
+            try:
+                url = f"{server_url}/table/v1/driving/{coords}"
+                response = requests.get(url, params=params, timeout=5)
+                if response.status_code == 200:
+                    data = response.json()
+                    if data.get('code') == 'Ok' and data.get('durations'):
+                        logger.info(f"Матрица OSRM рассчитана: {len(sources)}x{len(destinations)}")
+                        return data['durations'], data.get('distances')
+            except requests.exceptions.Timeout:
+                logger.warning(f"Таймаут при запросе матрицы OSRM ({server_url})")
+                continue
+            except requests.exceptions.RequestException as e:
+                logger.warning(f"Ошибка запроса матрицы OSRM ({server_url}): {e}")
+                continue
+            except Exception as e:
+                logger.error(f"Неожиданная ошибка при расчете матрицы через OSRM ({server_url}): {e}")
+                continue
+
+        return None
+
+
+class LocalGraphBackend(RoutingBackend):
+    """
+    Маршрутизация по локальному дорожному графу (без внешних серверов).
+    Граф загружается при первом запросе из .npz или .osm файла.
+
+    Если граф не загрузился или маршрутизатор упал, route()/table() возвращают
+    None (как OSRM без ответа) и DispatchEngine считает по прямой; повторная
+    загрузка - не чаще LOAD_RETRY_SECONDS.
+    """
+    name = 'local'
+
+    LOAD_RETRY_SECONDS = 60
+
+    def __init__(self, graph_path: str):
+        self.graph_path = graph_path
+        self._router = None
+        self._load_failed_at: Optional[float] = None
+
+    @property
+    def router(self):
+        if self._router is None:
+            now = time.monotonic()
+            if self._load_failed_at is not None and now - self._load_failed_at < self.LOAD_RETRY_SECONDS:
+                return None
+            try:
+                from dispatch.local_router import LocalRouter, RoadGraph
+                self._router = LocalRouter(RoadGraph.load(self.graph_path))
+                self._load_failed_at = None
+            except Exception as e:
+                self._load_failed_at = now
+                logger.error(f'Не удалось загрузить дорожный граф {self.graph_path}: {e}')
+                return None
+        return self._router
+
+    def route(
+        self,
+        lat1: float,
+        lon1: float,
+        lat2: float,
+        lon2: float,
+        geometry: bool = True
+    ) -> Optional[Dict]:
+        router = self.router
+        if router is None:
+            return None
+        try:
+            return router.route(lat1, lon1, lat2, lon2, geometry)
+        except Exception as e:
+            logger.error(f'Ошибка локального маршрутизатора {lat1},{lon1} -> {lat2},{lon2}: {e}')
+            return None
+
+    def table(
+        self,
+        sources: List[Tuple[float, float]],
+        destinations: List[Tuple[float, float]]
+    ) -> Optional[Tuple[List, List]]:
+        router = self.router
+        if router is None:
+            return None
+        try:
+            return router.table(sources, destinations)
+        except Exception as e:
+            logger.error(f'Ошибка матрицы локального маршрутизатора: {e}')
+            return None
+
+
+_routing_backend: Optional[RoutingBackend] = None
+
+
+def get_routing_backend() -> RoutingBackend:
+    """
+    Бэкенд маршрутизации по настройке ROUTING из settings.py
+    (ленивая инициализация, один экземпляр на процесс)
+    """
+    global _routing_backend
+    if _routing_backend is None:
+        from django.conf import settings
+        options = getattr(settings, 'ROUTING', {}) or {}
+        backend_name = options.get('BACKEND', 'osrm')
+        if backend_name == 'local':
+            _routing_backend = LocalGraphBackend(options['GRAPH_PATH'])
+        else:
+            _routing_backend = OsrmBackend(options.get('OSRM_SERVERS'))
+        logger.info(f'Бэкенд маршрутизации: {_routing_backend.name}')
+    return _routing_backend
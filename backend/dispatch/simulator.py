@@ -1,5 +1,9 @@
 """
 Модуль симуляции маршрута с проверкой временных ограничений
+
+Ядро (simulate_schedule) считает расписание в минутах от начала смены и
+возвращает компактный RouteSchedule; DataFrame строится только по запросу
+(RouteSchedule.to_dataframe), например для отладочных таблиц и экспорта.
 """
 from typing import List, Optional, Callable, Dict, Tuple
 from datetime import datetime, timedelta
@@ -11,7 +15,90 @@ from orders.models import Order
 logger = logging.getLogger(__name__)
 
 
-def simulate_route(
+class RouteSchedule:
+    """
+    Расписание маршрута: по одному элементу в каждом столбце на заказ.
+
+    Время хранится в минутах от start_time; datetime-значения и DataFrame
+    вычисляются только при обращении.
+    """
+    __slots__ = (
+        'start_time', 'order_ids', 'arrive_min', 'wait_time_min', 'start_min',
+        'deadline_min', 'end_min', 'is_late', 't_drive_to_pickup_min', 't_trip_min', '_df',
+    )
+
+    COLUMNS = [
+        'order_id', 'arrive_time', 'wait_time_min', 'start_time', 'deadline_time',
+        'end_time', 'is_late', 't_drive_to_pickup_min', 't_trip_min',
+    ]
+
+    def __init__(self, start_time: datetime):
+        self.start_time = start_time
+        self.order_ids = []
+        self.arrive_min = []
+        self.wait_time_min = []
+        self.start_min = []
+        self.deadline_min = []
+        self.end_min = []
+        self.is_late = []
+        self.t_drive_to_pickup_min = []
+        self.t_trip_min = []
+        self._df = None
+
+    def __len__(self) -> int:
+        return len(self.order_ids)
+
+    @property
+    def empty(self) -> bool:
+        return not self.order_ids
+
+    def at(self, minutes: float) -> datetime:
+        """Момент времени по смещению в минутах"""
+        return self.start_time + timedelta(minutes=minutes)
+
+    def index_of(self, order_id) -> Optional[int]:
+        """Позиция заказа в расписании или None"""
+        try:
+            return self.order_ids.index(str(order_id))
+        except ValueError:
+            return None
+
+    def slack_min(self, index: int) -> float:
+        """Запас времени до дедлайна для заказа на позиции index (минуты)"""
+        return self.deadline_min[index] - self.start_min[index]
+
+    @property
+    def total_time_min(self) -> float:
+        """Время от прибытия к первому заказу до завершения последнего"""
+        if not self.order_ids:
+            return 0.0
+        return self.end_min[-1] - self.arrive_min[0]
+
+    def rows(self) -> List[Dict]:
+        """Строки расписания (словари с теми же ключами, что и столбцы DataFrame)"""
+        return [
+            {
+                'order_id': self.order_ids[i],
+                'arrive_time': self.at(self.arrive_min[i]),
+                'wait_time_min': self.wait_time_min[i],
+                'start_time': self.at(self.start_min[i]),
+                'deadline_time': self.at(self.deadline_min[i]),
+                'end_time': self.at(self.end_min[i]),
+                'is_late': self.is_late[i],
+                't_drive_to_pickup_min': self.t_drive_to_pickup_min[i],
+                't_trip_min': self.t_trip_min[i],
+            }
+            for i in range(len(self.order_ids))
+        ]
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """DataFrame с расписанием (строится один раз при первом обращении)"""
+        if self._df is None:
+            self._df = pd.DataFrame(self.rows()) if self.order_ids else pd.DataFrame()
+        return self._df
+
+
+def simulate_schedule(
     driver_start_lat: float,
     driver_start_lng: float,
     driver_start_time: datetime,
@@ -23,28 +110,11 @@ def simulate_route(
     use_ml: bool = False,
     ml_predictor: Optional[object] = None,
     params: Optional[object] = None
-) -> Tuple[pd.DataFrame, bool, List[str], float]:
+) -> Tuple[RouteSchedule, bool, List[str], float]:
     """
-    Симулирует выполнение маршрута водителя с последовательностью заказов
-    и проверяет соблюдение временных ограничений.
-    
-    Args:
-        driver_start_lat: Начальная широта водителя
-        driver_start_lng: Начальная долгота водителя
-        driver_start_time: Время начала работы водителя
-        orders_sequence: Последовательность заказов (список Order объектов)
-        travel_minutes_fn: Функция расчета времени переезда (lat1, lon1, lat2, lon2, order, current_time) -> minutes
-        wait_limit_min: Лимит ожидания (минуты)
-        wait_period_min: Фиксированный период ожидания после scheduled_time (минуты)
-        use_ml: Использовать ML предсказания
-        ml_predictor: ML предсказатель (опционально)
-        params: Параметры алгоритма (опционально)
-    
-    Returns:
-        schedule_df: DataFrame с расписанием для каждого заказа
-        is_valid: Валидность маршрута (нет нарушений дедлайнов)
-        violations: Список ID заказов с нарушениями дедлайнов
-        total_time_min: Общее время выполнения маршрута (минуты)
+    Симулирует выполнение маршрута водителя без построения DataFrame.
+    Аргументы и смысл результата те же, что у simulate_route,
+    но расписание возвращается как RouteSchedule.
     """
     if travel_minutes_fn is None:
         # Используем DispatchEngine по умолчанию (lazy import для избежания циклического импорта)
@@ -53,19 +123,25 @@ def simulate_route(
         
         def default_travel_fn(lat1: float, lon1: float, lat2: float, lon2: float,
                               order_for_ml: Optional[Order] = None, current_time: Optional[datetime] = None) -> float:
-            route = dispatch_engine.calculate_route(lat1, lon1, lat2, lon2)
+            route = dispatch_engine.calculate_route(
+                lat1, lon1, lat2, lon2, geometry=False, departure_time=current_time
+            )
             if route:
                 return route['duration_minutes']
             return 0.0
         
         travel_minutes_fn = default_travel_fn
     
-    # Инициализация
+    # Время высадки пассажира (5-10 мин)
+    buf_min = getattr(params, 'dropoff_buffer_min', dropoff_buffer_min) if params else dropoff_buffer_min
+    
+    schedule = RouteSchedule(driver_start_time)
+    violations = []
+    
+    # Инициализация (время - минуты от начала смены)
     current_lat = driver_start_lat
     current_lng = driver_start_lng
-    current_time = driver_start_time
-    violations = []
-    schedule_rows = []
+    current_min = 0.0
     
     # Обработка каждого заказа
     for order in orders_sequence:
@@ -76,18 +152,16 @@ def simulate_route(
             current_lat, current_lng,
             order.pickup_lat, order.pickup_lon,
             order_for_ml=order,
-            current_time=current_time
+            current_time=schedule.at(current_min)
         )
         
-        # Время прибытия
-        arrive_time = current_time + timedelta(minutes=t_drive_to_pickup_min)
-        
-        # Получаем scheduled_time (желаемое время подачи)
-        scheduled_time = order.desired_pickup_time
+        # Время прибытия и желаемое время подачи
+        arrive_min = current_min + t_drive_to_pickup_min
+        scheduled_min = (order.desired_pickup_time - driver_start_time).total_seconds() / 60.0
         
         # Расчет времени ожидания
-        if arrive_time < scheduled_time:
-            early_arrival_min = (scheduled_time - arrive_time).total_seconds() / 60.0
+        if arrive_min < scheduled_min:
+            early_arrival_min = scheduled_min - arrive_min
             if use_ml and ml_predictor:
                 wait_time_min = ml_predictor.predict_wait_time(order, early_arrival_min)
             else:
@@ -95,68 +169,93 @@ def simulate_route(
         else:
             wait_time_min = 0.0
         
-        # Время начала поездки
-        start_time = max(
-            arrive_time + timedelta(minutes=wait_time_min),
-            scheduled_time
-        )
-        
-        # Дедлайн
-        deadline_time = scheduled_time + timedelta(minutes=wait_limit_min)
+        # Время начала поездки и дедлайн
+        start_min = max(arrive_min + wait_time_min, scheduled_min)
+        deadline_min = scheduled_min + wait_limit_min
         
         # Проверка опоздания
-        is_late = start_time > deadline_time
+        is_late = start_min > deadline_min
         if is_late:
             violations.append(order_id)
-            logger.warning(f'Заказ {order_id} нарушает дедлайн: start_time={start_time}, deadline_time={deadline_time}')
+            logger.warning(f'Заказ {order_id} нарушает дедлайн: start_time={schedule.at(start_min)}, deadline_time={schedule.at(deadline_min)}')
         
         # Расчет времени поездки (pickup → drop)
         t_trip_min = travel_minutes_fn(
             order.pickup_lat, order.pickup_lon,
             order.dropoff_lat, order.dropoff_lon,
             order_for_ml=order,
-            current_time=start_time
+            current_time=schedule.at(start_min)
         )
         
-        # Время высадки пассажира (5-10 мин)
-        buf_min = getattr(params, 'dropoff_buffer_min', dropoff_buffer_min) if params else dropoff_buffer_min
-        
         # Время завершения (поездка + высадка)
-        end_time = start_time + timedelta(minutes=t_trip_min + buf_min)
+        end_min = start_min + t_trip_min + buf_min
         
-        # Сохранение данных в строку расписания
-        schedule_rows.append({
-            'order_id': order_id,
-            'arrive_time': arrive_time,
-            'wait_time_min': wait_time_min,
-            'start_time': start_time,
-            'deadline_time': deadline_time,
-            'end_time': end_time,
-            'is_late': is_late,
-            't_drive_to_pickup_min': t_drive_to_pickup_min,
-            't_trip_min': t_trip_min
-        })
+        schedule.order_ids.append(order_id)
+        schedule.arrive_min.append(arrive_min)
+        schedule.wait_time_min.append(wait_time_min)
+        schedule.start_min.append(start_min)
+        schedule.deadline_min.append(deadline_min)
+        schedule.end_min.append(end_min)
+        schedule.is_late.append(is_late)
+        schedule.t_drive_to_pickup_min.append(t_drive_to_pickup_min)
+        schedule.t_trip_min.append(t_trip_min)
         
         # Обновление позиции
         current_lat = order.dropoff_lat
         current_lng = order.dropoff_lon
-        current_time = end_time
+        current_min = end_min
     
-    # Создание DataFrame
-    schedule_df = pd.DataFrame(schedule_rows)
+    return schedule, len(violations) == 0, violations, schedule.total_time_min
+
+
+def simulate_route(
+    driver_start_lat: float,
+    driver_start_lng: float,
+    driver_start_time: datetime,
+    orders_sequence: List[Order],
+    travel_minutes_fn: Optional[Callable] = None,
+    wait_limit_min: float = 20.0,
+    wait_period_min: float = 20.0,
+    dropoff_buffer_min: float = 7.0,
+    use_ml: bool = False,
+    ml_predictor: Optional[object] = None,
+    params: Optional[object] = None
+) -> Tuple[pd.DataFrame, bool, List[str], float]:
+    """
+    Симулирует выполнение маршрута водителя с последовательностью заказов
+    и проверяет соблюдение временных ограничений.
     
-    # Проверка валидности
-    is_valid = len(violations) == 0
+    Для горячих путей используйте simulate_schedule (без DataFrame).
     
-    # Расчет общего времени выполнения маршрута
-    if len(schedule_rows) > 0:
-        first_order_start = schedule_rows[0]['arrive_time']
-        last_order_end = schedule_rows[-1]['end_time']
-        total_time_min = (last_order_end - first_order_start).total_seconds() / 60.0
-    else:
-        total_time_min = 0.0
+    Args:
+        driver_start_lat: Начальная широта водителя
+        driver_start_lng: Начальная долгота водителя
+        driver_start_time: Время начала работы водителя
+        orders_sequence: Последовательность заказов (список Order объектов)
+        travel_minutes_fn: Функция расчета времени переезда (lat1, lon1, lat2, lon2, order, current_time) -> minutes
+        wait_limit_min: Лимит ожидания (минуты)
+        wait_period_min: Фиксированный период ожидания после scheduled_time (минуты)
+        use_ml: Использовать ML предсказания
+        ml_predictor: ML предсказатель (опционально)
+        params: Параметры алгоритма (опционально)
     
-    return schedule_df, is_valid, violations, total_time_min
+    Returns:
+        schedule_df: DataFrame с расписанием для каждого заказа
+        is_valid: Валидность маршрута (нет нарушений дедлайнов)
+        violations: Список ID заказов с нарушениями дедлайнов
+        total_time_min: Общее время выполнения маршрута (минуты)
+    """
+    schedule, is_valid, violations, total_time_min = simulate_schedule(
+        driver_start_lat, driver_start_lng, driver_start_time, orders_sequence,
+        travel_minutes_fn=travel_minutes_fn,
+        wait_limit_min=wait_limit_min,
+        wait_period_min=wait_period_min,
+        dropoff_buffer_min=dropoff_buffer_min,
+        use_ml=use_ml,
+        ml_predictor=ml_predictor,
+        params=params
+    )
+    return schedule.to_dataframe(), is_valid, violations, total_time_min
 
 
 def create_travel_minutes_function(
@@ -197,7 +296,10 @@ def create_travel_minutes_function(
         Returns:
             Время переезда в минутах
         """
-        route = dispatch_engine.calculate_route(lat1, lon1, lat2, lon2)
+        # Для планирования геометрия не нужна - только время в пути (кэшируется)
+        route = dispatch_engine.calculate_route(
+            lat1, lon1, lat2, lon2, geometry=False, departure_time=current_time
+        )
         if route:
             minutes = route['duration_minutes']
             
@@ -211,23 +313,39 @@ def create_travel_minutes_function(
             return minutes
         
         # Fallback: расчет по прямой линии
-        from geo.services import Geo
-        distance_m = Geo.calculate_distance(lat1, lon1, lat2, lon2)
-        distance_km = distance_m / 1000.0
-        
-        # Используем скорость из параметров или по умолчанию
-        speed_kmh = 50.0
-        if params and hasattr(params, 'speed_kmh'):
-            speed_kmh = params.speed_kmh
-        
-        # Применяем road_factor
-        road_factor = 1.25
-        if params and hasattr(params, 'road_factor'):
-            road_factor = params.road_factor
-        
-        distance_km_adjusted = distance_km * road_factor
-        minutes = (distance_km_adjusted / speed_kmh) * 60.0
-        
-        return minutes
+        return straight_line_minutes(lat1, lon1, lat2, lon2, params)
     
+    # Функции с одним бэкендом маршрутизации считают одинаково (буферы - в params),
+    # поэтому кэш временных шкал (insertion) может переиспользоваться между вызовами
+    travel_minutes_fn.timeline_identity = ('routing', dispatch_engine.routing_backend)
+    # Пакетное заполнение кэша маршрутов для набора пар (dispatch.parallel)
+    travel_minutes_fn.prefetch = dispatch_engine.prefetch_routes
     return travel_minutes_fn
+
+
+def straight_line_minutes(
+    lat1: float,
+    lon1: float,
+    lat2: float,
+    lon2: float,
+    params: Optional[object] = None
+) -> float:
+    """
+    Время переезда по прямой с коэффициентом дороги (fallback без маршрутизатора)
+    """
+    from geo.services import Geo
+    distance_m = Geo.calculate_distance(lat1, lon1, lat2, lon2)
+    distance_km = distance_m / 1000.0
+    
+    # Используем скорость из параметров или по умолчанию
+    speed_kmh = 50.0
+    if params and hasattr(params, 'speed_kmh'):
+        speed_kmh = params.speed_kmh
+    
+    # Применяем road_factor
+    road_factor = 1.25
+    if params and hasattr(params, 'road_factor'):
+        road_factor = params.road_factor
+    
+    distance_km_adjusted = distance_km * road_factor
+    return (distance_km_adjusted / speed_kmh) * 60.0
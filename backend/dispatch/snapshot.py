@@ -0,0 +1,277 @@
+"""
+Снимки (snapshot) водителей, заказов и регионов для алгоритмов планирования
+
+Простые объекты с __slots__ вместо ORM-экземпляров: их можно передавать
+в другие процессы (pickle) и обращаться к полям без ленивых запросов к БД.
+Имена полей совпадают с моделями, поэтому функции из dispatch.insertion и
+dispatch.utils работают и со снимками, и с моделями.
+
+PlanningSnapshot загружает все данные окна планирования фиксированным числом
+запросов, после чего планировщики работают только в памяти, а назначения
+записываются обратно пакетно (PlanningSnapshot.write_back).
+"""
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(slots=True)
+class RegionSnapshot:
+    """Снимок региона"""
+    id: str
+    title: str
+    city_id: Optional[str]
+    center_lat: float
+    center_lon: float
+
+    @classmethod
+    def from_model(cls, region) -> Optional['RegionSnapshot']:
+        if region is None:
+            return None
+        return cls(
+            id=region.id,
+            title=region.title,
+            city_id=region.city_id,
+            center_lat=region.center_lat,
+            center_lon=region.center_lon,
+        )
+
+
+@dataclass(slots=True)
+class DriverSnapshot:
+    """Снимок водителя"""
+    id: int
+    name: str
+    capacity: int
+    is_online: bool
+    current_lat: Optional[float]
+    current_lon: Optional[float]
+    region_id: Optional[str]
+    region: Optional[RegionSnapshot]
+    rating: float = 5.0
+
+    @classmethod
+    def from_model(cls, driver, region: Optional[RegionSnapshot] = None) -> 'DriverSnapshot':
+        if region is None and driver.region_id:
+            region = RegionSnapshot.from_model(driver.region)
+        return cls(
+            id=driver.id,
+            name=driver.name,
+            capacity=driver.capacity,
+            is_online=driver.is_online,
+            current_lat=driver.current_lat,
+            current_lon=driver.current_lon,
+            region_id=driver.region_id,
+            region=region,
+            rating=driver.rating,
+        )
+
+
+@dataclass(slots=True)
+class DriverStatisticsSnapshot:
+    """Снимок DriverStatistics (поля, используемые при скоринге)"""
+    driver_id: int
+    acceptance_rate: float = 1.0
+    cancel_rate: float = 0.0
+
+
+@dataclass(slots=True)
+class OrderSnapshot:
+    """
+    Снимок заказа.
+    pickup_region_id уже содержит fallback на регион пассажира
+    (см. Order.assign_regions), поэтому поле passenger не нужно.
+    """
+    id: str
+    status: str
+    pickup_lat: float
+    pickup_lon: float
+    dropoff_lat: float
+    dropoff_lon: float
+    desired_pickup_time: datetime
+    seats_needed: int
+    pickup_region_id: Optional[str]
+    dropoff_region_id: Optional[str]
+    pickup_region: Optional[RegionSnapshot]
+
+    @classmethod
+    def from_model(cls, order, pickup_region: Optional[RegionSnapshot] = None) -> 'OrderSnapshot':
+        if pickup_region is None and order.pickup_region_id:
+            pickup_region = RegionSnapshot.from_model(order.pickup_region)
+        return cls(
+            id=order.id,
+            status=order.status,
+            pickup_lat=order.pickup_lat,
+            pickup_lon=order.pickup_lon,
+            dropoff_lat=order.dropoff_lat,
+            dropoff_lon=order.dropoff_lon,
+            desired_pickup_time=order.desired_pickup_time,
+            seats_needed=order.seats_needed,
+            pickup_region_id=order.pickup_region_id,
+            dropoff_region_id=order.dropoff_region_id,
+            pickup_region=pickup_region,
+        )
+
+
+class PlanningSnapshot:
+    """
+    Данные окна планирования: регионы, водители, их статистика и заказы.
+
+    load() выполняет не более четырех запросов (индекс регионов, водители,
+    статистика, заказы) независимо от объема данных; связи (регион водителя,
+    регион заказа) уже развернуты в снимки, поэтому в цикле планирования
+    обращений к БД нет.
+    """
+
+    __slots__ = ('day_start', 'day_end', 'regions', 'drivers', 'statistics', 'orders')
+
+    ORDER_FIELDS = (
+        'id', 'status',
+        'pickup_lat', 'pickup_lon', 'dropoff_lat', 'dropoff_lon',
+        'desired_pickup_time', 'has_companion',
+        'pickup_region_id', 'dropoff_region_id', 'passenger__region_id',
+    )
+    DRIVER_FIELDS = (
+        'id', 'name', 'capacity', 'is_online', 'current_lat', 'current_lon', 'region_id', 'rating',
+    )
+
+    def __init__(
+        self,
+        day_start: Optional[datetime],
+        day_end: Optional[datetime],
+        regions: Dict[str, RegionSnapshot],
+        drivers: List[DriverSnapshot],
+        statistics: Dict[int, DriverStatisticsSnapshot],
+        orders: List[OrderSnapshot]
+    ):
+        self.day_start = day_start
+        self.day_end = day_end
+        self.regions = regions
+        self.drivers = drivers
+        self.statistics = statistics
+        self.orders = orders
+
+    @classmethod
+    def load(
+        cls,
+        day_start: Optional[datetime] = None,
+        day_end: Optional[datetime] = None,
+        statuses: Optional[Iterable[str]] = None,
+        online_only: bool = True
+    ) -> 'PlanningSnapshot':
+        """
+        Загружает снимок окна [day_start, day_end).
+
+        Args:
+            day_start: Начало окна (None - без ограничения)
+            day_end: Конец окна (None - без ограничения)
+            statuses: Статусы заказов (по умолчанию - ожидающие назначения)
+            online_only: Только водители онлайн
+        """
+        from accounts.models import Driver, DriverStatistics
+        from orders.models import Order, OrderStatus
+        from regions.services import get_region_index, get_regions_by_coordinates
+
+        if statuses is None:
+            statuses = [
+                OrderStatus.SUBMITTED,
+                OrderStatus.ACTIVE_QUEUE,
+                OrderStatus.AWAITING_DISPATCHER_DECISION,
+            ]
+
+        # 1. Регионы (из индекса, запрос только при его перестроении)
+        regions = {region.id: RegionSnapshot.from_model(region) for region in get_region_index().regions}
+
+        # 2. Водители
+        driver_qs = Driver.objects.all()
+        if online_only:
+            driver_qs = driver_qs.filter(is_online=True)
+        drivers = [
+            DriverSnapshot(region=regions.get(row['region_id']), **row)
+            for row in driver_qs.order_by('id').values(*cls.DRIVER_FIELDS)
+        ]
+
+        # 3. Статистика водителей
+        stats_qs = DriverStatistics.objects.all()
+        if online_only:
+            stats_qs = stats_qs.filter(driver__is_online=True)
+        statistics = {
+            row['driver_id']: DriverStatisticsSnapshot(**row)
+            for row in stats_qs.values('driver_id', 'acceptance_rate', 'cancel_rate')
+        }
+
+        # 4. Заказы окна
+        order_qs = Order.objects.filter(status__in=list(statuses))
+        if day_start is not None:
+            order_qs = order_qs.filter(desired_pickup_time__gte=day_start)
+        if day_end is not None:
+            order_qs = order_qs.filter(desired_pickup_time__lt=day_end)
+        rows = list(order_qs.order_by('desired_pickup_time', 'id').values(*cls.ORDER_FIELDS))
+
+        # Регионы для заказов, сохраненных в обход Order.save() (по индексу, без запросов)
+        missing = [row for row in rows if row['pickup_region_id'] is None or row['dropoff_region_id'] is None]
+        if missing:
+            pickup_found = get_regions_by_coordinates(
+                [row['pickup_lat'] for row in missing], [row['pickup_lon'] for row in missing]
+            )
+            dropoff_found = get_regions_by_coordinates(
+                [row['dropoff_lat'] for row in missing], [row['dropoff_lon'] for row in missing]
+            )
+            for row, pickup_region, dropoff_region in zip(missing, pickup_found, dropoff_found):
+                if row['pickup_region_id'] is None:
+                    row['pickup_region_id'] = pickup_region.id if pickup_region else row['passenger__region_id']
+                if row['dropoff_region_id'] is None and dropoff_region is not None:
+                    row['dropoff_region_id'] = dropoff_region.id
+
+        orders = [
+            OrderSnapshot(
+                id=row['id'],
+                status=row['status'],
+                pickup_lat=row['pickup_lat'],
+                pickup_lon=row['pickup_lon'],
+                dropoff_lat=row['dropoff_lat'],
+                dropoff_lon=row['dropoff_lon'],
+                desired_pickup_time=row['desired_pickup_time'],
+                seats_needed=2 if row['has_companion'] else 1,  # как Order.seats_needed
+                pickup_region_id=row['pickup_region_id'],
+                dropoff_region_id=row['dropoff_region_id'],
+                pickup_region=regions.get(row['pickup_region_id']),
+            )
+            for row in rows
+        ]
+
+        logger.debug(
+            f'Снимок планирования: {len(orders)} заказов, {len(drivers)} водителей, {len(regions)} регионов'
+        )
+        return cls(day_start, day_end, regions, drivers, statistics, orders)
+
+    def write_back(self, routes: Dict[int, List[OrderSnapshot]], reason: Optional[str] = None) -> int:
+        """
+        Пакетно записывает назначения {driver_id: [заказы]} в БД
+        (dispatch.bulk_assign.commit_assignments).
+
+        Returns:
+            Количество обновленных заказов (устаревшие назначения отклоняются)
+        """
+        from dispatch.bulk_assign import PendingAssignment, commit_assignments
+        from orders.models import OrderStatus
+
+        drivers = {driver.id: driver for driver in self.drivers}
+        pending = []
+        for driver_id, route in routes.items():
+            driver = drivers.get(driver_id)
+            description = reason or f'Назначен водитель {driver.name if driver else driver_id} (планирование)'
+            pending.extend(
+                PendingAssignment(order.id, driver_id, order.status, description)
+                for order in route if order.status != OrderStatus.ASSIGNED
+            )
+
+        committed = commit_assignments(pending)
+        for route in routes.values():
+            for order in route:
+                if order.id not in committed.rejected:
+                    order.status = OrderStatus.ASSIGNED
+        return len(committed.written)
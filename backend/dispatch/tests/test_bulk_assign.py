@@ -0,0 +1,114 @@
+"""
+Тесты для пакетной записи назначений
+"""
+from unittest import mock
+
+from django.test import TestCase
+
+from accounts.models import Driver, DriverStatus
+from dispatch import bulk_assign
+from dispatch.bulk_assign import PendingAssignment, commit_assignments, notify_assignments
+from dispatch.services import DispatchEngine
+from orders.models import Order, OrderEvent, OrderStatus
+from regions.services import invalidate_region_index
+from utils.testing import (
+    create_city, create_online_drivers, create_order, create_passenger, create_region, staff_client,
+)
+
+
+class BulkAssignTestCase(TestCase):
+    """Тесты для commit_assignments и auto_assign_all"""
+
+    def setUp(self):
+        invalidate_region_index()
+        DispatchEngine._driver_order_counts.clear()
+        self.region = create_region(create_city(), service_radius_meters=20000)
+        self.passenger = create_passenger(self.region)
+        self.drivers = create_online_drivers(self.region, 3)
+        self.orders = [create_order(f'o{i}', self.passenger) for i in range(4)]
+
+    def tearDown(self):
+        invalidate_region_index()
+        DispatchEngine._driver_order_counts.clear()
+
+    def _pending(self, orders):
+        return [
+            PendingAssignment(order.id, self.drivers[i % 3].id, order.status, 'тест')
+            for i, order in enumerate(orders)
+        ]
+
+    def test_commit_uses_constant_number_of_queries(self):
+        """Число запросов не зависит от количества назначений"""
+        # savepoint, блокировка заказов, блокировка водителей, bulk_update, bulk_create, update водителей, release
+        with self.assertNumQueries(7):
+            result = commit_assignments(self._pending(self.orders[:2]), DriverStatus.ENROUTE_TO_PICKUP, notify=False)
+        self.assertEqual(len(result.written), 2)
+        self.assertEqual(result.rejected, {})
+
+        Driver.objects.update(status=DriverStatus.ONLINE_IDLE)
+        more = [create_order(f'x{i}', self.passenger) for i in range(8)] + self.orders[2:]
+        with self.assertNumQueries(7):
+            commit_assignments(self._pending(more), DriverStatus.ENROUTE_TO_PICKUP, notify=False)
+
+        order = Order.objects.get(id='o1')
+        self.assertEqual(order.status, OrderStatus.ASSIGNED)
+        self.assertEqual(order.driver_id, self.drivers[1].id)
+        self.assertIsNotNone(order.assigned_at)
+        self.assertEqual(OrderEvent.objects.filter(status_to=OrderStatus.ASSIGNED).count(), 12)
+        self.assertEqual(Driver.objects.get(id=self.drivers[0].id).status, DriverStatus.ENROUTE_TO_PICKUP)
+
+    def test_stale_assignments_are_rejected(self):
+        """Заказ, сменивший статус, и занятый водитель не перезаписываются устаревшим планом"""
+        pending = self._pending(self.orders[:3])
+        Order.objects.filter(id='o0').update(status=OrderStatus.CANCELLED)
+        Driver.objects.filter(id=self.drivers[1].id).update(status=DriverStatus.ON_TRIP)
+
+        result = commit_assignments(pending, DriverStatus.ENROUTE_TO_PICKUP, notify=False)
+        self.assertEqual([a.order_id for a in result.written], ['o2'])
+        self.assertEqual(result.rejected, {
+            'o0': bulk_assign.REJECT_ORDER_CHANGED, 'o1': bulk_assign.REJECT_DRIVER_UNAVAILABLE,
+        })
+        self.assertEqual(Order.objects.get(id='o0').status, OrderStatus.CANCELLED)
+        self.assertEqual(Order.objects.get(id='o1').status, OrderStatus.ACTIVE_QUEUE)
+        self.assertEqual(Driver.objects.get(id=self.drivers[1].id).status, DriverStatus.ON_TRIP)
+        self.assertEqual(OrderEvent.objects.filter(status_to=OrderStatus.ASSIGNED).count(), 1)
+
+    def test_notification_is_sent_once_after_commit(self):
+        """После коммита dispatch_map получает одну пачку"""
+        layer = mock.Mock()
+        with mock.patch('orders.signals.get_channel_layer_safe', return_value=layer), \
+                mock.patch('dispatch.bulk_assign.async_to_sync', side_effect=lambda fn: fn):
+            with self.captureOnCommitCallbacks(execute=True) as callbacks:
+                commit_assignments(self._pending(self.orders))
+                layer.group_send.assert_not_called()
+        self.assertEqual(len(callbacks), 1)
+
+        batches = [c for c in layer.group_send.call_args_list if c.args[0] == 'dispatch_map']
+        self.assertEqual(len(batches), 1)
+        self.assertEqual(batches[0].args[1]['type'], 'orders_batch_update')
+        self.assertEqual(len(batches[0].args[1]['data']['orders']), 4)
+        driver_batches = [c for c in layer.group_send.call_args_list if c.args[0].startswith('driver_')]
+        self.assertEqual(len(driver_batches), 3)
+
+    def test_notification_serializes_without_per_order_queries(self):
+        """Сериализация пачки не делает запросов на каждый заказ"""
+        commit_assignments(self._pending(self.orders), notify=False)
+        layer = mock.Mock()
+        with mock.patch('orders.signals.get_channel_layer_safe', return_value=layer), \
+                mock.patch('dispatch.bulk_assign.async_to_sync', side_effect=lambda fn: fn):
+            with self.assertNumQueries(1):
+                notify_assignments([order.id for order in self.orders])
+
+    def test_auto_assign_all_spreads_orders_across_drivers(self):
+        """Водитель из пачки не получает второй заказ (как при последовательной записи)"""
+        client = staff_client()
+
+        response = client.post('/api/dispatch/auto-assign-all/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['assigned'], 3)
+        self.assertEqual(response.data['failed'], 1)
+
+        assigned = Order.objects.filter(status=OrderStatus.ASSIGNED)
+        self.assertEqual(sorted(assigned.values_list('driver_id', flat=True)), sorted(d.id for d in self.drivers))
+        self.assertEqual(OrderEvent.objects.filter(status_to=OrderStatus.ASSIGNED).count(), 3)
+        self.assertFalse(Driver.objects.filter(status=DriverStatus.ONLINE_IDLE).exists())
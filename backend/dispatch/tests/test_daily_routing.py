@@ -0,0 +1,103 @@
+"""
+Тесты для векторного скоринга распределения заказов на день
+"""
+import random
+from datetime import datetime, timedelta, timezone as dt_timezone
+from types import SimpleNamespace
+
+from django.test import TestCase
+
+from dispatch.daily_routing import DailyRoute, DailyScoringEngine, LoadMedian, _compute_ml_score
+
+DAY = datetime(2024, 1, 1, 6, 0, tzinfo=dt_timezone.utc)
+
+
+def _config():
+    return SimpleNamespace(
+        w_eta=0.3, w_deadhead=0.2, w_reject=0.15, w_cancel=0.1, w_fairness=0.25, w_zone=0.0, w_quality=0.1,
+        fairness_scale=2.0, max_deadhead_km=15.0,
+    )
+
+
+def _routes(rng, count):
+    routes = []
+    for i in range(count):
+        located = rng.random() < 0.8
+        driver = SimpleNamespace(
+            id=i, name=f'Водитель {i}', capacity=rng.choice([2, 4]), rating=rng.choice([None, 3.9, 4.4, 5.0]),
+            current_lat=51.0 + rng.random() * 0.2 if located else None,
+            current_lon=71.3 + rng.random() * 0.2 if located else None,
+        )
+        stats = SimpleNamespace(acceptance_rate=rng.random(), cancel_rate=rng.random() * 0.3) if rng.random() < 0.7 else None
+        routes.append(DailyRoute(driver, stats))
+    return routes
+
+
+def _orders(rng, count):
+    orders = [
+        SimpleNamespace(
+            id=f'o{i}',
+            pickup_lat=51.0 + rng.random() * 0.2, pickup_lon=71.3 + rng.random() * 0.2,
+            dropoff_lat=51.0 + rng.random() * 0.2, dropoff_lon=71.3 + rng.random() * 0.2,
+            desired_pickup_time=DAY + timedelta(minutes=rng.randint(0, 14 * 60)),
+            seats_needed=rng.choice([1, 1, 2]), distance_km=rng.choice([None, 3.0, 8.5]),
+        )
+        for i in range(count)
+    ]
+    orders.sort(key=lambda o: o.desired_pickup_time)
+    return orders
+
+
+def _median(values):
+    s = sorted(values)
+    n = len(s)
+    return (s[n // 2 - 1] + s[n // 2]) / 2.0 if n % 2 == 0 else s[n // 2]
+
+
+class DailyScoringEngineTestCase(TestCase):
+    """Тесты для DailyScoringEngine и LoadMedian"""
+
+    def test_load_median_matches_sort(self):
+        """Инкрементальная медиана совпадает с сортировкой"""
+        rng = random.Random(1)
+        for size in (1, 2, 7, 10):
+            loads = [rng.randint(0, 3) for _ in range(size)]
+            median = LoadMedian(loads)
+            for _ in range(60):
+                i = rng.randrange(size)
+                median.add(loads[i])
+                loads[i] += 1
+                self.assertEqual(median.median, _median(loads))
+
+    def test_engine_matches_per_pair_scoring(self):
+        """Выбор водителя совпадает с поштучным _compute_ml_score"""
+        config = _config()
+        rng = random.Random(2)
+        reference_routes = _routes(random.Random(3), 25)
+        engine_routes = _routes(random.Random(3), 25)
+        orders = _orders(rng, 120)
+        engine = DailyScoringEngine(engine_routes, config)
+
+        for order in orders:
+            # Эталон: полный перебор маршрутов (как до векторизации)
+            median = _median([r.total_orders for r in reference_routes])
+            scores = [
+                _compute_ml_score(route, order, config, median)
+                for route in reference_routes
+                if route.can_take_order(order) and route.deadhead_km_to(order) <= config.max_deadhead_km
+            ]
+            scores.sort(key=lambda s: s.cost)
+
+            index, deadhead = engine.best_route(order)
+            if not scores:
+                self.assertIsNone(index)
+                continue
+            self.assertEqual(engine_routes[index].driver.id, scores[0].driver_id)
+            self.assertAlmostEqual(engine.median, median)
+
+            winner = _compute_ml_score(engine_routes[index], order, config, engine.median, deadhead)
+            self.assertEqual(winner.details, scores[0].details)
+
+            reference_routes[index].add_order(order)
+            engine_routes[index].add_order(order)
+            engine.add_order(index, order)
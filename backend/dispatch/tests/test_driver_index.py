@@ -0,0 +1,185 @@
+"""
+Тесты для индекса ближайших водителей (dispatch.driver_index)
+"""
+import random
+
+from django.core.cache import cache
+from django.test import TestCase
+
+from accounts.locations import DEFAULT_LOCATION_PIPELINE_SETTINGS, LocationPipeline
+from accounts.models import Driver, DriverStatus
+from dispatch.bulk_assign import PendingAssignment, commit_assignments
+from dispatch.driver_index import VERSION_KEY, DriverIndex, IndexedDriver, get_driver_index, invalidate_driver_index
+from dispatch.matching_service import MatchingService
+from dispatch.services import DispatchEngine
+from geo.services import Geo
+from orders.models import DispatchConfig, OrderStatus
+from utils.testing import create_city, create_driver, create_order, create_passenger, create_region
+
+
+class DriverIndexTestCase(TestCase):
+    """Тесты для поиска по сетке без БД"""
+
+    def setUp(self):
+        rng = random.Random(7)
+        self.drivers = [
+            IndexedDriver(
+                id=i,
+                region_id=rng.choice(['a', 'b']),
+                status=rng.choice([DriverStatus.ONLINE_IDLE, DriverStatus.ON_TRIP]),
+                is_online=rng.random() < 0.9,
+                capacity=rng.randint(1, 6),
+                current_lat=51.15 + rng.uniform(-0.3, 0.3),
+                current_lon=71.45 + rng.uniform(-0.3, 0.3),
+            )
+            for i in range(2000)
+        ]
+        self.index = DriverIndex(self.drivers)
+
+    def _brute_force(self, lat, lon, k, radius_m=None, min_capacity=0):
+        found = []
+        for driver in self.drivers:
+            if not (driver.is_online and driver.region_id == 'a' and driver.status == DriverStatus.ONLINE_IDLE):
+                continue
+            if driver.capacity < min_capacity:
+                continue
+            distance = Geo.calculate_fast_distance(lat, lon, driver.current_lat, driver.current_lon)
+            if radius_m is None or distance <= radius_m:
+                found.append((driver.id, distance))
+        found.sort(key=lambda item: (item[1], item[0]))
+        return found[:k]
+
+    def test_nearest_matches_full_scan(self):
+        """Кольцевой поиск дает тот же результат, что полный перебор"""
+        rng = random.Random(11)
+        for _ in range(50):
+            lat, lon = 51.15 + rng.uniform(-0.35, 0.35), 71.45 + rng.uniform(-0.35, 0.35)
+            k = rng.choice([1, 5, 20])
+            radius_m = rng.choice([None, 3000, 15000])
+            min_capacity = rng.choice([0, 4])
+            self.assertEqual(
+                self.index.nearest(
+                    lat, lon, region_id='a', statuses=[DriverStatus.ONLINE_IDLE],
+                    min_capacity=min_capacity, k=k, radius_m=radius_m,
+                ),
+                self._brute_force(lat, lon, k, radius_m, min_capacity),
+            )
+
+    def test_updates_move_driver_between_buckets(self):
+        """Смена статуса и позиции сразу видна в запросах"""
+        driver = next(d for d in self.drivers if d.is_online and d.region_id == 'a'
+                      and d.status == DriverStatus.ONLINE_IDLE)
+        self.index.update(driver.id, current_lat=60.0, current_lon=30.0)
+        nearest = self.index.nearest(60.0, 30.0, region_id='a', statuses=[DriverStatus.ONLINE_IDLE], k=1)
+        self.assertEqual(nearest, [(driver.id, 0.0)])
+
+        self.index.update(driver.id, status=DriverStatus.ON_TRIP)
+        self.assertEqual(
+            self.index.nearest(60.0, 30.0, region_id='a', statuses=[DriverStatus.ONLINE_IDLE], radius_m=1000), []
+        )
+        self.index.remove(driver.id)
+        self.assertEqual(self.index.nearest(60.0, 30.0, k=1, radius_m=1000), [])
+
+
+class DriverIndexSyncTestCase(TestCase):
+    """Тесты для обновления индекса и отбора кандидатов DispatchEngine"""
+
+    def setUp(self):
+        cache.clear()
+        invalidate_driver_index()
+        self.region = create_region(create_city())
+        self.passenger = create_passenger(self.region)
+        self.drivers = [
+            create_driver(
+                self.region, i, is_online=True, status=DriverStatus.ONLINE_IDLE,
+                current_lat=51.15 + (3 - i) * 0.01, current_lon=71.45,
+            )
+            for i in range(3)
+        ]
+        self.order = create_order('o1', self.passenger, pickup_region=self.region)
+
+    def tearDown(self):
+        invalidate_driver_index()
+
+    def _nearest_ids(self):
+        return [
+            driver_id for driver_id, _ in get_driver_index().nearest(
+                51.15, 71.45, region_id='a', statuses=[DriverStatus.ONLINE_IDLE],
+            )
+        ]
+
+    def test_candidates_are_ordered_by_distance(self):
+        """Кандидаты DispatchEngine идут от ближайшего к подаче"""
+        candidates = DispatchEngine()._find_candidates(self.order)
+        self.assertEqual([d.id for d in candidates], [d.id for d in reversed(self.drivers)])
+
+    def test_index_follows_saves_locations_and_assignments(self):
+        """Сохранение водителя, запись позиций и пакетное назначение обновляют индекс"""
+        self.assertEqual(self._nearest_ids(), [d.id for d in reversed(self.drivers)])
+
+        self.drivers[2].status = DriverStatus.PAUSED
+        self.drivers[2].save(update_fields=['status'])
+        self.assertEqual(self._nearest_ids(), [self.drivers[1].id, self.drivers[0].id])
+
+        pipeline = LocationPipeline({**DEFAULT_LOCATION_PIPELINE_SETTINGS, 'EAGER': True})
+        pipeline._fan_out = lambda fixes: None
+        pipeline.ingest(self.drivers[0].id, 51.1501, 71.45)
+        self.assertEqual(self._nearest_ids(), [self.drivers[0].id, self.drivers[1].id])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            commit_assignments(
+                [PendingAssignment('o1', self.drivers[0].id, OrderStatus.ACTIVE_QUEUE)],
+                driver_status=DriverStatus.ENROUTE_TO_PICKUP, notify=False,
+            )
+        self.assertEqual(self._nearest_ids(), [self.drivers[1].id])
+
+    def test_stale_index_is_checked_in_database(self):
+        """Изменения в обход сигналов не дают лишних кандидатов"""
+        get_driver_index()
+        Driver.objects.filter(id=self.drivers[2].id).update(status=DriverStatus.ON_TRIP)
+        self.assertIn(self.drivers[2].id, self._nearest_ids())
+
+        candidates = DispatchEngine()._find_candidates(self.order)
+        self.assertEqual([d.id for d in candidates], [self.drivers[1].id, self.drivers[0].id])
+
+    def test_steady_state_uses_index(self):
+        """Без изменений в других процессах отбор идет через индекс, а не полным запросом"""
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        index = get_driver_index()
+        index.built_at -= 30
+        self.drivers[2].status = DriverStatus.PAUSED
+        with self.captureOnCommitCallbacks(execute=True):
+            self.drivers[2].save(update_fields=['status'])
+        # Свое изменение уже в индексе - перестраивать нечего
+        self.assertEqual(index.version, cache.get(VERSION_KEY))
+
+        with CaptureQueriesContext(connection) as queries:
+            DispatchEngine()._find_candidates(self.order)
+            MatchingService(DispatchConfig(k_candidates=5))._filter_candidates(self.order)
+        self.assertIs(get_driver_index(), index)
+        driver_queries = [q['sql'] for q in queries.captured_queries if 'FROM "accounts_driver"' in q['sql']]
+        self.assertEqual(len(driver_queries), 2)
+        for sql in driver_queries:
+            self.assertIn('"accounts_driver"."id" IN', sql)
+
+    def test_availability_change_in_other_process_rebuilds_index(self):
+        """Водитель, освободившийся в другом процессе, виден по общей версии без ожидания MAX_AGE_SECONDS"""
+        Driver.objects.filter(id=self.drivers[0].id).update(status=DriverStatus.ON_TRIP)
+        index = get_driver_index()
+        Driver.objects.filter(id=self.drivers[0].id).update(status=DriverStatus.ONLINE_IDLE)
+        expected = [d.id for d in reversed(self.drivers)]
+
+        candidates = DispatchEngine()._find_candidates(self.order)
+        self.assertEqual([d.id for d in candidates], expected[:2])
+
+        # Другой процесс зафиксировал изменение и увеличил версию
+        cache.set(VERSION_KEY, (cache.get(VERSION_KEY) or 0) + 1)
+        candidates = DispatchEngine()._find_candidates(self.order)
+        self.assertEqual([d.id for d in candidates], expected)
+        self.assertIsNot(get_driver_index(), index)
+        self.assertIn(
+            str(self.drivers[0].id),
+            [c['driver_id'] for c in DispatchEngine().get_candidates(self.order, include_offline=False)],
+        )
@@ -0,0 +1,87 @@
+"""
+Тесты для ETA по ходу движения по маршруту (dispatch.eta_tracker)
+"""
+from types import SimpleNamespace
+from unittest import mock
+
+from django.test import TestCase
+
+from dispatch.eta_tracker import DEFAULT_ETA_TRACKER_SETTINGS, EtaTracker
+from dispatch.route_cache import RouteCache
+from dispatch.services import DispatchEngine, RoutingBackend
+
+
+def _straight_route(lat1, lon1, lat2, lon2, geometry=True):
+    """Маршрут по прямой из 10 отрезков; первая половина вдвое медленнее второй"""
+    points = [[lat1 + (lat2 - lat1) * i / 10, lon1 + (lon2 - lon1) * i / 10] for i in range(11)]
+    segment_durations = [40.0] * 5 + [20.0] * 5
+    return {
+        'route': points,
+        'distance_m': 11000,
+        'distance_km': 11.0,
+        'duration_seconds': 300,
+        'duration_minutes': 5,
+        'segment_durations': segment_durations,
+    }
+
+
+class EtaTrackerTestCase(TestCase):
+    """Тесты для EtaTracker"""
+
+    def setUp(self):
+        self.backend = mock.Mock(spec=RoutingBackend)
+        self.backend.name = 'fake'
+        self.backend.route.side_effect = _straight_route
+        self.engine = DispatchEngine(routing_backend=self.backend)
+        self.cache_patch = mock.patch('dispatch.services.get_route_cache', return_value=RouteCache(enabled=False))
+        self.cache_patch.start()
+        self.tracker = EtaTracker(dict(DEFAULT_ETA_TRACKER_SETTINGS))
+        self.order = SimpleNamespace(id='o1', pickup_lat=51.20, pickup_lon=71.45)
+
+    def tearDown(self):
+        self.cache_patch.stop()
+
+    def _eta(self, lat, lon):
+        driver = SimpleNamespace(id=1, current_lat=lat, current_lon=lon)
+        return self.tracker.eta(driver, self.order, engine=self.engine)
+
+    def test_progress_along_route_does_not_reroute(self):
+        """Позиции на маршруте считаются по сохраненной полилинии"""
+        first = self._eta(51.10, 71.45)
+        self.assertEqual(first['duration_seconds'], 300)
+
+        # Половина пути (медленная часть пройдена) - осталось 100 с из 300
+        middle = self._eta(51.15, 71.4501)
+        self.assertEqual(middle['duration_seconds'], 100)
+        self.assertEqual(middle['distance_km'], 5.5)
+
+        self.assertEqual(self._eta(51.19, 71.45)['duration_seconds'], 20)
+        self.assertEqual(self.backend.route.call_count, 1)
+        self.assertEqual(self.tracker.stats['tracked'], 2)
+
+    def test_deviation_and_timer_reroute(self):
+        """Отклонение от маршрута, устаревший маршрут и новая точка подачи - новый запрос маршрута"""
+        self._eta(51.10, 71.45)
+        self._eta(51.15, 71.47)  # ~1.4 км в сторону
+        self.assertEqual(self.backend.route.call_count, 2)
+        self.assertEqual(self.tracker.stats['deviations'], 1)
+
+        self.tracker.options['REROUTE_INTERVAL_SECONDS'] = 0
+        self._eta(51.16, 71.47)
+        self.assertEqual(self.backend.route.call_count, 3)
+
+        self.tracker.options['REROUTE_INTERVAL_SECONDS'] = 300
+        self.order.pickup_lat = 51.25
+        self._eta(51.16, 71.47)
+        self.assertEqual(self.backend.route.call_count, 4)
+
+    def test_forget_and_bounded_size(self):
+        """Маршруты освобождаются по заказу и вытесняются сверх MAX_ENTRIES"""
+        self.tracker.options['MAX_ENTRIES'] = 2
+        for i in range(3):
+            self.order.id = f'o{i}'
+            self._eta(51.10, 71.45)
+        self.assertEqual(len(self.tracker), 2)
+
+        self.tracker.forget('o2')
+        self.assertEqual(len(self.tracker), 1)
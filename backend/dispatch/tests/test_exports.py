@@ -0,0 +1,72 @@
+"""
+Тесты для потокового экспорта ZIP/CSV
+"""
+import io
+import zipfile
+from datetime import date, timedelta
+
+from django.test import TestCase
+from django.utils import timezone
+
+from dispatch.exports import build_daily_routes_zip, csv_lines, stream_zip
+from orders.models import OrderStatus
+from utils.testing import create_city, create_driver, create_order, create_passenger, create_region, staff_client
+
+
+class StreamZipTestCase(TestCase):
+    """Тесты для stream_zip и экспорта маршрутов дня"""
+
+    def test_stream_zip_yields_chunks_and_valid_archive(self):
+        """Архив отдается кусками и читается стандартным zipfile"""
+        rows = ([i, f'строка {i}', i * 1.5] for i in range(5000))
+        chunks = list(stream_zip([('a.csv', csv_lines(rows, bom=True)), ('b.csv', iter(['x\r\n']))], chunk_size=4096))
+        self.assertGreater(len(chunks), 1)
+
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(chunks)))
+        self.assertEqual(archive.namelist(), ['a.csv', 'b.csv'])
+        lines = archive.read('a.csv').decode('utf-8-sig').splitlines()
+        self.assertEqual(len(lines), 5000)
+        self.assertEqual(lines[10], '10,строка 10,15.0')
+
+    def test_daily_routes_zip_content(self):
+        """Маршрутный лист водителя в архиве"""
+        routes = [{
+            'driver': {'id': 7, 'name': 'Иван Петров', 'phone': '+7700'},
+            'orders': [{'id': 'o1', 'passenger_name': 'Пассажир', 'desired_pickup_time': '2024-01-01T08:30:00',
+                        'estimated_price': '1500.40', 'has_companion': True}],
+            'total_orders': 1,
+            'total_distance_km': 4.2,
+        }]
+        archive = zipfile.ZipFile(io.BytesIO(build_daily_routes_zip(routes, date(2024, 1, 1))))
+        self.assertEqual(archive.namelist(), ['marshrut_2024-01-01_7_Иван_Петров.csv'])
+        content = archive.read(archive.namelist()[0]).decode('utf-8-sig')
+        self.assertIn('1;o1;Пассажир;;;08:30;Да;;;1500;', content)
+        self.assertIn('Итого заказов:;1', content)
+
+
+class ExportByDriversTestCase(TestCase):
+    """Тесты для потокового export-by-drivers"""
+
+    def setUp(self):
+        region = create_region(create_city())
+        passenger = create_passenger(region)
+        drivers = [create_driver(region, i) for i in range(2)]
+        for i in range(5):
+            create_order(
+                f'o{i}', passenger, driver=drivers[i % 2] if i < 4 else None, status=OrderStatus.ASSIGNED,
+                desired_pickup_time=timezone.now() + timedelta(hours=i),
+            )
+        self.client = staff_client()
+
+    def test_export_streams_csv_per_driver(self):
+        """Ответ потоковый, в архиве CSV на каждого водителя"""
+        response = self.client.get('/api/orders/export-by-drivers/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(len(archive.namelist()), 2)
+        for name in archive.namelist():
+            lines = archive.read(name).decode('utf-8-sig').splitlines()
+            self.assertEqual(lines[0].split(',')[0], 'order_id')
+            self.assertEqual(len(lines), 3)
@@ -0,0 +1,60 @@
+"""
+Тесты для векторных расчетов расстояний (geo.services.Geo)
+"""
+import random
+
+import numpy as np
+from django.test import TestCase
+
+from geo.services import Geo
+
+
+class GeoDistanceTestCase(TestCase):
+    """Тесты для пакетных расстояний и быстрого пути"""
+
+    def setUp(self):
+        rng = random.Random(3)
+        self.lats = [51.0 + rng.random() * 0.3 for _ in range(40)]
+        self.lons = [71.3 + rng.random() * 0.3 for _ in range(40)]
+
+    def _scalar(self, lat1, lon1, lat2, lon2):
+        return Geo.calculate_distance(lat1, lon1, lat2, lon2)
+
+    def test_one_to_many_matches_scalar(self):
+        """Расстояния от точки совпадают со скалярным Haversine"""
+        result = Geo.calculate_distances(51.1, 71.4, self.lats, self.lons)
+        expected = [self._scalar(51.1, 71.4, lat, lon) for lat, lon in zip(self.lats, self.lons)]
+        np.testing.assert_allclose(result, expected, rtol=1e-9)
+
+    def test_matrix_and_pairwise_match_scalar(self):
+        """Матрица и попарные расстояния совпадают со скалярным Haversine"""
+        matrix = Geo.calculate_distance_matrix(self.lats[:5], self.lons[:5], self.lats, self.lons)
+        self.assertEqual(matrix.shape, (5, 40))
+        self.assertAlmostEqual(matrix[2, 7], self._scalar(self.lats[2], self.lons[2], self.lats[7], self.lons[7]), places=6)
+
+        pairwise = Geo.calculate_pairwise_distances(self.lats[:20], self.lons[:20], self.lats[20:], self.lons[20:])
+        expected = [
+            self._scalar(a, b, c, d)
+            for a, b, c, d in zip(self.lats[:20], self.lons[:20], self.lats[20:], self.lons[20:])
+        ]
+        np.testing.assert_allclose(pairwise, expected, rtol=1e-9)
+
+    def test_path_distances(self):
+        """Длины отрезков ломаной"""
+        steps = Geo.calculate_path_distances(self.lats, self.lons)
+        self.assertEqual(len(steps), 39)
+        self.assertAlmostEqual(steps[10], self._scalar(self.lats[10], self.lons[10], self.lats[11], self.lons[11]), places=6)
+        self.assertEqual(len(Geo.calculate_path_distances([51.0], [71.0])), 0)
+
+    def test_fast_distance_error_is_bounded(self):
+        """Быстрый путь отличается от Haversine меньше чем на 0.01%"""
+        rng = random.Random(5)
+        for _ in range(2000):
+            lat1, lon1 = rng.uniform(-70, 70), rng.uniform(-179, 179)
+            lat2, lon2 = lat1 + rng.uniform(-0.3, 0.3), lon1 + rng.uniform(-0.3, 0.3)
+            exact = self._scalar(lat1, lon1, lat2, lon2)
+            fast = Geo.calculate_fast_distance(lat1, lon1, lat2, lon2)
+            self.assertLessEqual(abs(fast - exact), exact * 1e-4 + 1e-6)
+
+        # Дальние отрезки считаются по Haversine
+        self.assertEqual(Geo.calculate_fast_distance(51.0, 71.0, 43.2, 76.9), self._scalar(51.0, 71.0, 43.2, 76.9))
@@ -0,0 +1,221 @@
+"""
+Тесты для инкрементальной оценки вставки заказа
+"""
+import random
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from unittest import mock
+
+import pandas as pd
+from django.test import TestCase
+
+from dispatch.config import DispatchParams
+from dispatch.insertion import _calculate_risk_penalty, best_insertion, clear_timeline_cache
+from dispatch.simulator import RouteSchedule, simulate_route, simulate_schedule
+from geo.services import Geo
+
+START = datetime(2024, 1, 1, 7, 0)
+
+
+def _travel_minutes(lat1, lon1, lat2, lon2, order_for_ml=None, current_time=None):
+    """Время в пути по прямой 30 км/ч (не зависит от времени суток)"""
+    return Geo.calculate_distance(lat1, lon1, lat2, lon2) / 500.0
+
+
+def _order(order_id, rng):
+    return SimpleNamespace(
+        id=order_id,
+        pickup_lat=51.1 + rng.random() * 0.1, pickup_lon=71.4 + rng.random() * 0.1,
+        dropoff_lat=51.1 + rng.random() * 0.1, dropoff_lon=71.4 + rng.random() * 0.1,
+        desired_pickup_time=START + timedelta(minutes=rng.randint(30, 600)),
+        seats_needed=1, pickup_region_id=None, dropoff_region_id=None, passenger=None,
+    )
+
+
+def _brute_force(driver, route, new_order, params):
+    """Полный перебор позиций с симуляцией каждой (эталон)"""
+    def simulate(sequence):
+        return simulate_schedule(
+            driver.current_lat, driver.current_lon, START, sequence,
+            travel_minutes_fn=_travel_minutes, wait_limit_min=params.wait_limit_min, params=params
+        )
+
+    original_total = simulate(route)[3] if route else 0.0
+    best = (None, float('inf'))
+    for pos in range(len(route) + 1):
+        schedule, is_valid, _, total = simulate(route[:pos] + [new_order] + route[pos:])
+        if not is_valid:
+            continue
+        cost = total - original_total + _calculate_risk_penalty(schedule, new_order, params) + \
+            params.imbalance_weight * len(route)
+        if cost < best[1]:
+            best = (pos, cost)
+    return best
+
+
+class BestInsertionTestCase(TestCase):
+    """Тесты для best_insertion"""
+
+    def setUp(self):
+        clear_timeline_cache()
+        self.params = DispatchParams(max_orders_per_driver=50)
+        self.travel_patch = mock.patch(
+            'dispatch.insertion.create_travel_minutes_function', return_value=_travel_minutes
+        )
+        self.travel_patch.start()
+
+    def tearDown(self):
+        self.travel_patch.stop()
+        clear_timeline_cache()
+
+    def test_matches_full_simulation(self):
+        """Инкрементальная оценка выбирает ту же позицию, что и полный перебор"""
+        rng = random.Random(1)
+        for scenario in range(5):
+            driver = SimpleNamespace(id=scenario, capacity=4, current_lat=51.15, current_lon=71.45, region=None)
+            route = []
+            for i in range(25):
+                new_order = _order(f'{scenario}-{i}', rng)
+                expected_pos, expected_cost = _brute_force(driver, route, new_order, self.params)
+                pos, schedule, cost, debug_info = best_insertion(driver, route, new_order, START, self.params)
+
+                self.assertEqual(pos, expected_pos)
+                if pos is not None:
+                    self.assertAlmostEqual(cost, expected_cost, places=4)
+                    self.assertEqual(len(schedule), len(route) + 1)
+                    route.insert(pos, new_order)
+
+    def test_only_chosen_position_is_simulated(self):
+        """Полная симуляция выполняется только для выбранной позиции"""
+        driver = SimpleNamespace(id=1, capacity=4, current_lat=51.15, current_lon=71.45, region=None)
+        rng = random.Random(3)
+        route = []
+        for i in range(10):
+            order = _order(f'o{i}', rng)
+            order.desired_pickup_time = START + timedelta(hours=i + 1)
+            route.append(order)
+        new_order = _order('new', rng)
+        new_order.desired_pickup_time = START + timedelta(hours=4, minutes=30)
+
+        with mock.patch('dispatch.insertion.simulate_schedule', wraps=simulate_schedule) as simulate:
+            pos, _, _, debug_info = best_insertion(driver, route, new_order, START, self.params)
+            # Шкала текущего маршрута + выбранная позиция
+            self.assertEqual(simulate.call_count, 2)
+
+            # Для того же маршрута шкала берется из кэша
+            other_order = _order('other', rng)
+            other_order.desired_pickup_time = START + timedelta(hours=7, minutes=30)
+            best_insertion(driver, route, other_order, START, self.params)
+            self.assertEqual(simulate.call_count, 3)
+
+        self.assertIsNotNone(pos)
+        self.assertEqual(debug_info['positions_tried'], 11)
+
+    def test_timeline_cache_is_keyed_by_travel_function(self):
+        """Шкала, построенная с другой функцией времени в пути, не переиспользуется"""
+        driver = SimpleNamespace(id=1, capacity=4, current_lat=51.15, current_lon=71.45, region=None)
+        rng = random.Random(4)
+        route = sorted((_order(f'o{i}', rng) for i in range(5)), key=lambda o: o.desired_pickup_time)
+        new_order = _order('new', rng)
+
+        def slow_travel_minutes(lat1, lon1, lat2, lon2, order_for_ml=None, current_time=None):
+            return _travel_minutes(lat1, lon1, lat2, lon2) * 3
+
+        best_insertion(driver, route, new_order, START, self.params)
+        with mock.patch('dispatch.insertion.simulate_schedule', wraps=simulate_schedule) as simulate:
+            best_insertion(driver, route, new_order, START, self.params, travel_minutes_fn=slow_travel_minutes)
+            timelines = [c for c in simulate.call_args_list if len(c.args[3]) == len(route)]
+            self.assertEqual(len(timelines), 1)
+            self.assertIs(timelines[0].kwargs['travel_minutes_fn'], slow_travel_minutes)
+
+
+class SimulatorTestCase(TestCase):
+    """Тесты для компактного расписания симулятора"""
+
+    def test_schedule_matches_dataframe(self):
+        """RouteSchedule и DataFrame из simulate_route совпадают"""
+        rng = random.Random(5)
+        orders = [_order(f'o{i}', rng) for i in range(5)]
+        orders.sort(key=lambda o: o.desired_pickup_time)
+
+        schedule, is_valid, violations, total = simulate_schedule(
+            51.15, 71.45, START, orders, travel_minutes_fn=_travel_minutes
+        )
+        schedule_df, df_valid, df_violations, df_total = simulate_route(
+            51.15, 71.45, START, orders, travel_minutes_fn=_travel_minutes
+        )
+
+        self.assertEqual((is_valid, violations, total), (df_valid, df_violations, df_total))
+        self.assertEqual(list(schedule_df.columns), RouteSchedule.COLUMNS)
+        self.assertEqual(list(schedule_df['order_id']), [str(o.id) for o in orders])
+        index = schedule.index_of('o3') if schedule.index_of('o3') is not None else 0
+        row = schedule_df.iloc[index]
+        self.assertEqual(row['start_time'], schedule.at(schedule.start_min[index]))
+        self.assertAlmostEqual(
+            (row['deadline_time'] - row['start_time']).total_seconds() / 60.0, schedule.slack_min(index), places=4
+        )
+
+    def test_dataframe_is_built_lazily(self):
+        """DataFrame строится только при запросе и один раз"""
+        schedule, _, _, _ = simulate_schedule(51.15, 71.45, START, [], travel_minutes_fn=_travel_minutes)
+        self.assertTrue(schedule.empty)
+        with mock.patch('dispatch.simulator.pd.DataFrame', wraps=pd.DataFrame) as frame:
+            rng = random.Random(6)
+            schedule, _, _, _ = simulate_schedule(
+                51.15, 71.45, START, [_order('o1', rng)], travel_minutes_fn=_travel_minutes
+            )
+            self.assertEqual(frame.call_count, 0)
+            self.assertIs(schedule.to_dataframe(), schedule.to_dataframe())
+            self.assertEqual(frame.call_count, 1)
+
+
+class ParallelAssignTestCase(TestCase):
+    """Тесты для параллельной оценки кандидатов в assign_order"""
+
+    def setUp(self):
+        clear_timeline_cache()
+        self.patches = [
+            mock.patch('dispatch.insertion.create_travel_minutes_function', return_value=_travel_minutes),
+            mock.patch('dispatch.parallel.create_travel_minutes_function', return_value=_travel_minutes),
+        ]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        from dispatch.parallel import shutdown_executor
+
+        shutdown_executor()
+        for patch in self.patches:
+            patch.stop()
+        clear_timeline_cache()
+
+    def _plan(self, params):
+        from dispatch.dispatcher import assign_order
+
+        rng = random.Random(11)
+        drivers = [
+            SimpleNamespace(
+                id=i, name=f'Водитель {i}', capacity=4, is_online=True,
+                current_lat=51.1 + rng.random() * 0.1, current_lon=71.4 + rng.random() * 0.1,
+                region=None, region_id=None, rating=5.0,
+            )
+            for i in range(6)
+        ]
+        routes = {}
+        assignments = []
+        for i in range(30):
+            order = _order(f'o{i}', rng)
+            order.status = 'active_queue'
+            result = assign_order(drivers, routes, order, START, params)
+            driver_id = result['chosen_driver_id']
+            assignments.append((driver_id, result['insert_position']))
+            if driver_id is not None:
+                routes.setdefault(driver_id, []).insert(result['insert_position'], order)
+        return assignments
+
+    def test_parallel_matches_serial(self):
+        """Параллельный режим дает те же назначения, что и последовательный"""
+        serial = self._plan(DispatchParams())
+        parallel = self._plan(DispatchParams(parallel_workers=2, parallel_min_candidates=1))
+        self.assertEqual(serial, parallel)
+        self.assertTrue(any(driver_id is not None for driver_id, _ in serial))
@@ -0,0 +1,105 @@
+"""
+Тесты для фоновых задач планирования
+"""
+from datetime import timedelta
+from unittest import mock
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from dispatch.models import PlanningJob, PlanningJobKind, PlanningJobStatus
+from dispatch.services import DispatchEngine
+from orders.models import Order, OrderStatus
+from regions.services import invalidate_region_index
+from utils.testing import (
+    create_city, create_online_drivers, create_order, create_passenger, create_region, staff_client,
+)
+
+
+@override_settings(PLANNING_JOBS={'EAGER': True, 'PROGRESS_INTERVAL_SECONDS': 0})
+class PlanningJobTestCase(TestCase):
+    """Тесты для dispatch.jobs и API planning-jobs"""
+
+    def setUp(self):
+        invalidate_region_index()
+        DispatchEngine._driver_order_counts.clear()
+        region = create_region(create_city(), service_radius_meters=20000)
+        passenger = create_passenger(region)
+        create_online_drivers(region, 2)
+        for i in range(3):
+            create_order(f'o{i}', passenger)
+        self.client = staff_client()
+
+    def tearDown(self):
+        invalidate_region_index()
+        DispatchEngine._driver_order_counts.clear()
+
+    def test_auto_assign_all_async_streams_progress(self):
+        """Задача выполняется, прогресс уходит в dispatch_map, результат доступен по API"""
+        layer = mock.Mock()
+        with mock.patch('orders.signals.get_channel_layer_safe', return_value=layer), \
+                mock.patch('dispatch.jobs.async_to_sync', side_effect=lambda fn: fn):
+            response = self.client.post('/api/dispatch/auto-assign-all/?async=1')
+        self.assertEqual(response.status_code, 202)
+        job_id = response.data['job_id']
+        self.assertIn(job_id, response.data['status_url'])
+
+        messages = [
+            c.args[1]['data'] for c in layer.group_send.call_args_list
+            if c.args[1]['type'] == 'planning_job_progress'
+        ]
+        self.assertEqual(messages[0]['status'], PlanningJobStatus.QUEUED)
+        self.assertEqual(messages[-1]['status'], PlanningJobStatus.DONE)
+        progress = [m['progress'] for m in messages if m['status'] == PlanningJobStatus.RUNNING]
+        self.assertEqual(progress, sorted(progress))
+        self.assertIn(1.0, progress)
+
+        status_response = self.client.get(f'/api/dispatch/planning-jobs/{job_id}/')
+        self.assertEqual(status_response.data['status'], PlanningJobStatus.DONE)
+        result = self.client.get(f'/api/dispatch/planning-jobs/{job_id}/result/')
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(result.data['assigned'], 2)
+        self.assertEqual(Order.objects.filter(status=OrderStatus.ASSIGNED).count(), 2)
+
+    def test_failed_export_and_unfinished_job(self):
+        """Ошибка задачи сохраняется; результат незавершенной задачи - 409"""
+        response = self.client.get('/api/dispatch/daily-routes-export/?async=1&date=2000-01-01')
+        self.assertEqual(response.status_code, 202)
+        job = PlanningJob.objects.get(id=response.data['job_id'])
+        self.assertEqual(job.status, PlanningJobStatus.FAILED)
+        self.assertIn('Нет маршрутов', job.error)
+        self.assertEqual(self.client.get(f'/api/dispatch/planning-jobs/{job.id}/result/').status_code, 422)
+
+        queued = PlanningJob.objects.create(kind=PlanningJobKind.DAILY_ROUTES)
+        self.assertEqual(self.client.get(f'/api/dispatch/planning-jobs/{queued.id}/result/').status_code, 409)
+        self.assertEqual(self.client.get('/api/dispatch/planning-jobs/unknown/').status_code, 404)
+
+    def test_stale_jobs_are_failed_on_read(self):
+        """Задачи, потерянные при перезапуске, помечаются как FAILED при чтении"""
+        long_ago = timezone.now() - timedelta(hours=2)
+        queued = PlanningJob.objects.create(kind=PlanningJobKind.DAILY_ROUTES)
+        running = PlanningJob.objects.create(
+            kind=PlanningJobKind.DAILY_ROUTES, status=PlanningJobStatus.RUNNING, started_at=long_ago,
+        )
+        fresh = PlanningJob.objects.create(
+            kind=PlanningJobKind.DAILY_ROUTES, status=PlanningJobStatus.RUNNING, started_at=timezone.now(),
+        )
+        PlanningJob.objects.filter(id=queued.id).update(created_at=long_ago)
+
+        response = self.client.get(f'/api/dispatch/planning-jobs/{queued.id}/')
+        self.assertEqual(response.data['status'], PlanningJobStatus.FAILED)
+        self.assertEqual(self.client.get(f'/api/dispatch/planning-jobs/{running.id}/result/').status_code, 422)
+        fresh.refresh_from_db()
+        self.assertEqual(fresh.status, PlanningJobStatus.RUNNING)
+
+    def test_export_job_result_is_downloadable(self):
+        """Файл экспорта отдается через planning-jobs/<id>/result"""
+        routes = {'routes': [{'driver': {'id': 1, 'name': 'Водитель'}, 'orders': []}]}
+        with mock.patch('dispatch.daily_routing.distribute_orders_for_day', return_value=routes):
+            response = self.client.get('/api/dispatch/daily-routes-export/?async=1&date=2030-01-01')
+        job_id = response.data['job_id']
+        result = self.client.get(f'/api/dispatch/planning-jobs/{job_id}/result/')
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(result['Content-Type'], 'application/zip')
+        self.assertIn('daily_routes_2030-01-01.zip', result['Content-Disposition'])
+        self.assertTrue(result.content.startswith(b'PK'))
@@ -0,0 +1,152 @@
+"""
+Тесты для протокола снимок + дельты карты диспетчеризации (dispatch.map_state)
+"""
+from unittest import mock
+
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.core.cache import cache
+from django.test import TestCase
+
+from accounts.location_debounce import reset_location_debouncer
+from accounts.models import DriverStatus
+from dispatch import map_state
+from orders.models import OrderStatus
+from utils.testing import (
+    create_city, create_online_drivers, create_order, create_passenger, create_region, create_staff, staff_client,
+)
+from websocket.consumers import DispatchMapConsumer
+
+
+class MapStateTestCase(TestCase):
+    """Тесты для снимка, дельт и map-data"""
+
+    def setUp(self):
+        cache.clear()
+        reset_location_debouncer()
+        self.region = create_region(create_city())
+        self.passenger = create_passenger(self.region)
+        self.drivers = create_online_drivers(self.region, 3)
+        self.order = create_order('o1', self.passenger)
+        self.staff = create_staff()
+        self.client = staff_client(self.staff)
+
+    def tearDown(self):
+        reset_location_debouncer()
+
+    def test_snapshot_has_only_map_fields(self):
+        """Снимок - два запроса values() и только поля карты"""
+        with self.assertNumQueries(2):
+            snapshot = map_state.build_snapshot()
+
+        self.assertEqual(snapshot['seq'], map_state.current_seq())
+        self.assertEqual(snapshot['drivers_count'], 3)
+        driver = next(d for d in snapshot['drivers'] if d['id'] == str(self.drivers[0].id))
+        self.assertEqual(set(driver), {'id', *map_state.DRIVER_COLUMNS})
+        self.assertEqual(driver['region'], 'A')
+        order = snapshot['orders'][0]
+        self.assertEqual(order['id'], 'o1')
+        self.assertEqual(order['passenger'], {'id': str(self.passenger.id), 'full_name': 'Пассажир'})
+        self.assertIsNone(order['driver_id'])
+
+    def test_save_publishes_only_changed_fields(self):
+        """update_fields попадают в дельту, seq растет"""
+        seq = map_state.current_seq()
+        driver = self.drivers[0]
+        driver.status = DriverStatus.ENROUTE_TO_PICKUP
+        with self.captureOnCommitCallbacks(execute=True):
+            driver.save(update_fields=['status'])
+            # До фиксации транзакции дельта не публикуется
+            self.assertEqual(map_state.current_seq(), seq)
+
+        deltas = map_state.deltas_since(seq)
+        self.assertEqual(len(deltas), 1)
+        self.assertEqual(deltas[0]['seq'], seq + 1)
+        self.assertEqual(deltas[0]['kind'], map_state.KIND_DRIVER)
+        self.assertEqual(deltas[0]['fields'], {'status': DriverStatus.ENROUTE_TO_PICKUP})
+
+        self.order.status = OrderStatus.CANCELLED
+        with self.captureOnCommitCallbacks(execute=True):
+            self.order.save(update_fields=['status'])
+        delta = map_state.deltas_since(seq + 1)[0]
+        self.assertEqual((delta['kind'], delta['id'], delta['op']), (map_state.KIND_ORDER, 'o1', map_state.OP_REMOVE))
+
+    def test_map_data_resync_from_sequence(self):
+        """map-data?since= отдает пропущенные дельты, при разрыве журнала - снимок"""
+        seq = self.client.get('/api/dispatch/map-data/').data['seq']
+        self.order.driver = self.drivers[1]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.order.save(update_fields=['driver'])
+
+        response = self.client.get('/api/dispatch/map-data/', {'since': seq})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['seq'], seq + 1)
+        self.assertEqual(response.data['deltas'][0]['fields'], {'driver_id': str(self.drivers[1].id)})
+
+        cache.delete(map_state._delta_key(seq + 1))
+        response = self.client.get('/api/dispatch/map-data/', {'since': seq})
+        self.assertIn('orders', response.data)
+        self.assertEqual(response.data['orders'][0]['driver_id'], str(self.drivers[1].id))
+
+    def test_consumer_delta_mode(self):
+        """Клиент в режиме delta получает map_resync и map_delta, но не полные order_update"""
+        seq = map_state.current_seq()
+
+        async def scenario():
+            communicator = WebsocketCommunicator(
+                DispatchMapConsumer.as_asgi(), f'/ws/dispatch-map/?protocol=delta&since={seq}'
+            )
+            communicator.scope['user'] = self.staff
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            self.assertEqual(await sync_to_async(map_state.map_subscribers)(), 1)
+
+            resync = await communicator.receive_json_from()
+            self.assertEqual(resync, {'type': 'map_resync', 'data': {'seq': seq, 'deltas': []}})
+
+            await sync_to_async(map_state.publish)(map_state.KIND_DRIVER, 7, {'lat': 51.2, 'lon': 71.5})
+            delta = await communicator.receive_json_from()
+            self.assertEqual(delta['type'], 'map_delta')
+            self.assertEqual(delta['data']['deltas'][0]['fields'], {'lat': 51.2, 'lon': 71.5})
+
+            await get_channel_layer().group_send('dispatch_map', {'type': 'order_update', 'data': {'id': 'o1'}})
+            self.assertTrue(await communicator.receive_nothing())
+            await communicator.disconnect()
+
+        async_to_sync(scenario)()
+        # Подключение и отключение учтены в счетчике клиентов карты (его читает дебаунсинг позиций)
+        self.assertEqual(map_state.map_subscribers(), 0)
+        # Клиент дельт не считается подписчиком dispatch_map
+        self.assertIsNone(cache.get(map_state.LEGACY_SUBSCRIBERS_KEY))
+        self.assertTrue(map_state.has_legacy_subscribers())
+
+    def test_legacy_payloads_skipped_without_subscribers(self):
+        """Полные сообщения dispatch_map собираются, только пока есть клиенты прежнего протокола"""
+        async def scenario():
+            communicator = WebsocketCommunicator(DispatchMapConsumer.as_asgi(), '/ws/dispatch-map/')
+            communicator.scope['user'] = self.staff
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            self.assertTrue(await sync_to_async(map_state.has_legacy_subscribers)())
+
+            # Истекший счетчик (нет ping) восстанавливается ping живого клиента
+            await sync_to_async(cache.delete)(map_state.LEGACY_SUBSCRIBERS_KEY)
+            await communicator.send_json_to({'type': 'ping'})
+            self.assertEqual(await communicator.receive_json_from(), {'type': 'pong'})
+            self.assertEqual(await sync_to_async(cache.get)(map_state.LEGACY_SUBSCRIBERS_KEY), 1)
+            await communicator.disconnect()
+
+        async_to_sync(scenario)()
+        self.assertEqual(cache.get(map_state.LEGACY_SUBSCRIBERS_KEY), 0)
+        self.assertFalse(map_state.has_legacy_subscribers())
+
+        layer = mock.Mock()
+        with mock.patch('accounts.signals.get_channel_layer_safe', return_value=layer), \
+                mock.patch('orders.signals.get_channel_layer_safe', return_value=layer), \
+                mock.patch('orders.signals.async_to_sync', side_effect=lambda fn: fn):
+            self.drivers[0].save()
+            self.order.save()
+        groups = {c.args[0] for c in layer.group_send.call_args_list}
+        self.assertNotIn(map_state.LEGACY_GROUP, groups)
+        self.assertIn('order_o1', groups)
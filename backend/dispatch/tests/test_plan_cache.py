@@ -0,0 +1,99 @@
+"""
+Тесты для кэша дневного плана
+"""
+from datetime import datetime, timedelta
+
+from django.test import TestCase
+from django.utils import timezone
+
+from accounts.models import Driver
+from dispatch.daily_routing import distribute_orders_for_day
+from dispatch.plan_cache import get_daily_plan_cache
+from orders.models import DispatchConfig, Order, OrderStatus
+from regions.services import invalidate_region_index
+from utils.testing import create_city, create_online_drivers, create_order, create_passenger, create_region
+
+TARGET_DATE = (timezone.now() + timedelta(days=2)).date()
+
+
+class DailyPlanCacheTestCase(TestCase):
+    """Тесты для переиспользования плана в distribute_orders_for_day"""
+
+    def setUp(self):
+        invalidate_region_index()
+        get_daily_plan_cache().clear()
+        region = create_region(create_city(), service_radius_meters=20000)
+        passenger = create_passenger(region)
+        create_online_drivers(region, 3, step=0.02)
+        start = timezone.make_aware(datetime.combine(TARGET_DATE, datetime.min.time())) + timedelta(hours=7)
+        for i in range(8):
+            create_order(
+                f'o{i}', passenger, pickup_lat=51.15 + (i % 3) * 0.01,
+                desired_pickup_time=start + timedelta(minutes=40 * i), distance_km=4.0,
+            )
+
+    def tearDown(self):
+        invalidate_region_index()
+        get_daily_plan_cache().clear()
+
+    @staticmethod
+    def _assignments(result):
+        return {a['order_id']: a['driver_id'] for a in result['assignments']}
+
+    def test_repeated_preview_returns_cached_plan(self):
+        """Повторный просмотр при неизменных данных не пересчитывает план"""
+        first = distribute_orders_for_day(TARGET_DATE)
+        self.assertEqual(first['plan_cache']['status'], 'miss')
+        self.assertEqual(first['plan_cache']['scored'], 8)
+
+        second = distribute_orders_for_day(TARGET_DATE)
+        self.assertEqual(second['plan_cache']['status'], 'hit')
+        self.assertEqual(second['routes'], first['routes'])
+
+        config = DispatchConfig.get_active_config()
+        config.w_deadhead = 0.5
+        config.save()
+        self.assertEqual(distribute_orders_for_day(TARGET_DATE)['plan_cache']['status'], 'miss')
+
+    def test_driver_movement_beyond_precision_invalidates_plan(self):
+        """Дрожание GPS не сбрасывает план, смещение водителя на ~500 м - сбрасывает"""
+        distribute_orders_for_day(TARGET_DATE)
+        driver = Driver.objects.get(name='Водитель 0')
+
+        driver.current_lat = 51.15001
+        driver.save(update_fields=['current_lat'])
+        self.assertEqual(distribute_orders_for_day(TARGET_DATE)['plan_cache']['status'], 'hit')
+
+        driver.current_lat = 51.155
+        driver.save(update_fields=['current_lat'])
+        self.assertEqual(distribute_orders_for_day(TARGET_DATE)['plan_cache']['status'], 'miss')
+
+    def test_changed_order_is_rescored_as_delta(self):
+        """Измененный заказ пересчитывается, остальные сохраняют водителей"""
+        first = distribute_orders_for_day(TARGET_DATE)
+
+        order = Order.objects.get(id='o7')
+        order.pickup_lat = 51.19
+        order.save()
+        create_order(
+            'o8', order.passenger, pickup_lat=51.17,
+            desired_pickup_time=order.desired_pickup_time + timedelta(hours=1), distance_km=4.0,
+        )
+
+        second = distribute_orders_for_day(TARGET_DATE)
+        self.assertEqual(second['plan_cache'], {'status': 'delta', 'reused': 7, 'scored': 2})
+        before, after = self._assignments(first), self._assignments(second)
+        self.assertEqual({k: after[k] for k in before if k != 'o7'}, {k: v for k, v in before.items() if k != 'o7'})
+        self.assertIn('o8', after)
+
+    def test_apply_reuses_preview_and_invalidates(self):
+        """Применение после просмотра назначает заказы по сохраненному плану"""
+        preview = distribute_orders_for_day(TARGET_DATE)
+        applied = distribute_orders_for_day(TARGET_DATE, auto_assign=True)
+        self.assertEqual(applied['plan_cache']['reused'], 8)
+        self.assertEqual(self._assignments(applied), self._assignments(preview))
+        self.assertEqual(
+            dict(Order.objects.filter(status=OrderStatus.ASSIGNED).values_list('id', 'driver_id')),
+            self._assignments(preview),
+        )
+        self.assertIsNone(get_daily_plan_cache().get(TARGET_DATE))
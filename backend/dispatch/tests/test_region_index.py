@@ -0,0 +1,150 @@
+"""
+Тесты для индекса регионов
+"""
+import random
+from unittest import mock
+
+from django.test import TestCase
+
+from regions.models import Region
+from regions.services import (
+    get_region_by_coordinates, get_regions_by_coordinates, invalidate_region_index,
+    point_in_polygon, points_in_polygon,
+)
+from utils.testing import create_city, create_order, create_passenger, create_region
+
+
+class RegionIndexTestCase(TestCase):
+    """Тесты для определения региона по координатам через индекс"""
+
+    def setUp(self):
+        invalidate_region_index()
+        self.city = create_city()
+        # Невыпуклый полигон (буква "Г") и регион по радиусу, перекрывающий его
+        self.polygon_region = Region.objects.create(
+            id='poly', title='А-полигон', city=self.city, center_lat=51.15, center_lon=71.45,
+            polygon_coordinates=[
+                [51.10, 71.40], [51.20, 71.40], [51.20, 71.50],
+                [51.18, 71.50], [51.18, 71.42], [51.10, 71.42],
+            ],
+        )
+        self.radius_region = Region.objects.create(
+            id='radius', title='Б-радиус', city=self.city, center_lat=51.19, center_lon=71.47,
+            service_radius_meters=3000,
+        )
+
+    def tearDown(self):
+        invalidate_region_index()
+
+    def test_polygon_has_priority_over_radius(self):
+        """Полигон проверяется раньше радиуса"""
+        self.assertEqual(get_region_by_coordinates(51.19, 71.47), self.polygon_region)
+        self.assertEqual(get_region_by_coordinates(51.17, 71.47), self.radius_region)
+        self.assertIsNone(get_region_by_coordinates(51.00, 71.00))
+
+    def test_lookup_without_queries_after_warmup(self):
+        """После построения индекса запросы к БД не выполняются"""
+        get_region_by_coordinates(51.15, 71.41)
+        with self.assertNumQueries(0):
+            region = get_region_by_coordinates(51.15, 71.41)
+            self.assertEqual(region.city.title, 'Город')
+
+    def test_index_invalidated_on_region_save(self):
+        """Изменение региона сразу видно при поиске"""
+        self.assertIsNone(get_region_by_coordinates(51.30, 71.60))
+        self.radius_region.center_lat, self.radius_region.center_lon = 51.30, 71.60
+        self.radius_region.save()
+        self.assertEqual(get_region_by_coordinates(51.30, 71.60), self.radius_region)
+
+    def test_batch_lookup_matches_single(self):
+        """Пакетный поиск совпадает с поточечным"""
+        rng = random.Random(42)
+        lats = [rng.uniform(51.05, 51.25) for _ in range(300)] + [None]
+        lons = [rng.uniform(71.35, 71.55) for _ in range(300)] + [71.45]
+        expected = [get_region_by_coordinates(lat, lon) for lat, lon in zip(lats, lons)]
+        self.assertEqual(get_regions_by_coordinates(lats, lons), expected)
+
+    def test_vectorized_point_in_polygon(self):
+        """Векторизованный Ray Casting совпадает со скалярным"""
+        polygon = self.polygon_region.polygon_coordinates
+        rng = random.Random(7)
+        points = [(rng.uniform(51.08, 51.22), rng.uniform(71.38, 71.52)) for _ in range(500)]
+        points += [tuple(p) for p in polygon]
+        result = points_in_polygon([p[0] for p in points], [p[1] for p in points], polygon)
+        self.assertEqual(result.tolist(), [point_in_polygon(lat, lon, polygon) for lat, lon in points])
+
+
+class OrderRegionFieldsTestCase(TestCase):
+    """Тесты для сохраненных pickup_region/dropoff_region заказа"""
+
+    def setUp(self):
+        invalidate_region_index()
+        self.city = create_city()
+        self.region_a = create_region(self.city, 'a', center_lat=51.10, center_lon=71.40, service_radius_meters=2000)
+        self.region_b = create_region(self.city, 'b', center_lat=51.20, center_lon=71.50, service_radius_meters=2000)
+        self.passenger = create_passenger(self.region_b)
+
+    def tearDown(self):
+        invalidate_region_index()
+
+    def _create_order(self, order_id, pickup, dropoff):
+        from django.utils import timezone
+        from orders.models import OrderStatus
+
+        return create_order(
+            order_id, self.passenger, status=OrderStatus.DRAFT,
+            pickup_lat=pickup[0], pickup_lon=pickup[1],
+            dropoff_lat=dropoff[0], dropoff_lon=dropoff[1],
+            desired_pickup_time=timezone.now(),
+        )
+
+    def test_regions_assigned_on_create(self):
+        """Регионы определяются при создании, pickup с fallback на регион пассажира"""
+        order = self._create_order('o1', (51.10, 71.40), (51.20, 71.50))
+        self.assertEqual(order.pickup_region_id, 'a')
+        self.assertEqual(order.dropoff_region_id, 'b')
+
+        order = self._create_order('o2', (50.00, 70.00), (50.00, 70.00))
+        self.assertEqual(order.pickup_region_id, 'b')
+        self.assertIsNone(order.dropoff_region_id)
+
+    def test_regions_recomputed_only_on_coordinate_change(self):
+        """Пересчет при изменении координат, в том числе с update_fields"""
+        from orders.models import Order
+
+        self._create_order('o1', (51.10, 71.40), (51.20, 71.50))
+        order = Order.objects.get(id='o1')
+        order.pickup_lat, order.pickup_lon = 51.20, 71.50
+        order.save(update_fields=['pickup_lat', 'pickup_lon'])
+        self.assertEqual(Order.objects.get(id='o1').pickup_region_id, 'b')
+
+        order = Order.objects.get(id='o1')
+        order.note = 'Без изменения координат'
+        with mock.patch('regions.services.get_region_by_coordinates') as lookup:
+            order.save()
+        lookup.assert_not_called()
+
+    def test_precomputed_none_region_is_not_looked_up(self):
+        """Переданный None (вне регионов) не запускает повторный поиск региона"""
+        order = self._create_order('o1', (50.00, 70.00), (50.00, 70.00))
+        with mock.patch('regions.services.get_region_by_coordinates') as lookup:
+            order.assign_regions(pickup_region=self.region_a, dropoff_region=None)
+        lookup.assert_not_called()
+        self.assertEqual(order.pickup_region_id, 'a')
+        self.assertIsNone(order.dropoff_region_id)
+
+    def test_backfill_command(self):
+        """Команда заполняет регионы у заказов, сохраненных в обход save()"""
+        from django.core.management import call_command
+        from io import StringIO
+        from orders.models import Order
+
+        self._create_order('o1', (51.10, 71.40), (51.20, 71.50))
+        self._create_order('o2', (51.20, 71.50), (51.10, 71.40))
+        self._create_order('o3', (50.00, 70.00), (50.00, 70.00))
+        Order.objects.update(pickup_region=None, dropoff_region=None)
+
+        call_command('backfill_order_regions', chunk_size=2, stdout=StringIO())
+        regions = dict(Order.objects.values_list('id', 'pickup_region_id'))
+        self.assertEqual(regions, {'o1': 'a', 'o2': 'b', 'o3': 'b'})
+        self.assertEqual(Order.objects.get(id='o2').dropoff_region_id, 'a')
@@ -0,0 +1,107 @@
+"""
+Тесты для кэша маршрутов
+"""
+from datetime import datetime
+from unittest import mock
+import sqlite3
+import tempfile
+
+from django.test import TestCase
+
+from dispatch.route_cache import RouteCache, SqliteBackend
+from dispatch.services import DispatchEngine, RoutingBackend
+
+
+def _entry(duration_seconds=600, route=None):
+    return {
+        'route': route or [],
+        'distance_m': 5000,
+        'distance_km': 5.0,
+        'duration_seconds': duration_seconds,
+        'duration_minutes': duration_seconds // 60,
+    }
+
+
+class RouteCacheTestCase(TestCase):
+    """Тесты для класса RouteCache"""
+
+    def test_quantized_key_hits_nearby_points(self):
+        """Близкие точки попадают в один ключ"""
+        cache = RouteCache(coord_precision=3)
+        key1 = cache.make_key(51.16941, 71.44911, 51.2, 71.5)
+        key2 = cache.make_key(51.16938, 71.44909, 51.2, 71.5)
+        self.assertEqual(key1, key2)
+
+    def test_time_bucket_in_key(self):
+        """Разные корзины времени суток дают разные ключи"""
+        cache = RouteCache(time_bucket_minutes=60)
+        morning = cache.make_key(51.0, 71.0, 51.1, 71.1, datetime(2024, 1, 1, 8, 15))
+        morning_later = cache.make_key(51.0, 71.0, 51.1, 71.1, datetime(2024, 1, 1, 8, 45))
+        evening = cache.make_key(51.0, 71.0, 51.1, 71.1, datetime(2024, 1, 1, 18, 0))
+        self.assertEqual(morning, morning_later)
+        self.assertNotEqual(morning, evening)
+
+    def test_lru_eviction(self):
+        """При переполнении вытесняется самая старая запись"""
+        cache = RouteCache(max_entries=2)
+        cache.set('a', _entry())
+        cache.set('b', _entry())
+        cache.get('a', geometry=False)
+        cache.set('c', _entry())
+
+        self.assertIsNone(cache.get('b', geometry=False))
+        self.assertIsNotNone(cache.get('a', geometry=False))
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_ttl_expiry(self):
+        """Просроченные записи не возвращаются"""
+        cache = RouteCache(ttl_seconds=10)
+        with mock.patch('dispatch.route_cache.time.time', return_value=1000.0):
+            cache.set('a', _entry())
+        with mock.patch('dispatch.route_cache.time.time', return_value=1011.0):
+            self.assertIsNone(cache.get('a', geometry=False))
+
+    def test_duration_only_entry_does_not_satisfy_geometry(self):
+        """Запись без геометрии не подходит для карты"""
+        cache = RouteCache()
+        cache.set('a', _entry())
+        self.assertIsNotNone(cache.get('a', geometry=False))
+        self.assertIsNone(cache.get('a', geometry=True))
+
+        cache.set('a', _entry(route=[[51.0, 71.0], [51.1, 71.1]]))
+        self.assertIsNotNone(cache.get('a', geometry=True))
+
+    def test_calculate_route_uses_cache(self):
+        """Повторный запрос маршрута не обращается к OSRM"""
+        cache = RouteCache()
+        backend = mock.Mock(spec=RoutingBackend)
+        backend.route.return_value = _entry()
+        engine = DispatchEngine(routing_backend=backend)
+        with mock.patch('dispatch.services.get_route_cache', return_value=cache):
+            first = engine.calculate_route(51.0, 71.0, 51.1, 71.1, geometry=False)
+            second = engine.calculate_route(51.0, 71.0, 51.1, 71.1, geometry=False)
+
+        self.assertEqual(backend.route.call_count, 1)
+        self.assertEqual(first['duration_seconds'], second['duration_seconds'])
+        self.assertIn('eta', second)
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_sqlite_backend_is_bounded(self):
+        """sqlite-хранилище удаляет истекшие записи и держит не больше max_rows строк"""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = f'{tmp}/routes.sqlite3'
+            backend = SqliteBackend(path, max_rows=3, purge_every=2)
+            with mock.patch('dispatch.route_cache.time.time', return_value=1000.0):
+                backend.set('expired', _entry(), ttl=10)
+            with mock.patch('dispatch.route_cache.time.time', return_value=2000.0):
+                for i in range(5):
+                    backend.set(f'k{i}', _entry(), ttl=100 + i)
+                backend.purge()
+                self.assertIsNone(backend.get('k0'))
+                self.assertIsNotNone(backend.get('k4'))
+
+            with sqlite3.connect(path) as conn:
+                keys = {row[0] for row in conn.execute('SELECT key FROM route_cache')}
+            self.assertEqual(keys, {'k2', 'k3', 'k4'})
+            backend._connection().close()
@@ -0,0 +1,248 @@
+"""
+Тесты для пакетного расчета ETA и бэкендов маршрутизации
+"""
+from types import SimpleNamespace
+from unittest import mock
+
+from django.test import TestCase
+
+from dispatch.route_cache import RouteCache
+from dispatch.local_router import LocalRouter, RoadGraph
+from dispatch.services import DispatchEngine, LocalGraphBackend, RoutingBackend
+
+
+def _driver(driver_id, lat, lon):
+    return SimpleNamespace(id=driver_id, current_lat=lat, current_lon=lon)
+
+
+def _order(order_id, lat, lon):
+    return SimpleNamespace(id=order_id, pickup_lat=lat, pickup_lon=lon)
+
+
+class EtaMatrixTestCase(TestCase):
+    """Тесты для DispatchEngine.calculate_eta_matrix"""
+
+    def setUp(self):
+        self.backend = mock.Mock(spec=RoutingBackend)
+        self.backend.name = 'fake'
+        self.engine = DispatchEngine(routing_backend=self.backend)
+        self.cache_patch = mock.patch('dispatch.services.get_route_cache', return_value=RouteCache())
+        self.cache_patch.start()
+
+    def tearDown(self):
+        self.cache_patch.stop()
+
+    def test_haversine_fallback_when_osrm_unavailable(self):
+        """Без OSRM используется прямая линия для всех пар"""
+        drivers = [_driver(1, 51.16, 71.44), _driver(2, 51.20, 71.40), _driver(3, None, None)]
+        orders = [_order('o1', 51.17, 71.45)]
+
+        self.backend.table.return_value = None
+        matrix = self.engine.calculate_eta_matrix(drivers, orders)
+
+        self.assertEqual(set(matrix.keys()), {(1, 'o1'), (2, 'o1')})
+        self.assertLess(matrix[(1, 'o1')]['distance_m'], matrix[(2, 'o1')]['distance_m'])
+        self.assertGreater(matrix[(1, 'o1')]['duration_seconds'], 0)
+
+    def test_table_requests_are_chunked(self):
+        """Источники разбиваются на пачки по лимиту координат"""
+        drivers = [_driver(i, 51.0 + i * 0.001, 71.0) for i in range(10)]
+        orders = [_order('o1', 51.1, 71.1), _order('o2', 51.2, 71.2)]
+
+        def fake_table(sources, destinations):
+            return (
+                [[60.0] * len(destinations) for _ in sources],
+                [[1000.0] * len(destinations) for _ in sources],
+            )
+
+        self.backend.table.side_effect = fake_table
+        with mock.patch.object(DispatchEngine, 'OSRM_TABLE_MAX_COORDINATES', 6):
+            matrix = self.engine.calculate_eta_matrix(drivers, orders)
+
+        # 10 источников по 4 в запросе (6 координат - 2 назначения) = 3 запроса
+        self.assertEqual(self.backend.table.call_count, 3)
+        self.assertEqual(len(matrix), 20)
+        self.assertEqual(matrix[(5, 'o2')]['duration_seconds'], 60)
+        self.assertEqual(matrix[(5, 'o2')]['distance_m'], 1000)
+
+    def test_table_duration_kept_without_distance(self):
+        """Без расстояний из table прямой линией заменяется только расстояние"""
+        drivers = [_driver(1, 51.16, 71.44)]
+        orders = [_order('o1', 51.17, 71.45)]
+
+        self.backend.table.return_value = ([[420.0]], None)
+        matrix = self.engine.calculate_eta_matrix(drivers, orders)
+
+        self.assertEqual(matrix[(1, 'o1')]['duration_seconds'], 420)
+        self.assertGreater(matrix[(1, 'o1')]['distance_m'], 0)
+
+    def test_cached_pairs_skip_table_request(self):
+        """Повторный расчет берет пары из кэша маршрутов"""
+        drivers = [_driver(1, 51.16, 71.44)]
+        orders = [_order('o1', 51.17, 71.45)]
+        table = ([[120.0]], [[2000.0]])
+
+        self.backend.table.return_value = table
+        self.engine.calculate_eta_matrix(drivers, orders)
+        matrix = self.engine.calculate_eta_matrix(drivers, orders)
+
+        self.assertEqual(self.backend.table.call_count, 1)
+        self.assertEqual(matrix[(1, 'o1')]['duration_seconds'], 120)
+
+    def test_prefetch_routes_batches_pairs(self):
+        """Пары оценки вставки рассчитываются пакетом, затем время в пути берется из кэша"""
+        from dispatch.simulator import create_travel_minutes_function
+
+        pairs = {
+            (51.0 + i * 0.001, 71.0, 51.1 + j * 0.001, 71.1)
+            for i in range(12) for j in range(3)
+        }
+
+        def fake_table(sources, destinations):
+            return (
+                [[600.0 + (lat2 - lat1) * 1e4 for lat2, _ in destinations] for lat1, _ in sources],
+                [[5000.0] * len(destinations) for _ in sources],
+            )
+
+        self.backend.table.side_effect = fake_table
+        with mock.patch.object(DispatchEngine, 'OSRM_TABLE_MAX_COORDINATES', 8):
+            self.assertEqual(self.engine.prefetch_routes(pairs), len(pairs))
+
+        # 12 источников по 5 в запросе (8 координат - 3 назначения) = 3 запроса
+        self.assertEqual(self.backend.table.call_count, 3)
+        travel_minutes_fn = create_travel_minutes_function(dispatch_engine=self.engine)
+        self.assertEqual(travel_minutes_fn(51.0, 71.0, 51.1, 71.1), int((600.0 + 0.1 * 1e4) / 60))
+        self.backend.route.assert_not_called()
+
+        # Повторно запрашивать нечего
+        self.assertEqual(self.engine.prefetch_routes(pairs), 0)
+        self.assertEqual(self.backend.table.call_count, 3)
+
+
+class LocalRouterTestCase(TestCase):
+    """Тесты для локального маршрутизатора по графу"""
+
+    def setUp(self):
+        # Сетка 3x3 узлов с шагом ~1 км: медленные улицы и быстрая дорога по краю
+        lats, lons = [], []
+        for row in range(3):
+            for col in range(3):
+                lats.append(51.0 + row * 0.009)
+                lons.append(71.0 + col * 0.0143)
+
+        def node(row, col):
+            return row * 3 + col
+
+        edges = []
+        for row in range(3):
+            for col in range(3):
+                speed = 60.0 if row == 0 or col == 2 else 20.0
+                if col < 2:
+                    edges += [(node(row, col), node(row, col + 1), speed), (node(row, col + 1), node(row, col), speed)]
+                if row < 2:
+                    edges += [(node(row, col), node(row + 1, col), speed), (node(row + 1, col), node(row, col), speed)]
+        # Односторонняя улица: из центра нельзя проехать на запад
+        edges = [e for e in edges if (e[0], e[1]) != (node(1, 1), node(1, 0))]
+
+        self.graph = RoadGraph.from_edges(lats, lons, edges)
+        self.router = LocalRouter(self.graph)
+        self.lats, self.lons = lats, lons
+
+    def test_shortest_path_prefers_fast_roads(self):
+        """A* выбирает объезд по быстрым дорогам"""
+        path, duration, distance = self.graph.shortest_path(0, 8)
+        self.assertEqual(path, [0, 1, 2, 5, 8])
+        self.assertGreater(distance, 3500)
+
+    def test_oneway_is_respected(self):
+        """Односторонние рёбра не используются в обратную сторону"""
+        path, _, _ = self.graph.shortest_path(4, 3)
+        self.assertNotEqual(path, [4, 3])
+
+    def test_route_has_osrm_shape(self):
+        """Ответ совпадает по формату с OSRM-бэкендом"""
+        route = self.router.route(self.lats[0], self.lons[0], self.lats[8], self.lons[8])
+        for key in ('route', 'distance_m', 'distance_km', 'duration_seconds', 'duration_minutes'):
+            self.assertIn(key, route)
+        self.assertEqual(route['route'][0], [self.lats[0], self.lons[0]])
+
+    def test_table_matches_point_to_point(self):
+        """Матрица совпадает с попарными маршрутами"""
+        sources = [(self.lats[0], self.lons[0]), (self.lats[4], self.lons[4])]
+        destinations = [(self.lats[8], self.lons[8]), (self.lats[3], self.lons[3])]
+        durations, distances = self.router.table(sources, destinations)
+        for i, (slat, slon) in enumerate(sources):
+            for j, (dlat, dlon) in enumerate(destinations):
+                route = self.router.route(slat, slon, dlat, dlon, geometry=False)
+                self.assertEqual(int(durations[i][j]), route['duration_seconds'])
+
+    def test_graph_roundtrip_through_npz(self):
+        """Граф с иерархией сжатия сохраняется и загружается из .npz"""
+        import os
+        import tempfile
+        self.graph.contract()
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'graph.npz')
+            self.graph.save(path)
+            backend = LocalGraphBackend(path)
+            route = backend.route(self.lats[0], self.lons[0], self.lats[8], self.lons[8])
+        self.assertIsNotNone(route)
+        self.assertEqual(backend.router.graph.edge_count, self.graph.edge_count)
+        self.assertIsNotNone(backend.router.graph.ch)
+        self.assertEqual(route['route'][1:-1], [[self.lats[n], self.lons[n]] for n in (0, 1, 2, 5, 8)])
+
+    def test_contraction_hierarchy_matches_astar(self):
+        """Поиск по иерархии сжатия дает те же времена, что A*, и корректный путь"""
+        import random
+        rng = random.Random(3)
+        size = 12
+        lats = [51.0 + (i // size) * 0.002 for i in range(size * size)]
+        lons = [71.0 + (i % size) * 0.003 for i in range(size * size)]
+        edges = []
+        for u in range(size * size):
+            for v in ([u + 1] if u % size < size - 1 else []) + ([u + size] if u + size < size * size else []):
+                speed = rng.choice([20.0, 40.0, 60.0])
+                if rng.random() < 0.1:
+                    edges.append((u, v, speed))
+                else:
+                    edges += [(u, v, speed), (v, u, speed)]
+        plain = RoadGraph.from_edges(lats, lons, edges)
+        contracted = RoadGraph.from_edges(lats, lons, edges)
+        contracted.contract()
+        self.assertGreater(contracted.ch.shortcut_count, 0)
+
+        edge_durations = {
+            (u, int(plain.targets[e])): float(plain.durations[e])
+            for u in range(plain.node_count) for e in range(plain.indptr[u], plain.indptr[u + 1])
+        }
+        for _ in range(200):
+            source, target = rng.randrange(plain.node_count), rng.randrange(plain.node_count)
+            expected, found = plain.shortest_path(source, target), contracted.shortest_path(source, target)
+            self.assertEqual(expected is None, found is None)
+            if found is None:
+                continue
+            path, duration, _ = found
+            self.assertAlmostEqual(duration, expected[1])
+            self.assertEqual((path[0], path[-1]), (source, target))
+            self.assertAlmostEqual(sum(edge_durations[(u, v)] for u, v in zip(path, path[1:])), duration)
+
+        sources, targets = rng.sample(range(plain.node_count), 10), rng.sample(range(plain.node_count), 10)
+        for expected, found in zip(plain.many_to_many(sources, targets), contracted.many_to_many(sources, targets)):
+            self.assertEqual(expected.keys(), found.keys())
+            for node in expected:
+                self.assertAlmostEqual(found[node][0], expected[node][0])
+
+    def test_missing_graph_falls_back_to_straight_line(self):
+        """Без файла графа маршрут считается по прямой, а не падает"""
+        backend = LocalGraphBackend('/nonexistent/graph.npz')
+        self.assertIsNone(backend.route(51.0, 71.0, 51.01, 71.01))
+        self.assertIsNone(backend.table([(51.0, 71.0)], [(51.01, 71.01)]))
+
+        engine = DispatchEngine(routing_backend=backend)
+        with mock.patch('dispatch.services.get_route_cache', return_value=RouteCache(enabled=False)):
+            route = engine.calculate_route(51.0, 71.0, 51.01, 71.01)
+            matrix = engine.calculate_eta_matrix(
+                [_driver(1, 51.0, 71.0)], [_order('o1', 51.01, 71.01)]
+            )
+        self.assertGreater(route['distance_m'], 0)
+        self.assertIn((1, 'o1'), matrix)
@@ -0,0 +1,121 @@
+"""
+Тесты для снимка данных планирования
+"""
+from datetime import timedelta
+from unittest import mock
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from dispatch.config import DispatchParams
+from dispatch.insertion import clear_timeline_cache
+from dispatch.tests.test_insertion import _travel_minutes
+from regions.services import invalidate_region_index
+from utils.testing import create_city, create_driver, create_order, create_passenger, create_region, staff_client
+
+
+class PlanningSnapshotTestCase(TestCase):
+    """Тесты для PlanningSnapshot и plan_routes_for_window"""
+
+    def setUp(self):
+        from accounts.models import DriverStatistics
+
+        invalidate_region_index()
+        clear_timeline_cache()
+        self.city = create_city()
+        self.region = create_region(self.city, service_radius_meters=20000)
+        passenger = create_passenger(self.region)
+
+        self.drivers = []
+        for i in range(3):
+            driver = create_driver(self.region, i, is_online=True, current_lat=51.15 + i * 0.01, current_lon=71.45)
+            DriverStatistics.objects.create(driver=driver, acceptance_rate=0.9, cancel_rate=0.1)
+            self.drivers.append(driver)
+
+        self.day_start = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+        for i in range(6):
+            create_order(
+                f'o{i}', passenger, pickup_lat=51.15 + i * 0.005, dropoff_lon=71.46 + i * 0.005,
+                desired_pickup_time=self.day_start + timedelta(hours=8, minutes=40 * i),
+            )
+        # Заказ вне окна
+        create_order('late', passenger, desired_pickup_time=self.day_start + timedelta(days=2))
+
+        self.travel_patch = mock.patch(
+            'dispatch.insertion.create_travel_minutes_function', return_value=_travel_minutes
+        )
+        self.travel_patch.start()
+
+    def tearDown(self):
+        self.travel_patch.stop()
+        invalidate_region_index()
+        clear_timeline_cache()
+
+    def test_load_uses_fixed_number_of_queries(self):
+        """Загрузка - 4 запроса (с построением индекса регионов), связи развернуты в снимки"""
+        from dispatch.snapshot import PlanningSnapshot
+
+        invalidate_region_index()
+        with self.assertNumQueries(4):
+            snapshot = PlanningSnapshot.load(self.day_start, self.day_start + timedelta(days=1))
+
+        self.assertEqual([o.id for o in snapshot.orders], [f'o{i}' for i in range(6)])
+        self.assertEqual(len(snapshot.drivers), 3)
+        self.assertEqual(snapshot.drivers[0].region.city_id, 'city1')
+        self.assertEqual(snapshot.orders[0].pickup_region.id, 'a')
+        self.assertEqual(snapshot.statistics[self.drivers[0].id].acceptance_rate, 0.9)
+
+    def test_planning_loop_runs_without_queries(self):
+        """plan_routes_greedy на снимке не обращается к БД"""
+        from dispatch.planner import plan_routes_greedy
+        from dispatch.snapshot import PlanningSnapshot
+
+        snapshot = PlanningSnapshot.load(self.day_start, self.day_start + timedelta(days=1))
+        with self.assertNumQueries(0):
+            result = plan_routes_greedy(
+                snapshot.orders, snapshot.drivers, day_start=self.day_start, params=DispatchParams()
+            )
+        self.assertEqual(result['statistics']['total_orders'], 6)
+        self.assertGreater(result['statistics']['assigned_orders'], 0)
+
+    def test_write_back_is_bulk(self):
+        """Назначения записываются пакетно вместе с событиями"""
+        from dispatch.planner import plan_routes_for_window
+        from orders.models import Order, OrderEvent, OrderStatus
+
+        result = plan_routes_for_window(
+            self.day_start, self.day_start + timedelta(days=1), params=DispatchParams(), auto_assign=True
+        )
+        assigned = {order.id: driver_id for driver_id, route in result['routes'].items() for order in route}
+        self.assertEqual(result['written'], len(assigned))
+        for order in Order.objects.filter(id__in=assigned):
+            self.assertEqual(order.status, OrderStatus.ASSIGNED)
+            self.assertEqual(order.driver_id, assigned[order.id])
+        self.assertEqual(OrderEvent.objects.filter(status_to=OrderStatus.ASSIGNED).count(), len(assigned))
+        self.assertEqual(Order.objects.get(id='late').status, OrderStatus.ACTIVE_QUEUE)
+
+    @override_settings(PLANNING_JOBS={'EAGER': True, 'PROGRESS_INTERVAL_SECONDS': 0})
+    def test_window_routes_endpoint(self):
+        """window-routes: просмотр фоновой задачей и пакетная запись назначений"""
+        from orders.models import Order, OrderStatus
+
+        client = staff_client()
+        date = self.day_start.date().isoformat()
+
+        response = client.get('/api/dispatch/window-routes/', {'date': date, 'async': '1'})
+        self.assertEqual(response.status_code, 202)
+        job = client.get(response.data['status_url']).data
+        self.assertEqual(job['status'], 'done')
+        preview = client.get(f"{response.data['status_url']}result/").data
+        self.assertEqual(preview['statistics']['total_orders'], 6)
+        self.assertEqual(preview['written'], 0)
+        self.assertFalse(Order.objects.filter(status=OrderStatus.ASSIGNED).exists())
+
+        response = client.post(f'/api/dispatch/window-routes/?date={date}')
+        self.assertEqual(response.status_code, 200)
+        assigned = {order_id for route in response.data['routes'] for order_id in route['order_ids']}
+        self.assertTrue(assigned)
+        self.assertEqual(response.data['written'], len(assigned))
+        self.assertEqual(
+            set(Order.objects.filter(status=OrderStatus.ASSIGNED).values_list('id', flat=True)), assigned
+        )
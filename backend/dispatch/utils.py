@@ -18,23 +18,33 @@ def assign_regions_to_orders(orders: List[Order]) -> List[Order]:
     """
     Назначает регионы заказам по координатам pickup
     Если регион не определен, использует регион пассажира
+    
+    Регионы хранятся в Order.pickup_region/dropoff_region и заполняются при
+    сохранении; здесь они досчитываются (без сохранения) только для заказов,
+    где поле еще пустое (заказы, сохраненные в обход Order.save()).
+    Снимки (dispatch.snapshot) пропускаются - регионы в них уже определены.
     """
-    for order in orders:
-        if not hasattr(order, 'pickup_region') or order.pickup_region is None:
-            if order.pickup_lat and order.pickup_lon:
-                try:
-                    region = get_region_by_coordinates(order.pickup_lat, order.pickup_lon)
-                    if region:
-                        # Сохраняем регион в атрибут (если есть поле в модели)
-                        if hasattr(order, '_pickup_region'):
-                            order._pickup_region = region
-                        logger.debug(f'Регион назначен заказу {order.id}: {region.id}')
-                except Exception as e:
-                    logger.warning(f'Ошибка определения региона для заказа {order.id}: {e}')
+    from orders.services import OrderService
+    
+    missing = [order for order in orders if isinstance(order, Order) and order.pickup_region_id is None]
+    if missing:
+        try:
+            OrderService.assign_regions(missing)
+        except Exception as e:
+            logger.warning(f'Ошибка определения регионов для заказов: {e}')
     
     return orders
 
 
+def _order_region_id(order: Order) -> Optional[str]:
+    """ID региона заказа (сохраненный pickup_region, иначе регион пассажира)"""
+    if order.pickup_region_id:
+        return order.pickup_region_id
+    if hasattr(order, 'passenger') and order.passenger:
+        return order.passenger.region_id
+    return None
+
+
 def is_city_driver(driver: Driver) -> bool:
     """
     Проверяет, является ли водитель городским
@@ -44,7 +54,7 @@ def is_city_driver(driver: Driver) -> bool:
         return False
     
     # Проверяем через city - если есть город, то это городской водитель
-    if hasattr(driver.region, 'city') and driver.region.city:
+    if getattr(driver.region, 'city_id', None):
         # Можно добавить дополнительную логику для определения отдаленных регионов
         return True
     
@@ -126,21 +136,15 @@ def calculate_region_bonus(
         except Driver.DoesNotExist:
             return 0.0
     
-    # Получаем регион заказа
-    order_region = None
-    if hasattr(order, 'pickup_region') and order.pickup_region:
-        order_region = order.pickup_region
-    elif hasattr(order, 'passenger') and order.passenger and hasattr(order.passenger, 'region'):
-        order_region = order.passenger.region
-    
-    # Получаем регион водителя
-    driver_region = driver.region
+    # Получаем регион заказа и водителя (по ID, без загрузки объектов)
+    order_region_id = _order_region_id(order)
+    driver_region_id = driver.region_id
     
-    if not order_region or not driver_region:
+    if not order_region_id or not driver_region_id:
         return 0.0
     
     # Проверяем совпадение регионов
-    if order_region.id == driver_region.id:
+    if order_region_id == driver_region_id:
         base_bonus = 80.0
         
         # Дополнительный бонус для недогруженных водителей
@@ -193,33 +197,27 @@ def is_order_in_driver_region(order: Order, driver: Driver) -> bool:
     """
     Проверяет, находится ли заказ в регионе водителя
     """
-    order_region = None
-    if hasattr(order, 'pickup_region') and order.pickup_region:
-        order_region = order.pickup_region
-    elif hasattr(order, 'passenger') and order.passenger and hasattr(order.passenger, 'region'):
-        order_region = order.passenger.region
+    order_region_id = _order_region_id(order)
     
-    if not order_region or not driver.region:
+    if not order_region_id or not driver.region_id:
         return False
     
-    return order_region.id == driver.region.id
+    return order_region_id == driver.region_id
 
 
 def is_order_in_remote_region(order: Order) -> bool:
     """
     Проверяет, находится ли заказ в отдаленном регионе
     """
-    order_region = None
-    if hasattr(order, 'pickup_region') and order.pickup_region:
-        order_region = order.pickup_region
-    elif hasattr(order, 'passenger') and order.passenger and hasattr(order.passenger, 'region'):
+    order_region = order.pickup_region
+    if order_region is None and hasattr(order, 'passenger') and order.passenger:
         order_region = order.passenger.region
     
     if not order_region:
         return False
     
     # Проверяем через city - если нет города или это отдаленный регион
-    if hasattr(order_region, 'city') and order_region.city:
+    if getattr(order_region, 'city_id', None):
         return False  # Городской регион
     
     return True  # По умолчанию считаем отдаленным, если нет города
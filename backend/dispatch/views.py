@@ -3,18 +3,18 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from django.utils import timezone
-from django.http import HttpResponse
-import csv
-import io
-import zipfile
+from django.http import HttpResponse, StreamingHttpResponse
+from django.core.exceptions import ValidationError as DjangoValidationError
 import logging
 from orders.models import Order, OrderStatus, OrderOffer
 from orders.services import OrderService
-from orders.serializers import OrderSerializer
 from accounts.models import Driver
-from accounts.serializers import DriverSerializer
+from .eta_tracker import get_eta_tracker
 from .services import DispatchEngine
 from .matching_service import MatchingService
+from .exports import iter_daily_routes_zip
+from . import map_state
+from .models import PlanningJob, PlanningJobKind, PlanningJobStatus
 
 logger = logging.getLogger(__name__)
 
@@ -347,115 +347,20 @@ class DispatchViewSet(viewsets.ViewSet):
                 status=status.HTTP_403_FORBIDDEN
             )
 
-        # Получаем все заказы в очереди
-        queue_orders = Order.objects.filter(status=OrderStatus.ACTIVE_QUEUE)
-        
-        if not queue_orders.exists():
-            return Response({
-                'success': True,
-                'assigned': 0,
-                'failed': 0,
-                'message': 'Нет заказов в очереди'
-            })
+        if self._wants_async(request):
+            return self._submit_job(request, PlanningJobKind.AUTO_ASSIGN_ALL)
 
-        engine = DispatchEngine()
-        assigned_count = 0
-        failed_count = 0
-        failed_orders = []
+        from dispatch.bulk_assign import auto_assign_queue
 
-        for order in queue_orders:
-            try:
-                # Обновляем заказ из БД перед обработкой
-                order.refresh_from_db()
-                
-                result = engine.assign_order(order)
-                if result.driver_id:
-                    from accounts.models import Driver
-                    try:
-                        driver = Driver.objects.get(id=result.driver_id)
-                        
-                        # Проверяем, что водитель все еще доступен
-                        if not driver.is_online:
-                            failed_count += 1
-                            failed_orders.append({
-                                'order_id': order.id,
-                                'reason': f'Водитель {driver.name} больше не онлайн'
-                            })
-                            continue
-                        
-                        # Проверяем статус водителя
-                        from accounts.models import DriverStatus
-                        if hasattr(driver, 'status') and driver.status in [
-                            DriverStatus.ON_TRIP, 
-                            DriverStatus.ENROUTE_TO_PICKUP,
-                            DriverStatus.OFFERED
-                        ]:
-                            failed_count += 1
-                            failed_orders.append({
-                                'order_id': order.id,
-                                'reason': f'Водитель {driver.name} занят (статус: {driver.status})'
-                            })
-                            continue
-                        
-                        # Назначаем водителя
-                        # Важно: сначала устанавливаем driver_id, затем driver для правильной работы Django ORM
-                        order.driver_id = driver.id
-                        order.driver = driver
-                        order.assignment_reason = result.reason
-                        
-                        # Обновляем статус водителя
-                        driver.status = DriverStatus.ENROUTE_TO_PICKUP
-                        driver.idle_since = None
-                        driver.save(update_fields=['status', 'idle_since'])
-                        
-                        # Обновляем статус заказа (update_status теперь сохранит driver и assignment_reason)
-                        OrderService.update_status(order, OrderStatus.ASSIGNED, result.reason, user)
-                        
-                        # Перезагружаем заказ из БД для проверки
-                        order.refresh_from_db()
-                        
-                        # Проверяем, что водитель действительно сохранен
-                        if not order.driver_id or str(order.driver_id) != str(driver.id):
-                            raise Exception(f'Водитель не был сохранен в заказе. Ожидался ID {driver.id}, получен {order.driver_id}')
-                        
-                        assigned_count += 1
-                    except Driver.DoesNotExist:
-                        failed_count += 1
-                        failed_orders.append({
-                            'order_id': order.id,
-                            'reason': f'Водитель с ID {result.driver_id} не найден'
-                        })
-                else:
-                    failed_count += 1
-                    failed_orders.append({
-                        'order_id': order.id,
-                        'reason': result.reason or 'Не удалось назначить водителя'
-                    })
-            except Exception as e:
-                import traceback
-                import logging
-                logger = logging.getLogger(__name__)
-                logger.error(f'Ошибка при назначении заказа {order.id}: {str(e)}')
-                logger.error(traceback.format_exc())
-                
-                failed_count += 1
-                failed_orders.append({
-                    'order_id': order.id,
-                    'reason': f'Ошибка: {str(e)}'
-                })
-
-        return Response({
-            'success': True,
-            'assigned': assigned_count,
-            'failed': failed_count,
-            'total': queue_orders.count(),
-            'failed_orders': failed_orders,
-            'message': f'Обработано заказов: {queue_orders.count()}, назначено: {assigned_count}, ошибок: {failed_count}'
-        })
+        return Response(auto_assign_queue())
 
     @action(detail=False, methods=['get'], url_path='map-data')
     def map_data(self, request):
-        """Получить данные для карты диспетчеризации: водители и активные заказы"""
+        """
+        Снимок карты диспетчеризации: водители и активные заказы (dispatch.map_state).
+        Query param: since=<seq> — вместо снимка вернуть дельты после seq,
+        если они еще в журнале (иначе возвращается снимок)
+        """
         # Проверяем права доступа
         user = request.user
         if not user.is_staff:
@@ -464,62 +369,38 @@ class DispatchViewSet(viewsets.ViewSet):
                 status=status.HTTP_403_FORBIDDEN
             )
 
-        # Получаем всех водителей с локациями
-        drivers = Driver.objects.select_related('user', 'region').all()
-        drivers_data = []
-        for driver in drivers:
-            driver_data = DriverSerializer(driver).data
-            # Добавляем только если есть локация
-            if driver.current_lat is not None and driver.current_lon is not None:
-                drivers_data.append({
-                    'id': str(driver.id),
-                    'name': driver.name,
-                    'lat': float(driver.current_lat),
-                    'lon': float(driver.current_lon),
-                    'is_online': driver.is_online,
-                    'car_model': driver.car_model,
-                    'plate_number': driver.plate_number,
-                    'region': driver.region.title if driver.region else None,
-                    'last_location_update': driver.last_location_update.isoformat() if driver.last_location_update else None,
+        since = request.query_params.get('since')
+        if since is not None:
+            try:
+                deltas = map_state.deltas_since(int(since))
+            except ValueError:
+                return Response(
+                    {'error': 'since должен быть целым числом'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            if deltas is not None:
+                return Response({
+                    'seq': deltas[-1]['seq'] if deltas else int(since),
+                    'deltas': deltas,
                 })
 
-        # Получаем активные заказы (не завершенные и не отмененные)
-        active_statuses = [
-            OrderStatus.SUBMITTED,
-            OrderStatus.AWAITING_DISPATCHER_DECISION,
-            OrderStatus.ACTIVE_QUEUE,
-            OrderStatus.ASSIGNED,
-            OrderStatus.DRIVER_EN_ROUTE,
-            OrderStatus.ARRIVED_WAITING,
-            OrderStatus.RIDE_ONGOING,
-        ]
-        orders = Order.objects.filter(status__in=active_statuses).select_related('passenger', 'driver', 'passenger__user', 'driver__user')
-        orders_data = []
-        for order in orders:
-            order_data = OrderSerializer(order).data
-            orders_data.append({
-                'id': order.id,
-                'pickup_lat': float(order.pickup_lat) if order.pickup_lat else None,
-                'pickup_lon': float(order.pickup_lon) if order.pickup_lon else None,
-                'dropoff_lat': float(order.dropoff_lat) if order.dropoff_lat else None,
-                'dropoff_lon': float(order.dropoff_lon) if order.dropoff_lon else None,
-                'pickup_title': order.pickup_title,
-                'dropoff_title': order.dropoff_title,
-                'status': order.status,
-                'driver_id': str(order.driver.id) if order.driver else None,
-                'passenger': {
-                    'id': str(order.passenger.id),
-                    'full_name': order.passenger.full_name,
-                } if order.passenger else None,
-                'created_at': order.created_at.isoformat() if order.created_at else None,
-            })
+        return Response(map_state.build_snapshot())
 
-        return Response({
-            'drivers': drivers_data,
-            'orders': orders_data,
-            'drivers_count': len(drivers_data),
-            'orders_count': len(orders_data),
-        })
+    @action(detail=False, methods=['get'], url_path='location-debounce-stats')
+    def location_debounce_stats(self, request):
+        """
+        Счетчики дебаунсинга позиций на карте (accounts.location_debounce):
+        разосланные и отсеянные обновления воркера, обработавшего запрос
+        """
+        if not request.user.is_staff:
+            return Response(
+                {'error': 'Нет прав'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+
+        from accounts.location_debounce import get_location_debouncer
+
+        return Response(get_location_debouncer().stats())
 
     @action(detail=False, methods=['get'], url_path='route')
     def get_route(self, request):
@@ -659,8 +540,7 @@ class DispatchViewSet(viewsets.ViewSet):
                 status=status.HTTP_404_NOT_FOUND
             )
 
-        engine = DispatchEngine()
-        eta_data = engine.calculate_eta(driver, order)
+        eta_data = get_eta_tracker().eta(driver, order)
         
         if not eta_data:
             return Response(
@@ -871,6 +751,7 @@ class DispatchViewSet(viewsets.ViewSet):
         GET: Предварительный просмотр распределения заказов на день.
         POST: Применить распределение (auto_assign=True).
         Query param: date=YYYY-MM-DD (по умолчанию — сегодня)
+        Query param: async=1 — выполнить фоновой задачей (202 + job_id)
         """
         user = request.user
         if not user.is_staff:
@@ -889,14 +770,50 @@ class DispatchViewSet(viewsets.ViewSet):
             target_date = date_cls.today()
 
         auto_assign = request.method == 'POST'
+        if self._wants_async(request):
+            kind = PlanningJobKind.DAILY_ROUTES_APPLY if auto_assign else PlanningJobKind.DAILY_ROUTES
+            return self._submit_job(request, kind, {'date': target_date.isoformat()})
+
         result = distribute_orders_for_day(target_date, auto_assign=auto_assign, user=user)
         return Response(result)
 
+    @action(detail=False, methods=['get', 'post'], url_path='window-routes')
+    def window_routes(self, request):
+        """
+        Планирование дня best insertion с балансировкой (dispatch.planner) на снимке данных.
+        GET: просмотр плана. POST: пакетно записать назначения.
+        Query param: date=YYYY-MM-DD (по умолчанию — сегодня)
+        Query param: async=1 — выполнить фоновой задачей (202 + job_id)
+        """
+        if not request.user.is_staff:
+            return Response({'error': 'Нет прав'}, status=status.HTTP_403_FORBIDDEN)
+
+        from datetime import date as date_cls, datetime as dt_cls
+        from .planner import plan_routes_for_day
+
+        date_str = request.query_params.get('date') or request.data.get('date')
+        if date_str:
+            try:
+                target_date = dt_cls.strptime(date_str, '%Y-%m-%d').date()
+            except ValueError:
+                return Response({'error': 'Неверный формат даты. Используйте YYYY-MM-DD'}, status=status.HTTP_400_BAD_REQUEST)
+        else:
+            target_date = date_cls.today()
+
+        auto_assign = request.method == 'POST'
+        if self._wants_async(request):
+            kind = PlanningJobKind.WINDOW_ROUTES_APPLY if auto_assign else PlanningJobKind.WINDOW_ROUTES
+            return self._submit_job(request, kind, {'date': target_date.isoformat()})
+
+        return Response(plan_routes_for_day(target_date, auto_assign=auto_assign))
+
     @action(detail=False, methods=['get'], url_path='daily-routes-export')
     def daily_routes_export(self, request):
         """
         Экспорт маршрутов дня: ZIP с отдельным CSV файлом для каждого водителя.
         Query param: date=YYYY-MM-DD (по умолчанию — сегодня)
+        Query param: async=1 — собрать архив фоновой задачей, файл отдается
+        через planning-jobs/<job_id>/result
         """
         user = request.user
         if not user.is_staff:
@@ -917,6 +834,9 @@ class DispatchViewSet(viewsets.ViewSet):
         else:
             target_date = date_cls.today()
 
+        if self._wants_async(request):
+            return self._submit_job(request, PlanningJobKind.DAILY_ROUTES_EXPORT, {'date': target_date.isoformat()})
+
         result = distribute_orders_for_day(target_date, auto_assign=False, user=user)
         routes = result.get('routes', [])
 
@@ -926,71 +846,67 @@ class DispatchViewSet(viewsets.ViewSet):
                 status=status.HTTP_404_NOT_FOUND
             )
 
-        def _format_time(iso_str):
-            if not iso_str:
-                return ''
-            s = str(iso_str)
-            if 'T' in s:
-                part = s.split('T')[1][:5]
-                return part if len(part) == 5 else s
-            if len(s) >= 5 and ':' in s:
-                return s[:5]
-            return s
-
-        zip_buffer = io.BytesIO()
-        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-            for route in routes:
-                driver_info = route.get('driver', {})
-                driver_id = driver_info.get('id', 0)
-                driver_name = (driver_info.get('name', 'driver') or 'driver').replace(' ', '_').replace('/', '_')
-                orders = route.get('orders', [])
-
-                csv_buffer = io.StringIO()
-                writer = csv.writer(csv_buffer, delimiter=';', lineterminator='\r\n')
-
-                writer.writerow([f'Маршрутный лист на {target_date.strftime("%d.%m.%Y")}'])
-                writer.writerow([])
-                writer.writerow(['Водитель:', driver_info.get('name', '')])
-                writer.writerow(['Телефон:', driver_info.get('phone', '')])
-                writer.writerow(['Авто:', driver_info.get('car_model', '') or '', 'Гос. номер:', driver_info.get('plate_number', '') or ''])
-                writer.writerow(['Регион:', driver_info.get('region', '')])
-                writer.writerow([])
-                writer.writerow([
-                    '№', 'ID', 'Пассажир', 'Откуда', 'Куда', 'Время',
-                    'Сопр.', 'Мест', 'Км', 'Цена', 'Примечание'
-                ])
-
-                for idx, o in enumerate(orders, 1):
-                    price = o.get('estimated_price', '')
-                    if price:
-                        try:
-                            price = f'{float(price):.0f}'
-                        except (ValueError, TypeError):
-                            pass
-                    writer.writerow([
-                        idx,
-                        o.get('id', ''),
-                        o.get('passenger_name', ''),
-                        (o.get('pickup_title', '') or '')[:80],
-                        (o.get('dropoff_title', '') or '')[:80],
-                        _format_time(o.get('desired_pickup_time')),
-                        'Да' if o.get('has_companion') else 'Нет',
-                        o.get('seats_needed', ''),
-                        o.get('distance_km', '') if o.get('distance_km') is not None else '',
-                        price,
-                        (o.get('note') or '').replace('\n', ' ').strip()[:200],
-                    ])
-
-                writer.writerow([])
-                writer.writerow(['Итого заказов:', route.get('total_orders', 0)])
-                writer.writerow(['Общее расстояние, км:', route.get('total_distance_km', 0)])
-
-                filename = f'marshrut_{target_date}_{driver_id}_{driver_name}.csv'
-                zip_file.writestr(filename, csv_buffer.getvalue().encode('utf-8-sig'))  # BOM для Excel
-
-        zip_buffer.seek(0)
-        response = HttpResponse(zip_buffer.read(), content_type='application/zip')
+        response = StreamingHttpResponse(iter_daily_routes_zip(routes, target_date), content_type='application/zip')
         response['Content-Disposition'] = (
             f'attachment; filename="daily_routes_{target_date}.zip"'
         )
-        return response
\ No newline at end of file
+        return response
+
+    @staticmethod
+    def _wants_async(request) -> bool:
+        return request.query_params.get('async') in ('1', 'true', 'True')
+
+    def _submit_job(self, request, kind, params=None):
+        """Ставит фоновую задачу планирования и возвращает 202"""
+        from .jobs import job_to_dict, submit_job
+
+        job = submit_job(kind, params, user=request.user)
+        data = job_to_dict(job)
+        data['job_id'] = data['id']
+        data['status_url'] = f'/api/dispatch/planning-jobs/{job.id}/'
+        return Response(data, status=status.HTTP_202_ACCEPTED)
+
+    def _get_job(self, request, job_id):
+        if not request.user.is_staff:
+            return None, Response({'error': 'Нет прав'}, status=status.HTTP_403_FORBIDDEN)
+        from .jobs import fail_stale_jobs
+
+        fail_stale_jobs()
+        try:
+            return PlanningJob.objects.defer('result_file').get(id=job_id), None
+        except (PlanningJob.DoesNotExist, ValueError, DjangoValidationError):
+            return None, Response({'error': 'Задача не найдена'}, status=status.HTTP_404_NOT_FOUND)
+
+    @action(detail=False, methods=['get'], url_path='planning-jobs/(?P<job_id>[^/.]+)')
+    def planning_job(self, request, job_id=None):
+        """Статус и прогресс фоновой задачи планирования"""
+        from .jobs import job_to_dict
+
+        job, error = self._get_job(request, job_id)
+        if error:
+            return error
+        return Response(job_to_dict(job))
+
+    @action(detail=False, methods=['get'], url_path='planning-jobs/(?P<job_id>[^/.]+)/result')
+    def planning_job_result(self, request, job_id=None):
+        """
+        Результат фоновой задачи: файл (экспорт) или JSON.
+        409 — задача еще выполняется, 422 — задача завершилась ошибкой.
+        """
+        job, error = self._get_job(request, job_id)
+        if error:
+            return error
+        if not job.is_finished:
+            return Response(
+                {'error': 'Задача еще выполняется', 'status': job.status, 'progress': job.progress},
+                status=status.HTTP_409_CONFLICT
+            )
+        if job.status == PlanningJobStatus.FAILED:
+            return Response({'error': job.error}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+        if job.result_filename:
+            content = PlanningJob.objects.values_list('result_file', flat=True).get(id=job.id)
+            response = HttpResponse(bytes(content), content_type=job.result_content_type)
+            response['Content-Disposition'] = f'attachment; filename="{job.result_filename}"'
+            return response
+        return Response(job.result)
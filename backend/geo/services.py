@@ -1,5 +1,7 @@
 import math
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Sequence
+
+import numpy as np
 
 if TYPE_CHECKING:
     from geo.models import Coordinate
@@ -9,6 +11,9 @@ class Geo:
     """Сервис для геолокационных расчетов"""
     # Радиус Земли в метрах
     EARTH_RADIUS_M = 6371000
+    # До этого расстояния используется равнопромежуточная проекция
+    # (относительная погрешность меньше 0.01% на широтах до 70°)
+    FAST_DISTANCE_MAX_M = 50000.0
 
     @staticmethod
     def calculate_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
@@ -28,6 +33,80 @@ class Geo:
 
         return Geo.EARTH_RADIUS_M * c
 
+    @staticmethod
+    def calculate_fast_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+        """
+        Быстрое расстояние в метрах для коротких отрезков (равнопромежуточная
+        проекция относительно средней широты). Отрезки длиннее
+        FAST_DISTANCE_MAX_M пересчитываются по Haversine.
+        """
+        x = math.radians(lon2 - lon1) * math.cos(math.radians((lat1 + lat2) / 2))
+        y = math.radians(lat2 - lat1)
+        distance = Geo.EARTH_RADIUS_M * math.sqrt(x * x + y * y)
+        if distance > Geo.FAST_DISTANCE_MAX_M:
+            return Geo.calculate_distance(lat1, lon1, lat2, lon2)
+        return distance
+
+    @staticmethod
+    def _haversine(lat1: np.ndarray, lon1: np.ndarray, lat2: np.ndarray, lon2: np.ndarray) -> np.ndarray:
+        """Haversine для массивов в радианах (с поддержкой broadcasting)"""
+        a = (np.sin((lat2 - lat1) / 2) ** 2 +
+             np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2)
+        return Geo.EARTH_RADIUS_M * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+    @staticmethod
+    def calculate_distances(lat: float, lon: float, lats: Sequence[float], lons: Sequence[float]) -> np.ndarray:
+        """
+        Расстояния от одной точки до набора точек (векторизовано)
+        Возвращает массив длины len(lats) в метрах
+        """
+        return Geo._haversine(
+            math.radians(lat), math.radians(lon),
+            np.radians(np.asarray(lats, dtype=float)), np.radians(np.asarray(lons, dtype=float))
+        )
+
+    @staticmethod
+    def calculate_pairwise_distances(
+        lats1: Sequence[float], lons1: Sequence[float],
+        lats2: Sequence[float], lons2: Sequence[float]
+    ) -> np.ndarray:
+        """
+        Попарные расстояния между i-й точкой первого и i-й точкой второго набора
+        Возвращает массив длины len(lats1) в метрах
+        """
+        return Geo._haversine(
+            np.radians(np.asarray(lats1, dtype=float)), np.radians(np.asarray(lons1, dtype=float)),
+            np.radians(np.asarray(lats2, dtype=float)), np.radians(np.asarray(lons2, dtype=float))
+        )
+
+    @staticmethod
+    def calculate_path_distances(lats: Sequence[float], lons: Sequence[float]) -> np.ndarray:
+        """
+        Длины отрезков ломаной (между соседними точками)
+        Возвращает массив длины len(lats) - 1 в метрах
+        """
+        lat = np.radians(np.asarray(lats, dtype=float))
+        lon = np.radians(np.asarray(lons, dtype=float))
+        if lat.size < 2:
+            return np.zeros(0)
+        return Geo._haversine(lat[:-1], lon[:-1], lat[1:], lon[1:])
+
+    @staticmethod
+    def calculate_distance_matrix(
+        lats1: Sequence[float], lons1: Sequence[float],
+        lats2: Sequence[float], lons2: Sequence[float]
+    ) -> np.ndarray:
+        """
+        Матрица расстояний Haversine между двумя наборами точек (векторизовано)
+        Возвращает массив формы (len(lats1), len(lats2)) в метрах
+        """
+        lat1 = np.radians(np.asarray(lats1, dtype=float))[:, None]
+        lon1 = np.radians(np.asarray(lons1, dtype=float))[:, None]
+        lat2 = np.radians(np.asarray(lats2, dtype=float))[None, :]
+        lon2 = np.radians(np.asarray(lons2, dtype=float))[None, :]
+
+        return Geo._haversine(lat1, lon1, lat2, lon2)
+
 
 class GeofenceService:
     """Сервис для работы с геозонами"""
@@ -38,6 +117,6 @@ class GeofenceService:
         """
         Проверяет, находится ли точка внутри геозоны
         """
-        distance = Geo.calculate_distance(lat1, lon1, lat2, lon2)
+        distance = Geo.calculate_fast_distance(lat1, lon1, lat2, lon2)
         return distance <= GeofenceService.RADIUS_METERS
 
@@ -235,6 +235,133 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Бэкенд маршрутизации (dispatch.services.get_routing_backend)
+# 'osrm' - HTTP API OSRM (OSRM_SERVERS перебираются по очереди),
+# 'local' - локальный дорожный граф из GRAPH_PATH (.npz от build_road_graph или .osm)
+ROUTING = {
+    'BACKEND': os.getenv('ROUTING_BACKEND', 'osrm'),
+    'OSRM_SERVERS': [
+        url for url in os.getenv(
+            'OSRM_SERVERS', 'http://router.project-osrm.org,https://router.project-osrm.org'
+        ).split(',') if url
+    ],
+    'GRAPH_PATH': os.getenv('ROUTING_GRAPH_PATH', str(BASE_DIR / 'data' / 'road_graph.npz')),
+}
+
+# Кэш маршрутов (dispatch.route_cache)
+# BACKEND: 'memory' - только LRU в процессе, 'django' - общий через Django cache API,
+# 'sqlite' - общий sqlite-файл (SQLITE_PATH, по умолчанию BASE_DIR / 'route_cache.sqlite3')
+ROUTE_CACHE = {
+    'ENABLED': os.getenv('ROUTE_CACHE_ENABLED', 'True') == 'True',
+    'BACKEND': os.getenv('ROUTE_CACHE_BACKEND', 'memory'),
+    'MAX_ENTRIES': int(os.getenv('ROUTE_CACHE_MAX_ENTRIES', '50000')),
+    'TTL_SECONDS': int(os.getenv('ROUTE_CACHE_TTL_SECONDS', str(6 * 3600))),
+    'COORD_PRECISION': 4,  # ~11 метров
+    'TIME_BUCKET_MINUTES': 60,
+    # BACKEND='sqlite': лимит строк файла (истекшие удаляются раз в SQLITE_PURGE_EVERY записей)
+    'SQLITE_MAX_ROWS': int(os.getenv('ROUTE_CACHE_SQLITE_MAX_ROWS', '200000')),
+}
+
+# Индекс регионов (regions.services.get_region_index) перестраивается в своем процессе
+# по сигналам Region; максимальный возраст нужен, чтобы видеть изменения из других воркеров
+REGION_INDEX_MAX_AGE_SECONDS = int(os.getenv('REGION_INDEX_MAX_AGE_SECONDS', '600'))
+
+# Кэш дневного плана (dispatch.plan_cache): просмотр, экспорт и применение плана
+# переиспользуют расчет, пока не изменились заказы, водители или DispatchConfig
+DAILY_PLAN_CACHE = {
+    'ENABLED': os.getenv('DAILY_PLAN_CACHE_ENABLED', 'True') == 'True',
+    'BACKEND': os.getenv('DAILY_PLAN_CACHE_BACKEND', 'memory'),
+    'TTL_SECONDS': int(os.getenv('DAILY_PLAN_CACHE_TTL_SECONDS', '1800')),
+    'DELTA_MAX_FRACTION': 0.25,
+    'DRIVER_COORD_PRECISION': 3,  # ~110 м
+}
+
+# Срезы аналитики (analytics.rollups): обновляются командой refresh_analytics_rollups,
+# период после последнего обновления дочитывается из таблицы заказов
+ANALYTICS_ROLLUPS = {
+    'ENABLED': os.getenv('ANALYTICS_ROLLUPS_ENABLED', 'True') == 'True',
+    'LAG_SECONDS': 300,
+}
+
+# Кэш ответов аналитики (analytics.cache) через Django cache API (CACHES[ALIAS]).
+# Закрытые диапазоны живут HISTORICAL_TTL_SECONDS, диапазоны с сегодняшним днем - LIVE_TTL_SECONDS
+# (или ENDPOINT_TTL_SECONDS[эндпоинт]); сохранение заказа сбрасывает ответы за его день.
+# Без CACHES алиас 'default' - LocMemCache в памяти каждого процесса: сброс из другого
+# воркера до него не доходит, поэтому для такого кэша HISTORICAL_TTL_SECONDS не применяется
+# и все ответы живут короткий TTL. Для длинного TTL нужен общий кэш (Redis, Memcached)
+ANALYTICS_CACHE = {
+    'ENABLED': os.getenv('ANALYTICS_CACHE_ENABLED', 'True') == 'True',
+    'ALIAS': os.getenv('ANALYTICS_CACHE_ALIAS', 'default'),
+    'HISTORICAL_TTL_SECONDS': int(os.getenv('ANALYTICS_CACHE_HISTORICAL_TTL_SECONDS', str(24 * 3600))),
+    'LIVE_TTL_SECONDS': int(os.getenv('ANALYTICS_CACHE_LIVE_TTL_SECONDS', '60')),
+}
+
+# Состояние карты диспетчеризации (dispatch.map_state): счетчик seq и журнал дельт
+# в Django cache - для нескольких процессов нужен общий кэш (Redis)
+DISPATCH_MAP_STATE = {
+    'CACHE_ALIAS': os.getenv('DISPATCH_MAP_STATE_CACHE_ALIAS', 'default'),
+    'LOG_TTL_SECONDS': int(os.getenv('DISPATCH_MAP_STATE_LOG_TTL_SECONDS', '600')),
+    'MAX_RESYNC_DELTAS': 2000,
+    # Счетчики клиентов карты (и для дебаунсинга позиций) продлеваются ping клиентов (раз в 30 с)
+    'SUBSCRIBERS_TTL_SECONDS': 90,
+}
+
+# Прием позиций водителей (accounts.locations): последние точки копятся в памяти процесса
+# и записываются bulk_update раз в FLUSH_INTERVAL_SECONDS; EAGER=True - запись сразу в запросе
+LOCATION_PIPELINE = {
+    'FLUSH_INTERVAL_SECONDS': float(os.getenv('LOCATION_FLUSH_INTERVAL_SECONDS', '1.0')),
+    'MAX_PENDING': 2000,
+    'BATCH_SIZE': 500,
+    'ETA_INTERVAL_SECONDS': int(os.getenv('LOCATION_ETA_INTERVAL_SECONDS', '5')),
+    'EAGER': os.getenv('LOCATION_PIPELINE_EAGER', 'False') == 'True',
+}
+
+# Индекс водителей для поиска ближайших (dispatch.driver_index): обновляется сигналами
+# в своем процессе; изменения доступности из других воркеров - через общую версию
+# в CACHES[CACHE_ALIAS] (нужен общий кэш), позиции - перестроением раз в MAX_AGE_SECONDS
+DRIVER_INDEX = {
+    'MAX_AGE_SECONDS': int(os.getenv('DRIVER_INDEX_MAX_AGE_SECONDS', '60')),
+    'CACHE_ALIAS': os.getenv('DRIVER_INDEX_CACHE_ALIAS', 'default'),
+    'CELL_SIZE_DEG': 0.01,  # ~1 км
+    'MATCHING_CANDIDATES': 100,
+}
+
+# ETA по маршруту заказа (dispatch.eta_tracker): новая позиция проецируется на сохраненный
+# маршрут, запрос маршрута - только при отклонении, по таймеру или при смене точки назначения
+ETA_TRACKER = {
+    'ENABLED': os.getenv('ETA_TRACKER_ENABLED', 'True') == 'True',
+    'DEVIATION_METERS': int(os.getenv('ETA_TRACKER_DEVIATION_METERS', '150')),
+    'REROUTE_INTERVAL_SECONDS': int(os.getenv('ETA_TRACKER_REROUTE_INTERVAL_SECONDS', '300')),
+    'MAX_ENTRIES': 10000,
+    'TTL_SECONDS': 3 * 3600,
+}
+
+# Дебаунсинг рассылки позиций на карту (accounts.location_debounce): 'memory' - LRU процесса,
+# 'django' - общее для воркеров состояние через Django cache API (CACHES[DJANGO_CACHE_ALIAS])
+LOCATION_DEBOUNCE = {
+    'BACKEND': os.getenv('LOCATION_DEBOUNCE_BACKEND', 'memory'),
+    'DJANGO_CACHE_ALIAS': os.getenv('LOCATION_DEBOUNCE_CACHE_ALIAS', 'default'),
+    'MAX_ENTRIES': 20000,
+    'TTL_SECONDS': 600,
+    'MIN_INTERVAL_SECONDS': 0.5,
+    'UNWATCHED_INTERVAL_SECONDS': 5.0,
+    'MIN_DISTANCE_M': 10.0,
+    'MAX_DISTANCE_M': 50.0,
+    'DISTANCE_PER_SPEED_SECONDS': 1.0,
+    'STATS_LOG_INTERVAL_SECONDS': int(os.getenv('LOCATION_DEBOUNCE_STATS_LOG_INTERVAL_SECONDS', '300')),
+}
+
+# Фоновые задачи планирования (dispatch.jobs): пул потоков внутри процесса.
+# EAGER=True выполняет задачу сразу в запросе (тесты, отладка)
+PLANNING_JOBS = {
+    'WORKERS': int(os.getenv('PLANNING_JOBS_WORKERS', '2')),
+    'EAGER': os.getenv('PLANNING_JOBS_EAGER', 'False') == 'True',
+    'PROGRESS_INTERVAL_SECONDS': 0.5,
+    # Задачи в памяти процесса не переживают перезапуск: QUEUED/RUNNING
+    # дольше этого срока помечаются как FAILED
+    'STALE_AFTER_SECONDS': int(os.getenv('PLANNING_JOBS_STALE_AFTER_SECONDS', '3600')),
+}
+
 # OTP Settings
 OTP_EXPIRY_MINUTES = 5
 OTP_LENGTH = 6
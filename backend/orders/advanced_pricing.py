@@ -10,6 +10,8 @@ from datetime import datetime, timedelta
 import math
 import logging
 
+import numpy as np
+
 from orders.models import (
     PricingConfig, Order, OrderStatus, SurgeZone, PriceBreakdown, CancelPolicy
 )
@@ -421,30 +423,24 @@ class AdvancedPriceCalculator:
         # Фильтруем точки с плохой точностью (если есть информация о точности)
         # Пока просто проверяем на "телепорты"
         
-        filtered_points = [gps_points[0]]
         MAX_SPEED_KMH = 120.0  # Максимальная скорость в км/ч
         MAX_SPEED_MS = MAX_SPEED_KMH / 3.6  # м/с
         
-        for i in range(1, len(gps_points)):
-            prev_lat, prev_lon = gps_points[i-1]
-            curr_lat, curr_lon = gps_points[i]
-            
-            # Расстояние между точками в метрах
-            distance_m = Geo.calculate_distance(prev_lat, prev_lon, curr_lat, curr_lon)
-            
-            # Предполагаем, что точки с интервалом 1 секунда
-            # Если скорость превышает MAX_SPEED - это "телепорт", пропускаем точку
-            if distance_m <= MAX_SPEED_MS:
-                filtered_points.append((curr_lat, curr_lon))
-            else:
-                logger.warning(f'Обнаружен GPS "телепорт": расстояние {distance_m}m за 1 сек')
+        lats = np.array([point[0] for point in gps_points], dtype=float)
+        lons = np.array([point[1] for point in gps_points], dtype=float)
+        
+        # Расстояния между соседними точками в метрах.
+        # Предполагаем, что точки с интервалом 1 секунда
+        # Если скорость превышает MAX_SPEED - это "телепорт", пропускаем точку
+        steps = Geo.calculate_path_distances(lats, lons)
+        teleports = steps > MAX_SPEED_MS
+        for distance_m in steps[teleports]:
+            logger.warning(f'Обнаружен GPS "телепорт": расстояние {distance_m}m за 1 сек')
+        
+        keep = np.concatenate(([True], ~teleports))
         
         # Пересчитываем расстояние по отфильтрованным точкам
-        filtered_distance = 0.0
-        for i in range(1, len(filtered_points)):
-            prev_lat, prev_lon = filtered_points[i-1]
-            curr_lat, curr_lon = filtered_points[i]
-            filtered_distance += Geo.calculate_distance(prev_lat, prev_lon, curr_lat, curr_lon)
+        filtered_distance = float(Geo.calculate_path_distances(lats[keep], lons[keep]).sum())
         
         return filtered_distance / 1000.0  # Конвертируем в км
     
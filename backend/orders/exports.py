@@ -0,0 +1,80 @@
+"""
+Экспорт заказов по водителям (ZIP с отдельным CSV для каждого водителя)
+
+Заказы читаются queryset.iterator() в порядке водителей, CSV пишется
+построчно в потоковый ZIP (dispatch.exports.stream_zip).
+"""
+from itertools import chain, groupby
+from typing import Iterator, List
+
+from dispatch.exports import csv_lines, stream_zip
+
+EXPORT_CHUNK_SIZE = 2000
+
+ORDERS_BY_DRIVER_HEADER = [
+    'order_id',
+    'passenger_name',
+    'passenger_phone',
+    'pickup_title',
+    'pickup_lat',
+    'pickup_lon',
+    'dropoff_title',
+    'dropoff_lat',
+    'dropoff_lon',
+    'desired_pickup_time',
+    'status',
+    'assigned_at',
+    'has_companion',
+    'distance_km',
+    'estimated_price',
+    'final_price'
+]
+
+
+def _order_row(order) -> List:
+    return [
+        order.id,
+        order.passenger.full_name if order.passenger else '',
+        order.passenger.user.phone if order.passenger and order.passenger.user else '',
+        order.pickup_title,
+        order.pickup_lat,
+        order.pickup_lon,
+        order.dropoff_title,
+        order.dropoff_lat,
+        order.dropoff_lon,
+        order.desired_pickup_time.isoformat() if order.desired_pickup_time else '',
+        order.status,
+        order.assigned_at.isoformat() if order.assigned_at else '',
+        'Да' if order.has_companion else 'Нет',
+        order.distance_km or '',
+        float(order.estimated_price) if order.estimated_price else '',
+        float(order.final_price) if order.final_price else ''
+    ]
+
+
+def _driver_rows(orders) -> Iterator[List]:
+    yield ORDERS_BY_DRIVER_HEADER
+    for order in orders:
+        yield _order_row(order)
+
+
+def iter_orders_by_drivers_zip(queryset) -> Iterator[bytes]:
+    """
+    Потоковый ZIP: CSV на каждого водителя из заказов queryset
+    (заказы без водителя пропускаются)
+    """
+    orders = (
+        queryset.filter(driver__isnull=False)
+        .select_related('passenger', 'driver', 'passenger__user', 'driver__user')
+        .order_by('driver_id', '-created_at')
+        .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    )
+
+    def entries():
+        for _, driver_orders in groupby(orders, key=lambda o: o.driver_id):
+            first = next(driver_orders)
+            driver = first.driver
+            filename = f'orders_driver_{driver.id}_{driver.name.replace(" ", "_")}.csv'
+            yield filename, csv_lines(_driver_rows(chain([first], driver_orders)), bom=True)
+
+    return stream_zip(entries())
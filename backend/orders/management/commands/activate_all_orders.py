@@ -5,6 +5,7 @@ Django management command для перевода всех заказов в а
     python manage.py activate_all_orders
 """
 from django.core.management.base import BaseCommand
+from django.utils import timezone
 from orders.models import Order, OrderStatus
 
 
@@ -13,7 +14,8 @@ class Command(BaseCommand):
 
     def handle(self, *args, **options):
         updated = Order.objects.exclude(status=OrderStatus.ACTIVE_QUEUE).update(
-            status=OrderStatus.ACTIVE_QUEUE
+            status=OrderStatus.ACTIVE_QUEUE,
+            updated_at=timezone.now()
         )
         total = Order.objects.count()
         self.stdout.write(self.style.SUCCESS(
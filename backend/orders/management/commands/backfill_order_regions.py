@@ -0,0 +1,59 @@
+"""
+Management command для заполнения pickup_region/dropoff_region у существующих заказов
+"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from orders.models import Order
+from orders.services import OrderService
+
+
+class Command(BaseCommand):
+    help = 'Заполняет pickup_region/dropoff_region заказов по координатам (пачками, через индекс регионов)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=2000,
+            help='Количество заказов в одной пачке (по умолчанию 2000)',
+        )
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Пересчитать все заказы, а не только заказы без pickup_region',
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        
+        orders = Order.objects.all()
+        if not options['all']:
+            orders = orders.filter(pickup_region__isnull=True)
+        
+        total = orders.count()
+        self.stdout.write(f'Заказов для обработки: {total}')
+        
+        processed = 0
+        updated = 0
+        last_id = None
+        # Пагинация по первичному ключу: обновленные заказы выпадают из фильтра,
+        # поэтому смещение (OFFSET) здесь не подходит
+        while True:
+            chunk_qs = orders.select_related('passenger').order_by('id')
+            if last_id is not None:
+                chunk_qs = chunk_qs.filter(id__gt=last_id)
+            chunk = list(chunk_qs[:chunk_size])
+            if not chunk:
+                break
+            last_id = chunk[-1].id
+            
+            changed = OrderService.assign_regions(chunk)
+            if changed:
+                with transaction.atomic():
+                    Order.objects.bulk_update(changed, ['pickup_region', 'dropoff_region'])
+            
+            processed += len(chunk)
+            updated += len(changed)
+            self.stdout.write(f'  Обработано {processed}/{total}, обновлено {updated}')
+        
+        self.stdout.write(self.style.SUCCESS(f'Готово: обновлено {updated} из {processed} заказов'))
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.27 on 2026-10-17 03:58
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('regions', '0007_add_district_model'),
+        ('orders', '0009_add_fairness_scale_and_increase_w_fairness'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='dropoff_region',
+            field=models.ForeignKey(blank=True, help_text='Определяется по координатам dropoff при сохранении', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='dropoff_orders', to='regions.region', verbose_name='Регион назначения'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='pickup_region',
+            field=models.ForeignKey(blank=True, help_text='Определяется по координатам pickup при сохранении (fallback на регион пассажира)', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='pickup_orders', to='regions.region', verbose_name='Регион отправления'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['pickup_region', 'status'], name='orders_orde_pickup__20e3bf_idx'),
+        ),
+    ]
@@ -6,6 +6,9 @@ from accounts.models import User, Passenger, Driver
 from regions.models import Region
 from .validators import validate_pickup_time, validate_coordinates
 
+# Регион не передан в Order.assign_regions (None - точка вне регионов)
+_UNSET = object()
+
 
 class OrderStatus(models.TextChoices):
     """Статусы заказа"""
@@ -322,6 +325,24 @@ class Order(models.Model):
     pickup_lon = models.FloatField(verbose_name='Долгота отправления')
     dropoff_lat = models.FloatField(verbose_name='Широта назначения')
     dropoff_lon = models.FloatField(verbose_name='Долгота назначения')
+    pickup_region = models.ForeignKey(
+        Region,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='pickup_orders',
+        verbose_name='Регион отправления',
+        help_text='Определяется по координатам pickup при сохранении (fallback на регион пассажира)'
+    )
+    dropoff_region = models.ForeignKey(
+        Region,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='dropoff_orders',
+        verbose_name='Регион назначения',
+        help_text='Определяется по координатам dropoff при сохранении'
+    )
     desired_pickup_time = models.DateTimeField(
         verbose_name='Желаемое время забора',
         validators=[validate_pickup_time]
@@ -335,6 +356,7 @@ class Order(models.Model):
         verbose_name='Статус'
     )
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Создан')
+    updated_at = models.DateTimeField(auto_now=True, db_index=True, verbose_name='Изменен')
     assigned_at = models.DateTimeField(null=True, blank=True, verbose_name='Назначен')
     completed_at = models.DateTimeField(null=True, blank=True, verbose_name='Завершен')
     assignment_reason = models.TextField(null=True, blank=True, verbose_name='Причина назначения')
@@ -410,10 +432,70 @@ class Order(models.Model):
         verbose_name = 'Заказ'
         verbose_name_plural = 'Заказы'
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['pickup_region', 'status']),
+        ]
+
+    # Поля, от которых зависят pickup_region / dropoff_region
+    REGION_SOURCE_FIELDS = ('pickup_lat', 'pickup_lon', 'dropoff_lat', 'dropoff_lon', 'passenger')
+    REGION_FIELDS = ('pickup_region', 'dropoff_region')
 
     def __str__(self):
         return f'Заказ {self.id} - {self.passenger.full_name}'
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Запоминаем координаты из БД, чтобы пересчитывать регионы только при их изменении
+        instance._loaded_region_source = instance._region_source()
+        return instance
+
+    def _region_source(self):
+        return (
+            self.__dict__.get('pickup_lat'), self.__dict__.get('pickup_lon'),
+            self.__dict__.get('dropoff_lat'), self.__dict__.get('dropoff_lon'),
+            self.__dict__.get('passenger_id'),
+        )
+
+    def regions_outdated(self) -> bool:
+        """Нужно ли пересчитать pickup_region/dropoff_region"""
+        loaded = getattr(self, '_loaded_region_source', None)
+        if self._state.adding or loaded is None:
+            return True
+        return loaded != self._region_source()
+
+    def assign_regions(self, pickup_region=_UNSET, dropoff_region=_UNSET):
+        """
+        Определяет регионы по координатам (без сохранения)
+
+        Для pickup используется fallback на регион пассажира, как раньше
+        в вычисляемом свойстве pickup_region.
+        Регионы можно передать заранее вычисленными (пакетный расчет);
+        переданный None означает, что точка не попала ни в один регион.
+        """
+        from regions.services import get_region_by_coordinates
+
+        if pickup_region is _UNSET:
+            pickup_region = get_region_by_coordinates(self.pickup_lat, self.pickup_lon)
+        if dropoff_region is _UNSET:
+            dropoff_region = get_region_by_coordinates(self.dropoff_lat, self.dropoff_lon)
+
+        if pickup_region is None and self.passenger_id:
+            self.pickup_region_id = self.passenger.region_id
+        else:
+            self.pickup_region = pickup_region
+        self.dropoff_region = dropoff_region
+        self._loaded_region_source = self._region_source()
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or set(update_fields) & set(self.REGION_SOURCE_FIELDS):
+            if self.regions_outdated():
+                self.assign_regions()
+                if update_fields is not None:
+                    kwargs['update_fields'] = set(update_fields) | set(self.REGION_FIELDS)
+        super().save(*args, **kwargs)
+
     @property
     def seats_needed(self):
         """Количество необходимых мест"""
@@ -429,27 +511,6 @@ class Order(models.Model):
         """Координаты назначения"""
         return (self.dropoff_lat, self.dropoff_lon)
 
-    @property
-    def pickup_region(self):
-        """
-        Определяет регион по координатам точки pickup
-        Использует regions.services.get_region_by_coordinates
-        Fallback на order.passenger.region если регион не найден
-        """
-        from regions.services import get_region_by_coordinates
-        
-        # Пытаемся определить регион по координатам pickup
-        region = get_region_by_coordinates(self.pickup_lat, self.pickup_lon)
-        
-        if region:
-            return region
-        
-        # Fallback на район пассажира
-        if hasattr(self, 'passenger') and self.passenger and hasattr(self.passenger, 'region'):
-            return self.passenger.region
-        
-        return None
-
 
 class OrderEvent(models.Model):
     """История изменений заказа"""
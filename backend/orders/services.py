@@ -239,6 +239,36 @@ class OrderService:
         }
         return valid_transitions.get(current_status, [])
 
+    @staticmethod
+    def assign_regions(orders: list) -> list:
+        """
+        Пакетно определяет pickup_region/dropoff_region для списка заказов
+        (без сохранения). Для заказов с fallback на регион пассажира нужен
+        select_related('passenger').
+        
+        Returns:
+            Список заказов, у которых регионы изменились
+        """
+        from regions.services import get_regions_by_coordinates
+        
+        if not orders:
+            return []
+        
+        pickup_regions = get_regions_by_coordinates(
+            [o.pickup_lat for o in orders], [o.pickup_lon for o in orders]
+        )
+        dropoff_regions = get_regions_by_coordinates(
+            [o.dropoff_lat for o in orders], [o.dropoff_lon for o in orders]
+        )
+        
+        changed = []
+        for order, pickup_region, dropoff_region in zip(orders, pickup_regions, dropoff_regions):
+            before = (order.pickup_region_id, order.dropoff_region_id)
+            order.assign_regions(pickup_region=pickup_region, dropoff_region=dropoff_region)
+            if (order.pickup_region_id, order.dropoff_region_id) != before:
+                changed.append(order)
+        return changed
+
 
 class PriceCalculator:
     """Сервис для расчета цены заказа"""
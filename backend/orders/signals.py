@@ -1,9 +1,15 @@
-from django.db.models.signals import post_save
-from django.dispatch import receiver
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import Signal, receiver
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
 from .models import Order
 from .serializers import OrderSerializer
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Заказы изменены пакетно без post_save (bulk_update); аргумент order_ids
+orders_bulk_updated = Signal()
 
 
 def get_channel_layer_safe():
@@ -14,6 +20,41 @@ def get_channel_layer_safe():
         return None
 
 
+@receiver(post_save, sender=Order)
+def order_map_delta(sender, instance, update_fields=None, **kwargs):
+    """Дельта карты диспетчеризации: только измененные поля, после commit (dispatch.map_state)"""
+    from dispatch import map_state
+
+    try:
+        map_state.publish_on_commit([map_state.order_change(instance, update_fields)])
+    except Exception as e:
+        logger.error(f"Error publishing order map delta: {e}")
+
+
+@receiver(post_delete, sender=Order)
+def order_deleted_map_delta(sender, instance, **kwargs):
+    """Удаленный заказ убирается с карты"""
+    from dispatch import map_state
+
+    try:
+        map_state.publish_on_commit([
+            {'kind': map_state.KIND_ORDER, 'id': instance.id, 'op': map_state.OP_REMOVE}
+        ])
+    except Exception as e:
+        logger.error(f"Error publishing order map delta: {e}")
+
+
+@receiver(post_save, sender=Order)
+@receiver(post_delete, sender=Order)
+def order_eta_route_released(sender, instance, **kwargs):
+    """Маршрут ETA заказа больше не нужен (dispatch.eta_tracker)"""
+    from accounts.locations import ETA_ORDER_STATUSES
+    from dispatch.eta_tracker import release_order
+
+    if kwargs.get('signal') is post_delete or instance.status not in ETA_ORDER_STATUSES:
+        release_order(instance.id)
+
+
 @receiver(post_save, sender=Order)
 def order_updated(sender, instance, **kwargs):
     """Отправляет обновление заказа через WebSocket"""
@@ -85,6 +126,10 @@ def order_updated(sender, instance, **kwargs):
             )
 
         # Отправляем обновление в dispatch_map группу для карты диспетчеризации
+        # (клиенты в режиме дельт в ней не состоят - без подписчиков не отправляем)
+        from dispatch import map_state
+        if not map_state.has_legacy_subscribers():
+            return
         # Отправляем только для активных заказов (не draft, не rejected, not completed, not cancelled)
         active_statuses = [
             'submitted', 'awaiting_dispatcher_decision', 'active_queue',
@@ -92,8 +137,6 @@ def order_updated(sender, instance, **kwargs):
         ]
         inactive_statuses = ['completed', 'cancelled', 'rejected', 'draft']
         
-        order_data = OrderSerializer(instance).data
-        
         # Если заказ стал неактивным (завершен или отменен), отправляем обновление для удаления с карты
         if instance.status in inactive_statuses and 'status' in kwargs.get('update_fields', []):
             async_to_sync(channel_layer.group_send)(
@@ -3,17 +3,17 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from django.utils import timezone
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 from .models import Order, OrderStatus, PricingConfig, SurgeZone, PriceBreakdown, CancelPolicy
 from .serializers import OrderSerializer, OrderStatusUpdateSerializer
 from .pagination import OrderPagination
 from .services import OrderService, PriceCalculator
 from .advanced_pricing import AdvancedPriceCalculator
+from .exports import iter_orders_by_drivers_zip
 from accounts.models import Passenger, Driver
 from dispatch.services import DispatchEngine
 import csv
 import io
-import zipfile
 import logging
 from datetime import datetime
 from decimal import Decimal
@@ -1044,20 +1044,19 @@ class OrderViewSet(viewsets.ModelViewSet):
         if date_to:
             queryset = queryset.filter(created_at__lte=date_to)
         
-        # Группируем по водителям
-        drivers_orders = {}
-        for order in queryset:
-            if order.driver:
-                driver_id = order.driver.id
-                if driver_id not in drivers_orders:
-                    drivers_orders[driver_id] = {
-                        'driver': order.driver,
-                        'orders': []
-                    }
-                drivers_orders[driver_id]['orders'].append(order)
-        
         if format_type == 'json':
             # JSON формат
+            drivers_orders = {}
+            for order in queryset:
+                if order.driver:
+                    driver_id = order.driver.id
+                    if driver_id not in drivers_orders:
+                        drivers_orders[driver_id] = {
+                            'driver': order.driver,
+                            'orders': []
+                        }
+                    drivers_orders[driver_id]['orders'].append(order)
+
             result = {}
             for driver_id, data in drivers_orders.items():
                 driver = data['driver']
@@ -1071,68 +1070,9 @@ class OrderViewSet(viewsets.ModelViewSet):
                 }
             return Response(result)
         
-        # ZIP формат с CSV файлами
-        zip_buffer = io.BytesIO()
-        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-            for driver_id, data in drivers_orders.items():
-                driver = data['driver']
-                orders = data['orders']
-                
-                # Создаем CSV для водителя
-                csv_buffer = io.StringIO()
-                csv_buffer.write('\ufeff')  # BOM для UTF-8
-                writer = csv.writer(csv_buffer)
-                
-                # Заголовки
-                writer.writerow([
-                    'order_id',
-                    'passenger_name',
-                    'passenger_phone',
-                    'pickup_title',
-                    'pickup_lat',
-                    'pickup_lon',
-                    'dropoff_title',
-                    'dropoff_lat',
-                    'dropoff_lon',
-                    'desired_pickup_time',
-                    'status',
-                    'assigned_at',
-                    'has_companion',
-                    'distance_km',
-                    'estimated_price',
-                    'final_price'
-                ])
-                
-                # Данные
-                for order in orders:
-                    writer.writerow([
-                        order.id,
-                        order.passenger.full_name if order.passenger else '',
-                        order.passenger.user.phone if order.passenger and order.passenger.user else '',
-                        order.pickup_title,
-                        order.pickup_lat,
-                        order.pickup_lon,
-                        order.dropoff_title,
-                        order.dropoff_lat,
-                        order.dropoff_lon,
-                        order.desired_pickup_time.isoformat() if order.desired_pickup_time else '',
-                        order.status,
-                        order.assigned_at.isoformat() if order.assigned_at else '',
-                        'Да' if order.has_companion else 'Нет',
-                        order.distance_km or '',
-                        float(order.estimated_price) if order.estimated_price else '',
-                        float(order.final_price) if order.final_price else ''
-                    ])
-                
-                # Добавляем в ZIP
-                filename = f'orders_driver_{driver.id}_{driver.name.replace(" ", "_")}.csv'
-                zip_file.writestr(filename, csv_buffer.getvalue().encode('utf-8'))
-        
-        zip_buffer.seek(0)
-        
-        # Создаем HTTP ответ
+        # ZIP формат с CSV файлами (потоково)
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        response = HttpResponse(zip_buffer.read(), content_type='application/zip')
+        response = StreamingHttpResponse(iter_orders_by_drivers_zip(queryset), content_type='application/zip')
         response['Content-Disposition'] = f'attachment; filename="orders_export_{timestamp}.zip"'
         return response
 
@@ -5,3 +5,6 @@ class RegionsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'regions'
 
+
+    def ready(self):
+        import regions.signals  # noqa
@@ -1,10 +1,21 @@
 """
 Сервис для работы с регионами
+
+Определение региона по координатам идет через индекс RegionIndex в памяти
+процесса: регионы загружаются из БД один раз, кандидаты отбираются по
+равномерной сетке ограничивающих прямоугольников. Индекс сбрасывается
+сигналами сохранения/удаления Region (см. regions.signals).
 """
-from typing import Optional
+from typing import Optional, List, Sequence
 from .models import Region
 from geo.services import Geo
 import logging
+import math
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
 
 logger = logging.getLogger(__name__)
 
@@ -42,6 +53,185 @@ def point_in_polygon(lat: float, lon: float, polygon: list) -> bool:
     return inside
 
 
+def points_in_polygon(lats: Sequence[float], lons: Sequence[float], polygon: list) -> np.ndarray:
+    """
+    Векторизованный вариант point_in_polygon для массива точек
+    (тот же алгоритм Ray Casting, цикл по рёбрам, точки - массивом)
+    
+    Returns:
+        Массив bool той же длины, что и lats
+    """
+    lat = np.asarray(lats, dtype=float)
+    lon = np.asarray(lons, dtype=float)
+    inside = np.zeros(lat.shape, dtype=bool)
+    if not polygon or len(polygon) < 3:
+        return inside
+    
+    poly = np.asarray(polygon, dtype=float)
+    p1 = poly
+    p2 = np.roll(poly, -1, axis=0)
+    for (p1x, p1y), (p2x, p2y) in zip(p1.tolist(), p2.tolist()):
+        crosses = (lon > min(p1y, p2y)) & (lon <= max(p1y, p2y)) & (lat <= max(p1x, p2x))
+        if not crosses.any():
+            continue
+        if p1x == p2x:
+            inside ^= crosses
+            continue
+        # При p1y == p2y условие crosses всегда ложно, деление не выполняется
+        if p1y == p2y:
+            continue
+        xinters = (lon - p1y) * (p2x - p1x) / (p2y - p1y) + p1x
+        inside ^= crosses & (lat <= xinters)
+    
+    return inside
+
+
+class RegionIndex:
+    """
+    Индекс регионов в памяти для определения региона по координатам.
+
+    Порядок проверки совпадает с исходным полным перебором:
+    сначала полигоны (в порядке Region.Meta.ordering), затем радиусы
+    обслуживания. Для каждой ячейки сетки хранятся только регионы,
+    чей ограничивающий прямоугольник пересекает ячейку.
+    """
+    # Размер ячейки сетки (градусы, ~5 км)
+    CELL_DEG = 0.05
+
+    def __init__(self, regions: List[Region]):
+        self.regions = list(regions)
+        self.built_at = time.time()
+        self._polygons = []  # (порядок, region, polygon, bbox)
+        self._radii = []  # (порядок, region, center_lat, center_lon, radius_m)
+        self._polygon_cells = {}
+        self._radius_cells = {}
+
+        for position, region in enumerate(self.regions):
+            polygon = region.polygon_coordinates
+            if polygon:
+                try:
+                    if isinstance(polygon, list) and len(polygon) >= 3:
+                        coords = [(float(p[0]), float(p[1])) for p in polygon]
+                        bbox = (
+                            min(c[0] for c in coords), min(c[1] for c in coords),
+                            max(c[0] for c in coords), max(c[1] for c in coords)
+                        )
+                        entry = len(self._polygons)
+                        self._polygons.append((position, region, coords, bbox))
+                        self._add_to_cells(self._polygon_cells, entry, bbox)
+                except Exception as e:
+                    logger.warning(f'Ошибка индексации полигона для региона {region.id}: {e}')
+
+            if region.service_radius_meters:
+                try:
+                    radius = float(region.service_radius_meters)
+                    dlat = math.degrees(radius / Geo.EARTH_RADIUS_M)
+                    cos_lat = max(math.cos(math.radians(region.center_lat)), 1e-6)
+                    dlon = dlat / cos_lat
+                    bbox = (
+                        region.center_lat - dlat, region.center_lon - dlon,
+                        region.center_lat + dlat, region.center_lon + dlon
+                    )
+                    entry = len(self._radii)
+                    self._radii.append((position, region, region.center_lat, region.center_lon, radius))
+                    self._add_to_cells(self._radius_cells, entry, bbox)
+                except Exception as e:
+                    logger.warning(f'Ошибка индексации радиуса для региона {region.id}: {e}')
+
+    def _cell(self, lat: float, lon: float):
+        return (math.floor(lat / self.CELL_DEG), math.floor(lon / self.CELL_DEG))
+
+    def _add_to_cells(self, cells: dict, entry: int, bbox: tuple):
+        min_x, min_y = self._cell(bbox[0], bbox[1])
+        max_x, max_y = self._cell(bbox[2], bbox[3])
+        for x in range(min_x, max_x + 1):
+            for y in range(min_y, max_y + 1):
+                cells.setdefault((x, y), []).append(entry)
+
+    def lookup(self, lat: float, lon: float) -> Optional[Region]:
+        """Регион для точки (без запросов к БД)"""
+        cell = self._cell(lat, lon)
+
+        for entry in self._polygon_cells.get(cell, ()):
+            _, region, coords, bbox = self._polygons[entry]
+            if bbox[0] <= lat <= bbox[2] and bbox[1] <= lon <= bbox[3]:
+                if point_in_polygon(lat, lon, coords):
+                    logger.debug(f'Точка ({lat}, {lon}) найдена в регионе {region.id} по полигону')
+                    return region
+
+        for entry in self._radius_cells.get(cell, ()):
+            _, region, center_lat, center_lon, radius = self._radii[entry]
+            distance = Geo.calculate_distance(lat, lon, center_lat, center_lon)
+            if distance <= radius:
+                logger.debug(f'Точка ({lat}, {lon}) найдена в регионе {region.id} по радиусу ({distance:.0f}m <= {radius}m)')
+                return region
+
+        return None
+
+    def lookup_many(self, lats: Sequence[float], lons: Sequence[float]) -> List[Optional[Region]]:
+        """
+        Пакетное определение регионов для массива точек.
+        Полигоны проверяются векторизованно по всем еще не определенным точкам.
+        """
+        lat = np.asarray(lats, dtype=float)
+        lon = np.asarray(lons, dtype=float)
+        result_idx = np.full(lat.shape, -1, dtype=np.int64)
+
+        for position, _, coords, bbox in self._polygons:
+            pending = (result_idx < 0) & (lat >= bbox[0]) & (lat <= bbox[2]) & (lon >= bbox[1]) & (lon <= bbox[3])
+            if not pending.any():
+                continue
+            idx = np.nonzero(pending)[0]
+            hits = points_in_polygon(lat[idx], lon[idx], coords)
+            result_idx[idx[hits]] = position
+
+        pending = np.nonzero(result_idx < 0)[0]
+        if len(pending) and self._radii:
+            centers_lat = [r[2] for r in self._radii]
+            centers_lon = [r[3] for r in self._radii]
+            radii = np.array([r[4] for r in self._radii])
+            distances = Geo.calculate_distance_matrix(lat[pending], lon[pending], centers_lat, centers_lon)
+            within = distances <= radii[None, :]
+            # Первый подходящий радиус в порядке регионов (как в lookup)
+            has_any = within.any(axis=1)
+            first = within.argmax(axis=1)
+            positions = np.array([r[0] for r in self._radii], dtype=np.int64)
+            result_idx[pending[has_any]] = positions[first[has_any]]
+
+        return [self.regions[i] if i >= 0 else None for i in result_idx.tolist()]
+
+
+_region_index: Optional[RegionIndex] = None
+_region_index_lock = threading.Lock()
+
+
+def get_region_index() -> RegionIndex:
+    """
+    Индекс регионов (строится при первом обращении).
+    REGION_INDEX_MAX_AGE_SECONDS ограничивает возраст индекса, чтобы изменения,
+    сделанные в других процессах, подхватывались без перезапуска.
+    """
+    global _region_index
+    index = _region_index
+    max_age = getattr(settings, 'REGION_INDEX_MAX_AGE_SECONDS', 600)
+    if index is not None and (not max_age or time.time() - index.built_at < max_age):
+        return index
+
+    with _region_index_lock:
+        if _region_index is None or _region_index is index:
+            regions = list(Region.objects.select_related('city').all())
+            _region_index = RegionIndex(regions)
+            logger.debug(f'Индекс регионов построен: {len(regions)} регионов')
+        return _region_index
+
+
+def invalidate_region_index():
+    """Сбрасывает индекс регионов (вызывается из сигналов Region)"""
+    global _region_index
+    with _region_index_lock:
+        _region_index = None
+
+
 def get_region_by_coordinates(lat: float, lon: float) -> Optional[Region]:
     """
     Определяет регион по координатам
@@ -60,40 +250,34 @@ def get_region_by_coordinates(lat: float, lon: float) -> Optional[Region]:
         return None
     
     try:
-        # Получаем все регионы
-        regions = Region.objects.all()
-        
-        # Сначала проверяем полигоны
-        for region in regions:
-            if region.polygon_coordinates:
-                try:
-                    polygon = region.polygon_coordinates
-                    if isinstance(polygon, list) and len(polygon) >= 3:
-                        if point_in_polygon(lat, lon, polygon):
-                            logger.debug(f'Точка ({lat}, {lon}) найдена в регионе {region.id} по полигону')
-                            return region
-                except Exception as e:
-                    logger.warning(f'Ошибка проверки полигона для региона {region.id}: {e}')
-                    continue
-        
-        # Затем проверяем радиус обслуживания
-        for region in regions:
-            if region.service_radius_meters:
-                try:
-                    distance = Geo.calculate_distance(
-                        lat, lon,
-                        region.center_lat, region.center_lon
-                    )
-                    if distance <= region.service_radius_meters:
-                        logger.debug(f'Точка ({lat}, {lon}) найдена в регионе {region.id} по радиусу ({distance:.0f}m <= {region.service_radius_meters}m)')
-                        return region
-                except Exception as e:
-                    logger.warning(f'Ошибка проверки радиуса для региона {region.id}: {e}')
-                    continue
-        
-        logger.debug(f'Точка ({lat}, {lon}) не найдена ни в одном регионе')
-        return None
+        region = get_region_index().lookup(lat, lon)
+        if region is None:
+            logger.debug(f'Точка ({lat}, {lon}) не найдена ни в одном регионе')
+        return region
         
     except Exception as e:
         logger.error(f'Ошибка определения региона по координатам ({lat}, {lon}): {e}')
         return None
+
+
+def get_regions_by_coordinates(lats: Sequence[Optional[float]], lons: Sequence[Optional[float]]) -> List[Optional[Region]]:
+    """
+    Пакетный вариант get_region_by_coordinates для массивов точек
+    (точки с None координатами получают None)
+    """
+    valid = [i for i, (lat, lon) in enumerate(zip(lats, lons)) if lat is not None and lon is not None]
+    result: List[Optional[Region]] = [None] * len(lats)
+    if not valid:
+        return result
+    
+    try:
+        found = get_region_index().lookup_many(
+            [lats[i] for i in valid], [lons[i] for i in valid]
+        )
+    except Exception as e:
+        logger.error(f'Ошибка пакетного определения регионов: {e}')
+        return result
+    
+    for i, region in zip(valid, found):
+        result[i] = region
+    return result
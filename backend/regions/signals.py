@@ -0,0 +1,15 @@
+"""
+Сигналы для регионов: сброс индекса регионов при изменениях
+"""
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Region
+from .services import invalidate_region_index
+
+
+@receiver(post_save, sender=Region)
+@receiver(post_delete, sender=Region)
+def region_changed(sender, instance, **kwargs):
+    """Перестраивает индекс регионов при следующем обращении"""
+    invalidate_region_index()
@@ -0,0 +1,96 @@
+"""
+Общие тестовые данные: город, регион, пассажир, водители и заказы
+
+Значения по умолчанию совпадают во всех тестах приложений: город city1 с
+центром 51.15/71.45, регион 'a' в том же центре, заказ из центра в
+точку 51.16/71.46 через час.
+"""
+from datetime import timedelta
+
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from accounts.models import Driver, DriverStatus, Passenger, User
+from orders.models import Order, OrderStatus
+from regions.models import City, Region
+
+CENTER_LAT = 51.15
+CENTER_LON = 71.45
+
+
+def create_city(**fields) -> City:
+    """Город city1"""
+    values = {'id': 'city1', 'title': 'Город', 'center_lat': CENTER_LAT, 'center_lon': CENTER_LON}
+    values.update(fields)
+    return City.objects.create(**values)
+
+
+def create_region(city: City, region_id: str = 'a', **fields) -> Region:
+    """Регион в центре города (title по умолчанию - id в верхнем регистре)"""
+    values = {
+        'id': region_id, 'title': region_id.upper(), 'city': city,
+        'center_lat': CENTER_LAT, 'center_lon': CENTER_LON,
+    }
+    values.update(fields)
+    return Region.objects.create(**values)
+
+
+def create_passenger(region: Region, index: int = None, **fields) -> Passenger:
+    """
+    Пассажир региона. Без index - единственный пассажир теста
+    (+77000000001), с index - один из нескольких (+7700000000{index})
+    """
+    if index is None:
+        user = User.objects.create_user(username='passenger', phone='+77000000001', password='pass')
+        values = {'full_name': 'Пассажир'}
+    else:
+        user = User.objects.create_user(username=f'passenger{index}', phone=f'+7700000000{index}', password='pass')
+        values = {'full_name': f'Пассажир {index}'}
+    values.update({'region': region, 'disability_category': 'I группа'})
+    values.update(fields)
+    return Passenger.objects.create(user=user, **values)
+
+
+def create_driver(region: Region, index: int = 0, **fields) -> Driver:
+    """Водитель региона с телефоном +7700000010{index}"""
+    user = User.objects.create_user(username=f'driver{index}', phone=f'+7700000010{index}', password='pass')
+    values = {
+        'name': f'Водитель {index}', 'region': region, 'car_model': 'Car', 'plate_number': f'A{index}',
+    }
+    values.update(fields)
+    return Driver.objects.create(user=user, **values)
+
+
+def create_online_drivers(region: Region, count: int, step: float = 0.01, **fields) -> list:
+    """Свободные водители на линии, с шагом step по широте от центра"""
+    return [
+        create_driver(
+            region, i, is_online=True, status=DriverStatus.ONLINE_IDLE,
+            current_lat=CENTER_LAT + i * step, current_lon=CENTER_LON, **fields,
+        )
+        for i in range(count)
+    ]
+
+
+def create_order(order_id: str, passenger: Passenger, **fields) -> Order:
+    """Заказ в очереди из центра города в точку 51.16/71.46 через час"""
+    values = {
+        'status': OrderStatus.ACTIVE_QUEUE,
+        'pickup_title': 'Откуда', 'dropoff_title': 'Куда',
+        'pickup_lat': CENTER_LAT, 'pickup_lon': CENTER_LON, 'dropoff_lat': 51.16, 'dropoff_lon': 71.46,
+        'desired_pickup_time': timezone.now() + timedelta(hours=1),
+    }
+    values.update(fields)
+    return Order.objects.create(id=order_id, passenger=passenger, **values)
+
+
+def create_staff() -> User:
+    """Сотрудник (is_staff) для запросов к API диспетчера"""
+    return User.objects.create_user(username='admin', phone='+77000000999', password='pass', is_staff=True)
+
+
+def staff_client(staff: User = None) -> APIClient:
+    """APIClient, авторизованный сотрудником"""
+    client = APIClient()
+    client.force_authenticate(staff or create_staff())
+    return client
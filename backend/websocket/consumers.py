@@ -1,11 +1,15 @@
 import json
 import logging
+from urllib.parse import parse_qs
+from asgiref.sync import sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from django.contrib.auth import get_user_model
 from django.utils import timezone
 from orders.models import Order
 from accounts.models import Driver, Passenger
+from accounts.locations import fix_from_payload, get_location_pipeline
+from dispatch import map_state
 
 logger = logging.getLogger(__name__)
 User = get_user_model()
@@ -110,11 +114,24 @@ class OrderConsumer(AsyncWebsocketConsumer):
 
 
 class DriverConsumer(AsyncWebsocketConsumer):
-    """WebSocket consumer для обновлений водителя"""
+    """
+    WebSocket consumer для обновлений водителя.
+
+    Сам водитель отправляет позиции сообщением location (вместо PATCH .../location/):
+        {"type": "location", "seq": 17, "lat": .., "lon": .., "timestamp": "ISO", "accuracy": 5}
+        {"type": "location", "seq": 18, "fixes": [{"lat", "lon", "timestamp", "accuracy"}, ...]}
+    Ответ {"type": "location_ack", "seq": 18, "accepted": 3, "dropped": 0} - после него
+    приложение удаляет кадр из очереди повторной отправки. Кадр с seq не больше
+    подтвержденного считается повтором и только подтверждается снова.
+    """
+    # Максимум точек в одном кадре location
+    MAX_FIXES_PER_MESSAGE = 100
 
     async def connect(self):
         self.driver_id = self.scope['url_route']['kwargs']['driver_id']
         self.room_group_name = f'driver_{self.driver_id}'
+        self.can_report_location = False
+        self.last_location_seq = None
 
         # Проверяем права доступа
         user = self.scope.get('user')
@@ -127,6 +144,7 @@ class DriverConsumer(AsyncWebsocketConsumer):
         if not has_access:
             await self.close()
             return
+        self.can_report_location = await self.is_own_driver(user, self.driver_id)
 
         # Присоединяемся к группе
         await self.channel_layer.group_add(
@@ -151,9 +169,62 @@ class DriverConsumer(AsyncWebsocketConsumer):
 
             if message_type == 'ping':
                 await self.send(text_data=json.dumps({'type': 'pong'}))
+            elif message_type == 'location':
+                await self.receive_location(data)
         except json.JSONDecodeError:
             pass
 
+    async def receive_location(self, data):
+        """Позиции водителя -> accounts.locations (тот же путь, что у PATCH .../location/)"""
+        seq = data.get('seq')
+        if seq is not None and (isinstance(seq, bool) or not isinstance(seq, int)):
+            await self.send_location_error(None, 'seq должен быть целым числом')
+            return
+        if not self.can_report_location:
+            await self.send_location_error(seq, 'Позицию может отправлять только сам водитель')
+            return
+
+        if seq is not None and self.last_location_seq is not None and seq <= self.last_location_seq:
+            await self.send(text_data=json.dumps({
+                'type': 'location_ack', 'seq': seq, 'duplicate': True
+            }))
+            return
+
+        payloads = data['fixes'] if 'fixes' in data else [data]
+        if not isinstance(payloads, list) or not payloads:
+            await self.send_location_error(seq, 'fixes должен быть непустым списком')
+            return
+        if len(payloads) > self.MAX_FIXES_PER_MESSAGE:
+            await self.send_location_error(seq, f'Не больше {self.MAX_FIXES_PER_MESSAGE} точек в сообщении')
+            return
+        try:
+            fixes = [fix_from_payload(int(self.driver_id), payload) for payload in payloads]
+        except (ValueError, TypeError, AttributeError) as e:
+            await self.send_location_error(seq, str(e) or 'Неверный формат точки')
+            return
+
+        # По времени: иначе более старая точка кадра отбросит следующие
+        now = timezone.now()
+        fixes.sort(key=lambda fix: fix.recorded_at or now)
+        results = await self.ingest_locations(fixes)
+
+        if seq is not None:
+            self.last_location_seq = seq
+        accepted = sum(results)
+        await self.send(text_data=json.dumps({
+            'type': 'location_ack',
+            'seq': seq,
+            'accepted': accepted,
+            'dropped': len(results) - accepted,
+        }))
+
+    async def send_location_error(self, seq, error):
+        await self.send(text_data=json.dumps({'type': 'location_error', 'seq': seq, 'error': error}))
+
+    @database_sync_to_async
+    def ingest_locations(self, fixes):
+        return get_location_pipeline().ingest_many(fixes)
+
     async def new_order(self, event):
         """Отправка нового назначенного заказа"""
         await self.send(text_data=json.dumps({
@@ -168,6 +239,18 @@ class DriverConsumer(AsyncWebsocketConsumer):
             'data': event['data']
         }))
 
+    async def orders_batch_update(self, event):
+        """Отправка пачки назначенных заказов (dispatch.bulk_assign)"""
+        await self.send(text_data=json.dumps({
+            'type': 'orders_batch_update',
+            'data': event['data']
+        }))
+
+    @database_sync_to_async
+    def is_own_driver(self, user, driver_id):
+        """Подключился сам водитель (только он отправляет свои позиции)"""
+        return hasattr(user, 'driver') and str(user.driver.id) == str(driver_id)
+
     @database_sync_to_async
     def check_driver_access(self, user, driver_id):
         """Проверяет доступ пользователя к данным водителя"""
@@ -256,10 +339,24 @@ class PassengerConsumer(AsyncWebsocketConsumer):
 
 
 class DispatchMapConsumer(AsyncWebsocketConsumer):
-    """WebSocket consumer для карты диспетчеризации - отслеживание всех водителей и заказов"""
+    """
+    WebSocket consumer для карты диспетчеризации - отслеживание всех водителей и заказов.
+
+    ?protocol=delta - протокол снимок + дельты (dispatch.map_state): после подключения
+    приходит map_snapshot (или map_resync с пропущенными дельтами при ?since=<seq>),
+    затем map_delta только с измененными полями. Полные driver_/order_ сообщения
+    в этом режиме не отправляются. {"type": "resync", "since": <seq>} - дочитать пропущенное.
+    Клиент в режиме delta входит только в группу дельт, не в dispatch_map.
+    """
+    delta_mode = False
+    # Подписчик учтен в счетчике клиентов карты (map_state.subscriber_joined)
+    counted_subscriber = False
 
     async def connect(self):
         self.room_group_name = 'dispatch_map'
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        self.delta_mode = query.get('protocol', [''])[0] == 'delta'
+        since = query.get('since', [None])[0]
 
         # Выводим в консоль для немедленного отображения
         print("[DispatchMapConsumer] Connection attempt")
@@ -304,7 +401,13 @@ class DispatchMapConsumer(AsyncWebsocketConsumer):
 
         logger.info(f"WebSocket DispatchMapConsumer: User {user.id} ({user.username}) authenticated and authorized")
 
-        # Присоединяемся к группе
+        # Присоединяемся к группе: в режиме delta - только к группе дельт, до снимка
+        # (дельты, пришедшие во время его сборки, не теряются - клиент отбрасывает seq <= снимка)
+        if self.delta_mode:
+            self.room_group_name = map_state.DELTA_GROUP
+        # Счетчик до входа в группу: сообщения для нового клиента уже собираются
+        self.counted_subscriber = True
+        await sync_to_async(map_state.subscriber_joined)(self.delta_mode)
         try:
             logger.info(f"WebSocket DispatchMapConsumer: Attempting to add to group {self.room_group_name}")
             await self.channel_layer.group_add(
@@ -324,6 +427,9 @@ class DispatchMapConsumer(AsyncWebsocketConsumer):
         print("[DispatchMapConsumer] Connection accepted successfully")
         logger.info("=" * 60)
 
+        if self.delta_mode:
+            await self.send_map_state(since)
+
     async def disconnect(self, close_code):
         # Покидаем группу
         logger.info(f"WebSocket DispatchMapConsumer: Disconnecting with code {close_code}")
@@ -333,6 +439,9 @@ class DispatchMapConsumer(AsyncWebsocketConsumer):
                 self.room_group_name,
                 self.channel_name
             )
+            if self.counted_subscriber:
+                self.counted_subscriber = False
+                await sync_to_async(map_state.subscriber_left)(self.delta_mode)
             logger.info(f"WebSocket DispatchMapConsumer: Removed from group {self.room_group_name}")
         except Exception as e:
             logger.error(f"WebSocket DispatchMapConsumer: Error removing from group: {e}", exc_info=True)
@@ -347,11 +456,53 @@ class DispatchMapConsumer(AsyncWebsocketConsumer):
 
             if message_type == 'ping':
                 await self.send(text_data=json.dumps({'type': 'pong'}))
+                await self.refresh_subscriber_counter()
+            elif message_type == 'resync' and self.delta_mode:
+                await self.send_map_state(data.get('since'))
         except json.JSONDecodeError:
             pass
 
+    async def refresh_subscriber_counter(self):
+        """Продлевает счетчик клиентов карты (истекает без ping живых клиентов)"""
+        try:
+            if self.counted_subscriber:
+                await sync_to_async(map_state.subscriber_alive)(self.delta_mode)
+        except Exception as e:
+            logger.warning(f"WebSocket DispatchMapConsumer: Error refreshing subscriber counter: {e}")
+
+    async def send_map_state(self, since=None):
+        """Снимок карты или пропущенные дельты после since"""
+        try:
+            since = int(since) if since is not None else None
+        except (TypeError, ValueError):
+            since = None
+        message = await self.get_map_state(since)
+        await self.send(text_data=json.dumps(message))
+
+    @database_sync_to_async
+    def get_map_state(self, since):
+        if since is not None:
+            deltas = map_state.deltas_since(since)
+            if deltas is not None:
+                return {
+                    'type': 'map_resync',
+                    'data': {'seq': deltas[-1]['seq'] if deltas else since, 'deltas': deltas},
+                }
+        return {'type': 'map_snapshot', 'data': map_state.build_snapshot()}
+
+    async def map_delta(self, event):
+        """Отправка дельт карты (dispatch.map_state)"""
+        if not self.delta_mode:
+            return
+        await self.send(text_data=json.dumps({
+            'type': 'map_delta',
+            'data': event['data']
+        }))
+
     async def driver_location_update(self, event):
         """Отправка обновления локации водителя"""
+        if self.delta_mode:
+            return
         await self.send(text_data=json.dumps({
             'type': 'driver_location_update',
             'data': event['data']
@@ -359,6 +510,8 @@ class DispatchMapConsumer(AsyncWebsocketConsumer):
 
     async def driver_status_update(self, event):
         """Отправка обновления статуса водителя"""
+        if self.delta_mode:
+            return
         await self.send(text_data=json.dumps({
             'type': 'driver_status_update',
             'data': event['data']
@@ -366,6 +519,8 @@ class DispatchMapConsumer(AsyncWebsocketConsumer):
 
     async def order_update(self, event):
         """Отправка обновления заказа"""
+        if self.delta_mode:
+            return
         await self.send(text_data=json.dumps({
             'type': 'order_update',
             'data': event['data']
@@ -373,11 +528,29 @@ class DispatchMapConsumer(AsyncWebsocketConsumer):
 
     async def order_created(self, event):
         """Отправка уведомления о создании заказа"""
+        if self.delta_mode:
+            return
         await self.send(text_data=json.dumps({
             'type': 'order_created',
             'data': event['data']
         }))
 
+    async def orders_batch_update(self, event):
+        """Отправка пачки обновленных заказов (dispatch.bulk_assign)"""
+        if self.delta_mode:
+            return
+        await self.send(text_data=json.dumps({
+            'type': 'orders_batch_update',
+            'data': event['data']
+        }))
+
+    async def planning_job_progress(self, event):
+        """Отправка прогресса фоновой задачи планирования (dispatch.jobs)"""
+        await self.send(text_data=json.dumps({
+            'type': 'planning_job_progress',
+            'data': event['data']
+        }))
+
     async def driver_route_update(self, event):
         """Отправка обновления маршрута водителя"""
         await self.send(text_data=json.dumps({
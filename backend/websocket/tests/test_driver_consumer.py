@@ -0,0 +1,84 @@
+"""
+Тесты для приема позиций через DriverConsumer
+"""
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync
+from channels.testing import WebsocketCommunicator
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from accounts.locations import get_location_pipeline, reset_location_pipeline
+from accounts.models import DriverStatus
+from utils.testing import create_city, create_driver, create_region, create_staff
+from websocket.consumers import DriverConsumer
+
+
+@override_settings(LOCATION_PIPELINE={'EAGER': True})
+class DriverConsumerLocationTestCase(TestCase):
+    """Тесты для сообщений location"""
+
+    def setUp(self):
+        reset_location_pipeline()
+        region = create_region(create_city())
+        self.driver = create_driver(region, 1, is_online=True, status=DriverStatus.ONLINE_IDLE)
+        self.staff = create_staff()
+
+    def tearDown(self):
+        reset_location_pipeline()
+
+    def _communicator(self, user):
+        communicator = WebsocketCommunicator(DriverConsumer.as_asgi(), f'/ws/drivers/{self.driver.id}/')
+        communicator.scope['user'] = user
+        communicator.scope['url_route'] = {'kwargs': {'driver_id': str(self.driver.id)}}
+        return communicator
+
+    def test_batched_fixes_are_acknowledged(self):
+        """Пачка точек попадает в конвейер, повтор кадра только подтверждается"""
+        start = timezone.now() - timedelta(seconds=10)
+        fixes = [
+            {'lat': 51.1 + i * 0.001, 'lon': 71.4, 'timestamp': (start + timedelta(seconds=i)).isoformat(), 'accuracy': 5}
+            for i in (2, 0, 1)
+        ]
+
+        async def scenario():
+            communicator = self._communicator(self.driver.user)
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+
+            await communicator.send_json_to({'type': 'location', 'seq': 1, 'fixes': fixes})
+            self.assertEqual(
+                await communicator.receive_json_from(),
+                {'type': 'location_ack', 'seq': 1, 'accepted': 3, 'dropped': 0}
+            )
+            await communicator.send_json_to({'type': 'location', 'seq': 1, 'fixes': fixes})
+            self.assertEqual(
+                await communicator.receive_json_from(),
+                {'type': 'location_ack', 'seq': 1, 'duplicate': True}
+            )
+            await communicator.send_json_to({'type': 'location', 'seq': 2, 'lat': 95, 'lon': 71.4})
+            error = await communicator.receive_json_from()
+            self.assertEqual((error['type'], error['seq']), ('location_error', 2))
+            await communicator.disconnect()
+
+        async_to_sync(scenario)()
+
+        self.driver.refresh_from_db()
+        self.assertAlmostEqual(self.driver.current_lat, 51.102)
+        self.assertGreater(self.driver.last_location_update, start + timedelta(seconds=2))
+        self.assertEqual(get_location_pipeline().stats['accepted'], 3)
+
+    def test_only_driver_can_report_location(self):
+        """Диспетчер может слушать канал водителя, но не отправлять его позиции"""
+        async def scenario():
+            communicator = self._communicator(self.staff)
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            await communicator.send_json_to({'type': 'location', 'seq': 1, 'lat': 51.1, 'lon': 71.4})
+            response = await communicator.receive_json_from()
+            self.assertEqual(response['type'], 'location_error')
+            await communicator.disconnect()
+
+        async_to_sync(scenario)()
+        self.driver.refresh_from_db()
+        self.assertIsNone(self.driver.current_lat)